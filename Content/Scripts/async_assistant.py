@@ -0,0 +1,409 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import concurrent.futures
+import functools
+import time
+from threading import Lock, Thread
+
+import grpc
+import ue_site
+import channel_manager
+
+from googlesdk.assistant.embedded.v1alpha1 import embedded_assistant_pb2
+from googlesamples.assistant import (
+	auth_helpers,
+	common_settings
+)
+from googlesamples.assistant.log_helpers import log_error
+
+from threaded_assistant import AssistantConversation, END_OF_UTTERANCE
+
+class _OpenedResponses(object):
+	""" Iterates responses on a task of its own from the moment it is created.
+
+	AsyncChannelManager.converse() only calls Converse once iterated;
+	this opens the call right away, e.g. while the previous answer still
+	plays. Only a few responses are read ahead, so a slow playback still
+	holds back the call.
+	"""
+	_DONE = object()
+	_READ_AHEAD = 4
+
+	def __init__(self, responses):
+		self._responses = responses
+		self._queue = asyncio.Queue(self._READ_AHEAD)
+		self._closed = False
+		self._task = asyncio.ensure_future(self._run())
+
+	async def _run(self):
+		try:
+			async for resp in self._responses:
+				await self._queue.put(resp)
+		except (asyncio.CancelledError, Exception) as e:
+			if self._closed:
+				raise
+			# Includes a cancelled call, reported to the reader.
+			await self._queue.put(e)
+		await self._queue.put(self._DONE)
+
+	def __aiter__(self):
+		return self._iterate()
+
+	async def _iterate(self):
+		while True:
+			item = await self._queue.get()
+			if item is self._DONE:
+				return
+			if isinstance(item, BaseException):
+				raise item
+			yield item
+
+	async def aclose(self):
+		""" Stops the call if it is still running. """
+		if self._closed:
+			return
+		self._closed = True
+		self._task.cancel()
+		try:
+			await self._task
+		except (asyncio.CancelledError, Exception):
+			pass
+		await self._responses.aclose()
+
+class AsyncConversation(AssistantConversation):
+	""" A conversation driven by an AsyncAssistantEngine.
+
+	Request and response handling is the same as ThreadedAssistant's;
+	only the Converse call itself runs on the engine's event loop,
+	through its AsyncChannelManager.
+
+	Args:
+	  conversation_stream: the ConversationStream to record from and play to.
+	  follow_on: see AssistantConversation.
+	  preopen: see AssistantConversation.
+	  response_cache: see AssistantConversation.
+	  cache_responses: see AssistantConversation.
+	"""
+	# The current attempt's call, set as it starts.
+	_call = None
+	# An asyncio.Event cutting the waits for playback short, and a call
+	# setting it from any thread, made by interrupt().
+	_interrupted = None
+	_wake = None
+
+	async def run(self, channels, executor):
+		"""Send a voice request to the Assistant and playback the response.
+
+		While the Assistant expects a reply, follow-on turns reuse the
+		open audio devices and channel and carry the conversation_state.
+
+		Returns: True if conversation should continue.
+		"""
+		loop = asyncio.get_event_loop()
+		self._interrupted = asyncio.Event()
+		self._wake = functools.partial(loop.call_soon_threadsafe,
+									   self._interrupted.set)
+		# Writes wait for room in wait_room(), on the loop.
+		sink = self.conversation_stream.sink
+		wait_for_room = getattr(sink, 'wait_for_room', None)
+		if wait_for_room is not None:
+			sink.wait_for_room = False
+		await loop.run_in_executor(executor, self.begin_turn)
+		responses, requests_done = self.open_call(channels, executor)
+		turns = 1
+		try:
+			while True:
+				await self.handle_responses(responses, requests_done, executor)
+				if self.conversation_stream.full_duplex:
+					# Keep listening for the user until the answer has played.
+					await loop.run_in_executor(
+						executor, self.conversation_stream.drain, False)
+					await self.wait_played()
+				if not self.should_follow_on(turns):
+					break
+				if self.preopen and not self.conversation_stream.barged_in:
+					playback_drained = asyncio.Event()
+					responses, requests_done = self.open_call(
+						channels, executor, playback_drained)
+					await loop.run_in_executor(executor, self.end_turn, True,
+											   False)
+					await self.wait_played()
+					playback_drained.set()
+				else:
+					await loop.run_in_executor(executor, self.end_turn, True,
+											   False)
+					await self.wait_played()
+					await loop.run_in_executor(executor, self.begin_turn)
+					responses, requests_done = self.open_call(channels,
+															  executor)
+				turns += 1
+		finally:
+			# A no-op unless a turn was cut short.
+			await responses.aclose()
+			continue_conversation = await loop.run_in_executor(
+				executor, self.end_turn)
+			if wait_for_room is not None:
+				sink.wait_for_room = wait_for_room
+		return continue_conversation
+
+	async def _sleep(self, seconds):
+		"""Sleeps on the event loop; returns False if interrupted."""
+		self._interrupted.clear()
+		# Checked after clearing, so no barge-in goes unnoticed.
+		if self.conversation_stream.barged_in:
+			return False
+		try:
+			await asyncio.wait_for(self._interrupted.wait(), seconds)
+		except asyncio.TimeoutError:
+			return True
+		return False
+
+	async def wait_played(self):
+		"""Waits until the answer written so far has played.
+
+		Sleeps on the event loop rather than in an audio worker. A
+		barge-in cuts the wait short, through interrupt().
+		"""
+		played_until = self.conversation_stream.played_until
+		if played_until is not None:
+			await self._sleep(played_until - time.monotonic())
+
+	async def wait_room(self, size):
+		"""Waits until size more bytes of audio fit in the playback queue.
+
+		The back-pressure of ThreadedAssistant's blocking writes, applied
+		on the event loop, so no audio worker waits for the sound wave
+		to play. Until then no more responses are read, and gRPC flow
+		control holds back the rest on the server.
+		"""
+		queue = getattr(self.conversation_stream.sink, 'playback_queue', None)
+		if queue is None:
+			return
+		started = time.monotonic()
+		delay = queue.room_in(size)
+		if delay <= 0:
+			return
+		while delay > 0 and await self._sleep(delay):
+			delay = queue.room_in(size)
+		queue.waited(time.monotonic() - started)
+
+	def interrupt(self):
+		"""Cancels the Converse call in flight and stops waiting for the
+		answer to play; called on a barge-in."""
+		AssistantConversation.interrupt(self)
+		wake = self._wake
+		if wake is not None:
+			wake()
+
+	def open_call(self, channels, executor, playback_drained=None):
+		"""Starts a Converse call for the next turn.
+
+		Args:
+		  channels: the AsyncChannelManager to call through.
+		  playback_drained: asyncio.Event set once the previous answer has
+		    played; recording waits for it. The call is opened right away.
+		Returns:
+		  (responses, requests_done) tuple.
+		"""
+		requests_done = asyncio.Event()
+		responses = channels.converse(
+			self.gen_converse_requests(executor, requests_done,
+									   playback_drained),
+			self.deadline, on_call=self._on_call)
+		return _OpenedResponses(responses), requests_done
+
+	def _on_call(self, call):
+		self._call = call
+		# Barge-ins are detected on other threads.
+		self._cancel_call = functools.partial(
+			asyncio.get_event_loop().call_soon_threadsafe, call.cancel)
+
+	async def handle_responses(self, responses, requests_done, executor):
+		"""Handles the responses of one turn."""
+		loop = asyncio.get_event_loop()
+		try:
+			async for resp in responses:
+				if resp.event_type == END_OF_UTTERANCE:
+					# Ends the request stream waited for below.
+					self.conversation_stream.stop_recording()
+				# Playback only starts once the request stream is done.
+				# Wait for it here so no audio worker blocks on it; a
+				# transcript may be answered from the response cache.
+				if (len(resp.audio_out.audio_data) > 0 or
+						resp.result.spoken_request_text):
+					await requests_done.wait()
+				if len(resp.audio_out.audio_data) > 0:
+					# Writes do not wait for the sound wave, this does.
+					await self.wait_room(len(resp.audio_out.audio_data))
+				# Decoding and queueing the audio is blocking work, keep it
+				# off the loop.
+				handled = await loop.run_in_executor(
+					executor, self.handle_response, resp)
+				if not handled:
+					# Stop downloading responses that are not needed.
+					await responses.aclose()
+					return
+			await loop.run_in_executor(executor, self.cache_response)
+		except asyncio.CancelledError:
+			# Only the call was cancelled, by a barge-in.
+			if not (self.conversation_stream.barged_in and
+					self._call is not None and self._call.cancelled()):
+				raise
+		except grpc.RpcError as e:
+			# Retries are exhausted or audio was already sent; give up on
+			# this turn but keep the game running.
+			if not channel_manager.is_unavailable(e):
+				raise
+			log_error('grpc unavailable error: %s', e)
+			self.conversation_stream.stop_recording()
+
+	async def gen_converse_requests(self, executor, requests_done,
+									playback_drained=None):
+		"""Generates ConverseRequest messages to send to the API.
+
+		Sources capturing in the background are read once they have
+		audio ready, woken up by the capture, so no thread waits on the
+		microphone. Reads from other sources block, so they run on the
+		executor rather than on the event loop thread. requests_done is
+		set once recording has stopped and playback has started. With
+		playback_drained, the turn is begun once it is set.
+		"""
+		loop = asyncio.get_event_loop()
+		yield self.converse_config_request()
+		if playback_drained is not None:
+			await playback_drained.wait()
+			await loop.run_in_executor(executor, self.begin_turn)
+
+		capture = self.conversation_stream.capture
+		audio_ready = asyncio.Event()
+		waker = functools.partial(loop.call_soon_threadsafe, audio_ready.set)
+		if capture is not None:
+			audio_chunks = self.conversation_stream.iter_nowait()
+			capture.add_waker(waker)
+		else:
+			audio_chunks = iter(self.conversation_stream)
+		try:
+			while True:
+				if capture is None:
+					data = await loop.run_in_executor(executor, next,
+													  audio_chunks, b'')
+				else:
+					# Cleared first, so a block buffered meanwhile wakes us.
+					audio_ready.clear()
+					data = next(audio_chunks, b'')
+					if data is None:
+						await audio_ready.wait()
+						continue
+				if not len(data):
+					break
+				# Subsequent requests need audio data, but not config.
+				# Sources may return memoryviews; protobuf takes bytes.
+				yield embedded_assistant_pb2.ConverseRequest(audio_in=bytes(data))
+		finally:
+			if capture is not None:
+				capture.remove_waker(waker)
+			# Also runs when gRPC stops consuming requests early.
+			self.conversation_stream.start_playback()
+			requests_done.set()
+
+class AsyncAssistantEngine(object):
+	""" Drives any number of conversations from a single event loop thread.
+
+	Calls go through an AsyncChannelManager, which connects the channel
+	on warm_up() and replaces it after a jittered backoff whenever the
+	Assistant is UNAVAILABLE, retrying calls that sent no audio yet.
+
+	Args:
+	  channel_factory: callable taking a list of gRPC channel options and
+	    returning a grpc.aio.Channel. It is called on the event loop
+	    thread, as aio channels are bound to their loop.
+	  max_audio_workers: size of the thread pool used for blocking audio
+	    writes, and reads from sources that do not capture in the
+	    background, shared by every conversation.
+	  channel_options: keyword arguments for the AsyncChannelManager,
+	    e.g. max_retries.
+	"""
+	def __init__(self, channel_factory,
+				 max_audio_workers=common_settings.DEFAULT_AUDIO_WORKERS,
+				 **channel_options):
+		self.channels = channel_manager.AsyncChannelManager(
+			channel_factory, **channel_options)
+		self._executor = concurrent.futures.ThreadPoolExecutor(
+			max_workers=max_audio_workers,
+			thread_name_prefix='AssistantAudio')
+		self._loop = asyncio.new_event_loop()
+		self._thread = Thread(target=self._run_loop,
+							  name='AsyncAssistantEngine', daemon=True)
+
+	def _run_loop(self):
+		asyncio.set_event_loop(self._loop)
+		self._loop.run_forever()
+
+	def start(self):
+		"""Starts the event loop thread."""
+		if self._thread.is_alive():
+			return
+		self._thread.start()
+
+	def warm_up(self):
+		"""Opens the gRPC channel and connects it on the event loop.
+
+		Safe to call from any thread.
+
+		Returns:
+		  concurrent.futures.Future resolving once the channel is ready
+		  or the connect timeout has passed.
+		"""
+		self.start()
+		return asyncio.run_coroutine_threadsafe(self.channels.warm_up(),
+												self._loop)
+
+	def converse(self, conversation):
+		"""Schedules a conversation turn on the event loop.
+
+		Safe to call from any thread, including the game thread.
+
+		Args:
+		  conversation: the AsyncConversation to run.
+		Returns:
+		  concurrent.futures.Future resolving to True if the conversation
+		  should continue.
+		"""
+		return asyncio.run_coroutine_threadsafe(
+			self._converse(conversation), self._loop)
+
+	async def _converse(self, conversation):
+		try:
+			return await conversation.run(self.channels, self._executor)
+		except Exception as e:
+			log_error('Conversation failed: %s', e)
+			raise
+
+	def stop(self):
+		"""Closes the channel and stops the event loop thread."""
+		if not self._thread.is_alive():
+			return
+		asyncio.run_coroutine_threadsafe(self.channels.close(),
+										 self._loop).result()
+		self._loop.call_soon_threadsafe(self._loop.stop)
+		self._thread.join()
+		self._executor.shutdown(wait=False)
+
+_engine = None
+_engine_lock = Lock()
+
+def get_engine():
+	""" Returns the process-wide engine, starting it on first use. """
+	global _engine
+	with _engine_lock:
+		if _engine is None:
+			_engine = AsyncAssistantEngine(
+				lambda options: auth_helpers.create_aio_grpc_channel(
+					ue_site.ASSISTANT_API_ENDPOINT, ue_site.creds,
+					grpc_channel_options=options
+				)
+			)
+			_engine.start()
+		return _engine
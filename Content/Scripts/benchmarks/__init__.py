@@ -0,0 +1,10 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Micro-benchmarks for the Google Assistant scripts.
+
+The benchmarks run outside of the editor. Run them from Content/Scripts,
+for example:
+
+	python -m benchmarks.bench_normalize
+"""
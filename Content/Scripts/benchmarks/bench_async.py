@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Compares thread-per-conversation against the asyncio engine.
+
+Every configuration runs in a fresh child process against a local
+EmbeddedAssistantServicer stand-in running in another process, and
+reports the peak thread count, the resident memory growth, the
+per-conversation latency and how far the slowest reader let its
+capture fall behind.
+
+In real time, every conversation records from its own UnrealSoundStream,
+whose stand-in device delivers silence at the pace of a microphone on a
+thread of its own, counted in both modes. Without it, reads return at
+once from a silent source.
+"""
+
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import click
+
+from benchmarks import fakes, simulator
+
+SESSION_COUNTS = (1, 10, 100)
+
+
+def _os_thread_count():
+	"""Threads of this process, including the ones gRPC starts natively."""
+	try:
+		with open('/proc/self/status') as f:
+			for line in f:
+				if line.startswith('Threads:'):
+					return int(line.split()[1])
+	except IOError:
+		pass
+	return threading.active_count()
+
+
+def _rss_kb():
+	try:
+		with open('/proc/self/statm') as f:
+			return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+	except (IOError, ValueError):
+		import resource
+		return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class _PeakSampler(threading.Thread):
+	def __init__(self):
+		threading.Thread.__init__(self, daemon=True)
+		self.peak_threads = 0
+		self.peak_rss_kb = 0
+		self._done = threading.Event()
+
+	def run(self):
+		while not self._done.wait(0.005):
+			# Do not count the sampler itself.
+			self.peak_threads = max(self.peak_threads, _os_thread_count() - 1)
+			self.peak_rss_kb = max(self.peak_rss_kb, _rss_kb())
+
+	def stop(self):
+		self._done.set()
+		self.join()
+
+
+def _make_streams(sessions, realtime):
+	"""Returns the streams and a dict of the most audio any capture held
+	unread, in bytes."""
+	from googlesamples.assistant import audio_helpers, common_settings
+	sample_width = common_settings.DEFAULT_AUDIO_SAMPLE_WIDTH
+	block_size = common_settings.DEFAULT_AUDIO_DEVICE_BLOCK_SIZE
+	lag = {'bytes': 0}
+	streams = []
+	for _ in range(sessions):
+		if realtime:
+			source = sink = audio_helpers.UnrealSoundStream(
+				sample_rate=common_settings.DEFAULT_AUDIO_SAMPLE_RATE,
+				sample_width=sample_width, block_size=block_size,
+				flush_size=0,
+				procedural_audio_wave=fakes.FakeSoundWaveProcedural(),
+				ring_size=common_settings.DEFAULT_AUDIO_CAPTURE_RING_SIZE)
+		else:
+			source = fakes.SilentSource()
+			sink = fakes.NullSink()
+		stream = audio_helpers.ConversationStream(
+			source=source, sink=sink,
+			iter_size=common_settings.DEFAULT_AUDIO_ITER_SIZE,
+			sample_width=sample_width)
+		streams.append(stream)
+		if not realtime:
+			continue
+		# Each turn's end takes the capture counters for its log line.
+		def count_lag(reset=stream.reset_capture_stats):
+			stats = reset()
+			lag['bytes'] = max(lag['bytes'], stats['high_water'])
+			return stats
+		stream.reset_capture_stats = count_lag
+	return streams, lag
+
+
+def _run_threaded(address, streams):
+	import grpc
+	from googlesdk.assistant.embedded.v1alpha1 import embedded_assistant_pb2
+	import threaded_assistant
+
+	assistant = embedded_assistant_pb2.EmbeddedAssistantStub(
+		grpc.insecure_channel(address))
+	latencies = []
+
+	def converse(stream):
+		start = time.perf_counter()
+		threaded_assistant.ThreadedAssistant(stream, assistant).run()
+		latencies.append(time.perf_counter() - start)
+
+	threads = [threading.Thread(target=converse, args=(stream,))
+			   for stream in streams]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	return latencies
+
+
+def _run_async(address, streams):
+	import grpc
+	import async_assistant
+
+	engine = async_assistant.AsyncAssistantEngine(
+		lambda options: grpc.aio.insecure_channel(address, options=options))
+	engine.warm_up().result()
+	latencies = []
+
+	def done(start):
+		return lambda future: latencies.append(time.perf_counter() - start)
+
+	futures = []
+	for stream in streams:
+		future = engine.converse(async_assistant.AsyncConversation(stream))
+		future.add_done_callback(done(time.perf_counter()))
+		futures.append(future)
+	for future in futures:
+		future.result()
+	engine.stop()
+	return latencies
+
+
+def run_child(mode, sessions, port, realtime):
+	fakes.install()
+	fakes.install_site()
+	from googlesamples.assistant import common_settings
+	streams, lag = _make_streams(sessions, realtime)
+	address = 'localhost:%d' % port
+
+	base_threads = _os_thread_count()
+	base_rss_kb = _rss_kb()
+	sampler = _PeakSampler()
+	sampler.start()
+	if mode == 'threaded':
+		latencies = _run_threaded(address, streams)
+	else:
+		latencies = _run_async(address, streams)
+	sampler.stop()
+
+	latencies.sort()
+	return {
+		'mode': mode,
+		'sessions': sessions,
+		'extra_threads': sampler.peak_threads - base_threads,
+		'rss_kb': sampler.peak_rss_kb - base_rss_kb,
+		'latency_ms_p50': 1000 * latencies[len(latencies) // 2],
+		'latency_ms_max': 1000 * latencies[-1],
+		'capture_lag_ms': 1000 * lag['bytes'] / float(
+			common_settings.DEFAULT_AUDIO_SAMPLE_RATE *
+			common_settings.DEFAULT_AUDIO_SAMPLE_WIDTH),
+	}
+
+
+def _serve(port_queue):
+	server, port = simulator.serve(max_workers=256)
+	port_queue.put(port)
+	server.wait_for_termination()
+
+
+@click.command()
+@click.option('--realtime/--no-realtime', default=True, show_default=True,
+			  help='Capture from devices delivering audio in real time.')
+@click.option('--child', nargs=3, type=(str, int, int), default=None,
+			  hidden=True)
+def main(realtime, child):
+	if child:
+		mode, sessions, port = child
+		click.echo(json.dumps(run_child(mode, sessions, port, realtime)))
+		return
+
+	port_queue = multiprocessing.Queue()
+	server = multiprocessing.Process(target=_serve, args=(port_queue,),
+									 daemon=True)
+	server.start()
+	port = port_queue.get()
+
+	click.echo('%-9s %9s %14s %10s %12s %12s %16s' % (
+		'mode', 'sessions', 'extra threads', 'rss (KB)', 'p50 (ms)',
+		'max (ms)', 'capture lag (ms)'))
+	try:
+		for sessions in SESSION_COUNTS:
+			for mode in ('threaded', 'async'):
+				output = subprocess.check_output(
+					[sys.executable, '-m', 'benchmarks.bench_async',
+					 '--realtime' if realtime else '--no-realtime',
+					 '--child', mode, str(sessions), str(port)])
+				result = json.loads(output.decode('utf-8').splitlines()[-1])
+				click.echo('%-9s %9d %14d %10d %12.1f %12.1f %16.1f' % (
+					result['mode'], result['sessions'],
+					result['extra_threads'], result['rss_kb'],
+					result['latency_ms_p50'], result['latency_ms_max'],
+					result['capture_lag_ms']))
+	finally:
+		server.terminate()
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Measures how fast the user can talk over an answer.
+
+A local EmbeddedAssistantServicer answers with a few seconds of a
+square wave. The stand-in microphone hears that answer back at a fixed
+echo return while the sound wave is playing it, and, a second into the
+answer, the player saying something over it. Half-duplex, the player
+has to wait for the answer to end; full-duplex, the BargeInDetector
+cuts the answer short and the interrupting request is sent at once.
+The echo-only rows check that the answer does not interrupt itself,
+with echo suppression and without.
+"""
+
+import array
+import threading
+import time
+
+import click
+import grpc
+
+from benchmarks import fakes
+fakes.install()
+from benchmarks import simulator
+
+from googlesamples.assistant import audio_helpers, common_settings
+
+import channel_manager
+fakes.install_site()
+import threaded_assistant
+
+SAMPLE_RATE = common_settings.DEFAULT_AUDIO_SAMPLE_RATE
+SAMPLE_WIDTH = common_settings.DEFAULT_AUDIO_SAMPLE_WIDTH
+BYTES_PER_SECOND = float(SAMPLE_RATE * SAMPLE_WIDTH)
+# 20 ms capture blocks, so detection is not held up by long blocks.
+BLOCK_SIZE = 640
+# Periods of the answer and of the player's voice, in samples.
+ANSWER_PERIOD = 40
+SPEECH_PERIOD = 64
+
+
+class EchoingSoundWave(fakes.FakeSoundWaveProcedural):
+	"""Sound wave stand-in that knows what it is playing and when."""
+	def __init__(self):
+		fakes.FakeSoundWaveProcedural.__init__(self)
+		self.lock = threading.Lock()
+		self.segments = []
+		self.started = None
+		self.playing_until = 0.0
+
+	def queue_audio(self, buf):
+		now = time.monotonic()
+		level = max(abs(sample) for sample in array.array('h', bytes(buf)))
+		with self.lock:
+			if self.started is None:
+				self.started = now
+			start = max(self.playing_until, now)
+			self.playing_until = start + len(buf) / BYTES_PER_SECOND
+			self.segments.append((start, self.playing_until, level))
+
+	def reset_audio(self):
+		with self.lock:
+			self.segments = []
+			self.playing_until = time.monotonic()
+
+	def level_at(self, when):
+		with self.lock:
+			for start, end, level in self.segments:
+				if start <= when < end:
+					return level
+		return 0
+
+
+class Room(object):
+	"""What the microphone picks up: the answer's echo and the player."""
+	def __init__(self, wave, echo_return, speech_after, speech_ms,
+				 speech_level):
+		self.wave = wave
+		self.echo_return = echo_return
+		self.speech_after = speech_after
+		self.speech_time = speech_ms / 1000.0
+		self.speech_level = speech_level
+		self.speech_at = None
+		self._phase = 0
+
+	def __call__(self, frames):
+		now = time.monotonic()
+		echo = int(self.echo_return * self.wave.level_at(now))
+		speech = 0
+		if self.speech_level and self.wave.started is not None:
+			if self.speech_at is None:
+				self.speech_at = self.wave.started + self.speech_after
+			if self.speech_at <= now < self.speech_at + self.speech_time:
+				speech = self.speech_level
+		samples = array.array('h', bytes(2 * frames))
+		for idx in range(frames):
+			sample = self._phase + idx
+			value = echo if sample % ANSWER_PERIOD < ANSWER_PERIOD // 2 else -echo
+			value += (speech if sample % SPEECH_PERIOD < SPEECH_PERIOD // 2
+					  else -speech)
+			samples[idx] = max(-32768, min(32767, value))
+		self._phase += frames
+		return samples.tobytes()
+
+
+def run(channels, barge_in, echo_return, speech_after, speech_ms,
+		speech_level):
+	wave = EchoingSoundWave()
+	room = Room(wave, echo_return, speech_after, speech_ms, speech_level)
+	fakes.FakeRawInputStream.signal = room
+	device = audio_helpers.UnrealSoundStream(
+		sample_rate=SAMPLE_RATE, sample_width=SAMPLE_WIDTH,
+		block_size=BLOCK_SIZE, flush_size=0, procedural_audio_wave=wave,
+		ring_size=8 * BLOCK_SIZE)
+	stream = audio_helpers.ConversationStream(
+		source=device, sink=device, iter_size=BLOCK_SIZE,
+		sample_width=SAMPLE_WIDTH, barge_in=barge_in)
+	conversation = threaded_assistant.ThreadedAssistant(
+		stream, channels=channels, follow_on=False)
+	# A false barge-in would otherwise go on for every answer.
+	conversation.max_turns = 3
+	try:
+		conversation.run()
+		stream.drain()
+	finally:
+		fakes.FakeRawInputStream.signal = None
+		stream.close()
+	return conversation.barge_ins, room
+
+
+@click.command()
+@click.option('--answer-ms', default=4000, show_default=True,
+			  help='Length of each answer.')
+@click.option('--speech-after', default=1.0, show_default=True,
+			  help='Seconds into the answer the player starts talking.')
+@click.option('--speech-ms', default=400, show_default=True,
+			  help='How long the player talks over the answer.')
+@click.option('--echo-return', default=0.3, show_default=True,
+			  help='Share of the answer the microphone picks up.')
+def main(answer_ms, speech_after, speech_ms, echo_return):
+	response_chunk_size = 3200
+	response_chunks = int(answer_ms * BYTES_PER_SECOND / 1000 /
+						  response_chunk_size)
+	# Long enough for the request to take in all the player said.
+	utterance_ms = speech_ms + 400
+	server, port = simulator.serve(
+		max_workers=8, utterance_ms=utterance_ms,
+		response_chunks=response_chunks,
+		response_chunk_size=response_chunk_size, response_level=8000)
+	channels = channel_manager.ChannelManager(
+		lambda options: grpc.insecure_channel('127.0.0.1:%d' % port,
+											  options=options))
+
+	def detector(echo_return):
+		return audio_helpers.BargeInDetector(
+			SAMPLE_RATE, SAMPLE_WIDTH,
+			echo_return=echo_return,
+			min_speech_ms=common_settings.DEFAULT_BARGE_IN_MIN_SPEECH_MS,
+			duck_gain=common_settings.DEFAULT_BARGE_IN_DUCK_GAIN)
+
+	speech_level = 4000
+	modes = (
+		('half-duplex', lambda: None, speech_level),
+		('full-duplex', lambda: detector(
+			common_settings.DEFAULT_BARGE_IN_ECHO_RETURN), speech_level),
+		('echo only', lambda: detector(
+			common_settings.DEFAULT_BARGE_IN_ECHO_RETURN), 0),
+		('echo, no suppr.', lambda: detector(0), 0),
+	)
+	try:
+		channels.warm_up().join()
+		click.echo('%-16s %10s %14s %13s %13s %13s %16s' % (
+			'mode', 'barge-ins', 'detected (ms)', 'dropped (ms)',
+			'cancel (ms)', 'request (ms)', 'wait to talk (ms)'))
+		for name, make_detector, level in modes:
+			barge_ins, room = run(channels, make_detector(), echo_return,
+								  speech_after, speech_ms, level)
+			if barge_ins:
+				first = barge_ins[0]
+				click.echo('%-16s %10d %14.1f %13.1f %13.1f %13.1f %16.1f' % (
+					name, len(barge_ins), first['detected_ms'],
+					first['playback_stopped_ms'], first['call_cancelled_ms'],
+					first['request_ms'], first['request_ms']))
+			else:
+				# Half-duplex, the player can only talk once the answer
+				# has played.
+				wait = '-'
+				if level:
+					speech_at = room.wave.started + room.speech_after
+					wait = '%.1f' % (1000 * (room.wave.playing_until -
+											 speech_at))
+				click.echo('%-16s %10d %14s %13s %13s %13s %16s' % (
+					name, 0, '-', '-', '-', '-', wait))
+	finally:
+		channels.close()
+		server.stop(None)
+
+
+if __name__ == '__main__':
+	main()
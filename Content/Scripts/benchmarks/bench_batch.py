@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Measures batch runs of a corpus of recorded requests.
+
+A corpus of generated WAV requests is run through a BatchRunner against
+a local EmbeddedAssistantServicer that streams its answers at a multiple
+of real time, first one call at a time, then with more workers. A last
+run starts with the servicer rejecting some calls, then resumes from
+its results file, which sends only the requests that failed.
+"""
+
+import array
+import csv
+import os
+import shutil
+import tempfile
+import time
+import wave
+
+import click
+import grpc
+
+from benchmarks import fakes
+fakes.install()
+from benchmarks import simulator
+
+from googlesamples.assistant import batch_helpers, common_settings
+from googlesdk.assistant.embedded.v1alpha1 import embedded_assistant_pb2
+
+SAMPLE_RATE = common_settings.DEFAULT_AUDIO_SAMPLE_RATE
+SAMPLE_WIDTH = common_settings.DEFAULT_AUDIO_SAMPLE_WIDTH
+ITER_SIZE = common_settings.DEFAULT_AUDIO_ITER_SIZE
+
+
+def make_corpus(directory, requests, seconds):
+	samples = array.array('h', range(-8000, 8000, 16)).tobytes()
+	frames = samples * (int(seconds * SAMPLE_RATE) * SAMPLE_WIDTH //
+						len(samples))
+	for idx in range(requests):
+		# Requests are spread over subdirectories, like recording sessions.
+		path = os.path.join(directory, 'session%d' % (idx % 4),
+							'request%03d.wav' % idx)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		with wave.open(path, 'wb') as f:
+			f.setnchannels(1)
+			f.setsampwidth(SAMPLE_WIDTH)
+			f.setframerate(SAMPLE_RATE)
+			f.writeframes(frames)
+
+
+def run(corpus, port, results, workers, audio_dir=None):
+	"""Returns (seconds, rows sent, rows in the results file)."""
+	channel = grpc.insecure_channel('127.0.0.1:%d' % port)
+	results_file = batch_helpers.ResultsFile(results)
+	runner = batch_helpers.BatchRunner(
+		embedded_assistant_pb2.EmbeddedAssistantStub(channel), results_file,
+		audio_dir=audio_dir, workers=workers, trailing_silence_ms=200)
+	rows = []
+	started = time.perf_counter()
+	runner.run(corpus, batch_helpers.find_requests(corpus), rows.append)
+	elapsed = time.perf_counter() - started
+	results_file.close()
+	channel.close()
+	with open(results, newline='') as f:
+		written = list(csv.DictReader(f))
+	return elapsed, rows, written
+
+
+def _percentile(rows, column, fraction):
+	values = sorted(float(row[column]) for row in rows
+					if row[column] not in (None, ''))
+	if not values:
+		return float('nan')
+	return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+@click.command()
+@click.option('--requests', default=32, show_default=True,
+			  help='Requests in the corpus.')
+@click.option('--request-seconds', default=2.0, show_default=True,
+			  help='Length of each request.')
+@click.option('--answer-ms', default=2000, show_default=True,
+			  help='Length of each answer.')
+@click.option('--pace', default=10.0, show_default=True,
+			  help='Speed at which the server streams answers, relative to '
+			  'real time.')
+@click.option('--workers', default=common_settings.DEFAULT_BATCH_WORKERS,
+			  show_default=True, help='Workers of the concurrent run.')
+def main(requests, request_seconds, answer_ms, pace, workers):
+	directory = tempfile.mkdtemp()
+	corpus = os.path.join(directory, 'corpus')
+	make_corpus(corpus, requests, request_seconds)
+	chunk_time = ITER_SIZE / float(SAMPLE_RATE * SAMPLE_WIDTH)
+	servicer_options = dict(
+		max_workers=2 * workers,
+		utterance_ms=1000 * request_seconds,
+		response_chunks=int(answer_ms / 1000.0 / chunk_time),
+		response_chunk_size=ITER_SIZE, pace=pace)
+	server, port = simulator.serve(**servicer_options)
+	try:
+		click.echo('%-10s %10s %10s %10s %14s %14s %10s' % (
+			'workers', 'time (s)', 'done', 'req/s', 'p50 total (ms)',
+			'p95 total (ms)', 'audio'))
+		for count in (1, workers):
+			results = os.path.join(directory, 'results%d.csv' % count)
+			audio_dir = os.path.join(directory, 'audio%d' % count)
+			elapsed, rows, written = run(corpus, port, results, count,
+										 audio_dir)
+			saved = sum(1 for _, _, files in os.walk(audio_dir)
+						for name in files if name.endswith('.response.wav'))
+			click.echo('%-10d %10.2f %10d %10.1f %14.1f %14.1f %10d' % (
+				count, elapsed, len(written), len(rows) / elapsed,
+				_percentile(written, 'total_ms', 0.5),
+				_percentile(written, 'total_ms', 0.95), saved))
+	finally:
+		server.stop(None)
+
+	failing = requests // 4
+	server, port = simulator.serve(fail_first=failing, **servicer_options)
+	try:
+		results = os.path.join(directory, 'resumed.csv')
+		click.echo('%-10s %10s %10s %10s %10s' % (
+			'run', 'time (s)', 'sent', 'failed', 'ok rows'))
+		for name in ('first', 'resumed'):
+			elapsed, rows, written = run(corpus, port, results, workers)
+			click.echo('%-10s %10.2f %10d %10d %10d' % (
+				name, elapsed, len(rows),
+				sum(1 for row in rows if row['status'] != batch_helpers.OK),
+				sum(1 for row in written
+					if row['status'] == batch_helpers.OK)))
+	finally:
+		server.stop(None)
+		shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Measures what the response cache saves on repeated requests.
+
+Players ask a local EmbeddedAssistantServicer a handful of scripted
+questions over and over, plus one time-sensitive question the cache
+must never answer. The servicer streams its answers at a multiple of
+real time. Each conversation is timed from the start of the request to
+the last of the answer handed to the stream, and the servicer counts
+the answer audio it actually sent. The memory-mapped store is run once
+from an empty file and once reopened, as after a restart.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+import click
+import grpc
+
+from benchmarks import fakes
+fakes.install()
+from benchmarks import simulator
+
+from googlesamples.assistant import audio_helpers, common_settings
+
+import channel_manager
+fakes.install_site()
+import response_cache
+import threaded_assistant
+
+SAMPLE_RATE = common_settings.DEFAULT_AUDIO_SAMPLE_RATE
+SAMPLE_WIDTH = common_settings.DEFAULT_AUDIO_SAMPLE_WIDTH
+QUESTIONS = (
+	'Where is the blacksmith?',
+	'tell me a joke',
+	'What is the password',
+	'who are you?',
+	'what time is it',
+)
+
+
+def run(channels, server, conversations, cache):
+	stream = audio_helpers.ConversationStream(
+		source=fakes.SilentSource(), sink=fakes.NullSink(),
+		iter_size=common_settings.DEFAULT_AUDIO_ITER_SIZE,
+		sample_width=SAMPLE_WIDTH)
+	sent_before = server.calls['sent_bytes']
+	times = []
+	for _ in range(conversations):
+		conversation = threaded_assistant.ThreadedAssistant(
+			stream, channels=channels, follow_on=False,
+			response_cache=cache, cache_responses=cache is not None)
+		started = time.perf_counter()
+		conversation.run()
+		times.append(time.perf_counter() - started)
+	stream.close()
+	stats = cache.reset_stats() if cache is not None else None
+	return times, server.calls['sent_bytes'] - sent_before, stats
+
+
+@click.command()
+@click.option('--conversations', default=40, show_default=True,
+			  help='Conversations per mode.')
+@click.option('--answer-ms', default=2000, show_default=True,
+			  help='Length of each answer.')
+@click.option('--pace', default=10.0, show_default=True,
+			  help='Speed at which the server streams answers, relative to '
+			  'real time.')
+def main(conversations, answer_ms, pace):
+	chunk_size = 3200
+	chunk_time = chunk_size / float(SAMPLE_RATE * SAMPLE_WIDTH)
+	server, port = simulator.serve(
+		max_workers=8, response_chunks=int(answer_ms / 1000.0 / chunk_time),
+		response_chunk_size=chunk_size, pace=pace,
+		transcripts=QUESTIONS)
+	channels = channel_manager.ChannelManager(
+		lambda options: grpc.insecure_channel('127.0.0.1:%d' % port,
+											  options=options))
+	directory = tempfile.mkdtemp()
+	path = os.path.join(directory, 'responses.cache')
+
+	def cache(store=None):
+		return response_cache.ResponseCache(
+			max_entries=common_settings.DEFAULT_RESPONSE_CACHE_ENTRIES,
+			max_bytes=common_settings.DEFAULT_RESPONSE_CACHE_BYTES,
+			ttl=common_settings.DEFAULT_RESPONSE_CACHE_TTL,
+			no_store=common_settings.RESPONSE_CACHE_NO_STORE, store=store)
+
+	def mapped_cache():
+		return cache(response_cache.MappedStore(
+			path, common_settings.DEFAULT_RESPONSE_CACHE_STORE_SIZE))
+
+	try:
+		channels.warm_up().join()
+		click.echo('%-14s %14s %13s %16s %10s %16s' % (
+			'cache', 'mean (ms)', 'p50 (ms)', 'audio sent (kB)', 'hit rate',
+			'bytes saved (kB)'))
+		modes = (
+			('none', lambda: None),
+			('memory', cache),
+			('mmap, empty', mapped_cache),
+			('mmap, reopened', mapped_cache),
+		)
+		for name, make_cache in modes:
+			responses = make_cache()
+			times, sent, stats = run(channels, server, conversations,
+									 responses)
+			if responses is not None:
+				responses.close()
+			times.sort()
+			click.echo('%-14s %14.1f %13.1f %16.1f %10s %16s' % (
+				name, 1000 * sum(times) / len(times),
+				1000 * times[len(times) // 2], sent / 1000.0,
+				'%d%%' % (100 * stats['hit_rate']) if stats else '-',
+				'%.1f' % (stats['bytes_saved'] / 1000.0) if stats else '-'))
+	finally:
+		channels.close()
+		server.stop(None)
+		shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+	main()
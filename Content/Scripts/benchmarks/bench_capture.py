@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Measures the callback capture backend against a fake input device.
+
+Every scenario records for a few seconds while a reader drains the
+capture through read(), optionally slower than real time to mimic gRPC
+back-pressure. It reports the device startup time, the callback jitter
+and the number of blocks dropped because the reader fell behind.
+"""
+
+import threading
+import time
+
+import click
+
+from benchmarks import fakes
+fakes.install()
+
+from googlesamples.assistant import common_settings
+from googlesamples.assistant.audio_helpers import capture
+
+# (device jitter in ms, frames per device callback, reader delay in ms)
+SCENARIOS = (
+	(0, None, 0),
+	(5, None, 0),
+	(20, None, 0),
+	(0, 1000, 0),
+	(5, None, 120),
+	(5, None, 250),
+)
+
+
+def run_scenario(seconds, jitter_ms, block_frames, reader_delay_ms,
+				 ring_size, startup_delay_ms):
+	fakes.FakeRawInputStream.startup_delay = startup_delay_ms / 1000.0
+	fakes.FakeRawInputStream.jitter = jitter_ms / 1000.0
+	fakes.FakeRawInputStream.block_frames = block_frames
+
+	sample_rate = common_settings.DEFAULT_AUDIO_SAMPLE_RATE
+	sample_width = common_settings.DEFAULT_AUDIO_SAMPLE_WIDTH
+	iter_size = common_settings.DEFAULT_AUDIO_ITER_SIZE
+	recorder = capture.CallbackCapture(
+		sample_rate, sample_width,
+		common_settings.DEFAULT_AUDIO_DEVICE_BLOCK_SIZE, ring_size)
+	timestamps = []
+	recorder.add_consumer(lambda block: timestamps.append(block.timestamp))
+
+	done = threading.Event()
+
+	def reader():
+		while not done.is_set():
+			if not recorder.read(iter_size):
+				break
+			time.sleep(reader_delay_ms / 1000.0)
+
+	thread = threading.Thread(target=reader)
+	recorder.start()
+	thread.start()
+	time.sleep(seconds)
+	done.set()
+	recorder.close()
+	thread.join()
+
+	stats = recorder.stats
+	stats['ordered'] = all(a < b for a, b in zip(timestamps, timestamps[1:]))
+	return stats
+
+
+@click.command()
+@click.option('--seconds', default=5.0, show_default=True,
+			  help='Recording time per scenario.')
+@click.option('--ring-size', show_default=True,
+			  default=common_settings.DEFAULT_AUDIO_CAPTURE_RING_SIZE,
+			  help='Capacity of the capture ring buffer in bytes.')
+@click.option('--startup-delay', default=30, show_default=True,
+			  help='Fake device startup delay in ms.')
+def main(seconds, ring_size, startup_delay):
+	click.echo('%7s %7s %7s %10s %10s %10s %7s %8s %8s' % (
+		'jitter', 'frames', 'reader', 'start (ms)', 'mean (ms)', 'max (ms)',
+		'blocks', 'dropped', 'ordered'))
+	for jitter_ms, block_frames, reader_delay_ms in SCENARIOS:
+		stats = run_scenario(seconds, jitter_ms, block_frames,
+							 reader_delay_ms, ring_size, startup_delay)
+		click.echo('%7d %7s %7d %10.1f %10.2f %10.2f %7d %8d %8s' % (
+			jitter_ms, block_frames or 'block', reader_delay_ms,
+			1000 * stats['startup_time'], 1000 * stats['jitter_mean'],
+			1000 * stats['jitter_max'], stats['blocks'],
+			stats['dropped_blocks'], stats['ordered']))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Exercises ChannelManager against a local EmbeddedAssistantServicer.
+
+Reports the time to the first response of a conversation on a cold
+channel and on one warmed up in the background, and checks that a
+conversation survives the server rejecting its first call as UNAVAILABLE
+and the server going away and coming back on the same port. The last two
+checks are repeated with AsyncConversations on an AsyncAssistantEngine,
+as conversations in the game run.
+"""
+
+import threading
+import time
+
+import click
+import grpc
+
+from benchmarks import fakes
+fakes.install()
+from benchmarks import simulator
+
+from googlesamples.assistant import audio_helpers, common_settings
+
+import channel_manager
+fakes.install_site()
+import async_assistant
+import threaded_assistant
+
+
+def _manager(port, **options):
+	return channel_manager.ChannelManager(
+		lambda channel_options: grpc.insecure_channel(
+			'127.0.0.1:%d' % port, options=channel_options),
+		**options)
+
+
+def _stream(realtime=True):
+	# A realtime source only sends audio after the first 100 ms, which
+	# leaves the retries something to do.
+	return audio_helpers.ConversationStream(
+		source=fakes.SilentSource(realtime=realtime), sink=fakes.NullSink(),
+		iter_size=common_settings.DEFAULT_AUDIO_ITER_SIZE,
+		sample_width=common_settings.DEFAULT_AUDIO_SAMPLE_WIDTH)
+
+
+def _converse(channels, realtime=True):
+	"""Returns seconds to the first response and the response count."""
+	conversation = threaded_assistant.ThreadedAssistant(
+		_stream(realtime), channels=channels)
+	conversation.begin_turn()
+	started = time.perf_counter()
+	first = None
+	count = 0
+	for resp in channels.converse(conversation.gen_converse_requests(), 10):
+		if first is None:
+			first = time.perf_counter() - started
+		count += 1
+		conversation.handle_response(resp)
+	conversation.end_turn()
+	return first, count
+
+
+class _TimedConversation(async_assistant.AsyncConversation):
+	"""AsyncConversation noting when its responses arrive."""
+	def begin_turn(self):
+		self.started = time.perf_counter()
+		self.first = None
+		self.count = 0
+		async_assistant.AsyncConversation.begin_turn(self)
+
+	def handle_response(self, resp):
+		if self.first is None:
+			self.first = time.perf_counter() - self.started
+		self.count += 1
+		return async_assistant.AsyncConversation.handle_response(self, resp)
+
+
+def _engine(port, **options):
+	return async_assistant.AsyncAssistantEngine(
+		lambda channel_options: grpc.aio.insecure_channel(
+			'127.0.0.1:%d' % port, options=channel_options),
+		**options)
+
+
+def _converse_async(engine):
+	"""Returns seconds to the first response and the response count."""
+	conversation = _TimedConversation(_stream(), follow_on=False,
+									  cache_responses=False)
+	engine.converse(conversation).result()
+	return conversation.first, conversation.count
+
+
+def _check_async(restart_after):
+	"""Runs the rejection and restart checks on an AsyncAssistantEngine."""
+	flaky, flaky_port = simulator.serve(max_workers=8, fail_first=1)
+	try:
+		engine = _engine(flaky_port)
+		engine.warm_up().result()
+		first, count = _converse_async(engine)
+		click.echo('async, rejected once: %d responses after %d retries, '
+				   'first after %.1f ms' % (count, engine.channels.retries,
+											1000 * first))
+		engine.stop()
+	finally:
+		flaky.stop(None)
+
+	server, port = simulator.serve(max_workers=8)
+	engine = _engine(port, max_retries=5)
+	try:
+		engine.warm_up().result()
+		_converse_async(engine)
+		server.stop(None).wait()
+		restarted = []
+		def restart():
+			time.sleep(restart_after)
+			restarted.append(simulator.serve(port=port, max_workers=8))
+		threading.Thread(target=restart, daemon=True).start()
+		first, count = _converse_async(engine)
+		server = restarted[0][0]
+		click.echo('async, server down %.1f s: %d responses after %d '
+				   'retries, first after %.1f ms' % (
+					   restart_after, count, engine.channels.retries,
+					   1000 * first))
+	finally:
+		engine.stop()
+		server.stop(None)
+
+
+@click.command()
+@click.option('--restart-after', default=0.5, show_default=True,
+			  help='Seconds the server stays down in the restart test.')
+def main(restart_after):
+	server, port = simulator.serve(max_workers=8)
+	try:
+		cold = _manager(port)
+		cold_first, _ = _converse(cold, realtime=False)
+		cold.close()
+
+		# Extra retries, as the restarted server below takes a moment
+		# to accept connections on its old port.
+		warm = _manager(port, max_retries=5)
+		warm.warm_up().join()
+		warm_first, _ = _converse(warm, realtime=False)
+		click.echo('first response: cold %.2f ms, warm %.2f ms' % (
+			1000 * cold_first, 1000 * warm_first))
+
+		flaky, flaky_port = simulator.serve(max_workers=8, fail_first=1)
+		try:
+			channels = _manager(flaky_port)
+			channels.warm_up().join()
+			first, count = _converse(channels)
+			click.echo('rejected once: %d responses after %d retries, '
+					   'first after %.1f ms' % (count, channels.retries,
+												1000 * first))
+			channels.close()
+		finally:
+			flaky.stop(None)
+
+		server.stop(None).wait()
+		restarted = []
+		def restart():
+			time.sleep(restart_after)
+			restarted.append(simulator.serve(port=port, max_workers=8))
+		threading.Thread(target=restart, daemon=True).start()
+		first, count = _converse(warm)
+		server = restarted[0][0]
+		click.echo('server down %.1f s: %d responses after %d retries, '
+				   'first after %.1f ms' % (restart_after, count,
+											warm.retries, 1000 * first))
+		warm.close()
+	finally:
+		server.stop(None)
+	_check_async(restart_after)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Measures the background credential refresher against a fake token endpoint.
+
+Reports how long setup blocks the calling thread with the old forced
+refresh and with CredentialService, how many token requests a burst of
+authorized calls makes, and whether short-lived tokens are refreshed
+ahead of expiry while a reader keeps loading the credentials file.
+"""
+
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import click
+import google.auth.transport.requests
+
+from benchmarks import fakes
+fakes.install()
+
+from googlesamples.assistant import auth_helpers, common_settings
+
+import credential_service
+
+SCOPES = [common_settings.ASSISTANT_OAUTH_SCOPE]
+
+
+def _write_credentials(path, token_uri):
+	"""Saves credentials with an expired token, like after a night off."""
+	with open(path, 'w') as f:
+		json.dump({'access_token': 'stale', 'expiry': '2017-01-01T00:00:00Z',
+				   'refresh_token': 'refresh', 'token_uri': token_uri,
+				   'client_id': 'client', 'client_secret': 'secret'}, f)
+
+
+def _blocking_setup(path):
+	"""What setup_assistant and create_grpc_channel used to do."""
+	credentials = auth_helpers.load_credentials(path, scopes=SCOPES)
+	credentials.refresh(google.auth.transport.requests.Request())
+	return credentials
+
+
+def _service_setup(path, refresh_margin):
+	service = credential_service.CredentialService(
+		path, SCOPES, refresh_margin=refresh_margin)
+	service.load()
+	service.start()
+	return service
+
+
+@click.command()
+@click.option('--delay', default=0.3, show_default=True,
+			  help='Token endpoint response time in seconds.')
+@click.option('--calls', default=100, show_default=True,
+			  help='Authorized calls made after setup.')
+@click.option('--lifetime', default=2, show_default=True,
+			  help='Token lifetime in the expiry test, in seconds.')
+@click.option('--duration', default=5, show_default=True,
+			  help='Length of the expiry test in seconds.')
+def main(delay, calls, lifetime, duration):
+	tmp = tempfile.mkdtemp()
+	path = os.path.join(tmp, common_settings.ASSISTANT_CREDENTIALS_FILENAME)
+	server, url = fakes.serve_token_endpoint(delay=delay)
+	try:
+		_write_credentials(path, url)
+		started = time.perf_counter()
+		_blocking_setup(path)
+		blocking = time.perf_counter() - started
+
+		_write_credentials(path, url)
+		server.requests = 0
+		started = time.perf_counter()
+		service = _service_setup(
+			path, common_settings.DEFAULT_CREDENTIALS_REFRESH_MARGIN)
+		background = time.perf_counter() - started
+		click.echo('setup blocked for %.1f ms with a forced refresh, '
+				   '%.1f ms with CredentialService' % (
+					   1000 * blocking, 1000 * background))
+
+		# Every gRPC call runs the channel's auth plugin, which refreshes
+		# only when the cached token is not valid. The first conversation
+		# starts well after setup, by which time the refresh is done.
+		service.wait_until_valid()
+		request = google.auth.transport.requests.Request()
+		started = time.perf_counter()
+		for _ in range(calls):
+			service.credentials.before_request(request, 'POST', url, {})
+		service.stop()
+		click.echo('%d calls: %d token requests, %.2f ms per call' % (
+			calls, server.requests, 1000 * (time.perf_counter() - started) /
+			calls))
+	finally:
+		server.shutdown()
+
+	server, url = fakes.serve_token_endpoint(expires_in=lifetime)
+	try:
+		_write_credentials(path, url)
+		service = _service_setup(path, refresh_margin=lifetime)
+		expired = []
+		unreadable = []
+		done = threading.Event()
+		def read_file():
+			while not done.is_set():
+				refreshed = service.refreshes
+				try:
+					credentials = auth_helpers.load_credentials(path, SCOPES)
+				except ValueError:
+					unreadable.append(path)
+					continue
+				now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+				if refreshed and credentials.expiry < now:
+					expired.append(credentials.expiry)
+		reader = threading.Thread(target=read_file)
+		reader.start()
+		time.sleep(duration)
+		done.set()
+		reader.join()
+		service.stop()
+		click.echo('%d s of %d s tokens: %d refreshes, %d expired reads, '
+				   '%d unreadable reads' % (duration, lifetime,
+											service.refreshes, len(expired),
+											len(unreadable)))
+	finally:
+		server.shutdown()
+		shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+	main()
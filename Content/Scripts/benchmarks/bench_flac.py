@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Compares FLAC request audio against LINEAR16.
+
+Each signal is streamed through a ConversationStream the way
+gen_converse_requests does, and the benchmark reports the bytes of the
+serialized ConverseRequest messages and the encoding time per second
+of audio, for the NumPy and pure Python encoder paths.
+
+Every encoded stream is also decoded by a reference decoder written
+from the FLAC format description, which checks the frame header CRC-8
+and frame CRC-16 of every frame, and the decoded samples are compared
+with the input; any mismatch fails the benchmark.
+"""
+
+import math
+import random
+import struct
+import time
+
+import click
+
+from benchmarks import fakes
+fakes.install()
+
+from googlesdk.assistant.embedded.v1alpha1 import embedded_assistant_pb2
+from googlesamples.assistant import audio_helpers, common_settings
+from googlesamples.assistant.audio_helpers import flac
+
+from benchmarks.bench_vad import synthesize
+
+
+class _BufferSource(fakes.SilentSource):
+	"""Plays a fixed buffer, then ends the stream."""
+	def __init__(self, audio):
+		fakes.SilentSource.__init__(self)
+		self._audio = audio
+		self._offset = 0
+
+	def read(self, size):
+		data = self._audio[self._offset:self._offset + size]
+		self._offset += size
+		return data
+
+
+def _signals(sample_rate, seconds):
+	rng = random.Random(0)
+	count = sample_rate * seconds
+	return (
+		('speech', synthesize(sample_rate, 0, 1000 * seconds, 0, 60, 4000)),
+		('silence', bytes(2 * count)),
+		('quiet room', struct.pack('<%dh' % count, *[
+			int(rng.gauss(0, 30)) for _ in range(count)])),
+		('music', struct.pack('<%dh' % count, *[
+			int(8000 * math.sin(2 * math.pi * 440 * i / sample_rate) +
+				4000 * math.sin(2 * math.pi * 660 * i / sample_rate))
+			for i in range(count)])),
+	)
+
+
+def _crc(data, poly, bits):
+	"""Bit by bit CRC, independent of the encoder's table driven one."""
+	top = 1 << (bits - 1)
+	mask = (1 << bits) - 1
+	crc = 0
+	for byte in bytearray(data):
+		crc ^= byte << (bits - 8)
+		for _ in range(8):
+			crc = ((crc << 1) ^ poly) if crc & top else (crc << 1)
+			crc &= mask
+	return crc
+
+
+class _BitReader(object):
+	"""Big-endian bit reader over bytes."""
+	def __init__(self, data, position=0):
+		self.data = data
+		self.position = position * 8
+
+	def read(self, bits):
+		if not bits:
+			return 0
+		start = self.position >> 3
+		end = (self.position + bits + 7) >> 3
+		assert end <= len(self.data), 'FLAC stream truncated'
+		value = int.from_bytes(self.data[start:end], 'big')
+		value >>= 8 * (end - start) - (self.position & 7) - bits
+		self.position += bits
+		return value & ((1 << bits) - 1)
+
+	def read_signed(self, bits):
+		value = self.read(bits)
+		return value - (1 << bits) if bits and value >> (bits - 1) else value
+
+	def read_unary(self):
+		"""Counts the zero bits before the next one bit."""
+		count = 0
+		while True:
+			index = self.position >> 3
+			assert index < len(self.data), 'FLAC stream truncated'
+			# The bits of the current byte not read yet.
+			left = 8 - (self.position & 7)
+			rest = self.data[index] & ((1 << left) - 1)
+			if rest:
+				zeros = left - rest.bit_length()
+				self.position += zeros + 1
+				return count + zeros
+			count += left
+			self.position += left
+
+	def align(self):
+		self.position = (self.position + 7) & ~7
+
+	@property
+	def byte_position(self):
+		return self.position >> 3
+
+
+# Fixed predictor coefficients, most recent sample first.
+_FIXED_COEFFICIENTS = ((), (1,), (2, -1), (3, -3, 1), (4, -6, 4, -1))
+
+
+def _decode_residual(reader, block_size, order):
+	method = reader.read(2)
+	assert method in (0, 1), ('reserved residual coding method', method)
+	parameter_bits = 4 if method == 0 else 5
+	escape = (1 << parameter_bits) - 1
+	partition_order = reader.read(4)
+	residual = []
+	for partition in range(1 << partition_order):
+		count = block_size >> partition_order
+		if partition == 0:
+			count -= order
+		parameter = reader.read(parameter_bits)
+		if parameter == escape:
+			raw_bits = reader.read(5)
+			residual.extend(reader.read_signed(raw_bits)
+							for _ in range(count))
+			continue
+		for _ in range(count):
+			folded = (reader.read_unary() << parameter) | \
+				reader.read(parameter)
+			residual.append((folded >> 1) ^ -(folded & 1))
+	return residual
+
+
+def _decode_subframe(reader, block_size, bps):
+	assert reader.read(1) == 0, 'subframe padding bit set'
+	kind = reader.read(6)
+	assert reader.read(1) == 0, 'wasted bits are not written'
+	if kind == 0:
+		return [reader.read_signed(bps)] * block_size
+	if kind == 1:
+		return [reader.read_signed(bps) for _ in range(block_size)]
+	assert 8 <= kind <= 12, ('unexpected subframe type', kind)
+	order = kind - 8
+	samples = [reader.read_signed(bps) for _ in range(order)]
+	coefficients = _FIXED_COEFFICIENTS[order]
+	for residual in _decode_residual(reader, block_size, order):
+		prediction = 0
+		for coefficient, sample in zip(coefficients,
+									   samples[-1:-order - 1:-1]):
+			prediction += coefficient * sample
+		samples.append(prediction + residual)
+	return samples
+
+
+def _decode_utf8_number(reader):
+	first = reader.read(8)
+	if first < 0x80:
+		return first
+	length = 8 - (first ^ 0xFF).bit_length()
+	value = first & ((1 << (7 - length)) - 1)
+	for _ in range(length - 1):
+		byte = reader.read(8)
+		assert byte >> 6 == 2, 'bad frame number encoding'
+		value = (value << 6) | (byte & 0x3F)
+	return value
+
+
+def decode(data, sample_rate):
+	"""Decodes a mono 16-bit FLAC stream; returns (samples, frames)."""
+	data = bytes(data)
+	assert data[:4] == b'fLaC', 'no fLaC marker'
+	reader = _BitReader(data, 4)
+	last = reader.read(1)
+	assert last == 1 and reader.read(7) == 0, 'expected STREAMINFO only'
+	assert reader.read(24) == 34, 'bad STREAMINFO length'
+	reader.read(16 + 16 + 24 + 24)
+	assert reader.read(20) == sample_rate, 'bad STREAMINFO sample rate'
+	assert reader.read(3) == 0, 'expected one channel'
+	bps = reader.read(5) + 1
+	assert bps == 16, ('unexpected bits per sample', bps)
+	reader.read(36 + 128)
+
+	samples = []
+	frames = 0
+	while reader.byte_position < len(data):
+		start = reader.byte_position
+		assert reader.read(15) == 0x7FFC, 'lost frame sync'
+		assert reader.read(1) == 0, 'expected fixed block size'
+		block_code = reader.read(4)
+		rate_code = reader.read(4)
+		assert reader.read(4) == 0, 'expected mono'
+		assert reader.read(3) == 4, 'expected 16 bits per sample'
+		assert reader.read(1) == 0, 'frame header reserved bit set'
+		assert _decode_utf8_number(reader) == frames, 'frame out of order'
+		if block_code == 6:
+			block_size = reader.read(8) + 1
+		elif block_code == 7:
+			block_size = reader.read(16) + 1
+		else:
+			assert block_code != 0, 'reserved block size'
+			block_size = (192 if block_code == 1 else
+						  576 << (block_code - 2) if block_code <= 5 else
+						  256 << (block_code - 8))
+		if rate_code == 12:
+			reader.read(8)
+		elif rate_code in (13, 14):
+			reader.read(16)
+		assert _crc(data[start:reader.byte_position], 0x07, 8) == \
+			reader.read(8), ('frame header CRC-8 mismatch in frame', frames)
+		samples.extend(_decode_subframe(reader, block_size, bps))
+		reader.align()
+		assert _crc(data[start:reader.byte_position], 0x8005, 16) == \
+			reader.read(16), ('frame CRC-16 mismatch in frame', frames)
+		frames += 1
+	return samples, frames
+
+
+def _check_round_trip(audio, encoded, sample_rate):
+	"""Returns the frames decoded; asserts they give back the audio."""
+	samples, frames = decode(encoded, sample_rate)
+	expected = list(struct.unpack('<%dh' % (len(audio) // 2), audio))
+	assert len(samples) == len(expected), (
+		'decoded %d samples, expected %d' % (len(samples), len(expected)))
+	for index, (got, want) in enumerate(zip(samples, expected)):
+		assert got == want, ('sample %d decoded as %d, expected %d' %
+							 (index, got, want))
+	return frames
+
+
+def _stream(audio, encoder):
+	"""Returns the serialized request bytes, the time spent and the
+	audio sent."""
+	stream = audio_helpers.ConversationStream(
+		source=_BufferSource(audio), sink=fakes.NullSink(),
+		iter_size=common_settings.DEFAULT_AUDIO_ITER_SIZE,
+		sample_width=common_settings.DEFAULT_AUDIO_SAMPLE_WIDTH,
+		encoder=encoder)
+	wire = 0
+	sent = []
+	started = time.process_time()
+	for data in stream:
+		wire += embedded_assistant_pb2.ConverseRequest(audio_in=data).ByteSize()
+		sent.append(data)
+	return wire, time.process_time() - started, b''.join(sent)
+
+
+@click.command()
+@click.option('--seconds', default=5, show_default=True,
+			  help='Length of each test signal.')
+def main(seconds):
+	sample_rate = common_settings.DEFAULT_AUDIO_SAMPLE_RATE
+	block_samples = (common_settings.DEFAULT_AUDIO_ITER_SIZE //
+					 common_settings.DEFAULT_AUDIO_SAMPLE_WIDTH)
+	backends = [('numpy', flac.np)] if flac.np is not None else []
+	backends.append(('python', None))
+	np_module = flac.np
+
+	click.echo('%11s %8s %13s %11s %7s %18s %16s' % (
+		'signal', 'backend', 'LINEAR16 (B)', 'FLAC (B)', 'ratio',
+		'encode (ms per s)', 'frames checked'))
+	try:
+		for name, audio in _signals(sample_rate, seconds):
+			linear16, _, _ = _stream(audio, None)
+			for backend, np_backend in backends:
+				flac.np = np_backend
+				encoder = flac.FlacEncoder(sample_rate,
+										   block_samples=block_samples)
+				encoded, cpu, sent = _stream(audio, encoder)
+				frames = _check_round_trip(audio, sent, sample_rate)
+				click.echo('%11s %8s %13d %11d %6.1f%% %18.2f %16d' % (
+					name, backend, linear16, encoded,
+					100.0 * encoded / linear16, 1000 * cpu / seconds,
+					frames))
+	finally:
+		flac.np = np_module
+
+
+if __name__ == '__main__':
+	main()
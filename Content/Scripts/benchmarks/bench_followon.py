@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Measures the gap between the turns of a multi-turn conversation.
+
+A local EmbeddedAssistantServicer asks for a reply a few times in a row.
+The conversation is held once the old way, with the player pressing the
+talk key again the moment each answer has played, which restarts the
+audio device and loses the conversation_state, and then with automatic
+follow-on turns, with and without pre-opening the next Converse call.
+The gap is the time from the end of an answer's playback to the first
+chunk of the follow-on request audio.
+"""
+
+import time
+
+import click
+import grpc
+
+from benchmarks import fakes
+fakes.install()
+from benchmarks import simulator
+
+from googlesamples.assistant import audio_helpers, common_settings
+
+import channel_manager
+fakes.install_site()
+import threaded_assistant
+
+SAMPLE_RATE = common_settings.DEFAULT_AUDIO_SAMPLE_RATE
+SAMPLE_WIDTH = common_settings.DEFAULT_AUDIO_SAMPLE_WIDTH
+# 20 ms reads, so the gaps are not hidden behind long blocks.
+BLOCK_SIZE = 640
+
+
+def _stream():
+	device = audio_helpers.UnrealSoundStream(
+		sample_rate=SAMPLE_RATE, sample_width=SAMPLE_WIDTH,
+		block_size=BLOCK_SIZE, flush_size=0,
+		procedural_audio_wave=fakes.FakeSoundWaveProcedural(),
+		ring_size=8 * BLOCK_SIZE)
+	return audio_helpers.ConversationStream(
+		source=device, sink=device, iter_size=BLOCK_SIZE,
+		sample_width=SAMPLE_WIDTH)
+
+
+def run_press_again(channels, turns):
+	"""Returns the gaps and turns of the old press-to-reply flow."""
+	stream = _stream()
+	gaps = []
+	for _ in range(turns):
+		conversation = threaded_assistant.ThreadedAssistant(
+			stream, channels=channels, follow_on=False)
+		conversation.run()
+		gaps.extend(conversation.turn_gaps)
+		# The player presses the talk key again as the answer ends.
+		stream.drain()
+	stream.close()
+	return gaps, turns
+
+
+def run_follow_on(channels, preopen):
+	stream = _stream()
+	conversation = threaded_assistant.ThreadedAssistant(
+		stream, channels=channels, follow_on=True, preopen=preopen)
+	conversation.run()
+	stream.close()
+	return conversation.turn_gaps, len(conversation.turn_gaps) + 1
+
+
+@click.command()
+@click.option('--follow-ons', default=3, show_default=True,
+			  help='Replies the Assistant asks for in a row.')
+@click.option('--device-startup', default=0.05, show_default=True,
+			  help='Seconds the input device takes to deliver audio after '
+			  'being started.')
+def main(follow_ons, device_startup):
+	fakes.FakeRawInputStream.startup_delay = device_startup
+	server, port = simulator.serve(
+		max_workers=8, utterance_ms=500, response_chunks=5,
+		follow_on_turns=follow_ons)
+	channels = channel_manager.ChannelManager(
+		lambda options: grpc.insecure_channel('127.0.0.1:%d' % port,
+											  options=options))
+	try:
+		channels.warm_up().join()
+		click.echo('%-18s %6s %14s %13s %11s' % (
+			'mode', 'turns', 'mean gap (ms)', 'max gap (ms)', 'total (s)'))
+		modes = (
+			('press again', lambda: run_press_again(channels, follow_ons + 1)),
+			('follow-on', lambda: run_follow_on(channels, False)),
+			('follow-on+preopen', lambda: run_follow_on(channels, True)),
+		)
+		for name, run in modes:
+			started = time.perf_counter()
+			gaps, turns = run()
+			total = time.perf_counter() - started
+			click.echo('%-18s %6d %14.2f %13.2f %11.2f' % (
+				name, turns, 1000 * sum(gaps) / max(1, len(gaps)),
+				1000 * max(gaps or [0]), total))
+	finally:
+		channels.close()
+		server.stop(None)
+
+
+if __name__ == '__main__':
+	main()
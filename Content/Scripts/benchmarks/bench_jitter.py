@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Measures stutter and time to first audio of response playback.
+
+Responses arrive as unevenly sized chunks at a multiple of real-time
+pace, with some chunks held up by network jitter. They are written to an
+UnrealSoundStream once queued straight to the sound wave and once
+through a JitterBuffer. The sound wave stand-in timestamps every
+queue_audio() call, from which the audible gaps are worked out
+independently of the buffer's own counters.
+"""
+
+import random
+import time
+
+import click
+
+from benchmarks import fakes
+fakes.install()
+
+from googlesamples.assistant import audio_helpers, common_settings
+
+SAMPLE_RATE = common_settings.DEFAULT_AUDIO_SAMPLE_RATE
+SAMPLE_WIDTH = common_settings.DEFAULT_AUDIO_SAMPLE_WIDTH
+BYTES_PER_SECOND = float(SAMPLE_RATE * SAMPLE_WIDTH)
+
+
+class TimedSoundWave(fakes.FakeSoundWaveProcedural):
+	"""Sound wave stand-in remembering when audio was queued."""
+	def __init__(self):
+		fakes.FakeSoundWaveProcedural.__init__(self)
+		self.times = []
+
+	def queue_audio(self, buf):
+		self.times.append((time.monotonic(), len(buf)))
+
+
+def _arrivals(rng, response_ms, jitter_ms, late_fraction, pace):
+	"""Chunk sizes and arrival offsets of one response, in seconds."""
+	chunks = []
+	offset = 0.0
+	arrival = 0.0
+	sent = 0
+	total = int(response_ms * BYTES_PER_SECOND / 1000)
+	while sent < total:
+		size = min(total - sent, SAMPLE_WIDTH * rng.randint(200, 600))
+		delay = 0.0
+		if rng.random() < late_fraction:
+			delay = rng.uniform(0, jitter_ms / 1000.0)
+		# A held up chunk holds up the ones behind it on the stream.
+		arrival = max(arrival, offset + delay)
+		chunks.append((size, arrival))
+		offset += size / BYTES_PER_SECOND / pace
+		sent += size
+	return chunks
+
+
+def _gaps(times):
+	"""Audible gaps after playback started, as (count, seconds)."""
+	count = 0
+	silent = 0.0
+	played_until = None
+	for queued_at, size in times:
+		if played_until is not None and queued_at > played_until:
+			count += 1
+			silent += queued_at - played_until
+		played_until = max(played_until or queued_at, queued_at)
+		played_until += size / BYTES_PER_SECOND
+	return count, silent
+
+
+def run(responses, jitter_buffer):
+	wave = TimedSoundWave()
+	stream = audio_helpers.UnrealSoundStream(
+		sample_rate=SAMPLE_RATE, sample_width=SAMPLE_WIDTH,
+		block_size=common_settings.DEFAULT_AUDIO_DEVICE_BLOCK_SIZE,
+		flush_size=0, procedural_audio_wave=wave,
+		jitter_buffer=jitter_buffer)
+	first_audio = []
+	stutters = 0
+	silent = 0.0
+	calls = 0
+	for chunks in responses:
+		wave.times = []
+		started = time.monotonic()
+		for size, offset in chunks:
+			time.sleep(max(0, started + offset - time.monotonic()))
+			stream.write(bytes(size))
+		stream.drain()
+		first_audio.append(wave.times[0][0] - started)
+		count, seconds = _gaps(wave.times)
+		stutters += count
+		silent += seconds
+		calls += len(wave.times)
+	stream.close()
+	return first_audio, stutters, silent, calls
+
+
+@click.command()
+@click.option('--responses', default=6, show_default=True,
+			  help='Responses played one after the other.')
+@click.option('--response-ms', default=1500, show_default=True,
+			  help='Length of each response.')
+@click.option('--jitter-ms', default=120, show_default=True,
+			  help='Largest delay of a late chunk.')
+@click.option('--late-fraction', default=0.1, show_default=True,
+			  help='Share of chunks that arrive late.')
+@click.option('--pace', default=1.0, show_default=True,
+			  help='Speed at which the server streams audio, relative to '
+			  'real time.')
+def main(responses, response_ms, jitter_ms, late_fraction, pace):
+	rng = random.Random(0)
+	schedule = [_arrivals(rng, response_ms, jitter_ms, late_fraction, pace)
+				for _ in range(responses)]
+	chunks = sum(len(chunks) for chunks in schedule)
+	click.echo('%d responses, %d chunks, up to %d ms late' % (
+		responses, chunks, jitter_ms))
+	click.echo('%-14s %16s %16s %9s %12s %13s' % (
+		'playout', 'first audio (ms)', 'last resp. (ms)', 'stutters',
+		'silent (ms)', 'queue calls'))
+	jitter_buffer = audio_helpers.JitterBuffer(
+		SAMPLE_RATE, SAMPLE_WIDTH,
+		common_settings.DEFAULT_AUDIO_PLAYOUT_BLOCK_SIZE,
+		common_settings.DEFAULT_JITTER_MIN_DEPTH_MS,
+		common_settings.DEFAULT_JITTER_MAX_DEPTH_MS)
+	for name, buffer in (('direct', None), ('jitter buffer', jitter_buffer)):
+		first_audio, stutters, silent, calls = run(schedule, buffer)
+		click.echo('%-14s %16.1f %16.1f %9d %12.1f %13d' % (
+			name, 1000 * sum(first_audio) / len(first_audio),
+			1000 * first_audio[-1], stutters, 1000 * silent, calls))
+	stats = jitter_buffer.stats
+	click.echo('jitter buffer: %d late chunks, %d underruns, target %.0f ms' % (
+		stats['late_chunks'], stats['underruns'],
+		1000 * stats['target_depth']))
+
+
+if __name__ == '__main__':
+	main()
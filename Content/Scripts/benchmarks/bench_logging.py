@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Measures what logging costs the thread that logs.
+
+Log lines are written to a sink that takes a fixed time per line, like
+the Unreal log with its output devices attached. Each kind of line is
+logged straight to the sink, formatted by concatenation as the scripts
+used to, and through an AsyncLog, which only queues it. ConverseResponse
+lines compare copying the message and clearing its audio with a lazy
+summary. Finally an error repeated on every audio chunk shows how many
+lines rate limiting writes, and a flood of lines into a small queue
+how many are dropped.
+"""
+
+import time
+
+import click
+
+from benchmarks import fakes
+fakes.install()
+
+from googlesamples.assistant import (
+	assistant_helpers,
+	common_settings,
+	log_helpers
+)
+from googlesdk.assistant.embedded.v1alpha1 import embedded_assistant_pb2
+
+ITER_SIZE = common_settings.DEFAULT_AUDIO_ITER_SIZE
+
+
+class Sink(object):
+	"""Log sink spending the given time on every line."""
+	def __init__(self, line_us):
+		self._line_time = line_us / 1e6
+		self.lines = 0
+
+	def write(self, text):
+		until = time.perf_counter() + self._line_time
+		while time.perf_counter() < until:
+			pass
+		self.lines += 1
+
+	def __call__(self, level, text):
+		self.write(text)
+
+
+def _response():
+	return embedded_assistant_pb2.ConverseResponse(
+		audio_out=embedded_assistant_pb2.AudioOut(audio_data=bytes(ITER_SIZE)),
+		result=embedded_assistant_pb2.ConverseResult(
+			spoken_request_text='what time is it',
+			conversation_state=b'state',
+			microphone_mode=embedded_assistant_pb2.ConverseResult.DIALOG_FOLLOW_ON))
+
+
+def _copy_without_audio(resp):
+	# What the sample's helper did before logging a response
+	resp_copy = embedded_assistant_pb2.ConverseResponse()
+	resp_copy.CopyFrom(resp)
+	size = len(resp_copy.audio_out.audio_data)
+	resp_copy.audio_out.ClearField('audio_data')
+	return 'ConverseResponse: ' + str(resp_copy) + ' audio_data (' + str(size) + ' bytes)'
+
+
+def _time(function, lines):
+	started = time.perf_counter()
+	for idx in range(lines):
+		function(idx)
+	return 1e6 * (time.perf_counter() - started) / lines
+
+
+@click.command()
+@click.option('--lines', default=5000, show_default=True,
+			  help='Lines logged per measurement.')
+@click.option('--line-us', default=50, show_default=True,
+			  help='Time the sink takes to write a line.')
+def main(lines, line_us):
+	stats = {'chunks': 32, 'bytes_copied': 102400, 'allocations': 1}
+	resp = _response()
+	cases = (
+		('info line',
+		 lambda sink, idx: sink.write(
+			 'Response audio: ' + str(stats['chunks']) + ' chunks, ' +
+			 str(stats['bytes_copied']) + ' bytes copied, ' +
+			 str(stats['allocations']) + ' allocations'),
+		 lambda log, idx: log.log(
+			 'Response audio: %(chunks)d chunks, %(bytes_copied)d bytes '
+			 'copied, %(allocations)d allocations', stats)),
+		('ConverseResponse',
+		 lambda sink, idx: sink.write(_copy_without_audio(resp)),
+		 lambda log, idx: log.log('ConverseResponse: %s',
+								  assistant_helpers.MessageSummary(resp))),
+	)
+	click.echo('%-18s %14s %14s %14s' % (
+		'line', 'direct (us)', 'queued (us)', 'written (us)'))
+	for name, direct, queued in cases:
+		sink = Sink(line_us)
+		direct_us = _time(lambda idx: direct(sink, idx), lines)
+		log = log_helpers.AsyncLog(sink, max_queue=lines)
+		started = time.perf_counter()
+		queued_us = _time(lambda idx: queued(log, idx), lines)
+		log.flush()
+		written_us = 1e6 * (time.perf_counter() - started) / lines
+		click.echo('%-18s %14.2f %14.2f %14.2f' % (
+			name, direct_us, queued_us, written_us))
+
+	click.echo('%-18s %10s %10s %10s %10s' % (
+		'flood', 'logged', 'written', 'suppressed', 'dropped'))
+	log = log_helpers.AsyncLog(Sink(line_us))
+	for idx in range(lines):
+		log.error('Could not write audio to buffer! Error: %s', idx)
+	log.flush()
+	stats = log.stats
+	click.echo('%-18s %10d %10d %10d %10d' % (
+		'repeated error', lines, stats['written'], stats['suppressed'],
+		stats['dropped']))
+	log = log_helpers.AsyncLog(Sink(line_us), max_queue=64)
+	for idx in range(lines):
+		log.log('Chunk %d', idx)
+	log.flush()
+	stats = log.stats
+	click.echo('%-18s %10d %10d %10d %10d' % (
+		'small queue', lines, stats['written'], stats['suppressed'],
+		stats['dropped']))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Compares normalize_audio_buffer against the original per-sample loop."""
+
+import array
+import math
+import os
+import timeit
+
+import click
+
+from benchmarks import fakes
+fakes.install()
+
+from googlesamples.assistant import audio_helpers
+from googlesamples.assistant.audio_helpers import gain
+
+BUFFER_SIZES = (1 << 10, 16 << 10, 128 << 10, 1 << 20)
+
+
+def legacy_normalize_audio_buffer(buf, volume_percentage):
+	"""The per-sample loop normalize_audio_buffer used to run."""
+	scale = math.pow(2, 1.0*volume_percentage/100)-1
+	arr = array.array('h', buf)
+	for idx in range(0, len(arr)):
+		arr[idx] = int(arr[idx]*scale)
+	return arr.tobytes()
+
+
+def _time_per_call(func, repeat):
+	number = max(1, repeat)
+	return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+
+@click.command()
+@click.option('--volume', default=75, show_default=True,
+			  help='Volume percentage passed to the normalizer.')
+@click.option('--sample-width', default=2, show_default=True,
+			  help='Sample width in bytes for the batched engine.')
+def main(volume, sample_width):
+	backend = ('numpy' if gain.np is not None else
+			   'audioop' if gain.audioop is not None else 'python')
+	click.echo('backend: %s, volume: %d%%' % (backend, volume))
+	click.echo('%10s %14s %14s %10s' % ('bytes', 'legacy (ms)',
+										 'batched (ms)', 'speedup'))
+	for size in BUFFER_SIZES:
+		buf = os.urandom(size - size % (2 * sample_width))
+		repeat = max(1, (64 << 10) // size)
+		legacy = _time_per_call(
+			lambda: legacy_normalize_audio_buffer(buf, volume), repeat)
+		batched = _time_per_call(
+			lambda: audio_helpers.normalize_audio_buffer(buf, volume,
+														 sample_width),
+			repeat * 10)
+		click.echo('%10d %14.3f %14.3f %9.1fx' % (
+			size, legacy * 1000, batched * 1000, legacy / batched))
+
+
+if __name__ == '__main__':
+	main()
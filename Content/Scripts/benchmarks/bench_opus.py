@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Compares OPUS_IN_OGG response audio against LINEAR16.
+
+A synthetic response is sent as ConverseResponse audio_out chunks and
+played through a ConversationStream the way handle_response does. The
+benchmark reports the serialized response bytes, the decoding time per
+second of audio and how many bytes had to arrive before the first PCM
+could be queued for playback. Needs opuslib and libopus.
+"""
+
+import time
+
+import click
+
+from benchmarks import fakes
+fakes.install()
+
+from googlesdk.assistant.embedded.v1alpha1 import embedded_assistant_pb2
+from googlesamples.assistant import audio_helpers, common_settings
+
+from benchmarks.bench_vad import synthesize
+
+
+def _play(data, chunk_size, decoder):
+	"""Returns wire bytes, bytes before first audio, PCM played, CPU time."""
+	sink = fakes.NullSink()
+	stream = audio_helpers.ConversationStream(
+		source=fakes.SilentSource(), sink=sink,
+		iter_size=common_settings.DEFAULT_AUDIO_ITER_SIZE,
+		sample_width=common_settings.DEFAULT_AUDIO_SAMPLE_WIDTH,
+		decoder=decoder)
+	stream.start_playback()
+	wire = 0
+	first_audio = None
+	started = time.process_time()
+	for offset in range(0, len(data), chunk_size):
+		chunk = data[offset:offset + chunk_size]
+		wire += embedded_assistant_pb2.ConverseResponse(
+			audio_out=embedded_assistant_pb2.AudioOut(audio_data=chunk)).ByteSize()
+		stream.write(chunk)
+		if first_audio is None and sink.bytes_written:
+			first_audio = offset + len(chunk)
+	stream.stop_playback()
+	return wire, first_audio, sink.bytes_written, time.process_time() - started
+
+
+@click.command()
+@click.option('--seconds', default=5, show_default=True,
+			  help='Length of the response.')
+@click.option('--chunk-size', default=1024, show_default=True,
+			  help='Bytes of audio_data per ConverseResponse.')
+@click.option('--bitrate', default=24000, show_default=True,
+			  help='Opus bitrate in bits per second.')
+def main(seconds, chunk_size, bitrate):
+	sample_rate = common_settings.DEFAULT_AUDIO_SAMPLE_RATE
+	pcm = synthesize(sample_rate, 0, 1000 * seconds, 0, 60, 4000)
+	opus = fakes.make_ogg_opus(pcm, sample_rate, bitrate=bitrate)
+
+	click.echo('%12s %12s %14s %12s %18s' % (
+		'encoding', 'wire (B)', 'first audio (B)', 'played (B)',
+		'decode (ms per s)'))
+	for name, data, decoder in (
+			('LINEAR16', pcm, None),
+			('OPUS_IN_OGG', opus, audio_helpers.OpusInOggDecoder(sample_rate))):
+		wire, first_audio, played, cpu = _play(data, chunk_size, decoder)
+		click.echo('%12s %12d %14d %12d %18.2f' % (
+			name, wire, first_audio, played, 1000 * cpu / seconds))
+
+
+if __name__ == '__main__':
+	main()
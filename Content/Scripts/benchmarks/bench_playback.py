@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Measures how much of a long answer piles up ahead of its playback.
+
+ThreadedAssistant conversations play to an UnrealSoundStream against
+the Assistant simulator, which streams the answer as fast as it can. A
+monitor samples how far the audio queued to the sound wave, and the
+audio the server has sent, are ahead of what has played, with and
+without a playback queue budget. The budgeted run is repeated with
+AsyncConversations, which wait for room on the event loop. Finally writers waiting for room are
+cancelled, dropping the queued audio or leaving it to play out, and the
+time they take to give up is measured.
+"""
+
+import threading
+import time
+
+import click
+import grpc
+
+from benchmarks import fakes
+fakes.install()
+from benchmarks import simulator
+
+from googlesamples.assistant import audio_helpers, common_settings
+
+import channel_manager
+fakes.install_site()
+import async_assistant
+import threaded_assistant
+
+SAMPLE_RATE = common_settings.DEFAULT_AUDIO_SAMPLE_RATE
+SAMPLE_WIDTH = common_settings.DEFAULT_AUDIO_SAMPLE_WIDTH
+ITER_SIZE = common_settings.DEFAULT_AUDIO_ITER_SIZE
+BLOCK_SIZE = 640
+
+
+class CountingWave(fakes.FakeSoundWaveProcedural):
+	"""Sound wave counting the audio queued to it without keeping it."""
+	def __init__(self):
+		fakes.FakeSoundWaveProcedural.__init__(self)
+		self.queued_bytes = 0
+
+	def queue_audio(self, buf):
+		self.queued_bytes += len(buf)
+
+	def reset_audio(self):
+		pass
+
+
+def run(converse, server, conversations, max_queue_bytes):
+	"""Returns (peak queued, peak sent ahead, seconds per conversation,
+	waits and wait time).
+
+	converse(stream) runs one conversation playing to stream.
+	"""
+	wave = CountingWave()
+	device = audio_helpers.UnrealSoundStream(
+		sample_rate=SAMPLE_RATE, sample_width=SAMPLE_WIDTH,
+		block_size=BLOCK_SIZE, flush_size=0, procedural_audio_wave=wave,
+		ring_size=8 * BLOCK_SIZE, max_queue_bytes=max_queue_bytes)
+	stream = audio_helpers.ConversationStream(
+		source=device, sink=device, iter_size=ITER_SIZE,
+		sample_width=SAMPLE_WIDTH)
+	playback_queue = device.playback_queue
+	peaks = {'queued': 0, 'sent': 0}
+	# Each turn's end takes the queue counters for its log line.
+	totals = {'waits': 0, 'wait_time': 0.0}
+	reset_queue_stats = device.reset_queue_stats
+
+	def count_queue_stats():
+		stats = reset_queue_stats()
+		for name in totals:
+			totals[name] += stats[name]
+		return stats
+	device.reset_queue_stats = count_queue_stats
+	done = threading.Event()
+
+	def monitor(sent_before):
+		while not done.wait(0.005):
+			queued = playback_queue.queued_bytes
+			played = wave.queued_bytes - queued
+			sent = server.calls['sent_bytes'] - sent_before
+			peaks['queued'] = max(peaks['queued'], queued)
+			peaks['sent'] = max(peaks['sent'], sent - played)
+
+	times = []
+	for _ in range(conversations):
+		wave.queued_bytes = 0
+		done.clear()
+		thread = threading.Thread(target=monitor,
+								  args=(server.calls['sent_bytes'],))
+		thread.start()
+		started = time.monotonic()
+		converse(stream)
+		stream.drain()
+		times.append(time.monotonic() - started)
+		done.set()
+		thread.join()
+	count_queue_stats()
+	stream.close()
+	return peaks['queued'], peaks['sent'], sum(times) / len(times), totals
+
+
+def cancel_cost(max_queue_bytes, drop):
+	"""Returns (ms for a waiting writer to give up, bytes dropped,
+	bytes left to play)."""
+	playback_queue = audio_helpers.PlaybackQueue(SAMPLE_RATE, SAMPLE_WIDTH,
+												 max_queue_bytes)
+	# Fill the budget, so the next chunk has to wait.
+	playback_queue.queued(max_queue_bytes)
+	released = []
+	writer = threading.Thread(
+		target=lambda: released.append(
+			(playback_queue.reserve(ITER_SIZE), time.perf_counter())))
+	writer.start()
+	time.sleep(0.05)
+	cancelled = time.perf_counter()
+	playback_queue.cancel(drop)
+	writer.join()
+	fits, at = released[0]
+	assert not fits
+	return (1000 * (at - cancelled), playback_queue.stats['dropped_bytes'],
+			playback_queue.queued_bytes)
+
+
+@click.command()
+@click.option('--conversations', default=2, show_default=True,
+			  help='Conversations per run.')
+@click.option('--answer-ms', default=6000, show_default=True,
+			  help='Length of each answer.')
+@click.option('--max-queue-bytes',
+			  default=common_settings.DEFAULT_PLAYBACK_QUEUE_SIZE,
+			  show_default=True, help='Budget of the bounded run.')
+def main(conversations, answer_ms, max_queue_bytes):
+	response_chunks = int(answer_ms * SAMPLE_RATE * SAMPLE_WIDTH / 1000 /
+						  ITER_SIZE)
+	server, port = simulator.serve(
+		max_workers=8, utterance_ms=500, response_chunks=response_chunks,
+		response_chunk_size=ITER_SIZE, seed=1)
+	address = '127.0.0.1:%d' % port
+	channels = channel_manager.ChannelManager(
+		lambda options: grpc.insecure_channel(address, options=options))
+	engine = async_assistant.AsyncAssistantEngine(
+		lambda options: grpc.aio.insecure_channel(address, options=options))
+
+	def converse_threaded(stream):
+		threaded_assistant.ThreadedAssistant(
+			stream, channels=channels, follow_on=False,
+			cache_responses=False).run()
+
+	def converse_async(stream):
+		engine.converse(async_assistant.AsyncConversation(
+			stream, follow_on=False, cache_responses=False)).result()
+
+	try:
+		channels.warm_up().join()
+		engine.warm_up().result()
+		click.echo('%-10s %-10s %14s %14s %14s %8s %12s %14s' % (
+			'driver', 'budget', 'answer bytes', 'peak queued', 'peak sent',
+			'waits', 'waited (s)', 'conversation (s)'))
+		for driver, converse, budget in (
+				('threaded', converse_threaded, None),
+				('threaded', converse_threaded, max_queue_bytes),
+				('async', converse_async, max_queue_bytes)):
+			queued, sent, seconds, stats = run(converse, server,
+											   conversations, budget)
+			click.echo('%-10s %-10s %14d %14d %14d %8d %12.2f %14.2f' % (
+				driver, budget, response_chunks * ITER_SIZE, queued, sent,
+				stats['waits'], stats['wait_time'], seconds))
+	finally:
+		channels.close()
+		engine.stop()
+		server.stop(None)
+
+	click.echo('%-10s %14s %14s %14s' % (
+		'cancel', 'released (ms)', 'dropped', 'left to play'))
+	for drop in (True, False):
+		released_ms, dropped, left = cancel_cost(max_queue_bytes, drop)
+		click.echo('%-10s %14.2f %14d %14d' % (
+			'drop' if drop else 'play out', released_ms, dropped, left))
+
+
+if __name__ == '__main__':
+	main()
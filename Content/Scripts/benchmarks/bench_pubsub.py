@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Drives SubscriptionThread through the in-process fake subscriber.
+
+Intents with a handler, an intent without one and malformed payloads
+are published to a FakeSubscriberClient, along with an intent whose
+handler fails once, so its message is nacked and redelivered. The
+benchmark checks that every message reaches its handler or is dropped,
+that each is acknowledged exactly once and that flow control held, and
+reports the dispatch rate, the acknowledgement batches sent and how
+long setting shutdown_flag takes to stop the thread.
+"""
+
+import collections
+import json
+import logging
+import time
+
+import click
+
+from benchmarks import fakes
+fakes.install()
+fakes.install_site()
+
+from googlesamples.assistant import common_settings, log_helpers
+
+import pubsub_subscription
+
+# Payloads dispatch() must acknowledge and drop: not JSON, not UTF-8,
+# no intent, and JSON that is not an object.
+MALFORMED = (b'not json', b'\xff\xfe', b'{"move": "left"}', b'[1, 2]',
+			 b'"move_character"')
+
+
+class _LevelCounter(logging.Handler):
+	"""Counts the lines written to the Unreal log, by level."""
+	def __init__(self):
+		logging.Handler.__init__(self)
+		self.lines = collections.Counter()
+
+	def emit(self, record):
+		self.lines[record.levelname.lower()] += 1
+
+
+class _Handlers(object):
+	"""Intent handlers counting their calls."""
+	def __init__(self, subscriber, handler_us):
+		self._subscriber = subscriber
+		self._handler_time = handler_us / 1e6
+		self.moves = 0
+		self.flaky_calls = 0
+		self.peak_held = 0
+
+	def move(self, json_obj):
+		self.moves += 1
+		# Delivered and not yet settled, this one included.
+		self.peak_held = max(self.peak_held,
+							 len(self._subscriber._outstanding))
+		until = time.perf_counter() + self._handler_time
+		while time.perf_counter() < until:
+			pass
+
+	def flaky(self, json_obj):
+		self.flaky_calls += 1
+		if self.flaky_calls == 1:
+			raise Exception('failing the first delivery')
+
+
+def _wait_for(condition, timeout):
+	deadline = time.monotonic() + timeout
+	while not condition():
+		if time.monotonic() > deadline:
+			return False
+		time.sleep(0.001)
+	return True
+
+
+def run(messages, handler_us, ack_batch_size):
+	"""Returns the counters of one run; asserts on a lost or extra call."""
+	subscriber = fakes.FakeSubscriberClient(ack_batch_size=ack_batch_size)
+	handlers = _Handlers(subscriber, handler_us)
+	registry = pubsub_subscription.IntentRegistry()
+	registry.register('move_character', handlers.move)
+	registry.register('flaky', handlers.flaky)
+	thread = pubsub_subscription.SubscriptionThread(
+		subscriber=subscriber, registry=registry, project_id='bench')
+	thread.start()
+
+	started = time.perf_counter()
+	for index in range(messages):
+		subscriber.publish(json.dumps(
+			{'intent': 'move_character', 'move': index}).encode('utf-8'))
+	for data in MALFORMED:
+		subscriber.publish(data)
+	subscriber.publish(b'{"intent": "unknown"}')
+	subscriber.publish(b'{"intent": "flaky"}')
+	total = messages + len(MALFORMED) + 2
+	assert _wait_for(lambda: len(subscriber.acked) >= total, 30), (
+		'%d of %d messages acknowledged' % (len(subscriber.acked), total))
+	dispatch_time = time.perf_counter() - started
+
+	stopping = time.perf_counter()
+	thread.shutdown_flag.set()
+	thread.join(5)
+	shutdown_ms = 1000 * (time.perf_counter() - stopping)
+	assert not thread.is_alive(), 'shutdown_flag did not stop the thread'
+
+	assert thread.subscription_path in subscriber.subscriptions
+	assert handlers.moves == messages, (
+		'%d move_character calls, expected %d' % (handlers.moves, messages))
+	assert handlers.flaky_calls == 2, 'the nacked message was not redelivered'
+	assert len(subscriber.nacked) == 1, (
+		'%d messages nacked, expected 1' % len(subscriber.nacked))
+	ack_ids = [message.ack_id for message in subscriber.acked]
+	assert len(set(ack_ids)) == len(ack_ids) == total, (
+		'%d acks for %d messages' % (len(ack_ids), total))
+	batches = subscriber.ack_requests
+	assert sum(len(batch) for batch in batches) == total, (
+		'acks lost between the batches')
+	assert max(len(batch) for batch in batches) <= ack_batch_size
+	assert handlers.peak_held <= thread.flow_control.max_messages
+	return {
+		'total': total,
+		'per_second': total / dispatch_time,
+		'dropped': total - handlers.moves - 1,
+		'nacked': len(subscriber.nacked),
+		'ack_batches': len(batches),
+		'peak_held': handlers.peak_held,
+		'shutdown_ms': shutdown_ms,
+	}
+
+
+@click.command()
+@click.option('--messages', default=2000, show_default=True,
+			  help='move_character intents published per run.')
+@click.option('--handler-us', default=20, show_default=True,
+			  help='Time each move_character call takes.')
+def main(messages, handler_us):
+	counter = _LevelCounter()
+	logger = logging.getLogger('unreal_engine')
+	logger.addHandler(counter)
+	logger.setLevel(logging.INFO)
+	# Counted rather than printed.
+	logger.propagate = False
+
+	click.echo('%10s %9s %13s %8s %7s %12s %10s %14s' % (
+		'ack batch', 'messages', 'dispatch (/s)', 'dropped', 'nacked',
+		'ack requests', 'peak held', 'shutdown (ms)'))
+	for ack_batch_size in (1, 50):
+		stats = run(messages, handler_us, ack_batch_size)
+		click.echo('%10d %9d %13.0f %8d %7d %12d %10d %14.2f' % (
+			ack_batch_size, stats['total'], stats['per_second'],
+			stats['dropped'], stats['nacked'], stats['ack_batches'],
+			stats['peak_held'], stats['shutdown_ms']))
+	log_helpers.flush()
+	click.echo('flow control limit %d; log lines: %s' % (
+		common_settings.PUBSUB_MAX_OUTSTANDING_MESSAGES, ', '.join(
+			'%d %s' % (count, level)
+			for level, count in sorted(counter.lines.items()))))
+
+
+if __name__ == '__main__':
+	main()
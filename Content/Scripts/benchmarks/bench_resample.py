@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Measures the CPU cost and accuracy of the streaming Resampler.
+
+A tone is converted between the device rates and the network rate in
+chunks of a given length, with filters of a few lengths, and the CPU
+time spent per second of audio is reported with the signal to noise
+ratio of the result and the delay of the filter. The pure Python
+fallback is timed on the default filter. Finally ThreadedAssistant
+conversations run against the Assistant simulator from an
+UnrealSoundStream recording and playing at 48 kHz, and the audio sent
+and played is compared with that of a stream running at 16 kHz.
+"""
+
+import math
+import time
+
+import click
+import grpc
+
+from benchmarks import fakes
+fakes.install()
+from benchmarks import simulator
+
+from googlesamples.assistant import audio_helpers, common_settings
+from googlesamples.assistant.audio_helpers import resample
+
+import channel_manager
+fakes.install_site()
+import threaded_assistant
+
+SAMPLE_RATE = common_settings.DEFAULT_AUDIO_SAMPLE_RATE
+SAMPLE_WIDTH = common_settings.DEFAULT_AUDIO_SAMPLE_WIDTH
+ITER_SIZE = common_settings.DEFAULT_AUDIO_ITER_SIZE
+TONE_HZ = 1000
+AMPLITUDE = 10000
+
+
+def tone(rate, seconds):
+	samples = [int(AMPLITUDE * math.sin(2 * math.pi * TONE_HZ * idx / rate))
+			   for idx in range(int(rate * seconds))]
+	return b''.join(sample.to_bytes(2, 'little', signed=True)
+					for sample in samples)
+
+
+def snr(buf, rate, delay):
+	"""Signal to noise ratio of a converted tone, in dB."""
+	samples = [int.from_bytes(buf[idx:idx + 2], 'little', signed=True)
+			   for idx in range(0, len(buf) - 1, 2)]
+	signal = noise = 0.0
+	# The filter's start and end are left out.
+	for idx in range(len(samples) // 10, len(samples) * 9 // 10):
+		expected = AMPLITUDE * math.sin(
+			2 * math.pi * TONE_HZ * (idx / float(rate) - delay))
+		signal += expected * expected
+		noise += (samples[idx] - expected) ** 2
+	return 10 * math.log10(signal / noise) if noise else float('inf')
+
+
+def convert(in_rate, out_rate, audio, chunk_ms, taps):
+	"""Returns (converted audio, resampler stats, delay)."""
+	resampler = audio_helpers.Resampler(in_rate, out_rate, SAMPLE_WIDTH,
+										taps_per_phase=taps)
+	chunk_size = int(in_rate * chunk_ms / 1000) * SAMPLE_WIDTH
+	out = [resampler.process(audio[idx:idx + chunk_size])
+		   for idx in range(0, len(audio), chunk_size)]
+	out.append(resampler.flush())
+	return b''.join(out), resampler.stats, resampler.delay
+
+
+class CountingWave(fakes.FakeSoundWaveProcedural):
+	"""Sound wave counting the audio queued to it without keeping it."""
+	def __init__(self):
+		fakes.FakeSoundWaveProcedural.__init__(self)
+		self.queued_bytes = 0
+
+	def queue_audio(self, buf):
+		self.queued_bytes += len(buf)
+
+
+def converse(channels, server, device_rate, conversations):
+	"""Returns (request bytes sent, bytes queued to the wave, seconds per
+	conversation, resampler stats)."""
+	wave = CountingWave()
+	block_size = int(640 * device_rate / SAMPLE_RATE)
+	device = audio_helpers.UnrealSoundStream(
+		sample_rate=device_rate, sample_width=SAMPLE_WIDTH,
+		block_size=block_size, flush_size=0, procedural_audio_wave=wave,
+		ring_size=8 * block_size, playback_rate=device_rate)
+	stream = audio_helpers.ConversationStream(
+		source=device, sink=device, iter_size=ITER_SIZE,
+		sample_width=SAMPLE_WIDTH, sample_rate=SAMPLE_RATE)
+	received = server.calls['received_bytes']
+	resampled = {'capture': 0.0, 'playback': 0.0}
+	# Each turn's end takes the resampler counters for its log line.
+	reset_resampler_stats = stream.reset_resampler_stats
+
+	def count_resampler_stats():
+		stats = reset_resampler_stats()
+		for side, side_stats in stats.items():
+			if side_stats:
+				resampled[side] += side_stats['process_time']
+		return stats
+	stream.reset_resampler_stats = count_resampler_stats
+	started = time.monotonic()
+	for _ in range(conversations):
+		threaded_assistant.ThreadedAssistant(
+			stream, channels=channels, follow_on=False,
+			cache_responses=False).run()
+		stream.drain()
+	seconds = (time.monotonic() - started) / conversations
+	stream.close()
+	return (server.calls['received_bytes'] - received, wave.queued_bytes,
+			seconds, resampled)
+
+
+@click.command()
+@click.option('--seconds', default=2.0, show_default=True,
+			  help='Length of the converted tone.')
+@click.option('--conversations', default=3, show_default=True,
+			  help='Conversations per device rate.')
+def main(seconds, conversations):
+	click.echo('%-16s %8s %6s %14s %10s %10s' % (
+		'conversion', 'chunk', 'taps', 'CPU (ms/s)', 'SNR (dB)',
+		'delay (ms)'))
+	for in_rate, out_rate in ((48000, SAMPLE_RATE), (44100, SAMPLE_RATE),
+							  (SAMPLE_RATE, 48000), (SAMPLE_RATE, 44100)):
+		audio = tone(in_rate, seconds)
+		for chunk_ms, taps in ((20, 16), (100, 8), (100, 16), (100, 32)):
+			out, stats, delay = convert(in_rate, out_rate, audio, chunk_ms,
+										taps)
+			click.echo('%-16s %6d ms %6d %14.2f %10.1f %10.2f' % (
+				'%d->%d' % (in_rate, out_rate), chunk_ms, taps,
+				1000 * stats['cpu_per_second'], snr(out, out_rate, delay),
+				1000 * delay))
+	numpy = resample.np
+	resample.np = None
+	try:
+		audio = tone(48000, seconds / 4)
+		out, stats, delay = convert(48000, SAMPLE_RATE, audio, 100, 16)
+		click.echo('%-16s %6d ms %6d %14.2f %10.1f %10.2f  (pure Python)' % (
+			'48000->%d' % SAMPLE_RATE, 100, 16,
+			1000 * stats['cpu_per_second'], snr(out, SAMPLE_RATE, delay),
+			1000 * delay))
+	finally:
+		resample.np = numpy
+
+	server, port = simulator.serve(
+		max_workers=8, utterance_ms=500, response_chunks=10,
+		response_chunk_size=ITER_SIZE, pace=4.0, seed=1)
+	channels = channel_manager.ChannelManager(
+		lambda options: grpc.insecure_channel('127.0.0.1:%d' % port,
+											  options=options))
+	try:
+		channels.warm_up().join()
+		click.echo('%-12s %14s %14s %16s %18s' % (
+			'device rate', 'request bytes', 'wave bytes', 'conversation (s)',
+			'resampling (ms)'))
+		for device_rate in (SAMPLE_RATE, 48000):
+			sent, played, seconds, resampled = converse(
+				channels, server, device_rate, conversations)
+			click.echo('%-12d %14d %14d %16.2f %18.2f' % (
+				device_rate, sent // conversations, played // conversations,
+				seconds, 1000 * sum(resampled.values()) / conversations))
+	finally:
+		channels.close()
+		server.stop(None)
+
+
+if __name__ == '__main__':
+	main()
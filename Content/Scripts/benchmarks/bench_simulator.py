@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Runs ThreadedAssistant conversations against simulated network conditions.
+
+The Assistant simulator answers with a server delay, with jitter on top
+of it, and failing a share of its calls, either before they send any
+audio, where ChannelManager retries them, or halfway through the answer.
+Each conversation is timed to its first answer audio reaching the sink
+and to its end. Conversations that got less than the whole answer are
+counted as cut off.
+"""
+
+import time
+
+import click
+import grpc
+
+from benchmarks import fakes
+fakes.install()
+from benchmarks import simulator
+
+from googlesamples.assistant import audio_helpers, common_settings
+
+import channel_manager
+fakes.install_site()
+import threaded_assistant
+
+SAMPLE_RATE = common_settings.DEFAULT_AUDIO_SAMPLE_RATE
+SAMPLE_WIDTH = common_settings.DEFAULT_AUDIO_SAMPLE_WIDTH
+ITER_SIZE = common_settings.DEFAULT_AUDIO_ITER_SIZE
+
+
+class TimedSink(fakes.NullSink):
+	"""Audio sink remembering when the first audio was written."""
+	def __init__(self, *args, **kwargs):
+		fakes.NullSink.__init__(self, *args, **kwargs)
+		self.first_write = None
+
+	def write(self, buf):
+		if self.first_write is None:
+			self.first_write = time.perf_counter()
+		return fakes.NullSink.write(self, buf)
+
+
+def run(port, conversations, answer_bytes):
+	"""Returns (first audio times, total times, cut off, retries)."""
+	channels = channel_manager.ChannelManager(
+		lambda options: grpc.insecure_channel('127.0.0.1:%d' % port,
+											  options=options))
+	channels.warm_up().join()
+	first_audio = []
+	totals = []
+	cut_off = 0
+	for _ in range(conversations):
+		# A realtime source sends no audio for the first 100 ms, so calls
+		# rejected at their start can be retried.
+		sink = TimedSink()
+		stream = audio_helpers.ConversationStream(
+			source=fakes.SilentSource(realtime=True), sink=sink,
+			iter_size=ITER_SIZE, sample_width=SAMPLE_WIDTH)
+		started = time.perf_counter()
+		try:
+			threaded_assistant.ThreadedAssistant(
+				stream, channels=channels, follow_on=False,
+				cache_responses=False).run()
+		except grpc.RpcError:
+			pass
+		totals.append(time.perf_counter() - started)
+		if sink.first_write is not None:
+			first_audio.append(sink.first_write - started)
+		if sink.bytes_written < answer_bytes:
+			cut_off += 1
+		stream.close()
+	retries = channels.retries
+	channels.close()
+	return first_audio, totals, cut_off, retries
+
+
+def _percentile(values, fraction):
+	if not values:
+		return float('nan')
+	values = sorted(values)
+	return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+@click.command()
+@click.option('--conversations', default=20, show_default=True,
+			  help='Conversations per profile.')
+@click.option('--answer-ms', default=1000, show_default=True,
+			  help='Length of each answer.')
+@click.option('--pace', default=4.0, show_default=True,
+			  help='Speed at which the server streams answers, relative to '
+			  'real time.')
+@click.option('--latency-ms', default=300, show_default=True,
+			  help='Server delay of the slow profiles.')
+@click.option('--jitter-ms', default=100, show_default=True,
+			  help='Jitter of the jittery profiles.')
+@click.option('--error-rate', default=0.2, show_default=True,
+			  help='Share of calls failed by the failing profiles.')
+def main(conversations, answer_ms, pace, latency_ms, jitter_ms, error_rate):
+	response_chunks = int(answer_ms * SAMPLE_RATE * SAMPLE_WIDTH / 1000 /
+						  ITER_SIZE)
+	profiles = (
+		('ideal', {}),
+		('latency', dict(latency_ms=latency_ms)),
+		('latency+jitter', dict(latency_ms=latency_ms, jitter_ms=jitter_ms)),
+		('rejected', dict(error_rate=error_rate)),
+		('cut off', dict(error_rate=error_rate,
+						 error_after_chunks=response_chunks // 2)),
+	)
+	click.echo('%-16s %15s %15s %15s %8s %8s %8s' % (
+		'profile', 'p50 audio (ms)', 'p95 audio (ms)', 'mean total (ms)',
+		'cut off', 'retries', 'calls'))
+	for name, options in profiles:
+		server, port = simulator.serve(
+			max_workers=8, response_chunks=response_chunks,
+			response_chunk_size=ITER_SIZE, pace=pace, seed=1, **options)
+		try:
+			first_audio, totals, cut_off, retries = run(
+				port, conversations, response_chunks * ITER_SIZE)
+		finally:
+			server.stop(None)
+		click.echo('%-16s %15.1f %15.1f %15.1f %8d %8d %8d' % (
+			name, 1000 * _percentile(first_audio, 0.5),
+			1000 * _percentile(first_audio, 0.95),
+			1000 * sum(totals) / len(totals), cut_off, retries,
+			server.calls['total']))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Measures what importing the game scripts costs the editor.
+
+Every run imports testclass, as the editor does, in a fresh child
+process, once with the Assistant set up eagerly at import and once
+lazily. The benchmark reports the time spent in the import, which stalls
+the game thread, and the time until ue_site reports READY.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+from benchmarks import fakes
+
+
+def run_child(lazy, credentials_dir):
+	fakes.install()
+	# setup_assistant() looks for its credentials next to the scripts.
+	sys.path.insert(0, credentials_dir)
+	from googlesamples.assistant import common_settings
+	common_settings.LAZY_ASSISTANT_SETUP = lazy
+
+	started = time.perf_counter()
+	import testclass
+	imported = time.perf_counter()
+	import ue_site
+	ue_site.warm_up().result()
+	ready = time.perf_counter()
+	return {
+		'mode': 'lazy' if lazy else 'eager',
+		'import_ms': 1000 * (imported - started),
+		'ready_ms': 1000 * (ready - started),
+		'state': ue_site.state(),
+		'modules': len(sys.modules),
+	}
+
+
+def _write_credentials(credentials_dir):
+	"""Saves credentials with a valid token, so no refresh is needed."""
+	from googlesamples.assistant import common_settings
+	path = os.path.join(credentials_dir,
+						common_settings.ASSISTANT_CREDENTIALS_FILENAME)
+	with open(path, 'w') as f:
+		json.dump({'access_token': 'token', 'expiry': '2099-01-01T00:00:00Z',
+				   'refresh_token': 'refresh',
+				   'token_uri': 'http://localhost:1/token',
+				   'client_id': 'client', 'client_secret': 'secret'}, f)
+
+
+@click.command()
+@click.option('--runs', default=5, show_default=True,
+			  help='Child processes per mode; the median is reported.')
+@click.option('--child', nargs=2, type=(str, str), default=None, hidden=True)
+def main(runs, child):
+	if child:
+		mode, credentials_dir = child
+		click.echo(json.dumps(run_child(mode == 'lazy', credentials_dir)))
+		return
+
+	credentials_dir = tempfile.mkdtemp()
+	try:
+		_write_credentials(credentials_dir)
+		click.echo('%-6s %12s %12s %9s %8s' % (
+			'mode', 'import (ms)', 'ready (ms)', 'modules', 'state'))
+		for mode in ('eager', 'lazy'):
+			results = []
+			for _ in range(runs):
+				output = subprocess.check_output(
+					[sys.executable, '-m', 'benchmarks.bench_startup',
+					 '--child', mode, credentials_dir])
+				results.append(json.loads(
+					output.decode('utf-8').splitlines()[-1]))
+			results.sort(key=lambda result: result['import_ms'])
+			result = results[len(results) // 2]
+			click.echo('%-6s %12.1f %12.1f %9d %8s' % (
+				result['mode'], result['import_ms'], result['ready_ms'],
+				result['modules'], result['state']))
+	finally:
+		shutil.rmtree(credentials_dir)
+
+
+if __name__ == '__main__':
+	main()
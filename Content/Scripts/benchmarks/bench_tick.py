@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Measures the game thread cost of Hero's talk key handling per tick.
+
+A headless harness replays the same input, the talk key held for a few
+seconds at a time, once through the old per-tick is_input_key_down()
+polling and once through ConversationController's edge events. The
+conversations themselves run on a stand-in engine that never finishes
+them, so only the input handling is timed.
+"""
+
+import concurrent.futures
+import time
+
+import click
+
+from benchmarks import fakes
+fakes.install()
+fakes.install_site(ready=lambda: True)
+
+from googlesamples.assistant import audio_helpers, common_settings
+
+import conversation_controller
+import conversation_manager
+# Imported up front, so neither run pays for it on its first press.
+import async_assistant
+
+
+class _HeldEngine(object):
+	"""Engine stand-in whose conversations stay active."""
+	def __init__(self):
+		self.conversations = 0
+
+	def converse(self, conversation):
+		self.conversations += 1
+		return concurrent.futures.Future()
+
+
+class _FakeUObject(object):
+	"""The bits of a UE actor the old tick() used."""
+	def __init__(self):
+		self.down = set()
+
+	def is_input_key_down(self, key):
+		return key in self.down
+
+
+class _FakeAudioComponent(object):
+	def SetSound(self, sound):
+		pass
+
+
+def _manager():
+	manager = conversation_manager.ConversationManager(engine=_HeldEngine())
+	stream = audio_helpers.ConversationStream(
+		source=fakes.SilentSource(), sink=fakes.NullSink(),
+		iter_size=common_settings.DEFAULT_AUDIO_ITER_SIZE,
+		sample_width=common_settings.DEFAULT_AUDIO_SAMPLE_WIDTH)
+	manager._free_streams.append(stream)
+	manager.register('hero', _FakeAudioComponent())
+	return manager
+
+
+def _schedule(frames, period, hold):
+	"""Frames at which the key goes down and up."""
+	presses = set(range(0, frames, period))
+	releases = set(frame + hold for frame in presses)
+	return presses, releases
+
+
+def _percentile(samples, fraction):
+	samples = sorted(samples)
+	return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+def run_polling(frames, presses, releases):
+	manager = _manager()
+	uobject = _FakeUObject()
+	timings = []
+	calls = 0
+	for frame in range(frames):
+		if frame in presses:
+			uobject.down.add(common_settings.TALK_KEY)
+		if frame in releases:
+			uobject.down.discard(common_settings.TALK_KEY)
+		started = time.perf_counter()
+		# The old Hero.tick
+		if uobject.is_input_key_down(common_settings.TALK_KEY):
+			manager.request_conversation('hero')
+			calls += 1
+		timings.append(time.perf_counter() - started)
+	return timings, calls, manager.engine.conversations
+
+
+def run_events(frames, presses, releases):
+	manager = _manager()
+	controller = conversation_controller.ConversationController(
+		'hero', manager, debounce=0)
+	timings = []
+	calls = 0
+	for frame in range(frames):
+		started = time.perf_counter()
+		# What the engine's input dispatch and Hero.tick now do
+		if frame in presses:
+			controller.on_pressed()
+			calls += 1
+		if frame in releases:
+			controller.on_released()
+		controller.tick()
+		timings.append(time.perf_counter() - started)
+	# Let the worker catch up before counting conversations.
+	done = concurrent.futures.Future()
+	controller._worker.submit(done.set_result, None)
+	done.result()
+	return timings, calls, manager.engine.conversations
+
+
+@click.command()
+@click.option('--frames', default=60 * 60, show_default=True,
+			  help='Ticks to simulate (one minute at 60 fps).')
+@click.option('--period', default=600, show_default=True,
+			  help='Ticks between key presses.')
+@click.option('--hold', default=180, show_default=True,
+			  help='Ticks the key is held for.')
+def main(frames, period, hold):
+	presses, releases = _schedule(frames, period, hold)
+	click.echo('%-8s %12s %12s %12s %16s %14s' % (
+		'input', 'mean (us)', 'p99 (us)', 'max (us)', 'manager calls',
+		'conversations'))
+	for name, run in (('polling', run_polling), ('events', run_events)):
+		timings, calls, conversations = run(frames, presses, releases)
+		click.echo('%-8s %12.2f %12.2f %12.2f %16d %14d' % (
+			name, 1e6 * sum(timings) / len(timings),
+			1e6 * _percentile(timings, 0.99), 1e6 * max(timings), calls,
+			conversations))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Times the stages of conversation turns and what timing them costs.
+
+Conversations run through ThreadedAssistant, recording from and playing
+to an UnrealSoundStream on a fake sound wave, against the Assistant
+simulator with a server delay, jitter and answers streamed at real
+time. Each starts with a simulated talk key press. The stages of every
+turn are read back from the histogram registry, which is also exported
+in both formats. Finally the timer itself is timed, per mark() and per
+turn recorded, and conversations are run with TURN_METRICS on and off.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import timeit
+
+import click
+import grpc
+
+from benchmarks import fakes
+fakes.install()
+from benchmarks import simulator
+
+from googlesamples.assistant import audio_helpers, common_settings
+
+import channel_manager
+fakes.install_site()
+import threaded_assistant
+import turn_metrics
+
+SAMPLE_RATE = common_settings.DEFAULT_AUDIO_SAMPLE_RATE
+SAMPLE_WIDTH = common_settings.DEFAULT_AUDIO_SAMPLE_WIDTH
+ITER_SIZE = common_settings.DEFAULT_AUDIO_ITER_SIZE
+BLOCK_SIZE = 640
+
+
+def _stream():
+	device = audio_helpers.UnrealSoundStream(
+		sample_rate=SAMPLE_RATE, sample_width=SAMPLE_WIDTH,
+		block_size=BLOCK_SIZE, flush_size=0,
+		procedural_audio_wave=fakes.FakeSoundWaveProcedural(),
+		ring_size=8 * BLOCK_SIZE)
+	return audio_helpers.ConversationStream(
+		source=device, sink=device, iter_size=ITER_SIZE,
+		sample_width=SAMPLE_WIDTH)
+
+
+def run(channels, conversations, follow_ons):
+	"""Returns the seconds each conversation took."""
+	stream = _stream()
+	times = []
+	for _ in range(conversations):
+		conversation = threaded_assistant.ThreadedAssistant(
+			stream, channels=channels, follow_on=follow_ons > 0,
+			cache_responses=False)
+		conversation.pressed_at = started = time.monotonic()
+		conversation.run()
+		# The player waits for the answer to end before asking again.
+		stream.drain()
+		times.append(time.monotonic() - started)
+	stream.close()
+	return times
+
+
+def timer_cost(repeat):
+	"""Returns microseconds per mark() and per turn recorded."""
+	registry = turn_metrics.Registry()
+	timer = turn_metrics.TurnTimer()
+	mark = min(timeit.repeat(
+		lambda: timer.mark(turn_metrics.FIRST_AUDIO_OUT), number=repeat,
+		repeat=3)) / repeat
+
+	def turn():
+		turn_timer = turn_metrics.TurnTimer()
+		for stage in turn_metrics.STAGES:
+			turn_timer.mark(stage)
+		turn_timer.record(registry)
+	record = min(timeit.repeat(turn, number=repeat // 10, repeat=3))
+	return 1e6 * mark, 1e6 * record / (repeat // 10)
+
+
+@click.command()
+@click.option('--conversations', default=10, show_default=True,
+			  help='Conversations per run.')
+@click.option('--follow-ons', default=1, show_default=True,
+			  help='Replies the Assistant asks for in each conversation.')
+@click.option('--latency-ms', default=200, show_default=True,
+			  help='Server delay before each answer.')
+@click.option('--jitter-ms', default=50, show_default=True,
+			  help='Jitter of the answer chunks.')
+def main(conversations, follow_ons, latency_ms, jitter_ms):
+	server, port = simulator.serve(
+		max_workers=8, utterance_ms=500, response_chunks=5,
+		response_chunk_size=ITER_SIZE, pace=1.0, latency_ms=latency_ms,
+		jitter_ms=jitter_ms, follow_on_turns=follow_ons, seed=1)
+	channels = channel_manager.ChannelManager(
+		lambda options: grpc.insecure_channel('127.0.0.1:%d' % port,
+											  options=options))
+	directory = tempfile.mkdtemp()
+	try:
+		channels.warm_up().join()
+		turn_metrics.registry.clear()
+		run(channels, conversations, follow_ons)
+		click.echo('%-20s %8s %10s %10s %10s' % (
+			'stage', 'turns', 'mean (ms)', 'p50 (ms)', 'p95 (ms)'))
+		for stage in turn_metrics.STAGES:
+			histogram = turn_metrics.registry.histogram(
+				turn_metrics.TURN_SECONDS, labels={'stage': stage})
+			snapshot = histogram.snapshot()
+			if not snapshot['count']:
+				click.echo('%-20s %8d' % (stage, 0))
+				continue
+			click.echo('%-20s %8d %10.1f %10.1f %10.1f' % (
+				stage, snapshot['count'],
+				1000 * snapshot['sum'] / snapshot['count'],
+				1000 * histogram.quantile(0.5),
+				1000 * histogram.quantile(0.95)))
+		for name in ('turns.prom', 'turns.jsonl'):
+			path = os.path.join(directory, name)
+			turn_metrics.registry.write(path)
+			with open(path) as f:
+				lines = f.read().splitlines()
+			click.echo('exported %-12s %4d lines, %6d bytes' % (
+				name, len(lines), os.path.getsize(path)))
+
+		mark_us, record_us = timer_cost(100000)
+		click.echo('mark() %.2f us, turn of %d stages recorded in %.2f us' % (
+			mark_us, len(turn_metrics.STAGES), record_us))
+		click.echo('%-14s %16s' % ('TURN_METRICS', 'conversation (ms)'))
+		for enabled in (False, True, False, True):
+			common_settings.TURN_METRICS = enabled
+			times = run(channels, conversations, follow_ons)
+			click.echo('%-14s %16.1f' % (
+				enabled, 1000 * sum(times) / len(times)))
+	finally:
+		common_settings.TURN_METRICS = True
+		channels.close()
+		server.stop(None)
+		shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+	main()
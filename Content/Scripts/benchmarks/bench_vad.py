@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Runs the voice activity gate over a synthetic utterance.
+
+The utterance is leading background noise, a burst of voiced "speech"
+(a modulated low tone) and trailing noise. The benchmark reports where
+the gate detected speech, when it ended the utterance, how much audio it
+kept from being sent and the analysis cost per chunk for each backend.
+"""
+
+import math
+import random
+import struct
+
+import click
+
+from benchmarks import fakes
+fakes.install()
+
+from googlesamples.assistant import common_settings
+from googlesamples.assistant.audio_helpers import vad
+
+
+def synthesize(sample_rate, leading_ms, speech_ms, trailing_ms,
+			   noise_level, speech_level):
+	rng = random.Random(0)
+	samples = []
+	for _ in range(sample_rate * leading_ms // 1000):
+		samples.append(rng.gauss(0, noise_level))
+	count = sample_rate * speech_ms // 1000
+	for idx in range(count):
+		t = idx / float(sample_rate)
+		envelope = 0.6 + 0.4 * math.sin(2 * math.pi * 4 * t)
+		samples.append(speech_level * envelope * math.sin(2 * math.pi * 180 * t)
+					   + rng.gauss(0, noise_level))
+	for _ in range(sample_rate * trailing_ms // 1000):
+		samples.append(rng.gauss(0, noise_level))
+	samples = [max(-32768, min(32767, int(s))) for s in samples]
+	return struct.pack('<%dh' % len(samples), *samples)
+
+
+def run(audio, iter_size, hangover_ms):
+	gate = vad.VoiceActivityGate(
+		common_settings.DEFAULT_AUDIO_SAMPLE_RATE,
+		common_settings.DEFAULT_AUDIO_SAMPLE_WIDTH,
+		energy_threshold=common_settings.DEFAULT_VAD_ENERGY_THRESHOLD,
+		hangover_ms=hangover_ms,
+		pre_roll_ms=common_settings.DEFAULT_VAD_PRE_ROLL_MS)
+	for offset in range(0, len(audio), iter_size):
+		gate.process(audio[offset:offset + iter_size])
+		if gate.ended:
+			break
+	return gate.metrics
+
+
+@click.command()
+@click.option('--leading-ms', default=1500, show_default=True)
+@click.option('--speech-ms', default=2000, show_default=True)
+@click.option('--trailing-ms', default=3000, show_default=True)
+@click.option('--hangover-ms', show_default=True,
+			  default=common_settings.DEFAULT_VAD_HANGOVER_MS)
+def main(leading_ms, speech_ms, trailing_ms, hangover_ms):
+	sample_rate = common_settings.DEFAULT_AUDIO_SAMPLE_RATE
+	iter_size = common_settings.DEFAULT_AUDIO_ITER_SIZE
+	audio = synthesize(sample_rate, leading_ms, speech_ms, trailing_ms,
+					   noise_level=60, speech_level=4000)
+	total_ms = leading_ms + speech_ms + trailing_ms
+	click.echo('speech from %d to %d ms of %d ms recorded' % (
+		leading_ms, leading_ms + speech_ms, total_ms))
+
+	backends = [('numpy', vad.np, vad.audioop), ('audioop', None, vad.audioop),
+				('python', None, None)]
+	np_module, audioop_module = vad.np, vad.audioop
+	click.echo('%8s %10s %10s %10s %10s %14s' % (
+		'backend', 'start', 'end', 'sent', 'not sent', 'us per chunk'))
+	try:
+		for name, np_backend, audioop_backend in backends:
+			if name != 'python' and (np_backend or audioop_backend) is None:
+				continue
+			vad.np, vad.audioop = np_backend, audioop_backend
+			metrics = run(audio, iter_size, hangover_ms)
+			click.echo('%8s %10s %10s %10d %10d %14.1f' % (
+				name, '%d ms' % metrics['speech_start_ms'],
+				'%d ms' % metrics['speech_end_ms'], metrics['sent_ms'],
+				total_ms - metrics['sent_ms'],
+				1000 * metrics['processing_ms'] / metrics['chunks']))
+	finally:
+		vad.np, vad.audioop = np_module, audioop_module
+
+
+if __name__ == '__main__':
+	main()
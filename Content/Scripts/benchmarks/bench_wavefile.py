@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Measures reading and writing recordings for replays and batch runs.
+
+A generated WAV file is read in request-sized chunks through WaveSource
+and through MappedWaveSource, both unthrottled, and written back through
+WaveSink and MappedWaveSink in chunks of an odd size, which split
+samples across writes. Written files are read back with the wave module
+to check their frame count. Finally a short
+request is replayed through a ThreadedAssistant against a local
+EmbeddedAssistantServicer, paced at real time and as fast as possible.
+"""
+
+import array
+import os
+import shutil
+import tempfile
+import time
+import wave
+
+import click
+import grpc
+
+from benchmarks import fakes
+fakes.install()
+from benchmarks import simulator
+
+from googlesamples.assistant import audio_helpers, common_settings
+
+import channel_manager
+fakes.install_site()
+import threaded_assistant
+
+SAMPLE_RATE = common_settings.DEFAULT_AUDIO_SAMPLE_RATE
+SAMPLE_WIDTH = common_settings.DEFAULT_AUDIO_SAMPLE_WIDTH
+ITER_SIZE = common_settings.DEFAULT_AUDIO_ITER_SIZE
+
+
+def _write_wav(path, seconds):
+	samples = array.array('h', range(-8000, 8000, 16))
+	frames = samples.tobytes() * (int(seconds * SAMPLE_RATE) // len(samples))
+	with wave.open(path, 'wb') as f:
+		f.setnchannels(1)
+		f.setsampwidth(SAMPLE_WIDTH)
+		f.setframerate(SAMPLE_RATE)
+		f.writeframes(frames)
+	return frames
+
+
+def read_all(source, size, length):
+	"""Returns (seconds, reads, bytes) to read length bytes of audio.
+
+	WaveSource pads the end of the file with silence, so reads stop at
+	the file's length.
+	"""
+	total = 0
+	reads = 0
+	started = time.perf_counter()
+	while total < length:
+		data = source.read(size)
+		if not data:
+			break
+		total += len(data)
+		reads += 1
+	return time.perf_counter() - started, reads, total
+
+
+def write_all(sink, frames, size):
+	started = time.perf_counter()
+	for offset in range(0, len(frames), size):
+		sink.write(frames[offset:offset + size])
+	sink.close()
+	return time.perf_counter() - started
+
+
+def replay(path, port, realtime):
+	channels = channel_manager.ChannelManager(
+		lambda options: grpc.insecure_channel('127.0.0.1:%d' % port,
+											  options=options))
+	channels.warm_up().join()
+	source = audio_helpers.MappedWaveSource(path, SAMPLE_RATE, SAMPLE_WIDTH,
+											realtime=realtime)
+	stream = audio_helpers.ConversationStream(
+		source=source, sink=fakes.NullSink(), iter_size=ITER_SIZE,
+		sample_width=SAMPLE_WIDTH)
+	started = time.perf_counter()
+	threaded_assistant.ThreadedAssistant(
+		stream, channels=channels, follow_on=False).run()
+	elapsed = time.perf_counter() - started
+	stream.close()
+	channels.close()
+	return elapsed
+
+
+@click.command()
+@click.option('--seconds', default=60, show_default=True,
+			  help='Length of the generated recording.')
+@click.option('--request-seconds', default=3.0, show_default=True,
+			  help='Length of the replayed request.')
+def main(seconds, request_seconds):
+	directory = tempfile.mkdtemp()
+	try:
+		path = os.path.join(directory, 'recording.wav')
+		frames = _write_wav(path, seconds)
+		click.echo('%-18s %10s %8s %12s %14s' % (
+			'source', 'time (ms)', 'reads', 'bytes', 'x real time'))
+		readers = (
+			('WaveSource', lambda: audio_helpers.WaveSource(
+				open(path, 'rb'), SAMPLE_RATE, SAMPLE_WIDTH, realtime=False)),
+			('MappedWaveSource', lambda: audio_helpers.MappedWaveSource(
+				path, SAMPLE_RATE, SAMPLE_WIDTH, pad_silence=False)),
+		)
+		for name, make_source in readers:
+			source = make_source()
+			elapsed, reads, total = read_all(source, ITER_SIZE, len(frames))
+			source.close()
+			click.echo('%-18s %10.2f %8d %12d %14.0f' % (
+				name, 1000 * elapsed, reads, total, seconds / elapsed))
+
+		# Odd sizes split samples across writes.
+		size = ITER_SIZE + 1
+		click.echo('%-18s %10s %14s %14s' % (
+			'sink', 'time (ms)', 'frames', 'expected'))
+		writers = (
+			('WaveSink', lambda out: audio_helpers.WaveSink(
+				open(out, 'wb'), SAMPLE_RATE, SAMPLE_WIDTH)),
+			('MappedWaveSink', lambda out: audio_helpers.MappedWaveSink(
+				out, SAMPLE_RATE, SAMPLE_WIDTH)),
+		)
+		for name, make_sink in writers:
+			out = os.path.join(directory, name + '.wav')
+			elapsed = write_all(make_sink(out), frames, size)
+			with wave.open(out, 'rb') as f:
+				written = f.getnframes()
+			click.echo('%-18s %10.2f %14d %14d' % (
+				name, 1000 * elapsed, written, len(frames) // SAMPLE_WIDTH))
+
+		request = os.path.join(directory, 'request.wav')
+		_write_wav(request, request_seconds)
+		server, port = simulator.serve(
+			max_workers=8, response_chunks=5,
+			utterance_ms=1000 * request_seconds)
+		try:
+			click.echo('%-18s %10s' % ('replay', 'turn (ms)'))
+			for name, realtime in (('real time', True), ('fast', False)):
+				click.echo('%-18s %10.1f' % (
+					name, 1000 * replay(request, port, realtime)))
+		finally:
+			server.stop(None)
+	finally:
+		shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+	main()
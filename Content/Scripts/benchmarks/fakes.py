@@ -0,0 +1,455 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Stand-ins for the engine-only modules so scripts can run headless.
+
+install() registers fake `unreal_engine`, `sounddevice` and
+`google.cloud.pubsub_v1` modules when the real ones cannot be imported. It must be called before importing ue_site,
+threaded_assistant, pubsub_subscription or audio_helpers.
+
+The module also provides in-memory audio sources and sinks for
+benchmarks; those that talk gRPC run against benchmarks.simulator.
+"""
+
+import collections
+import logging
+import random
+import sys
+import threading
+import time
+import types
+
+
+class FakeSoundWaveProcedural(object):
+	"""Records the audio queued by UnrealSoundStream."""
+	def __init__(self):
+		self.queued = []
+
+	def queue_audio(self, buf):
+		self.queued.append(bytes(buf))
+
+
+class FakeRawStream(object):
+	"""Silent sounddevice.RawStream."""
+	def __init__(self, samplerate=None, dtype=None, channels=1,
+				 blocksize=None, **kwargs):
+		self.samplerate = samplerate
+		self.active = False
+		self.latency = 0.0
+
+	def read(self, size):
+		return bytes(2 * size), False
+
+	def write(self, buf):
+		return False
+
+	def start(self):
+		self.active = True
+
+	def stop(self):
+		self.active = False
+
+	def abort(self):
+		self.active = False
+
+	def close(self):
+		pass
+
+
+class FakeCallbackFlags(object):
+	input_overflow = False
+	input_underflow = False
+
+
+class FakeRawInputStream(object):
+	"""Callback-mode sounddevice.RawInputStream delivering silence.
+
+	While started, a thread calls the callback with one block of silence
+	per block duration, like a real input device. The class attributes
+	shape the device's timing for all instances:
+
+	  startup_delay: seconds between start() and the first callback.
+	  jitter: maximum random delay of a callback, in seconds. Late
+	    callbacks do not shift the ones after them.
+	  block_frames: frames per callback if different from blocksize,
+	    to mimic devices that ignore the requested block size.
+	  signal: callable(frames) returning the audio of the next callback,
+	    or None for silence.
+	"""
+	startup_delay = 0.0
+	jitter = 0.0
+	block_frames = None
+	signal = None
+
+	def __init__(self, samplerate=16000, dtype='int16', channels=1,
+				 blocksize=1600, callback=None, **kwargs):
+		self.samplerate = samplerate
+		self.blocksize = self.block_frames or blocksize
+		self._callback = callback
+		self._block = bytes(2 * channels * self.blocksize)
+		self._thread = None
+		self._running = threading.Event()
+		# Set by stop(), which a real device returns from at once.
+		self._stopping = threading.Event()
+		self._random = random.Random(0)
+
+	@property
+	def active(self):
+		return self._running.is_set()
+
+	def _run(self):
+		period = self.blocksize / float(self.samplerate)
+		self._stopping.wait(self.startup_delay)
+		deadline = time.monotonic()
+		status = FakeCallbackFlags()
+		while self._running.is_set():
+			deadline += period
+			delay = self._random.uniform(0, self.jitter) if self.jitter else 0
+			if self._stopping.wait(max(0, deadline + delay - time.monotonic())):
+				break
+			# Looked up on the class, so it is not bound to the stream.
+			signal = type(self).signal
+			block = signal(self.blocksize) if signal else self._block
+			self._callback(block, self.blocksize, None, status)
+
+	def start(self):
+		self._running.set()
+		self._stopping.clear()
+		self._thread = threading.Thread(target=self._run, daemon=True)
+		self._thread.start()
+
+	def stop(self):
+		self._running.clear()
+		self._stopping.set()
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
+
+	def close(self):
+		self.stop()
+
+
+def make_unreal_engine():
+	ue = types.ModuleType('unreal_engine')
+	logger = logging.getLogger('unreal_engine')
+	ue.log = logger.info
+	ue.log_warning = logger.warning
+	ue.log_error = logger.error
+	ue.IE_PRESSED = 0
+	ue.IE_RELEASED = 1
+	classes = types.ModuleType('unreal_engine.classes')
+	classes.SoundWaveProcedural = FakeSoundWaveProcedural
+	classes.AudioComponent = object
+	ue.classes = classes
+	return {'unreal_engine': ue, 'unreal_engine.classes': classes}
+
+
+def make_sounddevice():
+	sd = types.ModuleType('sounddevice')
+	sd.RawStream = FakeRawStream
+	sd.RawInputStream = FakeRawInputStream
+	sd.RawOutputStream = FakeRawStream
+	return {'sounddevice': sd}
+
+
+FlowControl = collections.namedtuple('FlowControl', ['max_messages'])
+FlowControl.__new__.__defaults__ = (1000,)
+
+
+class FakeMessage(object):
+	"""pubsub_v1 subscriber message delivered by FakeSubscriberClient."""
+	def __init__(self, subscriber, ack_id, data):
+		self._subscriber = subscriber
+		self.ack_id = ack_id
+		self.data = data
+		self.publish_time = time.time()
+
+	def ack(self):
+		self._subscriber._settle(self, True)
+
+	def nack(self):
+		self._subscriber._settle(self, False)
+
+
+class FakeStreamingPullFuture(object):
+	"""Delivers published messages to a callback on a background thread."""
+	def __init__(self, subscriber, callback, flow_control):
+		self._subscriber = subscriber
+		self._callback = callback
+		self._flow_control = flow_control
+		self._cancelled = False
+		self._done = threading.Event()
+		self._done_callbacks = []
+		self._thread = threading.Thread(target=self._run, daemon=True)
+		self._thread.start()
+
+	def _run(self):
+		subscriber = self._subscriber
+		while True:
+			with subscriber._cond:
+				while not self._cancelled and (
+						not subscriber._pending or
+						len(subscriber._outstanding) >=
+						self._flow_control.max_messages):
+					subscriber._cond.wait()
+				if self._cancelled:
+					break
+				message = subscriber._pending.popleft()
+				subscriber._outstanding[message.ack_id] = message
+			self._callback(message)
+		self._done.set()
+		for callback in self._done_callbacks:
+			callback(self)
+
+	def add_done_callback(self, callback):
+		self._done_callbacks.append(callback)
+
+	def cancel(self):
+		with self._subscriber._cond:
+			self._cancelled = True
+			self._subscriber._cond.notify_all()
+
+	def done(self):
+		return self._done.is_set()
+
+	def result(self, timeout=None):
+		self._done.wait(timeout)
+		self._subscriber.flush_acks()
+
+
+class FakeSubscriberClient(object):
+	"""In-process stand-in for pubsub_v1.SubscriberClient.
+
+	publish() queues a message for the streaming pull. Acknowledgements
+	are sent in batches of ack_batch_size, like the real client does, and
+	ack_requests records every batch. Nacked messages are redelivered.
+	"""
+	def __init__(self, credentials=None, ack_batch_size=50):
+		self._cond = threading.Condition()
+		self._pending = collections.deque()
+		self._outstanding = {}
+		self._ack_batch = []
+		self._ack_batch_size = ack_batch_size
+		self._next_ack_id = 0
+		self.subscriptions = {}
+		self.ack_requests = []
+		self.acked = []
+		self.nacked = []
+
+	@staticmethod
+	def subscription_path(project, subscription):
+		return 'projects/%s/subscriptions/%s' % (project, subscription)
+
+	def create_subscription(self, name=None, topic=None):
+		if name in self.subscriptions:
+			raise Exception('409 Resource already exists', name)
+		self.subscriptions[name] = topic
+
+	def subscribe(self, subscription, callback, flow_control=FlowControl()):
+		return FakeStreamingPullFuture(self, callback, flow_control)
+
+	def publish(self, data):
+		with self._cond:
+			self._next_ack_id += 1
+			self._pending.append(
+				FakeMessage(self, 'ack-%d' % self._next_ack_id, data))
+			self._cond.notify_all()
+
+	def _settle(self, message, acked):
+		with self._cond:
+			if self._outstanding.pop(message.ack_id, None) is None:
+				return
+			if acked:
+				self.acked.append(message)
+				self._ack_batch.append(message.ack_id)
+				if len(self._ack_batch) >= self._ack_batch_size:
+					self._flush_acks()
+			else:
+				self.nacked.append(message)
+				self._pending.append(message)
+			self._cond.notify_all()
+
+	def _flush_acks(self):
+		if self._ack_batch:
+			self.ack_requests.append(self._ack_batch)
+			self._ack_batch = []
+
+	def flush_acks(self):
+		with self._cond:
+			self._flush_acks()
+
+
+def make_pubsub():
+	pubsub_v1 = types.ModuleType('google.cloud.pubsub_v1')
+	pubsub_v1.SubscriberClient = FakeSubscriberClient
+	pubsub_v1.types = types.ModuleType('google.cloud.pubsub_v1.types')
+	pubsub_v1.types.FlowControl = FlowControl
+	modules = {'google.cloud.pubsub_v1': pubsub_v1,
+			   'google.cloud.pubsub_v1.types': pubsub_v1.types}
+	try:
+		import google.cloud as cloud
+	except ImportError:
+		cloud = types.ModuleType('google.cloud')
+		cloud.__path__ = []
+		modules['google.cloud'] = cloud
+	cloud.pubsub_v1 = pubsub_v1
+	return modules
+
+
+def install():
+	"""Registers the fake modules that are not importable for real."""
+	for name, factory in (('unreal_engine', make_unreal_engine),
+						  ('sounddevice', make_sounddevice),
+						  ('google.cloud.pubsub_v1', make_pubsub)):
+		try:
+			__import__(name)
+		except ImportError:
+			sys.modules.update(factory())
+
+
+def install_site(**attributes):
+	"""Registers a stand-in for ue_site, which needs credentials at import.
+
+	Args:
+	  attributes: module attributes, such as channels or conversation_stream.
+	"""
+	site = types.ModuleType('ue_site')
+	site.ASSISTANT_API_ENDPOINT = 'localhost'
+	site.channels = None
+	site.conversation_stream = None
+	site.creds = None
+	site.response_cache = None
+	for name, value in attributes.items():
+		setattr(site, name, value)
+	sys.modules['ue_site'] = site
+	return site
+
+
+class SilentSource(object):
+	"""Audio source returning silence, optionally at a real-time pace.
+
+	Args:
+	  sample_rate: sample rate in hertz.
+	  sample_width: size of a single sample in bytes.
+	  realtime: whether reads block for the duration of the returned audio.
+	"""
+	def __init__(self, sample_rate=16000, sample_width=2, realtime=False):
+		self._sample_rate = sample_rate
+		self._sample_width = sample_width
+		self._realtime = realtime
+
+	def read(self, size):
+		if self._realtime:
+			time.sleep(size / float(self._sample_rate * self._sample_width))
+		return bytes(size)
+
+	def write(self, buf):
+		return len(buf)
+
+	def start(self):
+		pass
+
+	def stop(self):
+		pass
+
+	def close(self):
+		pass
+
+	@property
+	def sample_rate(self):
+		return self._sample_rate
+
+
+class NullSink(SilentSource):
+	"""Audio sink counting the bytes written to it."""
+	def __init__(self, *args, **kwargs):
+		SilentSource.__init__(self, *args, **kwargs)
+		self.bytes_written = 0
+
+	def write(self, buf):
+		self.bytes_written += len(buf)
+		return len(buf)
+
+
+def serve_token_endpoint(expires_in=3600, delay=0):
+	"""Starts a local OAuth2 token endpoint handing out numbered tokens.
+
+	Args:
+	  expires_in: lifetime of every token, in seconds.
+	  delay: seconds to wait before answering, like a slow network.
+	Returns:
+	  (server, url) tuple; server.requests counts the token requests.
+	  Stop the server with server.shutdown().
+	"""
+	import http.server
+	import json
+
+	class TokenHandler(http.server.BaseHTTPRequestHandler):
+		def do_POST(self):
+			self.rfile.read(int(self.headers.get('Content-Length', 0)))
+			with self.server.lock:
+				self.server.requests += 1
+				token = 'token-%d' % self.server.requests
+			time.sleep(delay)
+			body = json.dumps({'access_token': token, 'token_type': 'Bearer',
+							   'expires_in': expires_in}).encode('utf-8')
+			self.send_response(200)
+			self.send_header('Content-Type', 'application/json')
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def log_message(self, *args):
+			pass
+
+	server = http.server.ThreadingHTTPServer(('localhost', 0), TokenHandler)
+	server.lock = threading.Lock()
+	server.requests = 0
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server, 'http://localhost:%d/token' % server.server_address[1]
+
+
+def _ogg_page(serial, sequence, granule_position, packets, header_type=0):
+	import struct
+	from googlesamples.assistant.audio_helpers import ogg
+
+	lacing = bytearray()
+	for packet in packets:
+		lacing += b'\xff' * (len(packet) // 255) + bytes([len(packet) % 255])
+	header = struct.pack('<4sBBqIIIB', b'OggS', 0, header_type,
+						 granule_position, serial, sequence, 0, len(lacing))
+	page = header + bytes(lacing) + b''.join(packets)
+	return page[:22] + struct.pack('<I', ogg.crc32(page)) + page[26:]
+
+
+def make_ogg_opus(pcm, sample_rate=16000, frame_ms=20, frames_per_page=5,
+				  bitrate=24000):
+	"""Encodes 16-bit mono PCM as an Ogg Opus stream; needs opuslib."""
+	import struct
+	import opuslib
+
+	encoder = opuslib.Encoder(sample_rate, 1, opuslib.APPLICATION_VOIP)
+	encoder.bitrate = bitrate
+	pre_skip = 312
+	frame_size = sample_rate * frame_ms // 1000
+	frame_bytes = 2 * frame_size
+	pcm = bytes(pcm) + bytes(-len(pcm) % frame_bytes)
+
+	pages = [
+		_ogg_page(1, 0, 0, [struct.pack('<8sBBHIhB', b'OpusHead', 1, 1,
+										pre_skip, sample_rate, 0, 0)], 0x02),
+		_ogg_page(1, 1, 0, [b'OpusTags' + struct.pack('<I', 5) + b'fakes' +
+							struct.pack('<I', 0)]),
+	]
+	packets = []
+	granule_position = pre_skip
+	for offset in range(0, len(pcm), frame_bytes):
+		packets.append(encoder.encode(pcm[offset:offset + frame_bytes],
+									  frame_size))
+		granule_position += 48000 * frame_ms // 1000
+		last = offset + frame_bytes >= len(pcm)
+		if len(packets) == frames_per_page or last:
+			pages.append(_ogg_page(1, len(pages), granule_position, packets,
+								   0x04 if last else 0))
+			packets = []
+	return b''.join(pages)
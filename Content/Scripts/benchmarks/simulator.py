@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Local EmbeddedAssistant simulator for load and latency tests.
+
+AssistantSimulator answers Converse calls like the Assistant does: it
+reads request audio until it has heard utterance_ms of it, sends
+END_OF_UTTERANCE and a result with the transcript, then streams the
+answer as audio_out chunks of a set size at a set pace. On top of that
+it can hold back its answer, jitter the arrival of every chunk and fail
+calls, at their start or halfway through the answer. The
+conversation_state a client sends back counts the turns of a
+conversation, so follow-on turns only end for clients that echo it.
+
+serve() runs the simulator on a local port for benchmarks. Run the
+module to serve it standalone, e.g. for batch runs:
+
+	python -m benchmarks.simulator --port 50051 --latency-ms 300
+"""
+
+import array
+import collections
+import random
+import threading
+import time
+
+import click
+import grpc
+
+from googlesamples.assistant import common_settings
+# embedded_assistant_pb2_grpc imports the protos from google.assistant,
+# where they are not installed; embedded_assistant_pb2 carries its own
+# copy of the servicer.
+from googlesdk.assistant.embedded.v1alpha1 import embedded_assistant_pb2
+
+# Where the answer of failing calls is cut off with error_after_chunks.
+ERROR_AT_START = None
+
+
+def square_wave(samples, level, period=40):
+	"""Returns 16-bit audio alternating between +level and -level."""
+	half = period // 2
+	wave = array.array('h', ([level] * half + [-level] * half) *
+					   (samples // period + 1))
+	return wave[:samples].tobytes()
+
+
+class AssistantSimulator(embedded_assistant_pb2.EmbeddedAssistantServicer):
+	"""Configurable EmbeddedAssistantServicer.
+
+	Request audio is measured in LINEAR16 samples at the rate of the
+	call's AudioInConfig; each chunk of compressed audio counts as
+	DEFAULT_AUDIO_ITER_SIZE bytes of it, what the client encodes at once.
+
+	Args:
+	  utterance_ms: request audio heard before END_OF_UTTERANCE.
+	  response_chunks: audio_out chunks in each answer.
+	  response_chunk_size: bytes of audio in each chunk.
+	  response_audio: canned answer audio, cut into chunks and repeated as
+	    needed; by default a 400 Hz square wave of response_level.
+	  response_level: amplitude of the default answer; 0 is silence.
+	  pace: speed at which answers are streamed, relative to real time at
+	    the AudioOutConfig's sample rate; 0 streams them at once.
+	  latency_ms: delay between END_OF_UTTERANCE and the result.
+	  jitter_ms: up to this much extra delay, at random, for the result
+	    and every chunk. Delays do not add up: a late chunk does not
+	    hold back the ones after it.
+	  fail_first: number of first calls failed with error_code.
+	  error_rate: chance of failing any other call.
+	  error_code: grpc.StatusCode failed calls end with.
+	  error_after_chunks: chunks of the answer sent before a call fails;
+	    ERROR_AT_START fails it before it reads the request.
+	  follow_on_turns: turns of a conversation that ask for a reply.
+	  transcripts: transcripts of the calls, in turn.
+	  response_text: spoken_response_text of the result, if any.
+	  seed: seed of the jitter and errors, for repeatable runs.
+
+	The calls Counter holds the number of calls (total), of calls failed
+	(failed) and of calls that sent a conversation_state back
+	(state_echoed), and the bytes of request (received_bytes) and answer
+	(sent_bytes) audio.
+	"""
+	def __init__(self, utterance_ms=500, response_chunks=10,
+				 response_chunk_size=3200, response_audio=None,
+				 response_level=0, pace=0, latency_ms=0, jitter_ms=0,
+				 fail_first=0, error_rate=0.0,
+				 error_code=grpc.StatusCode.UNAVAILABLE,
+				 error_after_chunks=ERROR_AT_START, follow_on_turns=0,
+				 transcripts=('what time is it',), response_text='',
+				 seed=None):
+		self._utterance_ms = utterance_ms
+		self._response_chunks = response_chunks
+		self._response_chunk_size = response_chunk_size
+		if response_audio is None:
+			response_audio = square_wave(response_chunk_size // 2,
+										 response_level)
+		self._response_audio = response_audio
+		self._pace = pace
+		self._latency = latency_ms / 1000.0
+		self._jitter = jitter_ms / 1000.0
+		self._fail_first = fail_first
+		self._error_rate = error_rate
+		self._error_code = error_code
+		self._error_after_chunks = error_after_chunks
+		self._follow_on_turns = follow_on_turns
+		self._transcripts = transcripts
+		self._response_text = response_text
+		self._random = random.Random(seed)
+		self._lock = threading.Lock()
+		self.calls = collections.Counter()
+
+	def _chunk(self, idx):
+		"""Returns the audio of the idx-th chunk of the answer."""
+		size = self._response_chunk_size
+		audio = self._response_audio
+		start = (idx * size) % len(audio)
+		chunk = audio[start:start + size]
+		while len(chunk) < size:
+			chunk += audio[:size - len(chunk)]
+		return chunk
+
+	def _wait(self, until, context):
+		"""Sleeps until a given time plus jitter; False if the call ended."""
+		with self._lock:
+			until += self._random.uniform(0, self._jitter)
+		delay = until - time.monotonic()
+		if delay > 0:
+			time.sleep(delay)
+		return context.is_active()
+
+	def Converse(self, request_iterator, context):
+		with self._lock:
+			self.calls['total'] += 1
+			call = self.calls['total']
+			failing = (call <= self._fail_first or
+					   self._random.random() < self._error_rate)
+			if failing:
+				self.calls['failed'] += 1
+			transcript = self._transcripts[(call - 1) % len(self._transcripts)]
+		if failing and self._error_after_chunks is ERROR_AT_START:
+			context.abort(self._error_code, 'simulated error')
+
+		turn = 0
+		in_rate = out_rate = common_settings.DEFAULT_AUDIO_SAMPLE_RATE
+		linear = True
+		heard = 0
+		for request in request_iterator:
+			if request.HasField('config'):
+				config = request.config
+				state = config.converse_state.conversation_state
+				if state:
+					turn = int(state)
+					with self._lock:
+						self.calls['state_echoed'] += 1
+				in_rate = config.audio_in_config.sample_rate_hertz or in_rate
+				out_rate = config.audio_out_config.sample_rate_hertz or out_rate
+				linear = config.audio_in_config.encoding in (
+					embedded_assistant_pb2.AudioInConfig.LINEAR16,
+					embedded_assistant_pb2.AudioInConfig.ENCODING_UNSPECIFIED)
+			if request.audio_in:
+				with self._lock:
+					self.calls['received_bytes'] += len(request.audio_in)
+				if linear:
+					heard += len(request.audio_in)
+				else:
+					heard += common_settings.DEFAULT_AUDIO_ITER_SIZE
+			if 1000.0 * heard / (2 * in_rate) >= self._utterance_ms:
+				break
+		yield embedded_assistant_pb2.ConverseResponse(
+			event_type=embedded_assistant_pb2.ConverseResponse.END_OF_UTTERANCE)
+
+		started = time.monotonic() + self._latency
+		if not self._wait(started, context):
+			return
+		if turn < self._follow_on_turns:
+			microphone_mode = embedded_assistant_pb2.ConverseResult.DIALOG_FOLLOW_ON
+		else:
+			microphone_mode = embedded_assistant_pb2.ConverseResult.CLOSE_MICROPHONE
+		yield embedded_assistant_pb2.ConverseResponse(
+			result=embedded_assistant_pb2.ConverseResult(
+				spoken_request_text=transcript,
+				spoken_response_text=self._response_text,
+				conversation_state=str(turn + 1).encode('ascii'),
+				microphone_mode=microphone_mode))
+
+		chunk_time = 0.0
+		if self._pace:
+			chunk_time = (self._response_chunk_size / (2.0 * out_rate) /
+						  self._pace)
+		for idx in range(self._response_chunks):
+			if failing and idx == self._error_after_chunks:
+				context.abort(self._error_code, 'simulated error')
+			if idx and not self._wait(started + idx * chunk_time, context):
+				return
+			if not context.is_active():
+				return
+			chunk = self._chunk(idx)
+			with self._lock:
+				self.calls['sent_bytes'] += len(chunk)
+			yield embedded_assistant_pb2.ConverseResponse(
+				audio_out=embedded_assistant_pb2.AudioOut(audio_data=chunk))
+		if failing:
+			context.abort(self._error_code, 'simulated error')
+
+
+def serve(port=0, max_workers=128, **options):
+	"""Starts a local gRPC server running an AssistantSimulator.
+
+	Args:
+	  port: port to listen on; 0 picks a free one.
+	  max_workers: calls served at a time.
+	  options: AssistantSimulator arguments.
+	Returns:
+	  (server, port) tuple; stop the server with server.stop(None).
+	  server.simulator is the simulator and server.calls its Counter.
+	"""
+	from concurrent import futures
+
+	server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+	simulator = AssistantSimulator(**options)
+	embedded_assistant_pb2.add_EmbeddedAssistantServicer_to_server(
+		simulator, server)
+	server.simulator = simulator
+	server.calls = simulator.calls
+	port = server.add_insecure_port('localhost:%d' % port)
+	server.start()
+	return server, port
+
+
+@click.command()
+@click.option('--port', default=50051, show_default=True,
+			  help='Port to listen on.')
+@click.option('--workers', default=128, show_default=True,
+			  help='Calls served at a time.')
+@click.option('--utterance-ms', default=500, show_default=True,
+			  help='Request audio heard before the end of the utterance.')
+@click.option('--response-chunks', default=10, show_default=True,
+			  help='Chunks of audio in each answer.')
+@click.option('--response-chunk-size', default=3200, show_default=True,
+			  help='Bytes of audio in each chunk.')
+@click.option('--response-level', default=0, show_default=True,
+			  help='Amplitude of the answer audio.')
+@click.option('--pace', default=1.0, show_default=True,
+			  help='Speed at which answers are streamed, relative to real '
+			  'time; 0 streams them at once.')
+@click.option('--latency-ms', default=0, show_default=True,
+			  help='Delay before the answer.')
+@click.option('--jitter-ms', default=0, show_default=True,
+			  help='Random extra delay of the answer and its chunks.')
+@click.option('--error-rate', default=0.0, show_default=True,
+			  help='Chance of failing a call.')
+@click.option('--error-code', default='UNAVAILABLE', show_default=True,
+			  type=click.Choice([code.name for code in grpc.StatusCode]),
+			  help='Status failed calls end with.')
+@click.option('--error-after-chunks', default=None, type=int,
+			  help='Chunks of the answer sent before a call fails. By '
+			  'default calls fail at their start.')
+@click.option('--follow-on-turns', default=0, show_default=True,
+			  help='Turns of a conversation that ask for a reply.')
+@click.option('--transcript', multiple=True, default=['what time is it'],
+			  show_default=True, help='Transcripts of the calls, in turn.')
+@click.option('--seed', default=None, type=int,
+			  help='Seed of the jitter and errors.')
+def main(port, workers, utterance_ms, response_chunks, response_chunk_size,
+		 response_level, pace, latency_ms, jitter_ms, error_rate, error_code,
+		 error_after_chunks, follow_on_turns, transcript, seed):
+	"""Serves an AssistantSimulator until interrupted."""
+	server, port = serve(
+		port=port, max_workers=workers, utterance_ms=utterance_ms,
+		response_chunks=response_chunks,
+		response_chunk_size=response_chunk_size,
+		response_level=response_level, pace=pace, latency_ms=latency_ms,
+		jitter_ms=jitter_ms, error_rate=error_rate,
+		error_code=grpc.StatusCode[error_code],
+		error_after_chunks=error_after_chunks,
+		follow_on_turns=follow_on_turns, transcripts=tuple(transcript),
+		seed=seed)
+	click.echo('Simulating the Assistant on localhost:%d' % port)
+	try:
+		server.wait_for_termination()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.stop(None)
+		calls = server.calls
+		click.echo('%d calls, %d failed, %d kB received, %d kB sent' % (
+			calls['total'], calls['failed'], calls['received_bytes'] // 1000,
+			calls['sent_bytes'] // 1000))
+
+
+if __name__ == '__main__':
+	main()
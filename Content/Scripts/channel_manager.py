@@ -0,0 +1,466 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import random
+import threading
+import time
+
+import grpc
+
+from googlesdk.assistant.embedded.v1alpha1 import embedded_assistant_pb2
+from googlesamples.assistant import common_settings
+from googlesamples.assistant.log_helpers import log, log_error
+
+_SETTLED_STATES = (
+	grpc.ChannelConnectivity.READY,
+	grpc.ChannelConnectivity.TRANSIENT_FAILURE,
+	grpc.ChannelConnectivity.SHUTDOWN,
+)
+
+# Seconds between unsubscribing from a channel and closing it.
+_CLOSE_DELAY = 1.0
+
+def keepalive_options():
+	""" HTTP/2 keepalive options shared by every Assistant channel.
+
+	Pings keep idle connections (and the NAT and proxy state along the
+	way) alive between conversations, so the next Converse does not pay
+	for a new TCP/TLS handshake.
+	"""
+	return [
+		('grpc.keepalive_time_ms',
+			common_settings.DEFAULT_GRPC_KEEPALIVE_TIME_MS),
+		('grpc.keepalive_timeout_ms',
+			common_settings.DEFAULT_GRPC_KEEPALIVE_TIMEOUT_MS),
+		('grpc.keepalive_permit_without_calls', 1),
+		('grpc.http2.max_pings_without_data', 0),
+	]
+
+def flow_control_options():
+	""" HTTP/2 flow control options shared by every Assistant channel.
+
+	Responses not yet read by a conversation that waits for its playback
+	to make room are held back by the server once the stream window is
+	full. Without a fixed window, gRPC grows it to keep the link busy
+	and a whole answer can be buffered in the client.
+	"""
+	return [
+		('grpc.http2.lookahead_bytes',
+			common_settings.DEFAULT_GRPC_STREAM_WINDOW),
+		('grpc.http2.bdp_probe', 0),
+	]
+
+def channel_options():
+	""" All the gRPC options of an Assistant channel. """
+	return keepalive_options() + flow_control_options()
+
+def _close_later(channel):
+	""" Closes a channel once gRPC's connectivity poller has let go of it.
+
+	The poller may still query the channel briefly after wait_ready()
+	unsubscribes, and fails noisily if the channel is closed by then.
+	"""
+	timer = threading.Timer(_CLOSE_DELAY, channel.close)
+	timer.daemon = True
+	timer.start()
+
+def is_unavailable(e):
+	""" True if e is a gRPC error with the UNAVAILABLE status. """
+	return (isinstance(e, grpc.RpcError) and
+			e.code() == grpc.StatusCode.UNAVAILABLE)
+
+class _ReplayableRequests(object):
+	""" Shares one request generator between successive Converse attempts.
+
+	Each attempt gets a view that first repeats the config request and
+	then continues the shared generator. A view left behind by a failed
+	attempt hands whatever it still reads over to the next attempt, so
+	no recorded audio is lost to gRPC's request thread.
+	"""
+	def __init__(self, requests):
+		self._requests = requests
+		# Held while reading, which blocks on the microphone.
+		self._read_lock = threading.Lock()
+		self._lock = threading.Lock()
+		self._pending = []
+		self._config = None
+		self.attempt = 0
+		self.audio_sent = False
+
+	def view(self):
+		""" Requests for the next attempt. """
+		return self._view(self.attempt)
+
+	def abandon(self):
+		""" Marks the current attempt as failed.
+
+		Returns: True if it had already sent audio.
+		"""
+		with self._lock:
+			self.attempt += 1
+			return self.audio_sent
+
+	def _view(self, attempt):
+		with self._read_lock:
+			if self._config is None:
+				self._config = next(self._requests)
+		yield self._config
+		while True:
+			with self._read_lock:
+				with self._lock:
+					request = self._pending.pop(0) if self._pending else None
+				if request is None:
+					request = next(self._requests, None)
+				with self._lock:
+					if attempt != self.attempt:
+						# This attempt failed, keep the request for the next one.
+						if request is not None:
+							self._pending.append(request)
+						return
+					if request is None:
+						return
+					if request.audio_in:
+						self.audio_sent = True
+			yield request
+
+class ChannelManager(object):
+	""" Owns the gRPC channel to the Assistant and keeps it usable.
+
+	The channel is opened and connected in the background by warm_up()
+	and replaced with a fresh one, after a jittered backoff, whenever a
+	Converse call finds the Assistant UNAVAILABLE.
+
+	Args:
+	  channel_factory: callable taking a list of gRPC channel options and
+	    returning a grpc.Channel.
+	  connect_timeout: seconds to wait for the channel to become ready
+	    before a call is attempted anyway.
+	  max_retries: number of times a Converse call that failed before any
+	    audio was sent is retried on a new channel.
+	"""
+	def __init__(self, channel_factory,
+				 connect_timeout=common_settings.DEFAULT_GRPC_CONNECT_TIMEOUT,
+				 max_retries=common_settings.DEFAULT_GRPC_RETRY_ATTEMPTS,
+				 backoff_base=common_settings.DEFAULT_GRPC_BACKOFF_BASE,
+				 backoff_max=common_settings.DEFAULT_GRPC_BACKOFF_MAX):
+		self._channel_factory = channel_factory
+		self._connect_timeout = connect_timeout
+		self._max_retries = max_retries
+		self._backoff_base = backoff_base
+		self._backoff_max = backoff_max
+		self._lock = threading.Lock()
+		self._channel = None
+		self._assistant = None
+		self.reconnects = 0
+		self.retries = 0
+
+	def _open(self):
+		channel = self._channel_factory(channel_options())
+		self._channel = channel
+		self._assistant = embedded_assistant_pb2.EmbeddedAssistantStub(channel)
+		return channel
+
+	def _current(self):
+		with self._lock:
+			if self._channel is None:
+				self._open()
+			return self._channel, self._assistant
+
+	@property
+	def assistant(self):
+		""" EmbeddedAssistantStub for the current channel. """
+		return self._current()[1]
+
+	def wait_ready(self, timeout=None):
+		""" Blocks until the channel connects or fails to.
+
+		Returns: True if it is ready within timeout seconds.
+		"""
+		channel = self._current()[0]
+		if timeout is None:
+			timeout = self._connect_timeout
+		settled = threading.Event()
+		result = []
+		def on_state(state):
+			if state in _SETTLED_STATES:
+				result.append(state)
+				settled.set()
+		channel.subscribe(on_state, try_to_connect=True)
+		try:
+			settled.wait(timeout)
+		finally:
+			channel.unsubscribe(on_state)
+		return bool(result) and result[0] == grpc.ChannelConnectivity.READY
+
+	def warm_up(self):
+		""" Opens the channel and connects it on a background thread. """
+		def connect():
+			started = time.time()
+			if self.wait_ready():
+				log('Assistant channel ready in %d ms',
+					1000 * (time.time() - started))
+			else:
+				log_error('Assistant channel not ready after %s s',
+						  self._connect_timeout)
+		thread = threading.Thread(target=connect, name='AssistantChannelWarmUp',
+								  daemon=True)
+		thread.start()
+		return thread
+
+	def reconnect(self):
+		""" Replaces the channel with a new one. """
+		with self._lock:
+			old = self._channel
+			self._open()
+			self.reconnects += 1
+		if old is not None:
+			_close_later(old)
+
+	def backoff_delay(self, attempt):
+		""" Seconds to wait before the given retry.
+
+		The exponential delay is half fixed and half random, so clients
+		that lost the same server do not all come back at once.
+		"""
+		delay = min(self._backoff_max, self._backoff_base * 2 ** attempt)
+		return delay / 2 + random.uniform(0, delay / 2)
+
+	def converse(self, requests, timeout, on_call=None):
+		""" Calls Converse, retrying while no audio has been sent.
+
+		Args:
+		  requests: ConverseRequest generator, starting with the config.
+		  timeout: deadline of each attempt in seconds.
+		  on_call: called with each attempt's call as it starts, e.g. to
+		    keep a handle to cancel it with.
+		Returns:
+		  Generator of ConverseResponse messages.
+		"""
+		replay = _ReplayableRequests(requests)
+		attempt = 0
+		while True:
+			last_attempt = attempt >= self._max_retries
+			# Without retries left, let gRPC report why it cannot connect.
+			if self.wait_ready() or last_attempt:
+				received = False
+				call = self.assistant.Converse(replay.view(), timeout)
+				if on_call is not None:
+					on_call(call)
+				try:
+					for resp in call:
+						received = True
+						yield resp
+					return
+				except grpc.RpcError as e:
+					audio_sent = replay.abandon()
+					if not is_unavailable(e):
+						raise
+					if received or audio_sent or last_attempt:
+						log_error('Assistant unavailable: %s', e.details())
+						# Later conversations get a fresh channel.
+						self.reconnect()
+						raise
+			delay = self.backoff_delay(attempt)
+			log_error('Assistant unavailable, reconnecting in %d ms',
+					  1000 * delay)
+			time.sleep(delay)
+			self.reconnect()
+			attempt += 1
+			self.retries += 1
+
+	def close(self):
+		""" Closes the current channel. """
+		with self._lock:
+			channel, self._channel = self._channel, None
+		if channel is not None:
+			_close_later(channel)
+
+class _AsyncReplayableRequests(_ReplayableRequests):
+	""" _ReplayableRequests for an async request generator.
+
+	The shared generator is read on a task of its own, so that gRPC
+	cancelling a failed attempt's view while it waits on the microphone
+	does not cancel the generator as well; the next view picks the read
+	up where it was left.
+	"""
+	def __init__(self, requests):
+		_ReplayableRequests.__init__(self, requests)
+		self._reading = None
+
+	async def _next(self):
+		try:
+			return await self._requests.__anext__()
+		except StopAsyncIteration:
+			return None
+
+	async def _read(self):
+		while True:
+			if self._pending:
+				return self._pending.pop(0)
+			if self._reading is None:
+				self._reading = asyncio.ensure_future(self._next())
+			reading = self._reading
+			request = await asyncio.shield(reading)
+			# Views waiting on the same read take turns; the first one
+			# gets the request, the others read on.
+			if self._reading is reading:
+				self._reading = None
+				return request
+
+	async def _view(self, attempt):
+		try:
+			if self._config is None:
+				self._config = await self._read()
+			yield self._config
+			while True:
+				request = await self._read()
+				if attempt != self.attempt:
+					# This attempt failed, keep the request for the next one.
+					if request is not None:
+						self._pending.append(request)
+					return
+				if request is None:
+					return
+				if request.audio_in:
+					self.audio_sent = True
+				yield request
+		except GeneratorExit:
+			# gRPC is done with the requests of a call that can no longer
+			# be retried; end the generator, as it would be without us.
+			if attempt == self.attempt and self.audio_sent:
+				await self.aclose()
+			raise
+
+	async def aclose(self):
+		""" Stops reading, running the request generator's cleanup. """
+		reading, self._reading = self._reading, None
+		if reading is not None:
+			reading.cancel()
+			try:
+				await reading
+			except (asyncio.CancelledError, Exception):
+				pass
+		await self._requests.aclose()
+
+class AsyncChannelManager(ChannelManager):
+	""" A ChannelManager for grpc.aio channels, used from one event loop.
+
+	Warm-up, reconnects and Converse retries work as ChannelManager's,
+	but wait_ready(), warm_up(), reconnect() and close() are coroutines
+	and converse() is an async generator, so nothing blocks the loop.
+
+	Args:
+	  channel_factory: callable taking a list of gRPC channel options and
+	    returning a grpc.aio.Channel. It is only called on the event loop
+	    thread, as aio channels are bound to their loop.
+	  connect_timeout: see ChannelManager.
+	  max_retries: see ChannelManager.
+	"""
+	def __init__(self, channel_factory, **options):
+		ChannelManager.__init__(self, channel_factory, **options)
+		self._closing = set()
+
+	async def wait_ready(self, timeout=None):
+		""" Waits until the channel connects or fails to.
+
+		Returns: True if it is ready within timeout seconds.
+		"""
+		channel = self._current()[0]
+		if timeout is None:
+			timeout = self._connect_timeout
+		async def settled():
+			state = channel.get_state(try_to_connect=True)
+			while state not in _SETTLED_STATES:
+				await channel.wait_for_state_change(state)
+				state = channel.get_state(try_to_connect=True)
+			return state
+		try:
+			state = await asyncio.wait_for(settled(), timeout)
+		except asyncio.TimeoutError:
+			return False
+		return state == grpc.ChannelConnectivity.READY
+
+	async def warm_up(self):
+		""" Opens the channel and connects it. """
+		started = time.time()
+		if await self.wait_ready():
+			log('Assistant channel ready in %d ms',
+				1000 * (time.time() - started))
+		else:
+			log_error('Assistant channel not ready after %s s',
+					  self._connect_timeout)
+
+	def _close_later(self, channel):
+		# Calls still on the channel get the same delay to finish.
+		task = asyncio.ensure_future(channel.close(_CLOSE_DELAY))
+		self._closing.add(task)
+		task.add_done_callback(self._closing.discard)
+
+	async def reconnect(self):
+		""" Replaces the channel with a new one. """
+		with self._lock:
+			old = self._channel
+			self._open()
+			self.reconnects += 1
+		if old is not None:
+			self._close_later(old)
+
+	async def converse(self, requests, timeout, on_call=None):
+		""" Calls Converse, retrying while no audio has been sent.
+
+		Args:
+		  requests: async ConverseRequest generator, starting with the
+		    config. It is closed once the call is done with it.
+		  timeout: deadline of each attempt in seconds.
+		  on_call: called with each attempt's call as it starts, e.g. to
+		    keep a handle to cancel it with.
+		Returns:
+		  Async generator of ConverseResponse messages.
+		"""
+		replay = _AsyncReplayableRequests(requests)
+		call = None
+		attempt = 0
+		try:
+			while True:
+				last_attempt = attempt >= self._max_retries
+				# Without retries left, let gRPC report why it cannot connect.
+				if await self.wait_ready() or last_attempt:
+					received = False
+					call = self.assistant.Converse(replay.view(),
+												   timeout=timeout)
+					if on_call is not None:
+						on_call(call)
+					try:
+						async for resp in call:
+							received = True
+							yield resp
+						return
+					except grpc.RpcError as e:
+						audio_sent = replay.abandon()
+						if not is_unavailable(e):
+							raise
+						if received or audio_sent or last_attempt:
+							log_error('Assistant unavailable: %s', e.details())
+							# Later conversations get a fresh channel.
+							await self.reconnect()
+							raise
+				delay = self.backoff_delay(attempt)
+				log_error('Assistant unavailable, reconnecting in %d ms',
+						  1000 * delay)
+				await asyncio.sleep(delay)
+				await self.reconnect()
+				attempt += 1
+				self.retries += 1
+		finally:
+			# A no-op unless the responses were left unread.
+			if call is not None:
+				call.cancel()
+			await replay.aclose()
+
+	async def close(self):
+		""" Closes the current channel. """
+		with self._lock:
+			channel, self._channel = self._channel, None
+		if channel is not None:
+			await channel.close()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import queue
+import threading
+import time
+
+from googlesamples.assistant import common_settings
+from googlesamples.assistant.log_helpers import log_error
+
+import conversation_manager
+
+class InputWorker(object):
+	""" One long-lived thread running the work triggered by input events.
+
+	The game thread only appends to a queue; starting, queueing and
+	ending conversations happens here, in the order the events arrived.
+	"""
+	def __init__(self):
+		self._tasks = queue.SimpleQueue()
+		self._thread = threading.Thread(target=self._run, name='InputWorker',
+										daemon=True)
+		self._thread.start()
+
+	def submit(self, function, *args):
+		""" Queues function(*args); never blocks. """
+		self._tasks.put((function, args))
+
+	def _run(self):
+		while True:
+			function, args = self._tasks.get()
+			try:
+				function(*args)
+			except Exception as e:
+				log_error('Input handling failed: %s', e)
+
+_worker = None
+_worker_lock = threading.Lock()
+
+def get_worker():
+	""" Returns the process-wide input worker, starting it on first use. """
+	global _worker
+	with _worker_lock:
+		if _worker is None:
+			_worker = InputWorker()
+		return _worker
+
+class ConversationController(object):
+	""" Drives one actor's conversations from talk key press/release events.
+
+	Bind on_pressed and on_released to the key's input events instead of
+	polling it every tick. Presses closer together than the debounce
+	interval count as one. With push_to_talk, releasing the key ends the
+	request; otherwise the Assistant decides when the user is done.
+
+	Args:
+	  key: the actor's key in the ConversationManager.
+	  manager: the ConversationManager. Defaults to the process-wide one.
+	  push_to_talk: end the request when the key is released.
+	  debounce: seconds during which further presses are ignored.
+	  on_state_changed: called from tick() with the new session state.
+	"""
+	def __init__(self, key, manager=None,
+				 push_to_talk=common_settings.PUSH_TO_TALK,
+				 debounce=common_settings.DEFAULT_INPUT_DEBOUNCE,
+				 on_state_changed=None):
+		self._key = key
+		self._manager = manager or conversation_manager.get_manager()
+		self._push_to_talk = push_to_talk
+		self._debounce = debounce
+		self._on_state_changed = on_state_changed
+		self._worker = get_worker()
+		self._last_press = None
+		self._held = False
+		self._state = conversation_manager.IDLE
+		self.ignored_presses = 0
+
+	def on_pressed(self, *args):
+		""" Talk key went down. """
+		now = time.monotonic()
+		if (self._last_press is not None and
+				now - self._last_press < self._debounce):
+			self.ignored_presses += 1
+			return
+		self._last_press = now
+		self._held = True
+		self._worker.submit(self._manager.request_conversation, self._key, now)
+
+	def on_released(self, *args):
+		""" Talk key went up. """
+		if not self._held:
+			return
+		self._held = False
+		if self._push_to_talk:
+			self._worker.submit(self._manager.end_request, self._key)
+
+	@property
+	def state(self):
+		""" IDLE, QUEUED or ACTIVE; never blocks. """
+		return self._manager.session_state(self._key)
+
+	def tick(self):
+		""" Reports state changes to on_state_changed on the calling thread. """
+		state = self._manager.session_state(self._key)
+		if state is not self._state:
+			self._state = state
+			if self._on_state_changed is not None:
+				self._on_state_changed(state)
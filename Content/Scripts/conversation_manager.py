@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+import threading
+import time
+from unreal_engine.classes import SoundWaveProcedural
+import ue_site
+
+from googlesamples.assistant import common_settings
+from googlesamples.assistant.log_helpers import log, log_error
+
+# Session states reported by ConversationManager.session_state()
+IDLE = 'idle'
+QUEUED = 'queued'
+ACTIVE = 'active'
+
+class ConversationSession(object):
+	""" The audio and conversation state of one voice-enabled actor.
+
+	Args:
+	  key: hashable key identifying the actor.
+	  procedural_audio_wave: the SoundWaveProcedural the actor plays from.
+	"""
+	def __init__(self, key, procedural_audio_wave):
+		self.key = key
+		self.procedural_audio_wave = procedural_audio_wave
+		# The ConversationStream lent while a conversation runs.
+		self.conversation_stream = None
+		self.conversation = None
+		self.future = None
+		# When the conversation waiting to start was asked for.
+		self.pressed_at = None
+
+class ConversationManager(object):
+	""" Lets many actors hold conversations over one shared gRPC channel.
+
+	ConversationStream/UnrealSoundStream pairs are pooled and lent to a
+	conversation as it starts, then returned once it ends, so there are
+	never more sound device streams than conversations ever ran at once.
+	At most max_active conversations run at once; the others wait in a
+	first-come, first-served queue. Conversations requested before
+	ue_site is set up wait in the same queue while ue_site.warm_up() runs.
+
+	Args:
+	  max_active: maximum number of concurrent conversations.
+	  engine: the AsyncAssistantEngine to run conversations on.
+	    Defaults to the process-wide engine.
+	"""
+	def __init__(self,
+				 max_active=common_settings.DEFAULT_MAX_ACTIVE_CONVERSATIONS,
+				 engine=None):
+		self._max_active = max_active
+		self._engine = engine
+		self._lock = threading.Lock()
+		self._sessions = {}
+		self._free_streams = []
+		self._active = set()
+		self._queue = collections.deque()
+		# QUEUED or ACTIVE per actor, so session_state() needs no lock.
+		self._states = {}
+
+	@property
+	def engine(self):
+		if self._engine is None:
+			# Imported on first use, it pulls in gRPC and protobuf.
+			import async_assistant
+			self._engine = async_assistant.get_engine()
+		return self._engine
+
+	def register(self, key, audio_component):
+		""" Gives an actor a SoundWaveProcedural to play conversations from.
+
+		Args:
+		  key: hashable key identifying the actor, e.g. its name.
+		  audio_component: the AudioComponent the actor plays audio from.
+		"""
+		procedural_audio_wave = SoundWaveProcedural()
+		with self._lock:
+			if key in self._sessions:
+				raise Exception('actor already registered:', key)
+		audio_component.SetSound(procedural_audio_wave)
+
+		session = ConversationSession(key, procedural_audio_wave)
+		with self._lock:
+			self._sessions[key] = session
+		return session
+
+	def unregister(self, key):
+		""" Forgets an actor.
+
+		A conversation still running for the actor is left to finish
+		before its stream is returned to the pool.
+		"""
+		with self._lock:
+			session = self._sessions.pop(key, None)
+			if session is None:
+				return
+			if self._states.get(key) == QUEUED:
+				self._queue.remove(key)
+				del self._states[key]
+
+	def _lend(self, session):
+		""" Lends a pooled stream to the session, creating one if needed. """
+		with self._lock:
+			stream = self._free_streams.pop() if self._free_streams else None
+		if stream is None:
+			stream = ue_site.create_conversation_stream(
+				session.procedural_audio_wave)
+		else:
+			stream.sink.procedural_audio_wave = session.procedural_audio_wave
+		session.conversation_stream = stream
+		return stream
+
+	def _recycle(self, session):
+		stream, session.conversation_stream = session.conversation_stream, None
+		if stream is None:
+			return
+		stream.reset()
+		with self._lock:
+			self._free_streams.append(stream)
+
+	def request_conversation(self, key, pressed_at=None):
+		""" Starts a conversation for the actor, or queues it at capacity.
+
+		Args:
+		  key: the actor's key.
+		  pressed_at: time.monotonic() the talk key was pressed, which the
+		    conversation's timing starts from. Defaults to now.
+		Returns: False if the actor is already talking or waiting.
+		"""
+		site_ready = ue_site.ready()
+		with self._lock:
+			session = self._sessions[key]
+			if key in self._states:
+				return False
+			session.pressed_at = pressed_at or time.monotonic()
+			start = site_ready and len(self._active) < self._max_active
+			if start:
+				self._active.add(key)
+				self._states[key] = ACTIVE
+			else:
+				self._queue.append(key)
+				self._states[key] = QUEUED
+				log('Conversation for %s queued (%d waiting)', key,
+					len(self._queue))
+		if start:
+			self._start(session)
+		elif not site_ready:
+			# Runs right away if setup has already finished.
+			ue_site.warm_up().add_done_callback(self._on_site_ready)
+		return True
+
+	def _start(self, session):
+		try:
+			stream = self._lend(session)
+			if session.conversation is None:
+				import async_assistant
+				session.conversation = async_assistant.AsyncConversation(stream)
+			# Kept between conversations for its conversation_state.
+			session.conversation.conversation_stream = stream
+			session.conversation.pressed_at = session.pressed_at
+			session.future = self.engine.converse(session.conversation)
+		except Exception as e:
+			log_error('Could not start conversation for %s: %s', session.key, e)
+			# Give the slot back, or it would stay taken for good.
+			with self._lock:
+				self._active.discard(session.key)
+				if self._states.get(session.key) == ACTIVE:
+					del self._states[session.key]
+			self._recycle(session)
+			return
+		session.future.add_done_callback(
+			lambda future: self._on_finished(session))
+
+	def _start_queued(self):
+		""" Starts queued conversations while there is room. """
+		while True:
+			with self._lock:
+				if len(self._active) >= self._max_active:
+					return
+				session = None
+				while self._queue and session is None:
+					session = self._sessions.get(self._queue.popleft())
+				if session is None:
+					return
+				self._active.add(session.key)
+				self._states[session.key] = ACTIVE
+			self._start(session)
+
+	def _on_site_ready(self, future):
+		""" Called once ue_site.warm_up() has finished. """
+		if not ue_site.ready():
+			with self._lock:
+				dropped = len(self._queue)
+				for key in self._queue:
+					self._states.pop(key, None)
+				self._queue.clear()
+			log_error('Google Assistant is unavailable, dropped %d '
+					  'conversation requests', dropped)
+			return
+		self._start_queued()
+
+	def _on_finished(self, session):
+		""" Called on the engine's thread when a conversation ends. """
+		with self._lock:
+			self._active.discard(session.key)
+			if self._states.get(session.key) == ACTIVE:
+				del self._states[session.key]
+		self._recycle(session)
+		self._start_queued()
+
+	def session_state(self, key):
+		""" Returns IDLE, QUEUED or ACTIVE for the given actor.
+
+		Never blocks, so it can be polled from tick().
+		"""
+		return self._states.get(key, IDLE)
+
+	def end_request(self, key):
+		""" Stops recording the actor's request, e.g. on a push-to-talk release.
+
+		A conversation still waiting for a slot is dropped instead.
+		"""
+		with self._lock:
+			session = self._sessions.get(key)
+			state = self._states.get(key)
+			if state == QUEUED:
+				self._queue.remove(key)
+				del self._states[key]
+			stream = session.conversation_stream if session else None
+		if state == ACTIVE and stream is not None:
+			stream.stop_recording()
+
+	@property
+	def active_count(self):
+		""" Number of conversations currently running. """
+		return len(self._active)
+
+	@property
+	def queued_count(self):
+		""" Number of conversations waiting for a free slot. """
+		return len(self._queue)
+
+	@property
+	def pooled_count(self):
+		""" Number of idle streams ready to be lent to the next conversation. """
+		return len(self._free_streams)
+
+_manager = None
+
+def get_manager():
+	""" Returns the process-wide conversation manager. """
+	global _manager
+	if _manager is None:
+		_manager = ConversationManager()
+	return _manager
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import datetime
+import threading
+
+import google.auth.transport.requests
+
+from googlesamples.assistant import (
+	auth_helpers,
+	common_settings
+)
+from googlesamples.assistant.log_helpers import log, log_error
+
+def _utcnow():
+	# Naive UTC, like the expiry times google.auth uses.
+	return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+class CredentialService(object):
+	""" Keeps the Assistant's OAuth2 access token fresh in the background.
+
+	The credentials object returned by load() is shared with the gRPC
+	channels, whose auth plugin reuses its token for as long as it is
+	valid. A background thread refreshes that token ahead of its expiry
+	and saves it, so neither the game thread nor a Converse call waits on
+	the token endpoint.
+
+	Args:
+	  path: the credentials file written by auth_helpers.
+	  scopes: OAuth2 scopes of the credentials.
+	  refresh_margin: seconds before expiry at which the token is
+	    refreshed.
+	  request_factory: callable returning a google.auth transport Request.
+	"""
+	def __init__(self, path, scopes,
+				 refresh_margin=common_settings.DEFAULT_CREDENTIALS_REFRESH_MARGIN,
+				 request_factory=google.auth.transport.requests.Request):
+		self._path = path
+		self._scopes = scopes
+		self._refresh_margin = refresh_margin
+		self._request_factory = request_factory
+		self._credentials = None
+		self._stop = threading.Event()
+		self._valid = threading.Event()
+		self._thread = None
+		self.refreshes = 0
+		self.failures = 0
+
+	@property
+	def credentials(self):
+		""" The loaded google.oauth2.credentials.Credentials, or None. """
+		return self._credentials
+
+	def load(self):
+		""" Reads the credentials file, without contacting the token endpoint.
+
+		Returns: the credentials, whose token may need refreshing.
+		"""
+		self._credentials = auth_helpers.load_credentials(
+			self._path, scopes=self._scopes)
+		if self._credentials.valid:
+			self._valid.set()
+		return self._credentials
+
+	def wait_until_valid(self, timeout=None):
+		""" Blocks until the credentials hold a valid token.
+
+		Returns: True if they do within timeout seconds.
+		"""
+		return self._valid.wait(timeout)
+
+	def seconds_until_refresh(self):
+		""" Seconds until the token should be refreshed.
+
+		Returns: 0 if it is due now, None if the token never expires.
+		"""
+		credentials = self._credentials
+		if not credentials.token:
+			return 0
+		if not credentials.expiry:
+			return None
+		lifetime = (credentials.expiry - _utcnow()).total_seconds()
+		if lifetime > 2 * self._refresh_margin:
+			return lifetime - self._refresh_margin
+		# Short-lived token, refresh it halfway.
+		return max(0, lifetime / 2)
+
+	def refresh(self):
+		""" Refreshes the token now and saves it to the credentials file. """
+		self._credentials.refresh(self._request_factory())
+		auth_helpers.save_credentials(self._path, self._credentials)
+		self.refreshes += 1
+		self._valid.set()
+
+	def _run(self):
+		retry_delay = common_settings.DEFAULT_CREDENTIALS_RETRY_DELAY
+		wait = self.seconds_until_refresh()
+		while not self._stop.wait(wait):
+			try:
+				self.refresh()
+			except Exception as e:
+				self.failures += 1
+				log_error('Could not refresh credentials: %s', e)
+				# The old token may still be good; try again soon.
+				wait = min(retry_delay * 2 ** (self.failures - 1),
+						   common_settings.DEFAULT_CREDENTIALS_MAX_RETRY_DELAY)
+				continue
+			self.failures = 0
+			wait = self.seconds_until_refresh()
+			if wait is not None:
+				log('Refreshed credentials, next refresh in %d s', wait)
+
+	def start(self):
+		""" Starts refreshing the loaded credentials in the background. """
+		if self._thread is not None:
+			return
+		self._stop.clear()
+		self._thread = threading.Thread(target=self._run,
+										name='CredentialRefresher',
+										daemon=True)
+		self._thread.start()
+
+	def stop(self):
+		""" Stops the background refreshes. """
+		if self._thread is None:
+			return
+		self._stop.set()
+		self._thread.join()
+		self._thread = None
@@ -14,39 +14,113 @@
 
 """Helper functions for the Google Assistant API."""
 
-import logging
-import unreal_engine as ue
+from google.protobuf.descriptor import FieldDescriptor
 
-from google.assistant.embedded.v1alpha1 import embedded_assistant_pb2
+from googlesdk.assistant.embedded.v1alpha1 import embedded_assistant_pb2
+
+from . import common_settings, log_helpers
 
 
 END_OF_UTTERANCE = embedded_assistant_pb2.ConverseResponse.END_OF_UTTERANCE
 
 
+def _summarize_value(field, value):
+	if field.type == FieldDescriptor.TYPE_BYTES:
+		return '<' + str(len(value)) + ' bytes>'
+	if field.type == FieldDescriptor.TYPE_MESSAGE:
+		return '{ ' + summarize_message(value) + ' }'
+	if field.type == FieldDescriptor.TYPE_ENUM:
+		enum_value = field.enum_type.values_by_number.get(value)
+		return enum_value.name if enum_value is not None else str(value)
+	if field.type == FieldDescriptor.TYPE_STRING:
+		return repr(value)
+	return str(value)
+
+
+def summarize_message(message):
+	"""Returns the set fields of a proto message on a single line.
+
+	Bytes fields, such as audio, are shown by their size. The message
+	is read in place; nothing is copied.
+	"""
+	parts = []
+	for field, value in message.ListFields():
+		if field.label == FieldDescriptor.LABEL_REPEATED:
+			values = [_summarize_value(field, item) for item in value]
+			parts.append(field.name + ': [' + ', '.join(values) + ']')
+		else:
+			parts.append(field.name + ': ' + _summarize_value(field, value))
+	return ' '.join(parts)
+
+
+class MessageSummary(object):
+	"""Formats a proto message with summarize_message() when printed.
+
+	Passed as a log argument, the message is only walked if and when
+	the log line is written.
+	"""
+	def __init__(self, message):
+		self._message = message
+
+	def __str__(self):
+		return summarize_message(self._message)
+
+
+def converse_config_request(conversation_stream, conversation_state=None):
+	"""Returns the first ConverseRequest of a call, carrying the ConverseConfig.
+
+	The audio formats and volume are those of the ConversationStream
+	the request is read from and the answer played to.
+
+	Args:
+	  conversation_stream: the ConversationStream of the call.
+	  conversation_state: conversation_state of the previous answer, if
+	    this call continues the conversation.
+	"""
+	converse_state = None
+	if conversation_state:
+		log_helpers.log('Sending converse_state: %r', conversation_state)
+		converse_state = embedded_assistant_pb2.ConverseState(
+			conversation_state=conversation_state,
+		)
+
+	config = embedded_assistant_pb2.ConverseConfig(
+		audio_in_config=embedded_assistant_pb2.AudioInConfig(
+			encoding=conversation_stream.encoding,
+			sample_rate_hertz=conversation_stream.sample_rate,
+		),
+		audio_out_config=embedded_assistant_pb2.AudioOutConfig(
+			encoding=conversation_stream.output_encoding,
+			sample_rate_hertz=conversation_stream.sample_rate,
+			volume_percentage=conversation_stream.volume_percentage,
+		),
+		converse_state=converse_state
+	)
+
+	# The first ConverseRequest must contain the ConverseConfig
+	# and no audio data.
+	request = embedded_assistant_pb2.ConverseRequest(config=config)
+	if common_settings.LOG_CONVERSE_MESSAGES:
+		log_converse_request_without_audio(request)
+	return request
+
+
+def gen_audio_requests(chunks):
+	"""Generates a ConverseRequest for each chunk of request audio.
+
+	Args:
+	  chunks: iterable of audio chunks, such as a ConversationStream.
+	"""
+	for data in chunks:
+		# Sources may return memoryviews; protobuf takes bytes.
+		yield embedded_assistant_pb2.ConverseRequest(audio_in=bytes(data))
+
+
 def log_converse_request_without_audio(converse_request):
 	"""Log ConverseRequest fields without audio data."""
-	#resp_copy = embedded_assistant_pb2.ConverseRequest()
-	#resp_copy.CopyFrom(converse_request)
-	#if len(resp_copy.audio_in) > 0:
-	#	size = len(resp_copy.audio_in)
-	#	resp_copy.ClearField('audio_in')
-	#	ue.log('ConverseRequest: audio_in (' + str(size) + ' bytes)')
-	#	return
-	#ue.log('ConverseRequest: ' + str(resp_copy))
+	log_helpers.log('ConverseRequest: %s', MessageSummary(converse_request))
 
 
 def log_converse_response_without_audio(converse_response):
 	"""Log ConverseResponse fields without audio data."""
-	#resp_copy = embedded_assistant_pb2.ConverseResponse()
-	#resp_copy.CopyFrom(converse_response)
-	#has_audio_data = (resp_copy.HasField('audio_out') and
-	#				  len(resp_copy.audio_out.audio_data) > 0)
-	#if has_audio_data:
-	#	size = len(resp_copy.audio_out.audio_data)
-	#	resp_copy.audio_out.ClearField('audio_data')
-	#	if resp_copy.audio_out.ListFields():
-	#		ue.log('ConverseResponse: '+ str(resp_copy) +' audio_data ('+ str(size)+' bytes)')
-	#	else:
-	#		ue.log('ConverseResponse: audio_data ('+str(size)+' bytes)')
-	#		return
-	#	ue.log('ConverseResponse: '+str(resp_copy))
+	log_helpers.log('ConverseResponse: %s', MessageSummary(converse_response))
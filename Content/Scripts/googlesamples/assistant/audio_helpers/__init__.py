@@ -18,12 +18,21 @@ import logging
 import threading
 import time
 import wave
-import math
-import array
 
 import sounddevice as sd
 
-import unreal_engine as ue
+from .. import log_helpers
+from . import gain
+from .buffers import AudioChunkBuffer
+from .bargein import BargeInDetector
+from .capture import CallbackCapture, CaptureBlock
+from .flac import FlacEncoder
+from .jitter import JitterBuffer
+from .opus import OpusInOggDecoder
+from .playback import PlaybackQueue
+from .resample import Resampler
+from .vad import VoiceActivityGate
+from .wavefile import MappedWaveSink, MappedWaveSource
 
 
 def normalize_audio_buffer(buf, volume_percentage, sample_width=2):
@@ -33,23 +42,16 @@ def normalize_audio_buffer(buf, volume_percentage, sample_width=2):
 	in the buffer by a scale factor of 2^(volume_percentage/100)-1.
 	For example, 50% volume scales the amplitude by a factor of 0.414,
 	and 75% volume scales the amplitude by a factor of 0.681.
-	For now we only sample_width 2.
+	Samples that would overflow are clipped to the limits of the
+	sample format.
 
 	Args:
 	  buf: byte string containing audio data to normalize.
 	  volume_percentage: volume setting as an integer percentage (1-100).
-	  sample_width: size of a single sample in bytes.
+	  sample_width: size of a single sample in bytes (2, 3 or 4).
 	"""
-	if sample_width != 2:
-		raise Exception('unsupported sample width:', sample_width)
-	scale = math.pow(2, 1.0*volume_percentage/100)-1
-	# Construct array from bytes based on sample_width, multiply by scale
-	# and convert it back to bytes
-	arr = array.array('h', buf)
-	for idx in range(0, len(arr)):
-		arr[idx] = int(arr[idx]*scale)
-	buf = arr.tostring()
-	return buf
+	return gain.apply_gain(buf, gain.volume_scale(volume_percentage),
+							sample_width)
 
 
 def align_buf(buf, sample_width):
@@ -64,24 +66,29 @@ class WaveSource(object):
 	"""Audio source that reads audio data from a WAV file.
 
 	Reads are throttled to emulate the given sample rate and silence
-	is returned when the end of the file is reached.
+	is returned when the end of the file is reached. MappedWaveSource
+	serves files from memory instead.
 
 	Args:
 	  fp: file-like stream object to read from.
 	  sample_rate: sample rate in hertz.
 	  sample_width: size of a single sample in bytes.
+	  realtime: whether reads are throttled.
 	"""
-	def __init__(self, fp, sample_rate, sample_width):
+	def __init__(self, fp, sample_rate, sample_width, realtime=True):
 		self._fp = fp
+		self._frame_bytes = sample_width
 		try:
 			self._wavep = wave.open(self._fp, 'r')
+			self._frame_bytes *= self._wavep.getnchannels()
 		except wave.Error as e:
-			ue.log_warning('error opening WAV file: ' + str(e) +
-							' falling back to RAW format')
+			log_helpers.log_warning('error opening WAV file: %s falling back to '
+									'RAW format', e)
 			self._fp.seek(0)
 			self._wavep = None
 		self._sample_rate = sample_rate
 		self._sample_width = sample_width
+		self._realtime = realtime
 		self._sleep_until = 0
 
 	def read(self, size):
@@ -90,12 +97,14 @@ class WaveSource(object):
 		Args:
 		  size: number of bytes to read from the stream.
 		"""
-		now = time.time()
-		missing_dt = self._sleep_until - now
-		if missing_dt > 0:
-			time.sleep(missing_dt)
-		self._sleep_until = time.time() + self._sleep_time(size)
-		data = (self._wavep.readframes(size)
+		if self._realtime:
+			now = time.time()
+			missing_dt = self._sleep_until - now
+			if missing_dt > 0:
+				time.sleep(missing_dt)
+			self._sleep_until = time.time() + self._sleep_time(size)
+		# readframes() counts frames, not bytes.
+		data = (self._wavep.readframes(size // self._frame_bytes)
 				if self._wavep
 				else self._fp.read(size))
 		#  When reach end of audio stream, pad remainder with silence (zeros).
@@ -166,75 +175,190 @@ class UnrealSoundStream(object):
 	  sample_rate: sample rate in hertz.
 	  sample_width: size of a single sample in bytes.
 	  block_size: size in bytes of each read and write operation.
-	  flush_size: size in bytes of silence data written during flush operation.
+	  flush_size: unused, as playback goes through the sound wave. Kept so
+	    both device streams are created the same way.
 	  audio_component: where the audio for the sound wave will be played from during a write.
+	  ring_size: size in bytes of the buffer between capture and read().
+	  jitter_buffer: optional JitterBuffer that played audio goes through.
+	  max_queue_bytes: most audio queued to the sound wave ahead of
+	    playback; write() waits for room beyond it. None for no limit.
+	  playback_rate: sample rate of the sound wave, if it differs from
+	    that of the recording.
 	"""
-	def __init__(self, sample_rate, sample_width, block_size, flush_size, procedural_audio_wave):
+	def __init__(self, sample_rate, sample_width, block_size, flush_size, procedural_audio_wave,
+				 ring_size=None, jitter_buffer=None, max_queue_bytes=None,
+				 playback_rate=None):
 
+		self._sample_rate = sample_rate
+		self._playback_rate = playback_rate or sample_rate
+		# Tracks when the audio queued so far will have played out.
+		self._playback_queue = PlaybackQueue(self._playback_rate, sample_width,
+											 max_queue_bytes)
+		# When the first audio since start() was queued.
+		self._first_queued_at = None
+		# False when the writer waits for room itself, with the playback
+		# queue's room_in(); writes then never block.
+		self.wait_for_room = True
+		self._jitter_buffer = jitter_buffer
+		self.procedural_audio_wave = procedural_audio_wave
+
+		# The sound device only records; it fills a ring buffer from its
+		# callback so slow readers do not stall it.
+		self._capture = CallbackCapture(sample_rate, sample_width, block_size,
+									ring_size or 8 * block_size)
+		self._block_size = block_size
+
+	@property
+	def procedural_audio_wave(self):
+		"""The SoundWaveProcedural that played audio is queued to."""
+		return self.ue_procedural_audio_wave
+
+	@procedural_audio_wave.setter
+	def procedural_audio_wave(self, procedural_audio_wave):
+		# Streams are recycled between actors, so the sound device
+		# stream is kept and only the target sound wave changes.
 		self.ue_procedural_audio_wave = procedural_audio_wave
-		self.ue_procedural_audio_wave.SampleRate = sample_rate
+		self.ue_procedural_audio_wave.SampleRate = self._playback_rate
 		self.ue_procedural_audio_wave.NumChannels = 1
 		self.ue_procedural_audio_wave.Duration = 10000.0
 		self.ue_procedural_audio_wave.SoundGroup = 4
 		self.ue_procedural_audio_wave.bLooping = False
 
-		if sample_width == 2:
-			audio_format = 'int16'
-		else:
-			raise Exception('unsupported sample width:', sample_width)
-		self._system_audio_stream = sd.RawStream(
-			samplerate=sample_rate, dtype=audio_format, channels=1,
-			blocksize=int(block_size/2),  # blocksize is in number of frames.
-		)
-		self._block_size = block_size
-		self._flush_size = flush_size
-		self._sample_rate = sample_rate
-
 	def read(self, size):
 		"""Read bytes from the stream. Used to record audio."""
-		buf, overflow = self._system_audio_stream.read(size)
-		if overflow:
-			ue.log_warning('SoundDeviceStream read overflow (' + size + ', '+ str(len(buf)) + ')')
-		return bytes(buf)
+		return self._capture.read(size)
 
 	def write(self, buf):
 		"""Write bytes to the stream. Used to play audio."""
-
+		size = len(buf)
+		if self._jitter_buffer is not None:
+			buf = self._jitter_buffer.write(buf)
+		self._queue_audio(buf)
+		return size
+
+	def _queue_audio(self, buf):
+		if not buf:
+			return
+		# Waiting here holds back the responses being played.
+		if not self._playback_queue.reserve(len(buf), self.wait_for_room):
+			return
 		#underflow = self._system_audio_stream.write(buf)
 		#if underflow:
 		#	 ue.log_warning('SoundDeviceStream write underflow (size: ' + str(len(buf)) + ')')
 		try:
 			self.ue_procedural_audio_wave.queue_audio(buf)
 		except Exception as err:
-			ue.log_error("Could not write audio to buffer! Error: "+str(err))
-		return len(buf)
+			log_helpers.log_error('Could not write audio to buffer! Error: %s', err)
+			return
+		# The sound wave plays queued audio back to back.
+		if self._first_queued_at is None:
+			self._first_queued_at = time.monotonic()
+		self._playback_queue.queued(len(buf))
 
-	def flush(self):
-		if self._flush_size > 0:
-			self._system_audio_stream.write(b'\x00' * self._flush_size)
+	def _flush_jitter_buffer(self):
+		if self._jitter_buffer is not None:
+			self._queue_audio(self._jitter_buffer.flush())
+
+	def drain(self, interrupt=None, wait=True):
+		"""Wait until the queued audio has played; returns the seconds waited.
+
+		Args:
+		  interrupt: optional threading.Event that cuts the wait short.
+		  wait: False only queues the audio the jitter buffer holds back,
+		    for callers that wait until played_until themselves.
+		"""
+		self._flush_jitter_buffer()
+		if not wait:
+			return 0.0
+		remaining = self._playback_queue.played_until - time.monotonic()
+		if remaining <= 0:
+			return 0.0
+		if interrupt is None:
+			time.sleep(remaining)
+			return remaining
+		started = time.monotonic()
+		interrupt.wait(remaining)
+		return time.monotonic() - started
+
+	def cancel_playback(self, drop=True):
+		"""Drops the audio still waiting to be played.
+
+		Writes waiting for room in the queue give up. With drop False,
+		the audio already queued to the sound wave plays out.
+		"""
+		if self._jitter_buffer is not None:
+			self._jitter_buffer.flush()
+		if drop:
+			# Plugin builds without reset_audio() cannot empty the sound
+			# wave; what it has queued then plays out.
+			reset_audio = getattr(self.ue_procedural_audio_wave, 'reset_audio', None)
+			if reset_audio is not None:
+				reset_audio()
+		self._playback_queue.cancel(drop)
 
 	def start(self):
 		"""Start the underlying stream."""
-		if not self._system_audio_stream.active:
-			self._system_audio_stream.start()
+		self._first_queued_at = None
+		self._capture.start()
+
+	def pause(self):
+		"""Stop buffering recorded audio, keeping the device open."""
+		self._capture.pause()
 
 	def stop(self):
 		"""Stop the underlying stream."""
-		if self._system_audio_stream.active:
-			self.flush()
-			self._system_audio_stream.stop()
+		self._flush_jitter_buffer()
+		self._capture.stop()
 
 	def close(self):
 		"""Close the underlying stream and audio interface."""
-		if self._system_audio_stream:
-			self.stop()
-			self._system_audio_stream.close()
-			self._system_audio_stream = None
+		if self._capture:
+			self._capture.close()
+			self._capture = None
+
+	@property
+	def capture(self):
+		"""The CallbackCapture recording for this stream."""
+		return self._capture
+
+	def reset_capture_stats(self):
+		"""Returns the capture counters and resets them."""
+		return self._capture.reset_stats()
+
+	def reset_playout_stats(self):
+		"""Returns the jitter buffer counters and resets them, or None."""
+		if self._jitter_buffer is None:
+			return None
+		return self._jitter_buffer.reset_stats()
+
+	def reset_queue_stats(self):
+		"""Returns the playback queue counters and resets them."""
+		return self._playback_queue.reset_stats()
+
+	@property
+	def playback_queue(self):
+		"""The PlaybackQueue keeping track of the audio queued to the sound wave."""
+		return self._playback_queue
+
+	@property
+	def first_queued_at(self):
+		"""time.monotonic() the first audio since start() was queued, or None."""
+		return self._first_queued_at
+
+	@property
+	def played_until(self):
+		"""time.monotonic() the audio queued so far will have played by."""
+		return self._playback_queue.played_until
 
 	@property
 	def sample_rate(self):
 		return self._sample_rate
 
+	@property
+	def playback_rate(self):
+		"""Sample rate of the audio passed to write()."""
+		return self._playback_rate
+
 
 class SoundDeviceStream(object):
 	"""Audio stream based on an underlying sound device.
@@ -246,13 +370,19 @@ class SoundDeviceStream(object):
 	  sample_width: size of a single sample in bytes.
 	  block_size: size in bytes of each read and write operation.
 	  flush_size: size in bytes of silence data written during flush operation.
+	  ring_size: size in bytes of the buffer between capture and read().
 	"""
-	def __init__(self, sample_rate, sample_width, block_size, flush_size):
+	def __init__(self, sample_rate, sample_width, block_size, flush_size,
+				 ring_size=None):
 		if sample_width == 2:
 			audio_format = 'int16'
 		else:
 			raise Exception('unsupported sample width:', sample_width)
-		self._audio_stream = sd.RawStream(
+		# Recording goes through a callback-driven ring buffer, playback
+		# through a blocking output stream.
+		self._capture = CallbackCapture(sample_rate, sample_width, block_size,
+									ring_size or 8 * block_size)
+		self._audio_stream = sd.RawOutputStream(
 			samplerate=sample_rate, dtype=audio_format, channels=1,
 			blocksize=int(block_size/2),  # blocksize is in number of frames.
 		)
@@ -262,31 +392,60 @@ class SoundDeviceStream(object):
 
 	def read(self, size):
 		"""Read bytes from the stream."""
-		buf, overflow = self._audio_stream.read(size)
-		if overflow:
-			logging.warning('SoundDeviceStream read overflow (%d, %d)',
-							size, len(buf))
-		return bytes(buf)
+		return self._capture.read(size)
 
 	def write(self, buf):
 		"""Write bytes to the stream."""
 		underflow = self._audio_stream.write(buf)
 		if underflow:
-			logging.warning('SoundDeviceStream write underflow (size: %d)',
-							len(buf))
+			log_helpers.log_warning(
+				'SoundDeviceStream write underflow (size: %d)', len(buf))
 		return len(buf)
 
 	def flush(self):
 		if self._flush_size > 0:
 			self._audio_stream.write(b'\x00' * self._flush_size)
 
+	def drain(self, interrupt=None, wait=True):
+		"""Wait until the written audio has played; returns the seconds waited.
+
+		Writes block, so only the device's output latency is left.
+
+		Args:
+		  interrupt: optional threading.Event that cuts the wait short.
+		  wait: False returns at once, as nothing is held back.
+		"""
+		if not wait or not self._audio_stream.active:
+			return 0.0
+		if interrupt is None:
+			time.sleep(self._audio_stream.latency)
+			return self._audio_stream.latency
+		started = time.monotonic()
+		interrupt.wait(self._audio_stream.latency)
+		return time.monotonic() - started
+
+	def cancel_playback(self, drop=True):
+		"""Drops the audio still waiting to be played.
+
+		With drop False, the device's buffer plays out.
+		"""
+		if drop and self._audio_stream.active:
+			self._audio_stream.abort()
+			self._audio_stream.start()
+
 	def start(self):
 		"""Start the underlying stream."""
+		self._capture.start()
 		if not self._audio_stream.active:
 			self._audio_stream.start()
 
+	def pause(self):
+		"""Stop buffering recorded audio, keeping playback running."""
+		self._capture.pause()
+
 	def stop(self):
 		"""Stop the underlying stream."""
+		self._capture.stop()
 		if self._audio_stream.active:
 			self.flush()
 			self._audio_stream.stop()
@@ -295,9 +454,19 @@ class SoundDeviceStream(object):
 		"""Close the underlying stream and audio interface."""
 		if self._audio_stream:
 			self.stop()
+			self._capture.close()
 			self._audio_stream.close()
 			self._audio_stream = None
 
+	@property
+	def capture(self):
+		"""The CallbackCapture recording for this stream."""
+		return self._capture
+
+	def reset_capture_stats(self):
+		"""Returns the capture counters and resets them."""
+		return self._capture.reset_stats()
+
 	@property
 	def sample_rate(self):
 		return self._sample_rate
@@ -320,6 +489,14 @@ class ConversationStream(object):
 	  - write()
 	  - stop_playback()
 
+	  For a follow-on turn, stop_playback(keep_open=True) and drain()
+	  leave the devices running for the next start_recording().
+
+	With a barge-in detector the stream is full-duplex: the source keeps
+	listening during playback, and once the user talks over the answer
+	the rest of it is dropped, on_barge_in is called and the next
+	recording starts with what the user has said so far.
+
 	  When conversations are finished:
 	  - close()
 
@@ -328,36 +505,232 @@ class ConversationStream(object):
 	  sink: file-like stream object to write output audio bytes to.
 	  iter_size: read size in bytes for each iteration.
 	  sample_width: size of a single sample in bytes.
+	  vad: optional VoiceActivityGate that trims leading silence and
+	    stops recording once the user has stopped talking.
+	  encoder: optional encoder, such as FlacEncoder, applied to the
+	    recorded audio when iterating over the stream.
+	  decoder: optional decoder, such as OpusInOggDecoder, applied to the
+	    response audio passed to write().
+	  barge_in: optional BargeInDetector; the source must capture in the
+	    background, like UnrealSoundStream and SoundDeviceStream.
+	  sample_rate: sample rate of the audio read from and written to the
+	    stream, as sent to and received from the Assistant. Defaults to
+	    the source's. Sources and sinks running at other rates, told by
+	    their sample_rate, or playback_rate for sinks that have one, are
+	    resampled to and from it.
+	  resampler_taps: taps_per_phase of the Resamplers.
 	"""
-	def __init__(self, source, sink, iter_size, sample_width):
+	def __init__(self, source, sink, iter_size, sample_width, vad=None,
+				 encoder=None, decoder=None, barge_in=None, sample_rate=None,
+				 resampler_taps=16):
 		self._source = source
 		self._sink = sink
 		self._iter_size = iter_size
 		self._sample_width = sample_width
+		self._sample_rate = sample_rate or source.sample_rate
+		self._capture_resampler = None
+		self._playback_resampler = None
+		capture_rate = source.sample_rate
+		if capture_rate != self._sample_rate:
+			self._capture_resampler = Resampler(
+				capture_rate, self._sample_rate, sample_width, resampler_taps)
+		playback_rate = (getattr(sink, 'playback_rate', None) or
+						 getattr(sink, 'sample_rate', None) or self._sample_rate)
+		if playback_rate != self._sample_rate:
+			self._playback_resampler = Resampler(
+				self._sample_rate, playback_rate, sample_width, resampler_taps)
 		self._stop_recording = threading.Event()
 		self._start_playback = threading.Event()
 		self._volume_percentage = 50
+		self._playback_buffer = AudioChunkBuffer(sample_width, iter_size)
+		self._vad = vad
+		self._encoder = encoder
+		self._decoder = decoder
+		self._drained_at = None
+		self._turn_gap = None
+		self._first_chunk_at = None
+		self._barge_in = barge_in
+		self._barged_in = threading.Event()
+		# Held by the monitor and while recording takes over from it.
+		self._monitor_lock = threading.Lock()
+		# Timing of the barge-ins not yet collected, oldest first.
+		self._barge_in_times = []
+		# Clear while a barge-in is being acted on.
+		self._barge_in_handled = threading.Event()
+		self._barge_in_handled.set()
+		self._request_audio = b''
+		# Called on its own thread when the user barges in.
+		self.on_barge_in = None
+		if barge_in is not None:
+			source.capture.add_monitor(self._monitor)
 
 	def start_recording(self):
 		"""Start recording from the audio source."""
 		self._stop_recording.clear()
-		self._source.start()
+		self._first_chunk_at = None
+		if self._vad is not None:
+			self._vad.reset()
+		if self._capture_resampler is not None:
+			self._capture_resampler.reset()
+		# The answer must be dropped and its call cancelled before the
+		# next one starts.
+		self._barge_in_handled.wait()
+		with self._monitor_lock:
+			if self._barged_in.is_set():
+				# Start with what the user said over the answer.
+				self._request_audio = self._barge_in.take_pre_roll()
+				self._barged_in.clear()
+			self._source.start()
 		self._sink.start()
+		# Timed here, as the VAD holds back the silence before the user
+		# speaks, which would add their reaction time.
+		self._turn_gap = None
+		if self._drained_at is not None:
+			self._turn_gap = time.monotonic() - self._drained_at
+			self._drained_at = None
 
 	def stop_recording(self):
 		"""Stop recording from the audio source."""
 		self._stop_recording.set()
+		# Sources capturing in the background stop buffering audio.
+		pause = getattr(self._source, 'pause', None)
+		if pause is not None:
+			pause()
 
 	def start_playback(self):
 		"""Start playback to the audio sink."""
+		if self._decoder is not None:
+			# Every response is a new compressed stream.
+			self._decoder.reset()
+		if self._playback_resampler is not None:
+			self._playback_resampler.reset()
+		if self._barge_in is not None:
+			with self._monitor_lock:
+				self._barge_in.reset()
 		self._start_playback.set()
 
-	def stop_playback(self):
-		"""Stop playback from the audio sink."""
+	def _monitor(self, block):
+		"""Runs on the sound device thread for every recorded block."""
+		with self._monitor_lock:
+			if self._barged_in.is_set():
+				# Kept for the request that interrupts the answer.
+				self._barge_in.process(block)
+				return
+			if not self._start_playback.is_set():
+				return
+			if not self._barge_in.process(block):
+				return
+			self._barge_in_handled.clear()
+			self._barged_in.set()
+		threading.Thread(target=self._handle_barge_in, name='BargeIn',
+						 daemon=True).start()
+
+	def _handle_barge_in(self):
+		times = {
+			'speech_start': self._barge_in.speech_start,
+			'detected': self._barge_in.detected_at,
+			'playback_stopped': None,
+			'call_cancelled': None,
+			'request_sent': None,
+		}
+		self._barge_in_times.append(times)
+		try:
+			self.cancel_playback()
+			times['playback_stopped'] = time.monotonic()
+			if self.on_barge_in is not None:
+				self.on_barge_in()
+			times['call_cancelled'] = time.monotonic()
+		finally:
+			self._barge_in_handled.set()
+
+	@property
+	def full_duplex(self):
+		"""True if the stream listens for the user during playback."""
+		return self._barge_in is not None
+
+	@property
+	def barged_in(self):
+		"""True from a barge-in until the next start_recording()."""
+		return self._barged_in.is_set()
+
+	def reset_barge_in_metrics(self):
+		"""Returns the timing of the barge-ins since the last call.
+
+		A barge-in is only included once the request that interrupted
+		the answer has sent its first chunk. Each is a dict of
+		milliseconds from the start of the user's speech to: its
+		detection (detected_ms), the answer being dropped
+		(playback_stopped_ms), the Converse call being cancelled
+		(call_cancelled_ms) and the first chunk of the new request
+		(request_ms).
+		"""
+		metrics = []
+		while (self._barge_in_times and
+			   None not in self._barge_in_times[0].values()):
+			times = self._barge_in_times.pop(0)
+			start = times['speech_start']
+			metrics.append({
+				'detected_ms': 1000 * (times['detected'] - start),
+				'playback_stopped_ms': 1000 * (times['playback_stopped'] - start),
+				'call_cancelled_ms': 1000 * (times['call_cancelled'] - start),
+				'request_ms': 1000 * (times['request_sent'] - start),
+			})
+		return metrics
+
+	def cancel_playback(self, drop=True):
+		"""Stops the answer being played, e.g. when the user interrupts it.
+
+		Writes waiting for the sink to make room give up. With drop False,
+		the audio the sink has already queued plays out. Sinks that do
+		not queue audio ahead of playback have nothing to cancel.
+		"""
+		cancel_playback = getattr(self._sink, 'cancel_playback', None)
+		if cancel_playback is not None:
+			cancel_playback(drop)
+
+	def stop_playback(self, keep_open=False):
+		"""Stop playback from the audio sink.
+
+		With keep_open, the source and sink keep running so a follow-on
+		turn can record without restarting the devices.
+		"""
+		tail = self._playback_buffer.flush(self._volume_scale())
+		if self._playback_resampler is not None:
+			tail = self._playback_resampler.process(tail)
+			tail += self._playback_resampler.flush()
+		if len(tail) and not self._barged_in.is_set():
+			self._sink.write(tail)
 		self._start_playback.clear()
+		if keep_open:
+			return
 		self._source.stop()
 		self._sink.stop()
 
+	def drain(self, wait=True):
+		"""Blocks until the audio written so far has been played.
+
+		In full-duplex mode a barge-in cuts the wait short.
+
+		Args:
+		  wait: False only hands the sink the audio it holds back and
+		    returns at once; the caller waits until played_until itself,
+		    e.g. on an event loop.
+		Returns: the seconds spent waiting.
+		"""
+		drain = getattr(self._sink, 'drain', None)
+		if drain is None:
+			waited = 0.0
+		elif not wait:
+			waited = drain(wait=False)
+		elif self._barge_in is not None:
+			waited = drain(self._barged_in)
+		else:
+			waited = drain()
+		self._drained_at = time.monotonic()
+		if not wait:
+			self._drained_at = max(self._drained_at, self.played_until or 0)
+		return waited
+
 	@property
 	def volume_percentage(self):
 		"""The current volume setting as an integer percentage (1-100)."""
@@ -368,24 +741,204 @@ class ConversationStream(object):
 		logging.info('Volume set to %s%%', new_volume_percentage)
 		self._volume_percentage = new_volume_percentage
 
+	def _volume_scale(self):
+		return gain.volume_scale(self._volume_percentage)
+
+	def reset_playback_stats(self):
+		"""Returns the playback buffer counters and resets them.
+
+		The counters include the number of chunks written, the bytes
+		copied and the buffers allocated since the last call.
+		"""
+		return self._playback_buffer.reset_stats()
+
+	def reset_capture_stats(self):
+		"""Returns the source's capture counters and resets them.
+
+		Returns None if the source does not capture in the background.
+		"""
+		reset = getattr(self._source, 'reset_capture_stats', None)
+		return reset() if reset is not None else None
+
+	def reset_playout_stats(self):
+		"""Returns the sink's jitter buffer counters and resets them.
+
+		Returns None if the sink plays without a jitter buffer.
+		"""
+		reset = getattr(self._sink, 'reset_playout_stats', None)
+		return reset() if reset is not None else None
+
+	def reset_resampler_stats(self):
+		"""Returns the counters of the capture and playback Resamplers and
+		resets them.
+
+		Returns a dict of 'capture' and 'playback' Resampler.stats, each
+		None if that side runs at the stream's sample rate.
+		"""
+		return dict(
+			(name, resampler.reset_stats() if resampler is not None else None)
+			for name, resampler in (('capture', self._capture_resampler),
+									('playback', self._playback_resampler)))
+
+	def reset_queue_stats(self):
+		"""Returns the sink's playback queue counters and resets them.
+
+		Returns None if the sink does not queue audio ahead of playback.
+		"""
+		reset = getattr(self._sink, 'reset_queue_stats', None)
+		return reset() if reset is not None else None
+
 	def read(self, size):
 		"""Read bytes from the source (if currently recording).
 
 		Will returns an empty byte string, if stop_recording() was called.
 		"""
+		return self._read(size, True)
+
+	def read_nowait(self, size):
+		"""Like read(), but returns None instead of waiting for the source.
+
+		Only sources capturing in the background can tell whether a read
+		would wait; others are read as usual.
+		"""
+		return self._read(size, False)
+
+	def _read(self, size, wait):
 		if self._stop_recording.is_set():
 			return b''
+		if self._vad is None:
+			return self._read_source(size, wait)
+		# Leading silence is dropped, so keep reading until there is
+		# audio to send or the utterance is over.
+		while not self._stop_recording.is_set():
+			buf = self._read_source(size, wait)
+			if buf is None or not buf:
+				return buf
+			buf = self._vad.process(buf)
+			if self._vad.ended:
+				log_helpers.log('End of audio request detected locally')
+				self.stop_recording()
+			if buf:
+				return buf
+		return b''
+
+	def _read_source(self, size, wait=True):
+		resampler = self._capture_resampler
+		if resampler is None:
+			return self._read_captured(size, wait)
+		size = int(size * resampler.in_rate / resampler.out_rate)
+		size = max(self._sample_width, size - size % self._sample_width)
+		while True:
+			buf = self._read_captured(size, wait)
+			if buf is None or not buf:
+				return buf
+			buf = resampler.process(buf)
+			if buf:
+				return buf
+
+	def _read_captured(self, size, wait=True):
+		if self._request_audio:
+			buf = self._request_audio[:size]
+			self._request_audio = self._request_audio[size:]
+			return buf
+		if not wait:
+			capture = self.capture
+			if capture is not None and not capture.ready(size):
+				return None
 		return self._source.read(size)
 
 	def write(self, buf):
 		"""Write bytes to the sink (if currently playing).
 
-		Will block until start_playback() is called.
+		Will block until start_playback() is called. The data is copied
+		once into a reusable buffer; a trailing partial sample is held
+		back until the next write() or stop_playback(). After a barge-in
+		the rest of the answer is dropped.
 		"""
 		self._start_playback.wait()
-		buf = align_buf(buf, self._sample_width)
-		buf = normalize_audio_buffer(buf, self.volume_percentage)
-		return self._sink.write(buf)
+		size = len(buf)
+		if self._barged_in.is_set():
+			return size
+		if self._decoder is not None:
+			buf = self._decoder.decode(buf)
+		scale = self._volume_scale()
+		if self._barge_in is not None and self._barge_in.ducked:
+			# The user may be talking; make room for them.
+			scale *= self._barge_in.duck_gain
+		aligned = self._playback_buffer.process(buf, scale)
+		if self._playback_resampler is not None:
+			aligned = self._playback_resampler.process(aligned)
+		if len(aligned):
+			if self._barge_in is not None:
+				self._barge_in.played(aligned)
+			self._sink.write(aligned)
+		return size
+
+	def reset(self):
+		"""Resets the conversation state so the stream can be reused."""
+		self.stop_recording()
+		self._start_playback.clear()
+		self._playback_buffer.reset()
+		self._playback_buffer.reset_stats()
+		self._volume_percentage = 50
+		self._drained_at = None
+		self._turn_gap = None
+		self._first_chunk_at = None
+		self._barged_in.clear()
+		self._barge_in_times = []
+		self._request_audio = b''
+		for resampler in (self._capture_resampler, self._playback_resampler):
+			if resampler is not None:
+				resampler.reset()
+				resampler.reset_stats()
+
+	@property
+	def turn_gap(self):
+		"""Seconds from the last drain() to the recording started after it.
+
+		None until start_recording() follows a drain().
+		"""
+		return self._turn_gap
+
+	@property
+	def first_chunk_at(self):
+		"""time.monotonic() the recording yielded its first chunk, or None."""
+		return self._first_chunk_at
+
+	@property
+	def first_queued_at(self):
+		"""time.monotonic() the sink queued its first audio this turn.
+
+		None until it does, or if the sink does not tell.
+		"""
+		return getattr(self._sink, 'first_queued_at', None)
+
+	@property
+	def played_until(self):
+		"""time.monotonic() the audio written will have played by.
+
+		None if the sink does not tell.
+		"""
+		return getattr(self._sink, 'played_until', None)
+
+	@property
+	def utterance_metrics(self):
+		"""Timing of the last utterance, or None without a VAD.
+
+		See VoiceActivityGate.metrics.
+		"""
+		return self._vad.metrics if self._vad is not None else None
+
+	@property
+	def sink(self):
+		"""The stream that played audio is written to."""
+		return self._sink
+
+	@property
+	def capture(self):
+		"""The source's CallbackCapture, or None if it does not capture in
+		the background."""
+		return getattr(self._source, 'capture', None)
 
 	def close(self):
 		"""Close source and sink."""
@@ -393,9 +946,79 @@ class ConversationStream(object):
 		self._sink.close()
 
 	def __iter__(self):
-		"""Returns a generator reading data from the stream."""
-		return iter(lambda: self.read(self._iter_size), b'')
+		"""Returns a generator reading data from the stream.
+
+		With an encoder the generator yields encoded chunks, starting
+		with the stream header and ending with the flushed encoder state.
+		"""
+		return self._chunks(True)
+
+	def iter_nowait(self):
+		"""Returns a generator like iter(), that yields None instead of
+		waiting for the source.
+
+		A coroutine can then wait for the capture's waker and go on.
+		"""
+		return self._chunks(False)
+
+	def _chunks(self, wait):
+		chunks = self._read_chunks(wait)
+		if self._encoder is not None:
+			chunks = self._encode(chunks)
+		return self._time_first_chunk(chunks)
+
+	def _read_chunks(self, wait):
+		while True:
+			buf = self._read(self._iter_size, wait)
+			if buf is not None and not len(buf):
+				return
+			yield buf
+
+	def _time_first_chunk(self, chunks):
+		for chunk in chunks:
+			if chunk is None:
+				yield chunk
+				continue
+			if self._first_chunk_at is None:
+				self._first_chunk_at = time.monotonic()
+			if (self._barge_in_times and
+					self._barge_in_times[-1]['request_sent'] is None):
+				self._barge_in_times[-1]['request_sent'] = time.monotonic()
+			yield chunk
+
+	def _encode(self, chunks):
+		self._encoder.reset()
+		for chunk in chunks:
+			if chunk is None:
+				yield chunk
+				continue
+			data = self._encoder.encode(chunk)
+			if data:
+				yield data
+		data = self._encoder.flush()
+		if data:
+			yield data
+
+	@property
+	def encoding(self):
+		"""AudioInConfig encoding of the chunks returned by iteration."""
+		if self._encoder is None:
+			return 'LINEAR16'
+		return self._encoder.encoding
+
+	@property
+	def output_encoding(self):
+		"""AudioOutConfig encoding expected by write()."""
+		if self._decoder is None:
+			return 'LINEAR16'
+		return self._decoder.encoding
+
+	@property
+	def decoder_stats(self):
+		"""Counters of the current response's decoder, or None."""
+		return self._decoder.stats if self._decoder is not None else None
 
 	@property
 	def sample_rate(self):
-		return self._source._sample_rate
+		"""Sample rate of the audio sent to and received from the Assistant."""
+		return self._sample_rate
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Barge-in detection while a response is playing.
+
+In full-duplex mode the microphone keeps listening while the Assistant
+answers, so it picks up the answer as well as the user. A speech frame
+therefore has to clear both the usual energy threshold and the level
+the answer is expected to leak back in at, estimated from the audio
+written for playback and held for a while to cover the playback delay.
+The first loud frame ducks the answer so the user can be heard; a run
+of speech frames confirms the barge-in, and the audio recorded since
+shortly before it is kept for the request that interrupts the answer.
+"""
+
+import collections
+import time
+
+from . import gain
+from .vad import frame_features
+
+
+class BargeInDetector(object):
+	"""Spots the user talking over a response, with echo suppression.
+
+	process() is fed the blocks recorded during playback and played() the
+	audio written for playback.
+
+	Args:
+	  sample_rate: sample rate in hertz.
+	  sample_width: size of a single sample in bytes.
+	  frame_ms: analysis frame length in milliseconds.
+	  energy_threshold: minimum RMS energy of a speech frame.
+	  echo_return: expected ratio of the echo's RMS energy to that of the
+	    audio played; 0 turns echo suppression off.
+	  echo_margin: how far above the expected echo a speech frame must be.
+	  echo_hold_ms: how long the loudest played audio is assumed to echo.
+	  max_crossing_rate: maximum zero-crossing rate of a speech frame.
+	  min_speech_ms: speech needed to barge in.
+	  duck_gain: gain applied to the response while the user may be
+	    talking, between 0 and 1.
+	  pre_roll_ms: recorded audio kept from before the barge-in.
+	  playback_rate: sample rate of the audio passed to played(), if it
+	    differs from that of the recorded blocks.
+	"""
+	def __init__(self, sample_rate, sample_width, frame_ms=20,
+				 energy_threshold=300, echo_return=0.3, echo_margin=2.0,
+				 echo_hold_ms=300, max_crossing_rate=0.5, min_speech_ms=120,
+				 duck_gain=0.3, pre_roll_ms=500, playback_rate=None):
+		gain.check_sample_width(sample_width)
+		if sample_width == 3:
+			raise Exception('unsupported sample width:', sample_width)
+		self._sample_width = sample_width
+		self._frame_samples = int(sample_rate * frame_ms / 1000)
+		self._frame_bytes = self._frame_samples * sample_width
+		self._frame_time = frame_ms / 1000.0
+		self._bytes_per_second = float(sample_rate * sample_width)
+		playback_rate = playback_rate or sample_rate
+		self._played_frame_bytes = (int(playback_rate * frame_ms / 1000) *
+									sample_width)
+		self._played_bytes_per_second = float(playback_rate * sample_width)
+		self._energy_threshold = energy_threshold
+		self._echo_factor = echo_return * echo_margin
+		self._echo_hold = echo_hold_ms / 1000.0
+		self._max_crossing_rate = max_crossing_rate
+		self._min_speech_frames = max(1, int(min_speech_ms / frame_ms))
+		self._duck_gain = duck_gain
+		self._pre_roll_bytes = int(pre_roll_ms * self._bytes_per_second / 1000)
+		self._pre_roll = collections.deque()
+		self.reset()
+
+	def reset(self):
+		"""Prepares the detector for a new response."""
+		self._echo_level = 0.0
+		self._echo_until = 0.0
+		self._playing_until = 0.0
+		self._speech_frames = 0
+		self._quiet_frames = 0
+		self._speech_start = None
+		self._ducked = False
+		self._triggered = False
+		self._pre_roll.clear()
+		self._pre_roll_size = 0
+		self.speech_start = None
+		self.detected_at = None
+
+	def played(self, buf):
+		"""Notes audio written for playback as the echo reference."""
+		usable = len(buf) - len(buf) % self._played_frame_bytes
+		if not usable:
+			return
+		energies, _ = frame_features(
+			memoryview(buf)[:usable], self._sample_width,
+			self._played_frame_bytes // self._sample_width)
+		level = float(max(energies))
+		now = time.monotonic()
+		if now > self._echo_until:
+			self._echo_level = 0.0
+		# Written audio is played back to back after what is queued, so
+		# hold the peak for as long as it may be playing and echoing.
+		self._echo_level = max(self._echo_level, level)
+		self._playing_until = (max(self._playing_until, now) +
+							   len(buf) / self._played_bytes_per_second)
+		self._echo_until = self._playing_until + self._echo_hold
+
+	def process(self, block):
+		"""Analyses a recorded CaptureBlock.
+
+		Returns: True once, when the user has barged in.
+		"""
+		if self._triggered:
+			# Everything from here on belongs to the interrupting request.
+			self._pre_roll.append(block.data)
+			return False
+		self._keep(block.data)
+		usable = len(block.data) - len(block.data) % self._frame_bytes
+		if not usable:
+			return False
+		energies, crossing_rates = frame_features(
+			memoryview(block.data)[:usable], self._sample_width,
+			self._frame_samples)
+		threshold = self._energy_threshold
+		if self._echo_factor and block.timestamp <= self._echo_until:
+			threshold = max(threshold, self._echo_factor * self._echo_level)
+		count = len(energies)
+		for idx in range(count):
+			if (energies[idx] >= threshold and
+					crossing_rates[idx] <= self._max_crossing_rate):
+				if self._speech_frames == 0:
+					# Start of the frame, from the time of the block's end.
+					self._speech_start = (block.timestamp -
+										  (count - idx) * self._frame_time)
+				self._speech_frames += 1
+				self._quiet_frames = 0
+				self._ducked = True
+				if self._speech_frames >= self._min_speech_frames:
+					self._triggered = True
+					self.speech_start = self._speech_start
+					self.detected_at = time.monotonic()
+					return True
+			else:
+				self._quiet_frames += 1
+				if self._quiet_frames >= 2:
+					# A short noise, not speech.
+					self._speech_frames = 0
+					self._ducked = False
+		return False
+
+	def _keep(self, data):
+		self._pre_roll.append(data)
+		self._pre_roll_size += len(data)
+		while (len(self._pre_roll) > 1 and
+			   self._pre_roll_size - len(self._pre_roll[0]) >=
+			   self._pre_roll_bytes):
+			self._pre_roll_size -= len(self._pre_roll.popleft())
+
+	def take_pre_roll(self):
+		"""Returns the audio recorded up to the barge-in, and forgets it."""
+		data = b''.join(self._pre_roll)
+		self._pre_roll.clear()
+		self._pre_roll_size = 0
+		return data
+
+	@property
+	def ducked(self):
+		"""True while the user may be talking."""
+		return self._ducked
+
+	@property
+	def duck_gain(self):
+		"""Gain to apply to the response while ducked."""
+		return self._duck_gain
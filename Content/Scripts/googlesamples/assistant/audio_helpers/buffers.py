@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Preallocated buffers used on the audio hot paths."""
+
+import threading
+import time
+
+from . import gain
+
+
+class AudioChunkBuffer(object):
+	"""Aligns and normalizes response audio chunks with at most one copy.
+
+	Each chunk is copied once into a preallocated bytearray, the gain is
+	applied in place and a memoryview over the sample-aligned part is
+	handed back. A trailing partial sample is carried over to the next
+	chunk instead of being padded with silence.
+
+	The returned view is only valid until the next call to process() or
+	flush(), so sinks must consume it synchronously.
+
+	Args:
+	  sample_width: size of a single sample in bytes.
+	  initial_size: initial capacity of the buffer in bytes.
+	"""
+	def __init__(self, sample_width, initial_size=0):
+		gain.check_sample_width(sample_width)
+		self._sample_width = sample_width
+		self._buf = bytearray(initial_size + sample_width)
+		self._view = memoryview(self._buf)
+		self._scratch = gain.GainScratch() if gain.np is not None else None
+		# Offset and length of the partial sample left by the last chunk.
+		self._carry_offset = 0
+		self._carry = 0
+		self._chunks = 0
+		self._copied = 0
+		self._allocations = 0
+
+	def _reserve(self, size):
+		"""Grows the buffer to size bytes, keeping the carried bytes."""
+		if size <= len(self._buf):
+			return
+		buf = bytearray(size)
+		buf[:self._carry] = self._view[:self._carry]
+		self._buf = buf
+		self._view = memoryview(buf)
+		self._allocations += 1
+
+	def _restore_carry(self):
+		"""Moves the carried partial sample to the front of the buffer."""
+		if self._carry and self._carry_offset:
+			end = self._carry_offset + self._carry
+			self._view[:self._carry] = self._view[self._carry_offset:end]
+		self._carry_offset = 0
+
+	def process(self, data, scale=1.0):
+		"""Appends a chunk and returns a view over the aligned samples.
+
+		Args:
+		  data: bytes-like object with the next chunk of audio.
+		  scale: amplitude scale factor applied to the returned samples.
+		"""
+		self._restore_carry()
+		size = self._carry + len(data)
+		self._reserve(size)
+		self._view[self._carry:size] = data
+		self._chunks += 1
+		self._copied += len(data)
+
+		aligned = size - size % self._sample_width
+		self._carry = size - aligned
+		self._carry_offset = aligned
+		out = self._view[:aligned]
+		self._allocations += gain.apply_gain_inplace(
+			out, scale, self._sample_width, self._scratch)
+		return out
+
+	def flush(self, scale=1.0):
+		"""Returns the carried partial sample padded with silence.
+
+		Returns an empty view if there is nothing left to flush.
+		"""
+		self._restore_carry()
+		carry = self._carry
+		self._carry = 0
+		if not carry:
+			return self._view[:0]
+		for idx in range(carry, self._sample_width):
+			self._buf[idx] = 0
+		out = self._view[:self._sample_width]
+		gain.apply_gain_inplace(out, scale, self._sample_width)
+		return out
+
+	def reset(self):
+		"""Drops any carried partial sample."""
+		self._carry = 0
+		self._carry_offset = 0
+
+	def reset_stats(self):
+		"""Resets the counters and returns their previous values."""
+		stats = self.stats
+		self._chunks = 0
+		self._copied = 0
+		self._allocations = 0
+		return stats
+
+	@property
+	def stats(self):
+		"""Counters since the last reset_stats() call."""
+		return {
+			'chunks': self._chunks,
+			'bytes_copied': self._copied,
+			'allocations': self._allocations,
+		}
+
+
+class RingBuffer(object):
+	"""Single-producer/single-consumer byte ring of fixed capacity.
+
+	One thread (usually a sound device callback) calls write() while
+	another calls read(). Each side only advances its own position, so
+	neither takes a lock: the GIL makes the position updates atomic, and
+	a position is only moved once the bytes behind it have been copied.
+
+	The producer never blocks. When the ring is full the data that does
+	not fit is dropped and counted as an overflow. The consumer blocks
+	until enough data has arrived and counts every such wait as an
+	underflow.
+
+	Args:
+	  capacity: size of the ring in bytes.
+	"""
+	def __init__(self, capacity):
+		if capacity <= 0:
+			raise Exception('unsupported ring capacity:', capacity)
+		self._capacity = capacity
+		self._buf = bytearray(capacity)
+		self._view = memoryview(self._buf)
+		# Total bytes written and read so far.
+		self._write_pos = 0
+		self._read_pos = 0
+		self._data_ready = threading.Event()
+		self._closed = False
+		self._overflows = 0
+		self._overflow_bytes = 0
+		self._underflows = 0
+		self._high_water = 0
+
+	@property
+	def capacity(self):
+		return self._capacity
+
+	@property
+	def available(self):
+		"""Number of bytes ready to be read."""
+		return self._write_pos - self._read_pos
+
+	@property
+	def closed(self):
+		"""True once close() was called, until the next clear()."""
+		return self._closed
+
+	def write(self, data):
+		"""Copies data into the ring. Only called by the producer.
+
+		Args:
+		  data: bytes-like object to append.
+		Returns:
+		  The number of bytes stored, less than len(data) on overflow.
+		"""
+		data = memoryview(data).cast('B')
+		size = len(data)
+		free = self._capacity - (self._write_pos - self._read_pos)
+		if size > free:
+			self._overflows += 1
+			self._overflow_bytes += size - free
+			size = free
+		start = self._write_pos % self._capacity
+		first = min(size, self._capacity - start)
+		self._view[start:start + first] = data[:first]
+		self._view[:size - first] = data[first:size]
+		self._write_pos += size
+		self._high_water = max(self._high_water,
+							   self._write_pos - self._read_pos)
+		self._data_ready.set()
+		return size
+
+	def read(self, size, timeout=None):
+		"""Removes size bytes from the ring. Only called by the consumer.
+
+		Blocks until size bytes are available. Fewer bytes are returned
+		only if the ring is closed or the timeout expires first.
+
+		Args:
+		  size: number of bytes to read, at most the ring capacity.
+		  timeout: maximum time to wait in seconds, None to wait forever.
+		"""
+		if size > self._capacity:
+			raise Exception('read larger than ring capacity:', size)
+		if self._write_pos - self._read_pos < size and not self._closed:
+			self._underflows += 1
+			self._wait(size, timeout)
+		size = min(size, self._write_pos - self._read_pos)
+		start = self._read_pos % self._capacity
+		first = min(size, self._capacity - start)
+		if first == size:
+			data = bytes(self._view[start:start + size])
+		else:
+			data = b''.join((self._view[start:], self._view[:size - first]))
+		self._read_pos += size
+		return data
+
+	def _wait(self, size, timeout):
+		deadline = None if timeout is None else time.monotonic() + timeout
+		while True:
+			# Clear before checking so a concurrent write() is not missed.
+			self._data_ready.clear()
+			if self._write_pos - self._read_pos >= size or self._closed:
+				return
+			remaining = None
+			if deadline is not None:
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					return
+			self._data_ready.wait(remaining)
+
+	def close(self):
+		"""Wakes up the consumer; reads no longer wait for data."""
+		self._closed = True
+		self._data_ready.set()
+
+	def clear(self):
+		"""Drops buffered data and reopens the ring.
+
+		This only moves the read position, so it is safe to call from
+		the consumer side while the producer is running.
+		"""
+		self._closed = False
+		self._read_pos = self._write_pos
+
+	def reset_stats(self):
+		"""Resets the counters and returns their previous values."""
+		stats = self.stats
+		self._overflows = 0
+		self._overflow_bytes = 0
+		self._underflows = 0
+		self._high_water = self._write_pos - self._read_pos
+		return stats
+
+	@property
+	def stats(self):
+		"""Counters since the last reset_stats() call."""
+		return {
+			'overflows': self._overflows,
+			'overflow_bytes': self._overflow_bytes,
+			'underflows': self._underflows,
+			'high_water': self._high_water,
+		}
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Callback-driven microphone capture.
+
+The sound device runs in callback mode, so no thread blocks on
+RawStream.read(). Each callback is cut into fixed-size CaptureBlocks that
+are handed to the registered consumers with a timestamp and a sequence
+number. The read() contract of the audio streams is kept by a RingBuffer
+that the callback also fills and readers drain at their own pace. A
+reader that falls behind, for example because gRPC is applying
+back-pressure, no longer stalls the device; once the ring is full the
+dropped blocks are counted. Readers that must not block, such as
+coroutines, check ready() and are woken up by a waker instead.
+"""
+
+import collections
+import time
+
+import sounddevice as sd
+
+from .. import log_helpers
+from .buffers import RingBuffer
+
+
+CaptureBlock = collections.namedtuple(
+	'CaptureBlock', ['data', 'timestamp', 'sequence'])
+CaptureBlock.__doc__ = """A fixed-size block of recorded audio.
+
+data: bytes of block_size length.
+timestamp: time.monotonic() at which the last sample was captured.
+sequence: index of the block since the capture was started.
+"""
+
+
+class CallbackCapture(object):
+	"""Records from the default input device in callback mode.
+
+	Consumers run on the sound device thread, so they must copy or queue
+	the block and return quickly. read() is a thin adapter over a ring
+	buffer for code that pulls audio instead.
+
+	Args:
+	  sample_rate: sample rate in hertz.
+	  sample_width: size of a single sample in bytes.
+	  block_size: size in bytes of each block handed to consumers.
+	  ring_size: capacity in bytes of the ring buffer behind read(),
+	    or 0 if read() is not used.
+	"""
+	def __init__(self, sample_rate, sample_width, block_size, ring_size):
+		if sample_width == 2:
+			audio_format = 'int16'
+		else:
+			raise Exception('unsupported sample width:', sample_width)
+		if block_size % sample_width:
+			raise Exception('unsupported block size:', block_size)
+		self._block_size = block_size
+		self._bytes_per_second = float(sample_rate * sample_width)
+		self._ring = RingBuffer(ring_size) if ring_size else None
+		# Replaced rather than mutated so the callback needs no lock.
+		self._consumers = ()
+		self._monitors = ()
+		self._wakers = ()
+		# Samples of a block split across two device callbacks.
+		self._partial = bytearray(block_size)
+		self._partial_size = 0
+		self._paused = True
+		self._sequence = 0
+		self._reported_drops = 0
+		self._start_time = None
+		self._last_callback = None
+		self._last_period = 0
+		self._reset_counters()
+		self._input_stream = sd.RawInputStream(
+			samplerate=sample_rate, dtype=audio_format, channels=1,
+			blocksize=int(block_size/sample_width),  # blocksize is in frames.
+			callback=self._callback,
+		)
+
+	def _reset_counters(self):
+		self._startup_time = None
+		self._callbacks = 0
+		self._jitter_total = 0.0
+		self._jitter_max = 0.0
+		self._blocks = 0
+		self._dropped_blocks = 0
+		self._device_overflows = 0
+
+	def add_consumer(self, consumer):
+		"""Calls consumer(block) for every CaptureBlock recorded."""
+		self._consumers = self._consumers + (consumer,)
+
+	def remove_consumer(self, consumer):
+		self._consumers = tuple(c for c in self._consumers if c is not consumer)
+
+	def add_monitor(self, monitor):
+		"""Calls monitor(block) for every block, even while paused.
+
+		Monitors listen in while nothing is being recorded, for example
+		for the user talking over a response. Their blocks do not go to
+		the ring buffer or the counters.
+		"""
+		self._monitors = self._monitors + (monitor,)
+
+	def remove_monitor(self, monitor):
+		self._monitors = tuple(m for m in self._monitors if m is not monitor)
+
+	def add_waker(self, waker):
+		"""Calls waker() whenever a read() waiting for audio could go on.
+
+		That is after every block buffered and once the capture is
+		paused. Wakers run on the sound device thread, or on the thread
+		pausing the capture, and must return quickly.
+		"""
+		self._wakers = self._wakers + (waker,)
+
+	def remove_waker(self, waker):
+		self._wakers = tuple(w for w in self._wakers if w is not waker)
+
+	def _callback(self, indata, frames, time_info, status):
+		"""Runs on the sound device thread; must never block."""
+		now = time.monotonic()
+		if status.input_overflow:
+			self._device_overflows += 1
+		if self._last_callback is None:
+			if self._startup_time is None and self._start_time is not None:
+				self._startup_time = now - self._start_time
+		else:
+			# How far the callback strayed from the device's own pace.
+			jitter = abs(now - self._last_callback - self._last_period)
+			self._jitter_total += jitter
+			self._jitter_max = max(self._jitter_max, jitter)
+			self._callbacks += 1
+		self._last_callback = now
+		data = memoryview(indata).cast('B')
+		self._last_period = len(data) / self._bytes_per_second
+		if self._paused and not self._monitors:
+			return
+
+		offset = 0
+		if self._partial_size:
+			offset = min(len(data), self._block_size - self._partial_size)
+			end = self._partial_size + offset
+			self._partial[self._partial_size:end] = data[:offset]
+			self._partial_size = end
+			if end == self._block_size:
+				self._partial_size = 0
+				self._emit(memoryview(self._partial),
+						   now - (len(data) - offset) / self._bytes_per_second)
+		while len(data) - offset >= self._block_size:
+			end = offset + self._block_size
+			self._emit(data[offset:end],
+					   now - (len(data) - end) / self._bytes_per_second)
+			offset = end
+		if offset < len(data):
+			self._partial_size = len(data) - offset
+			self._partial[:self._partial_size] = data[offset:]
+
+	def _emit(self, data, timestamp):
+		block = None
+		if self._monitors or (self._consumers and not self._paused):
+			block = CaptureBlock(bytes(data), timestamp, self._sequence)
+		self._sequence += 1
+		for monitor in self._monitors:
+			monitor(block)
+		if self._paused:
+			return
+		self._blocks += 1
+		if self._ring is not None and self._ring.write(data) < len(data):
+			self._dropped_blocks += 1
+		for consumer in self._consumers:
+			consumer(block)
+		for waker in self._wakers:
+			waker()
+
+	def read(self, size):
+		"""Read bytes from the ring, waiting for the device if needed."""
+		data = self._ring.read(size)
+		if self._dropped_blocks > self._reported_drops:
+			self._reported_drops = self._dropped_blocks
+			log_helpers.log_warning(
+				'Capture ring buffer overflow (%d blocks dropped)',
+				self._dropped_blocks)
+		return data
+
+	def ready(self, size):
+		"""True if read(size) would return without waiting."""
+		return (self._ring is None or self._ring.closed or
+				self._ring.available >= size)
+
+	def start(self):
+		"""Drops stale audio and starts delivering blocks."""
+		if self._ring is not None:
+			self._ring.clear()
+		self._partial_size = 0
+		self._sequence = 0
+		self._paused = False
+		if not self._input_stream.active:
+			self._start_time = time.monotonic()
+			self._startup_time = None
+			self._last_callback = None
+			self._input_stream.start()
+
+	def pause(self):
+		"""Stops delivering blocks but keeps the device running.
+
+		Pending and future reads return whatever is left in the ring.
+		"""
+		self._paused = True
+		if self._ring is not None:
+			self._ring.close()
+		for waker in self._wakers:
+			waker()
+
+	def stop(self):
+		"""Stops the device and wakes up any pending read."""
+		self.pause()
+		if self._input_stream.active:
+			self._input_stream.stop()
+
+	def close(self):
+		"""Stops and closes the device."""
+		if self._input_stream:
+			self.stop()
+			self._input_stream.close()
+			self._input_stream = None
+
+	def reset_stats(self):
+		"""Resets the counters and returns their previous values."""
+		stats = self.stats
+		if self._ring is not None:
+			self._ring.reset_stats()
+		startup_time = self._startup_time
+		self._reset_counters()
+		# The startup time belongs to the device, not to a counting period.
+		self._startup_time = startup_time
+		self._reported_drops = 0
+		return stats
+
+	@property
+	def stats(self):
+		"""Capture counters since the last reset_stats() call.
+
+		startup_time is the time between start() and the first callback,
+		and jitter_mean/jitter_max measure how far callback intervals
+		strayed from the audio duration they delivered, in seconds.
+		"""
+		stats = self._ring.stats if self._ring is not None else {}
+		stats.update({
+			'startup_time': self._startup_time,
+			'jitter_mean': self._jitter_total / max(1, self._callbacks),
+			'jitter_max': self._jitter_max,
+			'blocks': self._blocks,
+			'dropped_blocks': self._dropped_blocks,
+			'device_overflows': self._device_overflows,
+		})
+		return stats
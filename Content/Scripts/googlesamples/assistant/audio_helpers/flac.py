@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Streaming FLAC encoder for 16-bit mono request audio.
+
+The stream starts with the fLaC marker and a STREAMINFO block, followed
+by one frame per block_samples of audio, so every chunk handed out can
+be sent on its own. Frames use FLAC's fixed predictors (orders 0-4) with
+partitioned Rice coding, silent blocks collapse to CONSTANT subframes
+and incompressible ones fall back to VERBATIM. The number of samples and
+the MD5 signature are unknown while streaming and are left at zero, as
+the format allows.
+
+Residuals are computed and Rice coded with NumPy when it is available,
+with a pure Python fallback.
+"""
+
+import array
+import struct
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+# Subframe types
+_CONSTANT = 0x00
+_VERBATIM = 0x01
+_FIXED = 0x08
+
+_MAX_FIXED_ORDER = 4
+_MAX_PARTITION_ORDER = 4
+# Residual coding methods: RICE with 4-bit and RICE2 with 5-bit parameters.
+_RICE_PARAMETER_BITS = ((0, 4, 14), (1, 5, 30))
+
+# Sample rate codes that avoid storing the rate in every frame header.
+_SAMPLE_RATE_CODES = {
+	88200: 1, 176400: 2, 192000: 3, 8000: 4, 16000: 5, 22050: 6,
+	24000: 7, 32000: 8, 44100: 9, 48000: 10, 96000: 11,
+}
+
+
+def _crc_table(poly, bits):
+	top = 1 << (bits - 1)
+	mask = (1 << bits) - 1
+	table = []
+	for byte in range(256):
+		crc = byte << (bits - 8)
+		for _ in range(8):
+			crc = ((crc << 1) ^ poly) if crc & top else (crc << 1)
+		table.append(crc & mask)
+	return table
+
+_CRC8_TABLE = _crc_table(0x07, 8)
+_CRC16_TABLE = _crc_table(0x8005, 16)
+
+
+def crc8(data):
+	crc = 0
+	table = _CRC8_TABLE
+	for byte in bytearray(data):
+		crc = table[crc ^ byte]
+	return crc
+
+
+def crc16(data):
+	crc = 0
+	table = _CRC16_TABLE
+	for byte in bytearray(data):
+		crc = ((crc << 8) & 0xFFFF) ^ table[(crc >> 8) ^ byte]
+	return crc
+
+
+def _utf8_number(value):
+	"""Encodes a frame number the way FLAC frame headers do."""
+	if value < 0x80:
+		return bytes((value,))
+	payload = []
+	while True:
+		payload.append(0x80 | (value & 0x3F))
+		value >>= 6
+		# Room left in the first byte for this many continuation bytes.
+		if value < (1 << (6 - len(payload))):
+			break
+	lead = (0xFF << (7 - len(payload))) & 0xFF
+	return bytes([lead | value] + payload[::-1])
+
+
+class _BitWriter(object):
+	"""Big-endian bit writer backed by a Python integer."""
+	def __init__(self):
+		self._value = 0
+		self._bits = 0
+
+	def write(self, value, bits):
+		self._value = (self._value << bits) | (value & ((1 << bits) - 1))
+		self._bits += bits
+
+	def write_bits(self, value, bits):
+		"""Appends an already packed bit string."""
+		self._value = (self._value << bits) | value
+		self._bits += bits
+
+	def getvalue(self):
+		"""Returns the bytes written, zero-padded to a byte boundary."""
+		pad = -self._bits % 8
+		return (self._value << pad).to_bytes((self._bits + pad) // 8, 'big')
+
+
+def _zigzag(residual):
+	return [(r << 1) if r >= 0 else ((-r << 1) - 1) for r in residual]
+
+
+def _fixed_residual(samples, order):
+	if np is not None:
+		return np.diff(np.asarray(samples, dtype='int64'), n=order)
+	residual = list(samples)
+	for _ in range(order):
+		residual = [b - a for a, b in zip(residual, residual[1:])]
+	return residual
+
+
+def _rice_cost(folded, max_parameter):
+	"""Returns (bits, parameter) of the cheapest Rice parameter."""
+	count = len(folded)
+	if count == 0:
+		return 0, 0
+	# The best parameter is close to log2 of the mean folded residual.
+	guess = max(0, min(max_parameter, (sum(folded) // count).bit_length() - 1))
+	best = None
+	for parameter in range(max(0, guess - 1), min(max_parameter, guess + 2) + 1):
+		bits = count * (parameter + 1) + sum(u >> parameter for u in folded)
+		if best is None or bits < best[0]:
+			best = (bits, parameter)
+	return best
+
+
+def _partition_orders(block_size, order):
+	"""Partition orders usable for a block, finest last."""
+	partition_order = 0
+	while (partition_order < _MAX_PARTITION_ORDER and
+		   block_size % (2 << partition_order) == 0 and
+		   (block_size >> (partition_order + 1)) > order):
+		partition_order += 1
+	return range(partition_order + 1)
+
+
+def _plan_residual_numpy(folded, block_size, order):
+	"""Vectorized _plan_residual: costs every parameter at once."""
+	finest = _partition_orders(block_size, order)[-1]
+	partitions = 1 << finest
+	size = block_size >> finest
+	# Warm-up samples have no residual; pad them with zeros, which add
+	# nothing to the sums, and take them out of the counts.
+	padded = np.concatenate((np.zeros(order, dtype='int64'), folded))
+	parameters = np.arange(_RICE_PARAMETER_BITS[-1][2] + 1, dtype='int64')
+	sums = (padded[None, :] >> parameters[:, None]).reshape(
+		len(parameters), partitions, size).sum(axis=2)
+	counts = np.full(partitions, size, dtype='int64')
+	counts[0] -= order
+
+	best = None
+	for partition_order in range(finest, -1, -1):
+		if partition_order < finest:
+			sums = sums[:, 0::2] + sums[:, 1::2]
+			counts = counts[0::2] + counts[1::2]
+		costs = counts[None, :] * (parameters[:, None] + 1) + sums
+		for method, parameter_bits, max_parameter in _RICE_PARAMETER_BITS:
+			chosen = costs[:max_parameter + 1].argmin(axis=0)
+			bits = 6 + len(counts) * parameter_bits + int(
+				costs[chosen, np.arange(len(counts))].sum())
+			if best is None or bits < best[0]:
+				ends = np.cumsum(counts)
+				plan = [(int(k), int(end - count), int(end))
+						for k, count, end in zip(chosen, counts, ends)]
+				best = (bits, method, parameter_bits, partition_order, plan)
+	return best
+
+
+def _plan_residual(folded, block_size, order):
+	"""Picks the coding method, partition order and Rice parameters.
+
+	Returns: (bits, method, parameter bits, partition order, parameters).
+	"""
+	if np is not None:
+		return _plan_residual_numpy(folded, block_size, order)
+	best = None
+	for method, parameter_bits, max_parameter in _RICE_PARAMETER_BITS:
+		for partition_order in _partition_orders(block_size, order):
+			partitions = 1 << partition_order
+			size = block_size >> partition_order
+			bits = 6
+			parameters = []
+			start = 0
+			for partition in range(partitions):
+				end = (partition + 1) * size - order
+				cost, parameter = _rice_cost(folded[start:end], max_parameter)
+				bits += parameter_bits + cost
+				parameters.append((parameter, start, end))
+				start = end
+			if best is None or bits < best[0]:
+				best = (bits, method, parameter_bits, partition_order,
+						parameters)
+		if best is not None and all(p[0] < max_parameter
+									for p in best[4]):
+			# RICE2 only helps when a parameter had to be clamped.
+			break
+	return best
+
+
+def _write_rice(writer, folded, parameter):
+	if np is not None and len(folded):
+		writer.write_bits(*_pack_rice_numpy(folded, parameter))
+		return
+	for u in folded:
+		# q zeros, a one, then the parameter low bits.
+		writer.write_bits((1 << parameter) | (u & ((1 << parameter) - 1)),
+						  (u >> parameter) + 1 + parameter)
+
+
+def _pack_rice_numpy(folded, parameter):
+	"""Rice codes a partition in one pass; returns (int value, bits)."""
+	quotients = folded >> parameter
+	lengths = quotients + 1 + parameter
+	ends = np.cumsum(lengths)
+	total = int(ends[-1])
+	bits = np.zeros(total + (-total % 8), dtype='uint8')
+	stops = ends - lengths + quotients
+	bits[stops] = 1
+	if parameter:
+		shifts = np.arange(parameter - 1, -1, -1, dtype='int64')
+		low = (folded[:, None] >> shifts) & 1
+		positions = stops[:, None] + 1 + np.arange(parameter)
+		bits[positions.ravel()] = low.ravel()
+	packed = np.packbits(bits).tobytes()
+	return int.from_bytes(packed, 'big') >> (-total % 8), total
+
+
+class FlacEncoder(object):
+	"""Encodes a stream of 16-bit mono PCM chunks into FLAC.
+
+	Chunks may be of any size. Audio is carried over until a whole block
+	is available, and flush() emits the last, shorter block.
+
+	Args:
+	  sample_rate: sample rate in hertz.
+	  sample_width: size of a single sample in bytes. Only 2 is supported.
+	  block_samples: number of samples per FLAC frame.
+	"""
+	# AudioInConfig encoding of the produced stream.
+	encoding = 'FLAC'
+
+	def __init__(self, sample_rate, sample_width=2, block_samples=1600):
+		if sample_width != 2:
+			raise Exception('unsupported sample width:', sample_width)
+		if not 16 <= block_samples <= 65535:
+			raise Exception('unsupported block size:', block_samples)
+		self._sample_rate = sample_rate
+		self._sample_width = sample_width
+		self._block_samples = block_samples
+		self._bits_per_sample = 8 * sample_width
+		self.reset()
+
+	def reset(self):
+		"""Starts a new FLAC stream."""
+		self._carry = b''
+		self._frame_number = 0
+		self._header_sent = False
+		self._bytes_in = 0
+		self._bytes_out = 0
+
+	def stream_header(self):
+		"""Returns the fLaC marker and the STREAMINFO metadata block."""
+		info = _BitWriter()
+		info.write(self._block_samples, 16)  # minimum block size
+		info.write(self._block_samples, 16)  # maximum block size
+		info.write(0, 24)  # minimum frame size, unknown
+		info.write(0, 24)  # maximum frame size, unknown
+		info.write(self._sample_rate, 20)
+		info.write(0, 3)  # channels - 1
+		info.write(self._bits_per_sample - 1, 5)
+		info.write(0, 36)  # total samples, unknown while streaming
+		streaminfo = info.getvalue() + bytes(16)  # MD5, unknown
+		# Last metadata block, type 0 (STREAMINFO).
+		return b'fLaC' + struct.pack('>I', (1 << 31) | len(streaminfo)) + \
+			streaminfo
+
+	def encode(self, chunk):
+		"""Returns the FLAC bytes for the whole blocks now available.
+
+		The first call also returns the stream header.
+		"""
+		self._bytes_in += len(chunk)
+		data = self._carry + bytes(chunk) if self._carry else bytes(chunk)
+		block_bytes = self._block_samples * self._sample_width
+		usable = len(data) - len(data) % block_bytes
+		self._carry = data[usable:]
+		out = []
+		if not self._header_sent:
+			self._header_sent = True
+			out.append(self.stream_header())
+		for offset in range(0, usable, block_bytes):
+			out.append(self._encode_frame(data[offset:offset + block_bytes]))
+		out = b''.join(out)
+		self._bytes_out += len(out)
+		return out
+
+	def flush(self):
+		"""Returns the frame for the remaining samples, if any."""
+		data = self._carry[:len(self._carry) - len(self._carry) %
+						   self._sample_width]
+		self._carry = b''
+		out = b''
+		if not self._header_sent and data:
+			self._header_sent = True
+			out = self.stream_header()
+		if data:
+			out += self._encode_frame(data)
+		self._bytes_out += len(out)
+		return out
+
+	@property
+	def stats(self):
+		"""PCM bytes encoded and FLAC bytes produced so far."""
+		return {'bytes_in': self._bytes_in, 'bytes_out': self._bytes_out}
+
+	def _samples(self, data):
+		if np is not None:
+			return np.frombuffer(data, dtype='<i2').astype('int64')
+		samples = array.array('h', data)
+		return samples.tolist()
+
+	def _encode_frame(self, data):
+		samples = self._samples(data)
+		block_size = len(samples)
+
+		header = bytearray(b'\xff\xf8')  # sync code, fixed block size
+		rate_code = _SAMPLE_RATE_CODES.get(self._sample_rate, 0)
+		header.append(0x70 | rate_code)  # 16-bit block size at the end
+		header.append(0x08)  # mono, 16 bits per sample
+		header += _utf8_number(self._frame_number)
+		header += struct.pack('>H', block_size - 1)
+		header.append(crc8(header))
+		self._frame_number += 1
+
+		frame = bytes(header) + self._encode_subframe(samples, block_size)
+		return frame + struct.pack('>H', crc16(frame))
+
+	def _encode_subframe(self, samples, block_size):
+		bps = self._bits_per_sample
+		writer = _BitWriter()
+		first = int(samples[0])
+		if np is not None:
+			constant = bool((samples == first).all())
+		else:
+			constant = samples.count(first) == block_size
+		if constant:
+			# Silence, typically.
+			writer.write(_CONSTANT << 1, 8)
+			writer.write(first, bps)
+			return writer.getvalue()
+
+		# The predictor leaving the smallest residuals codes best.
+		best = None
+		for order in range(min(_MAX_FIXED_ORDER, block_size - 1) + 1):
+			residual = _fixed_residual(samples, order)
+			if np is not None:
+				folded = np.where(residual >= 0, residual << 1,
+								  ((-residual) << 1) - 1)
+				total = int(folded.sum())
+			else:
+				folded = _zigzag(residual)
+				total = sum(folded)
+			if best is None or total < best[0]:
+				best = (total, order, folded)
+		total, order, folded = best
+		plan = _plan_residual(folded, block_size, order)
+		bits = order * bps + plan[0]
+
+		if bits >= block_size * bps:
+			writer.write(_VERBATIM << 1, 8)
+			for sample in samples:
+				writer.write(int(sample), bps)
+			return writer.getvalue()
+
+		_, method, parameter_bits, partition_order, parameters = plan
+		writer.write((_FIXED | order) << 1, 8)
+		for sample in samples[:order]:
+			writer.write(int(sample), bps)
+		writer.write(method, 2)
+		writer.write(partition_order, 4)
+		for parameter, start, end in parameters:
+			writer.write(parameter, parameter_bits)
+			_write_rice(writer, folded[start:end], parameter)
+		return writer.getvalue()
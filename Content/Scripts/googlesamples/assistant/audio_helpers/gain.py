@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Batched gain engine used to normalize the volume of audio buffers.
+
+Whole buffers are scaled at once, either through NumPy or, when NumPy is
+not available, through the C implementation in audioop. A pure Python
+loop is only used as a last resort. Results saturate at the limits of the
+sample format instead of wrapping around.
+"""
+
+import array
+import math
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+try:
+	import audioop
+except ImportError:
+	# audioop was removed from the standard library in Python 3.13.
+	audioop = None
+
+
+# NumPy sample types for each supported sample width (in bytes).
+# 24-bit samples have no native NumPy type and go through audioop.
+# 8-bit WAV PCM is unsigned, unlike every other width, and is not
+# supported.
+_NUMPY_DTYPES = {
+	2: '<i2',
+	4: '<i4',
+}
+
+_ARRAY_TYPECODES = {
+	2: 'h',
+	4: 'i',
+}
+
+SUPPORTED_SAMPLE_WIDTHS = (2, 3, 4)
+
+# Gain for every integer volume percentage, computed once.
+_VOLUME_SCALES = tuple(math.pow(2, 1.0*v/100)-1 for v in range(0, 101))
+
+
+def volume_scale(volume_percentage):
+	"""Returns the amplitude scale factor for the given volume.
+
+	The scale factor is 2^(volume_percentage/100)-1.
+
+	Args:
+	  volume_percentage: volume setting as an integer percentage (1-100);
+	    values outside 0-100 are clamped.
+	"""
+	volume_percentage = min(max(volume_percentage, 0), 100)
+	try:
+		return _VOLUME_SCALES[volume_percentage]
+	except TypeError:
+		return math.pow(2, 1.0*volume_percentage/100)-1
+
+
+def sample_limits(sample_width):
+	"""Returns the (min, max) value of a signed sample of the given width."""
+	bits = 8 * sample_width
+	return -(1 << (bits - 1)), (1 << (bits - 1)) - 1
+
+
+def check_sample_width(sample_width):
+	if sample_width not in SUPPORTED_SAMPLE_WIDTHS:
+		raise Exception('unsupported sample width:', sample_width)
+
+
+def apply_gain(buf, scale, sample_width=2):
+	"""Scales every sample in the buffer and returns the result as bytes.
+
+	Args:
+	  buf: bytes-like object containing audio data aligned to sample_width.
+	  scale: amplitude scale factor.
+	  sample_width: size of a single sample in bytes.
+	"""
+	check_sample_width(sample_width)
+	if scale == 1.0:
+		return bytes(buf)
+	if np is not None and sample_width in _NUMPY_DTYPES:
+		samples = np.frombuffer(buf, dtype=_NUMPY_DTYPES[sample_width])
+		return _scale_numpy(samples, scale, sample_width).tobytes()
+	if audioop is not None:
+		return audioop.mul(buf, sample_width, scale)
+	return _scale_python(buf, scale, sample_width)
+
+
+def apply_gain_inplace(buf, scale, sample_width=2, scratch=None):
+	"""Scales every sample in a writable buffer in place.
+
+	Args:
+	  buf: writable bytes-like object (a bytearray or a memoryview of one)
+	    containing audio data aligned to sample_width.
+	  scale: amplitude scale factor.
+	  sample_width: size of a single sample in bytes.
+	  scratch: optional GainScratch reused between calls so that no
+	    intermediate buffer has to be allocated.
+	Returns:
+	  The number of temporary buffers allocated by this call.
+	"""
+	check_sample_width(sample_width)
+	if scale == 1.0 or len(buf) == 0:
+		return 0
+	if np is not None and sample_width in _NUMPY_DTYPES:
+		samples = np.frombuffer(buf, dtype=_NUMPY_DTYPES[sample_width])
+		if scratch is None:
+			samples[:] = _scale_numpy(samples, scale, sample_width)
+			return 2
+		work, allocated = scratch.get(len(samples))
+		lo, hi = sample_limits(sample_width)
+		np.multiply(samples, scale, out=work)
+		np.clip(work, lo, hi, out=work)
+		np.copyto(samples, work, casting='unsafe')
+		return allocated
+	view = memoryview(buf).cast('B')
+	if audioop is not None:
+		view[:] = audioop.mul(view, sample_width, scale)
+	else:
+		view[:] = _scale_python(view, scale, sample_width)
+	return 1
+
+
+class GainScratch(object):
+	"""Float work buffer reused by apply_gain_inplace().
+
+	The buffer only grows, so steady-state calls do not allocate.
+	"""
+	def __init__(self):
+		self._work = None
+
+	def get(self, count):
+		"""Returns a work array of count samples and the allocation count."""
+		if self._work is None or len(self._work) < count:
+			self._work = np.empty(count, dtype='float64')
+			return self._work[:count], 1
+		return self._work[:count], 0
+
+
+def _scale_numpy(samples, scale, sample_width):
+	lo, hi = sample_limits(sample_width)
+	scaled = samples * scale
+	np.clip(scaled, lo, hi, out=scaled)
+	return scaled.astype(samples.dtype)
+
+
+def _scale_python(buf, scale, sample_width):
+	lo, hi = sample_limits(sample_width)
+	if sample_width == 3:
+		data = bytes(buf)
+		out = bytearray(len(data))
+		for idx in range(0, len(data), 3):
+			value = int(int.from_bytes(data[idx:idx+3], 'little',
+										signed=True) * scale)
+			value = min(max(value, lo), hi)
+			out[idx:idx+3] = value.to_bytes(3, 'little', signed=True)
+		return bytes(out)
+	arr = array.array(_ARRAY_TYPECODES[sample_width], bytes(buf))
+	for idx in range(0, len(arr)):
+		arr[idx] = min(max(int(arr[idx]*scale), lo), hi)
+	return arr.tobytes()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Playout jitter buffer for response audio.
+
+Response chunks arrive from gRPC at an uneven pace, while a sound wave
+plays whatever has been queued to it back to back. Queueing each chunk
+on arrival turns every late chunk into an audible gap. The JitterBuffer
+holds back the start of a response until it has a target depth of audio
+in hand, then hands it on in whole blocks while the engine has more
+than the target depth queued, and as it comes when it has less. From
+then on the engine's own queue is the buffer: the JitterBuffer keeps
+track of how much audio is still queued, and counts a chunk as late
+when less than half the minimum depth was left on its arrival and as
+an underrun when it had already run dry.
+
+The target depth adapts between responses. Arrival lateness is run
+through Lindley's recursion, which gives the buffer depth that would
+have covered the response's worst run of late chunks; the target moves
+up to it at once and decays slowly when the network calms down. An
+underrun also raises the target on the spot and the buffer refills.
+"""
+
+import time
+
+
+class JitterBuffer(object):
+	"""Coalesces response audio and delays its start to absorb jitter.
+
+	Args:
+	  sample_rate: sample rate in hertz.
+	  sample_width: size of a single sample in bytes.
+	  block_size: size in bytes of the blocks handed on to the engine.
+	  min_depth_ms: lowest target depth in milliseconds.
+	  max_depth_ms: highest target depth in milliseconds.
+	"""
+	def __init__(self, sample_rate, sample_width, block_size, min_depth_ms,
+				 max_depth_ms):
+		if block_size % sample_width:
+			raise Exception('unsupported block size:', block_size)
+		self._bytes_per_second = float(sample_rate * sample_width)
+		self._block_size = block_size
+		self._block_time = block_size / self._bytes_per_second
+		self._min_depth = min_depth_ms / 1000.0
+		self._max_depth = max_depth_ms / 1000.0
+		self._target = self._min_depth
+		self._pending = bytearray()
+		self._reset_response()
+		self._reset_counters()
+
+	def _reset_response(self):
+		self._playing = False
+		self._played_until = 0.0
+		# When the engine ran dry, until playback resumes.
+		self._dry_since = None
+		self._first_arrival = None
+		self._last_arrival = None
+		self._last_duration = 0.0
+		self._backlog = 0.0
+		self._needed = 0.0
+
+	def _reset_counters(self):
+		self._chunks = 0
+		self._releases = 0
+		self._late_chunks = 0
+		self._underruns = 0
+		self._underrun_time = 0.0
+		self._first_audio_delay = None
+
+	def write(self, buf):
+		"""Adds a response chunk.
+
+		Returns: the audio to queue to the engine now, possibly empty.
+		"""
+		now = time.monotonic()
+		duration = len(buf) / self._bytes_per_second
+		self._chunks += 1
+		if self._first_arrival is None:
+			self._first_arrival = now
+		else:
+			# Lindley's recursion: how far arrivals have fallen behind
+			# the audio they carry since the buffer last had slack.
+			lateness = now - self._last_arrival - self._last_duration
+			self._backlog = max(0.0, self._backlog + lateness)
+			self._needed = max(self._needed, self._backlog)
+		self._last_arrival = now
+		self._last_duration = duration
+		self._pending += buf
+
+		if self._playing:
+			queued = self._played_until - now
+			if queued < 0:
+				# The engine ran dry; refill to a deeper target.
+				self._underruns += 1
+				self._dry_since = self._played_until
+				self._target = min(self._max_depth, self._target - queued)
+				self._playing = False
+			else:
+				if queued < self._min_depth / 2:
+					self._late_chunks += 1
+				if queued < self._target:
+					# Running low, so hand on partial blocks too.
+					return self._release(now, len(self._pending))
+		if not self._playing:
+			if len(self._pending) < self._target * self._bytes_per_second:
+				return b''
+			self._playing = True
+			if self._first_audio_delay is None:
+				self._first_audio_delay = now - self._first_arrival
+			if self._dry_since is not None:
+				self._underrun_time += now - self._dry_since
+				self._dry_since = None
+		return self._release(
+			now, len(self._pending) - len(self._pending) % self._block_size)
+
+	def _release(self, now, size):
+		if size <= 0:
+			return b''
+		data = bytes(self._pending[:size])
+		del self._pending[:size]
+		self._releases += 1
+		self._played_until = (max(self._played_until, now) +
+							  size / self._bytes_per_second)
+		return data
+
+	def flush(self):
+		"""Ends the response and returns the audio still held back.
+
+		The response's arrival pattern updates the target depth for the
+		next one.
+		"""
+		now = time.monotonic()
+		if self._first_audio_delay is None and self._first_arrival is not None:
+			self._first_audio_delay = now - self._first_arrival
+		if self._dry_since is not None:
+			self._underrun_time += now - self._dry_since
+		data = self._release(now, len(self._pending))
+		if self._first_arrival is not None:
+			needed = self._needed + self._block_time
+			if needed > self._target:
+				self._target = needed
+			else:
+				self._target -= (self._target - needed) / 4
+			self._target = min(self._max_depth,
+							   max(self._min_depth, self._target))
+		self._reset_response()
+		return data
+
+	@property
+	def target_depth(self):
+		"""Seconds of audio buffered before a response starts playing."""
+		return self._target
+
+	def reset_stats(self):
+		"""Resets the counters and returns their previous values."""
+		stats = self.stats
+		self._reset_counters()
+		return stats
+
+	@property
+	def stats(self):
+		"""Playout counters since the last reset_stats() call.
+
+		first_audio_delay is the time from the first chunk's arrival to
+		its playback being queued, in seconds, and underrun_time the
+		total silence caused by underruns.
+		"""
+		return {
+			'chunks': self._chunks,
+			'releases': self._releases,
+			'late_chunks': self._late_chunks,
+			'underruns': self._underruns,
+			'underrun_time': self._underrun_time,
+			'first_audio_delay': self._first_audio_delay,
+			'target_depth': self._target,
+		}
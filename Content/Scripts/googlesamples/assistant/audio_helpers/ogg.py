@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Incremental Ogg page reader.
+
+Response audio arrives in arbitrary slices of an Ogg stream. The reader
+buffers bytes until a whole page is available, checks its CRC and hands
+back the packets it completes, so decoding can start with the first
+page instead of waiting for the whole stream.
+"""
+
+
+def _crc_table():
+	table = []
+	for byte in range(256):
+		crc = byte << 24
+		for _ in range(8):
+			crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else (crc << 1)
+		table.append(crc & 0xFFFFFFFF)
+	return table
+
+_CRC_TABLE = _crc_table()
+
+_CAPTURE_PATTERN = b'OggS'
+_HEADER_SIZE = 27
+_CONTINUED = 0x01
+
+
+def crc32(data):
+	"""The CRC used by Ogg pages (polynomial 0x04C11DB7, no reflection)."""
+	crc = 0
+	table = _CRC_TABLE
+	for byte in bytearray(data):
+		crc = ((crc << 8) & 0xFFFFFFFF) ^ table[(crc >> 24) ^ byte]
+	return crc
+
+
+class OggPageReader(object):
+	"""Splits an Ogg stream into packets as its bytes arrive.
+
+	Only single logical streams are expected, as sent by the Assistant.
+	Corrupt pages are skipped by searching for the next capture pattern.
+	"""
+	def __init__(self):
+		self.reset()
+
+	def reset(self):
+		"""Starts reading a new stream."""
+		self._buf = bytearray()
+		self._packet = []
+		self.pages = 0
+		self.corrupt_pages = 0
+		self.granule_position = 0
+
+	def feed(self, data):
+		"""Adds stream bytes and returns the packets completed by them."""
+		self._buf += data
+		packets = []
+		while self._read_page(packets):
+			pass
+		return packets
+
+	def _read_page(self, packets):
+		buf = self._buf
+		start = buf.find(_CAPTURE_PATTERN)
+		if start < 0:
+			# Keep a possible partial capture pattern.
+			del buf[:max(0, len(buf) - 3)]
+			return False
+		if start:
+			del buf[:start]
+		if len(buf) < _HEADER_SIZE:
+			return False
+		segments = buf[26]
+		body = _HEADER_SIZE + segments
+		if len(buf) < body:
+			return False
+		lacing = buf[_HEADER_SIZE:body]
+		end = body + sum(lacing)
+		if len(buf) < end:
+			return False
+
+		page = bytes(buf[:end])
+		expected = int.from_bytes(page[22:26], 'little')
+		if crc32(page[:22] + b'\0\0\0\0' + page[26:]) != expected:
+			self.corrupt_pages += 1
+			self._packet = []
+			del buf[:1]
+			return True
+		del buf[:end]
+		self.pages += 1
+
+		if not page[5] & _CONTINUED:
+			# A packet left unfinished by a lost page cannot be used.
+			self._packet = []
+		granule_position = int.from_bytes(page[6:14], 'little', signed=True)
+		if granule_position >= 0:
+			self.granule_position = granule_position
+		offset = body
+		for size in bytearray(lacing):
+			self._packet.append(page[offset:offset + size])
+			offset += size
+			if size < 255:
+				packets.append(b''.join(self._packet))
+				self._packet = []
+		return True
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Streaming decoder for OPUS_IN_OGG response audio.
+
+Each response chunk is fed through an OggPageReader and the Opus packets
+of every completed page are decoded straight away into LINEAR16 samples
+at the stream's sample rate. Decoding needs the optional opuslib package
+and the libopus library it binds to.
+"""
+
+import struct
+import time
+
+try:
+	import opuslib
+except Exception:
+	# opuslib raises a plain Exception when libopus itself is missing.
+	opuslib = None
+
+from .ogg import OggPageReader
+
+# Longest Opus packet, in milliseconds.
+_MAX_PACKET_MS = 120
+# Opus streams count their pre-skip in 48 kHz samples.
+_OPUS_RATE = 48000
+
+
+class OpusInOggDecoder(object):
+	"""Decodes an Ogg Opus stream into 16-bit mono PCM as it arrives.
+
+	Args:
+	  sample_rate: rate in hertz to decode at: 8000, 12000, 16000, 24000
+	    or 48000.
+	  sample_width: size of a single output sample in bytes. Only 2 is
+	    supported.
+	"""
+	# AudioOutConfig encoding of the decoded stream.
+	encoding = 'OPUS_IN_OGG'
+
+	def __init__(self, sample_rate, sample_width=2):
+		if opuslib is None:
+			raise Exception('OPUS_IN_OGG needs opuslib and libopus')
+		if sample_width != 2:
+			raise Exception('unsupported sample width:', sample_width)
+		self._sample_rate = sample_rate
+		self._sample_width = sample_width
+		self._max_frame_size = sample_rate * _MAX_PACKET_MS // 1000
+		self._reader = OggPageReader()
+		self.reset()
+
+	def reset(self):
+		"""Prepares for a new stream, e.g. the next response."""
+		self._reader.reset()
+		self._decoder = None
+		self._tags_seen = False
+		self._skip = 0
+		self._bytes_in = 0
+		self._bytes_out = 0
+		self._decode_time = 0.0
+
+	def decode(self, data):
+		"""Returns the PCM for the pages completed by data; may be empty."""
+		started = time.perf_counter()
+		self._bytes_in += len(data)
+		out = []
+		for packet in self._reader.feed(data):
+			if self._decoder is None:
+				self._open(packet)
+			elif not self._tags_seen:
+				# OpusTags carries no audio.
+				self._tags_seen = True
+			else:
+				out.append(self._decoder.decode(packet, self._max_frame_size))
+		pcm = b''.join(out)
+		if self._skip and pcm:
+			# Drop the encoder delay announced by OpusHead.
+			skipped = min(self._skip, len(pcm))
+			self._skip -= skipped
+			pcm = pcm[skipped:]
+		self._bytes_out += len(pcm)
+		self._decode_time += time.perf_counter() - started
+		return pcm
+
+	def _open(self, packet):
+		if not packet.startswith(b'OpusHead') or len(packet) < 19:
+			raise Exception('not an Ogg Opus stream:', packet[:8])
+		pre_skip, = struct.unpack('<H', packet[10:12])
+		# libopus downmixes to the requested single channel.
+		self._decoder = opuslib.Decoder(self._sample_rate, 1)
+		self._skip = (pre_skip * self._sample_rate // _OPUS_RATE *
+					  self._sample_width)
+
+	@property
+	def stats(self):
+		"""Compressed bytes received, PCM bytes produced and time spent."""
+		return {
+			'bytes_in': self._bytes_in,
+			'bytes_out': self._bytes_out,
+			'pages': self._reader.pages,
+			'corrupt_pages': self._reader.corrupt_pages,
+			'decode_time': self._decode_time,
+		}
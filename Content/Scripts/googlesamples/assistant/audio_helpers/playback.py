@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Byte budget for the response audio queued to the engine.
+
+A SoundWaveProcedural takes whatever is queued to it, so a response
+streamed faster than real time piles up in the engine for as long as
+the answer lasts. The PlaybackQueue keeps track of how much queued
+audio has yet to play and makes writers wait while another chunk would
+take it over the budget. The writer is the thread consuming the
+Converse responses, so waiting stops it from pulling more of them and
+gRPC flow control holds back the rest on the server.
+
+Writers that must not block, such as coroutines, ask room_in() how
+long to sleep before their chunk fits and then reserve it without
+waiting.
+
+Cancelling the queue releases the writers waiting on it, whose chunks
+are then dropped, and either drops the queued audio or leaves it to
+play out.
+"""
+
+import threading
+import time
+
+
+class PlaybackQueue(object):
+	"""Keeps the audio queued ahead of playback within a budget.
+
+	Args:
+	  sample_rate: sample rate in hertz.
+	  sample_width: size of a single sample in bytes.
+	  max_bytes: most bytes of audio queued ahead of playback, or None
+	    for no limit. A chunk larger than the budget waits for the queue
+	    to run dry.
+	"""
+	def __init__(self, sample_rate, sample_width, max_bytes=None):
+		if max_bytes is not None and max_bytes <= 0:
+			raise Exception('unsupported playback queue size:', max_bytes)
+		self._bytes_per_second = float(sample_rate * sample_width)
+		self._max_bytes = max_bytes
+		self._cond = threading.Condition()
+		# When the audio queued so far will have played out.
+		self._played_until = 0.0
+		# Bumped by cancel(), so waiting writers know to drop their chunk.
+		self._cancels = 0
+		self._reset_counters()
+
+	def _reset_counters(self):
+		self._high_water = 0
+		self._waits = 0
+		self._wait_time = 0.0
+		self._dropped = 0
+
+	def _queued_bytes(self, now):
+		return max(0.0, self._played_until - now) * self._bytes_per_second
+
+	def reserve(self, size, wait=True):
+		"""Waits until size more bytes fit in the budget.
+
+		Args:
+		  size: bytes about to be queued.
+		  wait: False returns at once, for writers that waited with
+		    room_in() beforehand.
+		Returns: False if the queue was cancelled while waiting, in which
+		  case the chunk must be dropped.
+		"""
+		if self._max_bytes is None or not wait:
+			return True
+		limit = max(0, self._max_bytes - size)
+		with self._cond:
+			cancels = self._cancels
+			started = None
+			while True:
+				if self._cancels != cancels:
+					self._dropped += size
+					fits = False
+					break
+				now = time.monotonic()
+				excess = self._queued_bytes(now) - limit
+				if excess <= 0:
+					fits = True
+					break
+				if started is None:
+					started = now
+					self._waits += 1
+				# Until enough has played, unless cancel() comes first.
+				self._cond.wait(excess / self._bytes_per_second)
+			if started is not None:
+				self._wait_time += time.monotonic() - started
+			return fits
+
+	def room_in(self, size):
+		"""Returns the seconds until size more bytes fit in the budget.
+
+		0 if they fit now. Nothing is reserved; the caller sleeps for as
+		long, asks again, and counts the time with waited().
+		"""
+		if self._max_bytes is None:
+			return 0.0
+		limit = max(0, self._max_bytes - size)
+		with self._cond:
+			excess = self._queued_bytes(time.monotonic()) - limit
+		return max(0.0, excess / self._bytes_per_second)
+
+	def waited(self, seconds):
+		"""Counts a wait for room made outside reserve()."""
+		with self._cond:
+			self._waits += 1
+			self._wait_time += seconds
+
+	def queued(self, size):
+		"""Notes that size bytes were queued for playback just now.
+
+		Returns: time.monotonic() the audio queued so far will have
+		  played by.
+		"""
+		with self._cond:
+			now = time.monotonic()
+			self._played_until = (max(self._played_until, now) +
+								  size / self._bytes_per_second)
+			queued = self._queued_bytes(now)
+			if queued > self._high_water:
+				self._high_water = queued
+			return self._played_until
+
+	def cancel(self, drop=True):
+		"""Releases the writers waiting for room; their chunks are dropped.
+
+		Args:
+		  drop: whether the queued audio is dropped too, as when the
+		    sound wave is reset. Otherwise it is left to play out.
+		"""
+		with self._cond:
+			self._cancels += 1
+			if drop:
+				now = time.monotonic()
+				self._dropped += int(self._queued_bytes(now))
+				self._played_until = now
+			self._cond.notify_all()
+
+	@property
+	def played_until(self):
+		"""time.monotonic() the audio queued so far will have played by."""
+		return self._played_until
+
+	@property
+	def queued_bytes(self):
+		"""Bytes of queued audio that have yet to play."""
+		with self._cond:
+			return int(self._queued_bytes(time.monotonic()))
+
+	@property
+	def max_bytes(self):
+		return self._max_bytes
+
+	def reset_stats(self):
+		"""Resets the counters and returns their previous values."""
+		with self._cond:
+			stats = self._stats()
+			self._reset_counters()
+			return stats
+
+	@property
+	def stats(self):
+		"""Queue counters since the last reset_stats() call.
+
+		high_water_bytes is the most audio that was queued at once,
+		waits the writes that had to wait for room and wait_time the
+		seconds they waited, and dropped_bytes the audio cancelled.
+		"""
+		with self._cond:
+			return self._stats()
+
+	def _stats(self):
+		return {
+			'high_water_bytes': int(self._high_water),
+			'max_bytes': self._max_bytes,
+			'waits': self._waits,
+			'wait_time': self._wait_time,
+			'dropped_bytes': self._dropped,
+		}
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Streaming sample rate conversion for 16-bit mono audio.
+
+Capture devices and the engine's mixer often run at 44.1 or 48 kHz while
+the Assistant is spoken to at 16 kHz. The Resampler converts between any
+two rates by their exact ratio L/M: the audio is notionally upsampled by
+L, low-pass filtered below the lower of the two Nyquist frequencies and
+decimated by M. The filter is split into L phases of taps_per_phase
+taps, so each output sample only costs one phase's taps and the zeros
+of the upsampling are never computed.
+
+Chunks are converted as they come, keeping the last taps_per_phase - 1
+input samples and the phase of the next output between calls, so the
+output of a stream cut into chunks is the same as that of the whole
+stream. Whole chunks are filtered at once with NumPy when it is
+available, with a pure Python fallback.
+"""
+
+import array
+import math
+import time
+
+try:
+	import numpy as np
+	from numpy.lib.stride_tricks import sliding_window_view
+except ImportError:
+	np = None
+
+
+def _design_filter(up, down, taps_per_phase, cutoff):
+	"""Returns the L * taps_per_phase taps of the Kaiser windowed sinc
+	low-pass filter, with a gain of L to make up for the upsampling."""
+	length = up * taps_per_phase
+	# Cycles per upsampled sample, below the lower Nyquist frequency.
+	fc = cutoff * 0.5 / max(up, down)
+	center = (length - 1) / 2.0
+	beta = 8.0
+	norm = _bessel_i0(beta)
+	taps = []
+	for n in range(length):
+		x = n - center
+		sinc = 2 * fc if x == 0 else math.sin(2 * math.pi * fc * x) / (math.pi * x)
+		ratio = 2.0 * n / (length - 1) - 1 if length > 1 else 0.0
+		window = _bessel_i0(beta * math.sqrt(max(0.0, 1 - ratio * ratio))) / norm
+		taps.append(up * sinc * window)
+	return taps
+
+
+def _bessel_i0(x):
+	total = term = 1.0
+	k = 1
+	while term > 1e-12 * total:
+		term *= (x / (2.0 * k)) ** 2
+		total += term
+		k += 1
+	return total
+
+
+class Resampler(object):
+	"""Converts 16-bit mono audio from one sample rate to another.
+
+	Args:
+	  in_rate: sample rate of the audio passed to process(), in hertz.
+	  out_rate: sample rate of the audio returned, in hertz.
+	  sample_width: size of a single sample in bytes; must be 2.
+	  taps_per_phase: filter taps per output sample, times the
+	    decimation ratio when downsampling so the filter spans as many
+	    samples of the lower rate. More taps give a sharper cutoff at a
+	    higher CPU cost and delay.
+	  cutoff: passband edge as a fraction of the lower Nyquist frequency.
+	"""
+	def __init__(self, in_rate, out_rate, sample_width=2, taps_per_phase=16,
+				 cutoff=0.9):
+		if sample_width != 2:
+			raise Exception('unsupported sample width:', sample_width)
+		if in_rate <= 0 or out_rate <= 0:
+			raise Exception('unsupported sample rates:', in_rate, out_rate)
+		gcd = math.gcd(in_rate, out_rate)
+		self._up = out_rate // gcd
+		self._down = in_rate // gcd
+		self._in_rate = in_rate
+		self._out_rate = out_rate
+		self._taps = taps_per_phase * max(1, -(-self._down // self._up))
+		taps = _design_filter(self._up, self._down, self._taps, cutoff)
+		# Phase p holds taps p, p + L, p + 2L, ..., reversed so they line
+		# up with the input samples, oldest first.
+		self._phases = [taps[p::self._up][::-1] for p in range(self._up)]
+		if np is not None:
+			self._phase_array = np.array(self._phases, dtype=np.float64)
+		self.reset()
+		self._reset_counters()
+
+	def reset(self):
+		"""Forgets the audio seen so far, to start a new stream."""
+		self._history = [0.0] * (self._taps - 1)
+		# Upsampled position of the next output, from the first sample
+		# of the next chunk.
+		self._next = 0
+		self._carry = b''
+
+	def _reset_counters(self):
+		self._samples_in = 0
+		self._samples_out = 0
+		self._process_time = 0.0
+
+	def process(self, buf):
+		"""Converts the next chunk of the stream.
+
+		A trailing partial sample is held back for the next chunk.
+
+		Returns: the converted audio as bytes, possibly empty.
+		"""
+		started = time.perf_counter()
+		if self._carry:
+			buf = self._carry + bytes(buf)
+		size = len(buf) - len(buf) % 2
+		self._carry = bytes(buf[size:])
+		count = size // 2
+		if not count:
+			return b''
+		if np is not None:
+			out = self._process_numpy(memoryview(buf)[:size], count)
+		else:
+			out = self._process_python(memoryview(buf)[:size], count)
+		self._samples_in += count
+		self._samples_out += len(out) // 2
+		self._process_time += time.perf_counter() - started
+		return out
+
+	def _outputs(self, count):
+		"""Number of outputs whose newest input sample is in the chunk."""
+		end = count * self._up
+		if self._next >= end:
+			return 0
+		return (end - self._next + self._down - 1) // self._down
+
+	def _process_numpy(self, view, count):
+		samples = np.frombuffer(view, dtype='<i2').astype(np.float64)
+		history = np.asarray(self._history, dtype=np.float64)
+		stream = np.concatenate((history, samples))
+		outputs = self._outputs(count)
+		positions = self._next + self._down * np.arange(outputs)
+		windows = sliding_window_view(stream, self._taps)[positions // self._up]
+		phases = self._phase_array[positions % self._up]
+		out = np.einsum('ij,ij->i', windows, phases)
+		self._next += self._down * outputs - count * self._up
+		self._history = stream[len(stream) - self._taps + 1:].tolist()
+		np.rint(out, out=out)
+		np.clip(out, -32768, 32767, out=out)
+		return out.astype('<i2').tobytes()
+
+	def _process_python(self, view, count):
+		samples = array.array('h')
+		samples.frombytes(view)
+		stream = self._history + samples.tolist()
+		out = array.array('h')
+		up = self._up
+		for idx in range(self._outputs(count)):
+			position = self._next + idx * self._down
+			start = position // up
+			value = sum(tap * sample for tap, sample in
+						zip(self._phases[position % up],
+							stream[start:start + self._taps]))
+			out.append(max(-32768, min(32767, int(round(value)))))
+		self._next += self._down * len(out) - count * up
+		self._history = stream[len(stream) - self._taps + 1:]
+		return out.tobytes()
+
+	def flush(self):
+		"""Returns the end of the stream still in the filter and resets.
+
+		The filter delays the audio by half its length; the samples
+		that delay held back are pushed out with silence.
+		"""
+		out = self.process(bytes(2 * (self._taps // 2 + 1)))
+		self.reset()
+		return out
+
+	@property
+	def in_rate(self):
+		return self._in_rate
+
+	@property
+	def out_rate(self):
+		return self._out_rate
+
+	@property
+	def delay(self):
+		"""Seconds the filter delays the audio by."""
+		return (self._up * self._taps - 1) / 2.0 / self._up / self._in_rate
+
+	def reset_stats(self):
+		"""Resets the counters and returns their previous values."""
+		stats = self.stats
+		self._reset_counters()
+		return stats
+
+	@property
+	def stats(self):
+		"""Conversion counters since the last reset_stats() call.
+
+		cpu_per_second is the processing time spent per second of
+		input audio, so 0.001 means 1 ms of CPU for every second of it.
+		"""
+		seconds = self._samples_in / float(self._in_rate)
+		return {
+			'in_rate': self._in_rate,
+			'out_rate': self._out_rate,
+			'samples_in': self._samples_in,
+			'samples_out': self._samples_out,
+			'process_time': self._process_time,
+			'cpu_per_second': self._process_time / seconds if seconds else 0.0,
+		}
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Energy and zero-crossing voice activity detection.
+
+Audio is cut into short frames. A frame counts as speech when its RMS
+energy clears a threshold that adapts to the background noise and its
+zero-crossing rate is below that of broadband noise. Whole chunks are
+analysed at once through NumPy, or frame by frame through audioop when
+NumPy is not available.
+"""
+
+import array
+import collections
+import math
+import time
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+try:
+	import audioop
+except ImportError:
+	# audioop was removed from the standard library in Python 3.13.
+	audioop = None
+
+from . import gain
+
+# Gate states
+LEADING_SILENCE = 'leading_silence'
+SPEECH = 'speech'
+ENDED = 'ended'
+
+
+def frame_features(buf, sample_width, frame_samples):
+	"""Returns the RMS energy and zero-crossing rate of every frame.
+
+	Args:
+	  buf: bytes-like object containing whole frames of audio.
+	  sample_width: size of a single sample in bytes (2 or 4).
+	  frame_samples: number of samples per frame.
+	Returns:
+	  (energies, crossing_rates) sequences, one entry per frame. The
+	  crossing rate is the fraction of sample pairs that change sign.
+	"""
+	frame_bytes = frame_samples * sample_width
+	count = len(buf) // frame_bytes
+	if np is not None and sample_width in gain._NUMPY_DTYPES:
+		samples = np.frombuffer(buf, dtype=gain._NUMPY_DTYPES[sample_width],
+								count=count * frame_samples)
+		frames = samples.reshape(count, frame_samples).astype('float32')
+		energies = np.sqrt(np.mean(frames * frames, axis=1))
+		crossings = np.count_nonzero(np.diff(np.signbit(frames), axis=1),
+									 axis=1)
+		return energies, crossings / float(frame_samples - 1)
+	view = memoryview(buf).cast('B')
+	energies = []
+	crossing_rates = []
+	for idx in range(count):
+		frame = view[idx * frame_bytes:(idx + 1) * frame_bytes]
+		if audioop is not None:
+			energies.append(audioop.rms(frame, sample_width))
+			crossings = audioop.cross(frame, sample_width)
+		else:
+			samples = array.array(gain._ARRAY_TYPECODES[sample_width],
+								  frame.tobytes())
+			energies.append(math.sqrt(sum(s * s for s in samples) /
+									  float(frame_samples)))
+			crossings = sum(1 for a, b in zip(samples, samples[1:])
+							if (a < 0) != (b < 0))
+		crossing_rates.append(crossings / float(frame_samples - 1))
+	return energies, crossing_rates
+
+
+class VoiceActivityGate(object):
+	"""Trims leading silence and ends an utterance after trailing silence.
+
+	process() is fed the recorded chunks in order and returns the audio
+	that should be sent: nothing while the user has not started talking,
+	then everything from a short pre-roll before the first speech frame
+	on. Once speech has been followed by hangover_ms of silence the gate
+	ends the utterance.
+
+	Args:
+	  sample_rate: sample rate in hertz.
+	  sample_width: size of a single sample in bytes.
+	  frame_ms: analysis frame length in milliseconds.
+	  energy_threshold: minimum RMS energy of a speech frame.
+	  noise_ratio: how far above the measured noise floor a speech frame
+	    must be, if that is higher than energy_threshold.
+	  max_crossing_rate: maximum zero-crossing rate of a speech frame.
+	  hangover_ms: trailing silence that ends the utterance.
+	  pre_roll_ms: audio kept from before the first speech frame.
+	  max_leading_silence_ms: leading silence after which audio is sent
+	    anyway, leaving the decision to the server.
+	"""
+	def __init__(self, sample_rate, sample_width, frame_ms=20,
+				 energy_threshold=300, noise_ratio=3.0, max_crossing_rate=0.5,
+				 hangover_ms=600, pre_roll_ms=200,
+				 max_leading_silence_ms=5000):
+		gain.check_sample_width(sample_width)
+		if sample_width == 3:
+			raise Exception('unsupported sample width:', sample_width)
+		self._sample_width = sample_width
+		self._bytes_per_ms = sample_rate * sample_width / 1000.0
+		self._frame_samples = int(sample_rate * frame_ms / 1000)
+		self._frame_bytes = self._frame_samples * sample_width
+		self._frame_ms = frame_ms
+		self._energy_threshold = energy_threshold
+		self._noise_ratio = noise_ratio
+		self._max_crossing_rate = max_crossing_rate
+		self._hangover_ms = hangover_ms
+		self._pre_roll_bytes = int(pre_roll_ms * self._bytes_per_ms)
+		self._max_leading_silence_ms = max_leading_silence_ms
+		self._carry = b''
+		self._pre_roll = collections.deque()
+		self.reset()
+
+	def reset(self):
+		"""Prepares the gate for a new utterance."""
+		self._state = LEADING_SILENCE
+		self._carry = b''
+		self._pre_roll.clear()
+		self._pre_roll_size = 0
+		self._noise_floor = None
+		self._silence_ms = 0
+		self._received = 0
+		self._sent = 0
+		self._start_time = time.monotonic()
+		self._speech_start_ms = None
+		self._speech_end_ms = None
+		self._ended_time = None
+		self._processing_time = 0.0
+		self._chunks = 0
+
+	@property
+	def state(self):
+		"""LEADING_SILENCE, SPEECH or ENDED."""
+		return self._state
+
+	@property
+	def ended(self):
+		"""True once the utterance has ended."""
+		return self._state == ENDED
+
+	def _speech_frames(self, chunk):
+		"""Classifies the whole frames available after this chunk."""
+		data = self._carry + bytes(chunk) if self._carry else chunk
+		usable = len(data) - len(data) % self._frame_bytes
+		self._carry = bytes(data[usable:])
+		if not usable:
+			return []
+		energies, crossing_rates = frame_features(
+			memoryview(data)[:usable], self._sample_width,
+			self._frame_samples)
+		threshold = self._energy_threshold
+		if self._noise_floor is not None:
+			threshold = max(threshold, self._noise_floor * self._noise_ratio)
+		if np is not None and not isinstance(energies, list):
+			speech = (energies >= threshold) & (
+				crossing_rates <= self._max_crossing_rate)
+			quiet = energies[~speech]
+			quiet_mean = float(quiet.mean()) if len(quiet) else None
+			speech = speech.tolist()
+		else:
+			speech = [e >= threshold and z <= self._max_crossing_rate
+					  for e, z in zip(energies, crossing_rates)]
+			quiet = [e for e, s in zip(energies, speech) if not s]
+			quiet_mean = sum(quiet) / float(len(quiet)) if quiet else None
+		if quiet_mean is not None and self._state == LEADING_SILENCE:
+			# Track the background noise while waiting for speech.
+			if self._noise_floor is None:
+				self._noise_floor = quiet_mean
+			else:
+				self._noise_floor = 0.8 * self._noise_floor + 0.2 * quiet_mean
+		return speech
+
+	def process(self, chunk):
+		"""Returns the part of the chunk that should be sent upstream.
+
+		Args:
+		  chunk: the next bytes-like chunk of recorded audio.
+		"""
+		if self._state == ENDED:
+			return b''
+		started = time.perf_counter()
+		self._chunks += 1
+		chunk_start_ms = self._received / self._bytes_per_ms
+		self._received += len(chunk)
+		speech = self._speech_frames(chunk)
+		out = b''
+
+		if self._state == LEADING_SILENCE:
+			if True in speech:
+				first = speech.index(True)
+				self._speech_start_ms = chunk_start_ms + first * self._frame_ms
+				self._state = SPEECH
+			elif self._received / self._bytes_per_ms >= \
+					self._max_leading_silence_ms:
+				# Nothing sounded like speech, maybe the microphone is
+				# quiet: send the audio and let the server decide.
+				self._state = SPEECH
+			if self._state == SPEECH:
+				out = b''.join(self._pre_roll) + bytes(chunk)
+				self._pre_roll.clear()
+				self._pre_roll_size = 0
+			else:
+				self._keep_pre_roll(chunk)
+			speech = speech[speech.index(True):] if True in speech else []
+
+		if self._state == SPEECH:
+			if not out:
+				out = bytes(chunk)
+			if True in speech:
+				if self._speech_start_ms is None:
+					self._speech_start_ms = (
+						chunk_start_ms + speech.index(True) * self._frame_ms)
+				last = len(speech) - 1 - speech[::-1].index(True)
+				self._silence_ms = (len(speech) - 1 - last) * self._frame_ms
+			else:
+				self._silence_ms += len(speech) * self._frame_ms
+			# Only end utterances that were actually heard.
+			if (self._speech_start_ms is not None and
+					self._silence_ms >= self._hangover_ms):
+				self._state = ENDED
+				self._ended_time = time.monotonic()
+				self._speech_end_ms = (self._received / self._bytes_per_ms -
+									   self._silence_ms)
+
+		self._sent += len(out)
+		self._processing_time += time.perf_counter() - started
+		return out
+
+	def _keep_pre_roll(self, chunk):
+		self._pre_roll.append(bytes(chunk))
+		self._pre_roll_size += len(chunk)
+		while (self._pre_roll_size - len(self._pre_roll[0]) >=
+			   self._pre_roll_bytes and len(self._pre_roll) > 1):
+			self._pre_roll_size -= len(self._pre_roll.popleft())
+
+	@property
+	def metrics(self):
+		"""Timing of the current utterance, in milliseconds of audio.
+
+		speech_start_ms and speech_end_ms are offsets in the recording,
+		trimmed_ms is the leading audio that was not sent, ended_after_ms
+		is the wall time from reset() until the gate ended the utterance,
+		and processing_ms is the time spent analysing audio.
+		"""
+		return {
+			'state': self._state,
+			'recorded_ms': self._received / self._bytes_per_ms,
+			'sent_ms': self._sent / self._bytes_per_ms,
+			'trimmed_ms': (self._received - self._sent) / self._bytes_per_ms,
+			'speech_start_ms': self._speech_start_ms,
+			'speech_end_ms': self._speech_end_ms,
+			'ended_after_ms': (None if self._ended_time is None else
+							   1000 * (self._ended_time - self._start_time)),
+			'chunks': self._chunks,
+			'processing_ms': 1000 * self._processing_time,
+		}
@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Memory-mapped WAV and RAW audio files.
+
+Regression tests and replays read whole recordings through the same
+source and sink interface as the sound devices. MappedWaveSource maps
+the file once and serves each read() as a memoryview slice of it, so no
+audio is copied until it leaves the process; MappedWaveSink maps the
+file it writes, growing it in large steps, and fills in the WAV header
+on close(). Sizes are kept in whole frames: reads return whole frames,
+and partial frames written are held back until they are complete.
+
+Both run as fast as they are called by default. A source can also be
+paced at real time, like a microphone.
+"""
+
+import logging
+import mmap
+import os
+import struct
+import time
+
+_RIFF_HEADER = struct.Struct('<4sI4s')
+_CHUNK_HEADER = struct.Struct('<4sI')
+_FMT = struct.Struct('<HHIIHH')
+# Format code at the start of a WAVE_FORMAT_EXTENSIBLE fmt chunk's
+# SubFormat GUID.
+_SUBFORMAT = struct.Struct('<H')
+_SUBFORMAT_OFFSET = 24
+_WAVE_FORMAT_PCM = 1
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+# RIFF, fmt and data chunk headers of the files MappedWaveSink writes.
+_WAV_HEADER_SIZE = 44
+
+
+def _parse_wav(data):
+	"""Returns (format, offset, size) of the audio in a WAV file.
+
+	format is a (channels, sample_rate, sample_width) tuple; None if the
+	data is not a WAV file.
+	"""
+	if len(data) < _RIFF_HEADER.size:
+		return None
+	riff, _, wave_id = _RIFF_HEADER.unpack_from(data)
+	if riff != b'RIFF' or wave_id != b'WAVE':
+		return None
+	fmt = None
+	offset = _RIFF_HEADER.size
+	while offset + _CHUNK_HEADER.size <= len(data):
+		chunk_id, size = _CHUNK_HEADER.unpack_from(data, offset)
+		offset += _CHUNK_HEADER.size
+		if chunk_id == b'fmt ':
+			(encoding, channels, sample_rate, _, _,
+			 bits) = _FMT.unpack_from(data, offset)
+			if encoding == _WAVE_FORMAT_EXTENSIBLE:
+				if size < _SUBFORMAT_OFFSET + _SUBFORMAT.size:
+					raise Exception('unsupported WAV file: short fmt chunk')
+				encoding, = _SUBFORMAT.unpack_from(
+					data, offset + _SUBFORMAT_OFFSET)
+			if encoding != _WAVE_FORMAT_PCM:
+				raise Exception('unsupported WAV encoding:', encoding)
+			fmt = (channels, sample_rate, bits // 8)
+		elif chunk_id == b'data':
+			if fmt is None:
+				raise Exception('unsupported WAV file: data before fmt')
+			# Files still being written may not have their size set yet.
+			return fmt, offset, min(size, len(data) - offset)
+		# Chunks are padded to an even size.
+		offset += size + (size & 1)
+	raise Exception('unsupported WAV file: no data chunk')
+
+
+class MappedWaveSource(object):
+	"""Audio source serving a WAV or RAW file from memory.
+
+	read() returns memoryview slices of the mapped file; they stay valid
+	while the source is open.
+
+	Args:
+	  path: mono PCM WAV file, or RAW file of samples in the given
+	    format.
+	  sample_rate: sample rate in hertz.
+	  sample_width: size of a single sample in bytes.
+	  realtime: whether reads block for the duration of the audio they
+	    return. Off, the file is served as fast as it is read.
+	  pad_silence: whether reads past the end of the file return silence,
+	    like a microphone would. Off, they return b''.
+	"""
+	def __init__(self, path, sample_rate, sample_width, realtime=False,
+				 pad_silence=True):
+		self._file = open(path, 'rb')
+		size = os.fstat(self._file.fileno()).st_size
+		self._map = None
+		self._view = memoryview(b'')
+		if size:
+			self._map = mmap.mmap(self._file.fileno(), 0,
+								  access=mmap.ACCESS_READ)
+			self._view = memoryview(self._map)
+		self._frame_bytes = sample_width
+		self._start = 0
+		self._end = size
+		try:
+			wav = _parse_wav(self._view)
+		except Exception:
+			self.close()
+			raise
+		if wav is None:
+			logging.warning('%s is not a WAV file, reading it as RAW', path)
+		else:
+			(channels, wav_rate, wav_width), self._start, data_size = wav
+			if (channels != 1 or wav_rate != sample_rate or
+					wav_width != sample_width):
+				self.close()
+				raise Exception('unsupported WAV format:', channels, wav_rate,
+								wav_width)
+			self._end = self._start + data_size
+		# A truncated last frame is not served.
+		self._end -= (self._end - self._start) % self._frame_bytes
+		self._sample_rate = sample_rate
+		self._bytes_per_second = float(sample_rate * self._frame_bytes)
+		self._realtime = realtime
+		self._pad_silence = pad_silence
+		self._silence = bytearray()
+		self._position = self._start
+		self._next_read = None
+		self._bytes_read = 0
+		self._silence_bytes = 0
+
+	def read(self, size):
+		"""Returns the next whole frames of at most size bytes.
+
+		Near the end of the file fewer bytes are returned, and past it
+		silence or b''.
+		"""
+		size -= size % self._frame_bytes
+		left = self._end - self._position
+		if left > 0:
+			data = self._view[self._position:self._position + min(size, left)]
+			self._position += len(data)
+		elif self._pad_silence:
+			if len(self._silence) < size:
+				self._silence = bytearray(size)
+			data = memoryview(self._silence)[:size]
+			self._silence_bytes += size
+		else:
+			return b''
+		self._bytes_read += len(data)
+		if self._realtime:
+			# Wait out the previous read, so the first one is not held up.
+			now = time.monotonic()
+			if self._next_read is not None and self._next_read > now:
+				time.sleep(self._next_read - now)
+				now = self._next_read
+			self._next_read = now + len(data) / self._bytes_per_second
+		return data
+
+	def rewind(self):
+		"""Serves the file again from its start."""
+		self._position = self._start
+		self._next_read = None
+
+	@property
+	def frames(self):
+		"""Number of frames in the file."""
+		return (self._end - self._start) // self._frame_bytes
+
+	@property
+	def duration(self):
+		"""Length of the file's audio in seconds."""
+		return (self._end - self._start) / self._bytes_per_second
+
+	@property
+	def position(self):
+		"""Frames of the file served so far."""
+		return (self._position - self._start) // self._frame_bytes
+
+	@property
+	def stats(self):
+		"""Bytes and frames returned by read(), and the silence among them."""
+		return {
+			'bytes_read': self._bytes_read,
+			'frames_read': self._bytes_read // self._frame_bytes,
+			'silence_bytes': self._silence_bytes,
+		}
+
+	def start(self):
+		pass
+
+	def stop(self):
+		pass
+
+	def close(self):
+		"""Unmaps and closes the file."""
+		self._view.release()
+		if self._map is not None:
+			try:
+				self._map.close()
+			except BufferError:
+				# Slices are still in use; the map goes with the last.
+				pass
+			self._map = None
+		self._file.close()
+
+	@property
+	def sample_rate(self):
+		return self._sample_rate
+
+
+class MappedWaveSink(object):
+	"""Audio sink writing a mono WAV file through a memory map.
+
+	The file grows by grow_size bytes at a time and is cut to the audio
+	written, with its header filled in, on close().
+
+	Args:
+	  path: the WAV file to write.
+	  sample_rate: sample rate in hertz.
+	  sample_width: size of a single sample in bytes.
+	  grow_size: bytes the file grows by when full.
+	"""
+	def __init__(self, path, sample_rate, sample_width, grow_size=1 << 20):
+		self._file = open(path, 'w+b')
+		self._sample_rate = sample_rate
+		self._sample_width = sample_width
+		self._grow_size = grow_size
+		self._capacity = 0
+		self._map = None
+		self._position = _WAV_HEADER_SIZE
+		self._carry = b''
+		self._frames_written = 0
+		self._grow(_WAV_HEADER_SIZE + grow_size)
+
+	def _grow(self, capacity):
+		if self._map is not None:
+			# Some platforms cannot resize a file while it is mapped.
+			self._map.close()
+		self._file.truncate(capacity)
+		self._map = mmap.mmap(self._file.fileno(), capacity)
+		self._capacity = capacity
+
+	def write(self, data):
+		"""Appends audio; a trailing partial frame waits for the next write.
+
+		Args:
+		  data: bytes-like frame data to write.
+		"""
+		if self._carry:
+			data = self._carry + bytes(data)
+			self._carry = b''
+		size = len(data)
+		whole = size - size % self._sample_width
+		if whole < size:
+			self._carry = bytes(data[whole:])
+		if not whole:
+			return
+		end = self._position + whole
+		if end > self._capacity:
+			self._grow(max(end, self._capacity + self._grow_size))
+		self._map[self._position:end] = data[:whole] if whole < size else data
+		self._position = end
+		self._frames_written += whole // self._sample_width
+
+	@property
+	def frames_written(self):
+		"""Whole frames written so far."""
+		return self._frames_written
+
+	def close(self):
+		"""Writes the WAV header, cuts the file to size and closes it."""
+		data_size = self._position - _WAV_HEADER_SIZE
+		self._map[:_WAV_HEADER_SIZE] = (
+			_RIFF_HEADER.pack(b'RIFF', self._position - 8, b'WAVE') +
+			_CHUNK_HEADER.pack(b'fmt ', _FMT.size) +
+			_FMT.pack(_WAVE_FORMAT_PCM, 1, self._sample_rate,
+					  self._sample_rate * self._sample_width,
+					  self._sample_width, 8 * self._sample_width) +
+			_CHUNK_HEADER.pack(b'data', data_size))
+		self._map.flush()
+		self._map.close()
+		self._map = None
+		self._file.truncate(self._position)
+		self._file.close()
+
+	def start(self):
+		pass
+
+	def stop(self):
+		pass
@@ -14,8 +14,10 @@
 
 """auth_helpers implements InstalledApp authorization flow helpers."""
 
+import datetime
 import json
 import os
+import tempfile
 
 import google.auth
 import google.auth.transport.grpc
@@ -24,6 +26,9 @@ import google_auth_oauthlib.flow
 import google.oauth2.credentials
 import grpc
 
+# How access token expiry times are stored, in UTC.
+EXPIRY_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
 
 def credentials_flow_interactive(client_secrets_path, scopes):
     """Initiate an interactive OAuth2InstalledApp flow.
@@ -49,7 +54,11 @@ def credentials_flow_interactive(client_secrets_path, scopes):
 
 
 def credentials_to_dict(credentials):
+    expiry = None
+    if credentials.expiry:
+        expiry = credentials.expiry.strftime(EXPIRY_FORMAT)
     return {'access_token': credentials.token,
+            'expiry': expiry,
             'refresh_token': credentials.refresh_token,
             'token_uri': credentials.token_uri,
             'client_id': credentials.client_id,
@@ -57,8 +66,17 @@ def credentials_to_dict(credentials):
 
 
 def credentials_from_dict(credentials, scopes):
+    token = credentials['access_token']
+    expiry = credentials.get('expiry')
+    if expiry:
+        expiry = datetime.datetime.strptime(expiry, EXPIRY_FORMAT)
+    else:
+        # Without an expiry the token would look valid forever; drop it
+        # so it gets refreshed before use.
+        token = None
     return google.oauth2.credentials.Credentials(
-        token=credentials['access_token'],
+        token=token,
+        expiry=expiry,
         refresh_token=credentials['refresh_token'],
         token_uri=credentials['token_uri'],
         client_id=credentials['client_id'],
@@ -68,15 +86,28 @@ def credentials_from_dict(credentials, scopes):
 
 def save_credentials(path, credentials):
     """Write credentials to the given file.
+
+    The file is replaced atomically, so a reader never sees it half
+    written, even if the process dies while saving.
+
     Args:
       path(str): path to the credentials file.
       credentials(google.oauth2.credentials.Credentials): OAuth2 credentials.
     """
     config_path = os.path.dirname(path)
-    if not os.path.isdir(config_path):
+    if config_path and not os.path.isdir(config_path):
         os.makedirs(config_path)
-    with open(path, 'w') as f:
-        json.dump(credentials_to_dict(credentials), f)
+    fd, tmp_path = tempfile.mkstemp(dir=config_path or None,
+                                    prefix='.credentials-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(credentials_to_dict(credentials), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
 
 
 def load_credentials(path, scopes):
@@ -109,10 +140,39 @@ def create_grpc_channel(target, credentials, ssl_credentials_file=None,
         with open(ssl_credentials_file) as f:
             ssl_credentials = grpc.ssl_channel_credentials(f.read())
     http_request = google.auth.transport.requests.Request()
-    # TODO(proppy): figure out if/why we need to force a refresh.
-    # if yes, consider remove access token from serialized credentials.
-    credentials.refresh(http_request)
+    # Tokens are no longer forced to refresh here: saved tokens carry
+    # their expiry, and invalid ones are refreshed by the channel's auth
+    # plugin on first use, off the calling thread.
     return google.auth.transport.grpc.secure_authorized_channel(
         credentials, http_request, target,
         ssl_credentials=ssl_credentials,
         options=grpc_channel_options)
+
+
+def create_aio_grpc_channel(target, credentials, ssl_credentials_file=None,
+                            grpc_channel_options=[]):
+    """Create and return an asyncio gRPC channel.
+
+    Must be called from the thread running the event loop that will use
+    the channel.
+
+    Args:
+      credentials(google.oauth2.credentials.Credentials): OAuth2 credentials.
+      ssl_credentials_file(str): Path to SSL credentials.pem file
+        (for testing).
+      grpc_channel_options([(option_name, option_val)]): gRPC channel options.
+    Returns:
+      grpc.aio.Channel.
+    """
+    root_certificates = None
+    if ssl_credentials_file:
+        with open(ssl_credentials_file, 'rb') as f:
+            root_certificates = f.read()
+    ssl_credentials = grpc.ssl_channel_credentials(root_certificates)
+    http_request = google.auth.transport.requests.Request()
+    metadata_plugin = google.auth.transport.grpc.AuthMetadataPlugin(
+        credentials, http_request)
+    channel_credentials = grpc.composite_channel_credentials(
+        ssl_credentials, grpc.metadata_call_credentials(metadata_plugin))
+    return grpc.aio.secure_channel(target, channel_credentials,
+                                   options=grpc_channel_options)
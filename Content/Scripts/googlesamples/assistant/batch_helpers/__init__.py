@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Runs recorded requests through the Assistant in bulk.
+
+Every WAV file of a corpus is sent as the audio of its own Converse
+call, a bounded number of calls at a time. Requests are built the way
+the game builds them: a ConverseConfig first, then the audio read
+through a ConversationStream, encoded as configured. Once the file runs
+out, a little silence follows so the Assistant can hear the request
+end. The transcript, the response text and audio and the latency of
+each request are written to a results file, CSV or, with pyarrow,
+Parquet; rows are written as requests finish, so an interrupted run
+can be resumed without sending the files that already succeeded.
+"""
+
+import concurrent.futures
+import csv
+import logging
+import os
+import threading
+import time
+
+import grpc
+
+try:
+	import pyarrow
+	import pyarrow.parquet
+except ImportError:
+	pyarrow = None
+
+from google.rpc import code_pb2
+from googlesdk.assistant.embedded.v1alpha1 import embedded_assistant_pb2
+
+from .. import assistant_helpers, common_settings
+from ..audio_helpers import (
+	ConversationStream,
+	FlacEncoder,
+	MappedWaveSink,
+	MappedWaveSource,
+)
+
+END_OF_UTTERANCE = embedded_assistant_pb2.ConverseResponse.END_OF_UTTERANCE
+
+# Columns of the results file, in order.
+COLUMNS = (
+	'path', 'status', 'error', 'transcript', 'response_text',
+	'response_audio', 'request_ms', 'request_bytes', 'response_bytes',
+	'end_of_utterance_ms', 'transcript_ms', 'first_audio_ms', 'total_ms',
+)
+_NUMBER_COLUMNS = frozenset(COLUMNS[6:])
+# Status of a request that went through.
+OK = 'OK'
+
+
+def find_requests(corpus):
+	"""Returns the WAV files under a directory, relative to it, sorted."""
+	paths = []
+	for root, _, files in os.walk(corpus):
+		for name in files:
+			if name.lower().endswith('.wav'):
+				paths.append(os.path.relpath(os.path.join(root, name), corpus))
+	return sorted(paths)
+
+
+class ResultsFile(object):
+	"""Results of a batch run, one row per request.
+
+	A CSV file gets each row appended as it is added. A Parquet file,
+	which needs pyarrow, is written in one go by close(). Rows of an
+	existing file are kept; those of requests that failed are dropped
+	so they are sent again.
+
+	Args:
+	  path: a .csv or .parquet file.
+	"""
+	def __init__(self, path):
+		self._path = path
+		self._parquet = path.lower().endswith('.parquet')
+		if self._parquet and pyarrow is None:
+			raise Exception('unsupported results file without pyarrow:', path)
+		self._lock = threading.Lock()
+		self._rows = [row for row in self._load() if row['status'] == OK]
+		self.done = set(row['path'] for row in self._rows)
+		self._csv = None
+		if not self._parquet:
+			self._file = open(path + '.tmp', 'w', newline='')
+			self._csv = csv.DictWriter(self._file, COLUMNS)
+			self._csv.writeheader()
+			self._csv.writerows(self._rows)
+			self._file.flush()
+			os.replace(path + '.tmp', path)
+
+	def _load(self):
+		if not os.path.exists(self._path):
+			return []
+		if self._parquet:
+			return pyarrow.parquet.read_table(self._path).to_pylist()
+		with open(self._path, newline='') as f:
+			return list(csv.DictReader(f))
+
+	def add(self, row):
+		with self._lock:
+			self._rows.append(row)
+			if self._csv is not None:
+				self._csv.writerow(row)
+				self._file.flush()
+
+	@property
+	def rows(self):
+		"""The rows kept and added, in the order they finished."""
+		return list(self._rows)
+
+	def close(self):
+		with self._lock:
+			if self._csv is not None:
+				self._file.close()
+				self._csv = None
+			elif self._parquet:
+				columns = dict((name, [row.get(name) for row in self._rows])
+							   for name in COLUMNS)
+				for name in _NUMBER_COLUMNS:
+					columns[name] = [None if value in (None, '') else
+									 float(value) for value in columns[name]]
+				pyarrow.parquet.write_table(pyarrow.table(columns), self._path)
+
+
+class BatchRunner(object):
+	"""Sends the requests of a corpus through concurrent Converse calls.
+
+	Args:
+	  assistant: an EmbeddedAssistantStub.
+	  results: the ResultsFile to add a row to per request.
+	  audio_dir: where response audio is saved, as <request>.response.wav,
+	    or None not to save it.
+	  workers: number of calls in flight at a time.
+	  deadline: deadline of each call in seconds.
+	  realtime: whether requests are sent at the pace they were recorded.
+	  trailing_silence_ms: silence sent after each file.
+	"""
+	def __init__(self, assistant, results, audio_dir=None,
+				 workers=common_settings.DEFAULT_BATCH_WORKERS,
+				 deadline=common_settings.DEFAULT_GRPC_DEADLINE,
+				 realtime=False, trailing_silence_ms=1000):
+		self._assistant = assistant
+		self._results = results
+		self._audio_dir = audio_dir
+		self._workers = workers
+		self._deadline = deadline
+		self._realtime = realtime
+		self._sample_rate = common_settings.DEFAULT_AUDIO_SAMPLE_RATE
+		self._sample_width = common_settings.DEFAULT_AUDIO_SAMPLE_WIDTH
+		self._iter_size = common_settings.DEFAULT_AUDIO_ITER_SIZE
+		self._trailing_bytes = int(trailing_silence_ms * self._sample_rate *
+								   self._sample_width / 1000)
+
+	def run(self, corpus, paths, on_result=None):
+		"""Sends the requests not done yet.
+
+		Args:
+		  corpus: the directory the paths are relative to.
+		  paths: WAV files of the requests, see find_requests().
+		  on_result: called with each row as it is added.
+		Returns:
+		  Number of requests sent.
+		"""
+		todo = [path for path in paths if path not in self._results.done]
+		with concurrent.futures.ThreadPoolExecutor(self._workers) as pool:
+			futures = dict((pool.submit(self.converse_file, corpus, path), path)
+						   for path in todo)
+			for future in concurrent.futures.as_completed(futures):
+				path = futures[future]
+				try:
+					row = future.result()
+				except Exception as e:
+					# One broken request must not end the run.
+					row = dict((name, None) for name in COLUMNS)
+					row['path'] = path
+					row['status'] = 'CLIENT_ERROR'
+					row['error'] = str(e)
+					logging.warning('%s: %s %s', path, row['status'],
+									row['error'])
+				self._results.add(row)
+				if on_result is not None:
+					on_result(row)
+		return len(todo)
+
+	def _encoder(self):
+		encoding = common_settings.DEFAULT_AUDIO_IN_ENCODING
+		if encoding == 'FLAC':
+			return FlacEncoder(
+				sample_rate=self._sample_rate,
+				sample_width=self._sample_width,
+				block_samples=int(self._iter_size / self._sample_width))
+		if encoding == 'LINEAR16':
+			return None
+		raise Exception('unsupported audio encoding:', encoding)
+
+	def _gen_converse_requests(self, stream, source, sent):
+		yield assistant_helpers.converse_config_request(stream)
+		for request in assistant_helpers.gen_audio_requests(stream):
+			sent[0] += len(request.audio_in)
+			yield request
+			if source.stats['silence_bytes'] >= self._trailing_bytes:
+				stream.stop_recording()
+
+	def converse_file(self, corpus, path):
+		"""Sends one request; returns its row of results."""
+		row = dict((name, None) for name in COLUMNS)
+		row['path'] = path
+		try:
+			source = MappedWaveSource(
+				os.path.join(corpus, path), self._sample_rate,
+				self._sample_width, realtime=self._realtime)
+		except Exception as e:
+			row['status'] = 'UNSUPPORTED_FILE'
+			row['error'] = str(e)
+			return row
+		row['request_ms'] = 1000 * source.duration
+		sink = None
+		if self._audio_dir is not None:
+			row['response_audio'] = os.path.splitext(path)[0] + '.response.wav'
+			audio_path = os.path.join(self._audio_dir, row['response_audio'])
+			os.makedirs(os.path.dirname(audio_path) or '.', exist_ok=True)
+			sink = MappedWaveSink(audio_path, self._sample_rate,
+								  self._sample_width)
+		stream = ConversationStream(
+			source=source, sink=sink or _NoSink(), iter_size=self._iter_size,
+			sample_width=self._sample_width, encoder=self._encoder())
+		sent = [0]
+		response_bytes = 0
+		started = time.monotonic()
+
+		def elapsed_ms():
+			return round(1000 * (time.monotonic() - started), 1)
+
+		try:
+			stream.start_recording()
+			responses = self._assistant.Converse(
+				self._gen_converse_requests(stream, source, sent),
+				self._deadline)
+			row['status'] = OK
+			for resp in responses:
+				if resp.error.code != code_pb2.OK:
+					row['status'] = 'SERVER_ERROR'
+					row['error'] = resp.error.message
+					break
+				if (resp.event_type == END_OF_UTTERANCE and
+						row['end_of_utterance_ms'] is None):
+					row['end_of_utterance_ms'] = elapsed_ms()
+					stream.stop_recording()
+				if resp.result.spoken_request_text:
+					row['transcript'] = resp.result.spoken_request_text
+					row['transcript_ms'] = elapsed_ms()
+				if resp.result.spoken_response_text:
+					row['response_text'] = resp.result.spoken_response_text
+				audio = resp.audio_out.audio_data
+				if audio:
+					if row['first_audio_ms'] is None:
+						row['first_audio_ms'] = elapsed_ms()
+					response_bytes += len(audio)
+					if sink is not None:
+						sink.write(audio)
+		except grpc.RpcError as e:
+			row['status'] = e.code().name
+			row['error'] = e.details()
+		finally:
+			stream.stop_recording()
+			stream.close()
+		row['total_ms'] = elapsed_ms()
+		row['request_bytes'] = sent[0]
+		row['response_bytes'] = response_bytes
+		if row['status'] != OK:
+			logging.warning('%s: %s %s', path, row['status'], row['error'])
+		return row
+
+
+class _NoSink(object):
+	"""Sink for runs that do not save the response audio."""
+	def write(self, buf):
+		return len(buf)
+
+	def start(self):
+		pass
+
+	def stop(self):
+		pass
+
+	def close(self):
+		pass
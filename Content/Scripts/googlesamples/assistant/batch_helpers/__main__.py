@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Helper command to run a corpus of recorded requests.
+
+- Send every WAV file under a directory to the Assistant.
+- Write the transcripts, answers and latencies to a results file.
+- Run again with the same results file to retry the requests that failed.
+"""
+
+import logging
+import os.path
+import time
+
+import click
+import grpc
+
+from googlesdk.assistant.embedded.v1alpha1 import embedded_assistant_pb2
+
+from . import (
+	BatchRunner,
+	OK,
+	ResultsFile,
+	find_requests,
+)
+from .. import (
+	auth_helpers,
+	common_settings
+)
+
+ASSISTANT_API_ENDPOINT = 'embeddedassistant.googleapis.com'
+
+
+def _percentile(values, fraction):
+	if not values:
+		return float('nan')
+	values = sorted(values)
+	return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+@click.command()
+@click.argument('corpus', type=click.Path(exists=True, file_okay=False))
+@click.argument('results', type=click.Path(dir_okay=False))
+@click.option('--audio-dir', type=click.Path(file_okay=False),
+			  help='Directory to save the response audio to.')
+@click.option('--workers', default=common_settings.DEFAULT_BATCH_WORKERS,
+			  show_default=True, help='Converse calls in flight at a time.')
+@click.option('--api-endpoint', default=ASSISTANT_API_ENDPOINT,
+			  metavar='<api endpoint>', show_default=True,
+			  help='Address of Google Assistant API service.')
+@click.option('--insecure', is_flag=True,
+			  help='Connect without TLS or credentials, e.g. to a local '
+			  'servicer.')
+@click.option('--credentials',
+			  metavar='<oauth2_credentials_file>', show_default=True,
+			  default=os.path.join(
+				  click.get_app_dir(common_settings.ASSISTANT_APP_NAME),
+				  common_settings.ASSISTANT_CREDENTIALS_FILENAME
+			  ),
+			  help='Path to read OAuth2 credentials.')
+@click.option('--realtime', is_flag=True,
+			  help='Send requests at the pace they were recorded.')
+@click.option('--trailing-silence-ms', default=1000, show_default=True,
+			  help='Silence sent after each request.')
+@click.option('--deadline', default=common_settings.DEFAULT_GRPC_DEADLINE,
+			  show_default=True, help='gRPC deadline of each call in seconds.')
+@click.option('--resume/--no-resume', default=True, show_default=True,
+			  help='Keep the successful results of a previous run.')
+def main(corpus, results, audio_dir, workers, api_endpoint, insecure,
+		 credentials, realtime, trailing_silence_ms, deadline, resume):
+	"""Sends every WAV file under CORPUS to the Assistant and writes the
+	results to RESULTS, a .csv or .parquet file.
+	"""
+	logging.basicConfig(level=logging.INFO)
+	if not resume and os.path.exists(results):
+		os.remove(results)
+	if insecure:
+		channel = grpc.insecure_channel(api_endpoint)
+	else:
+		creds = auth_helpers.load_credentials(
+			credentials, scopes=[common_settings.ASSISTANT_OAUTH_SCOPE])
+		channel = auth_helpers.create_grpc_channel(api_endpoint, creds)
+	assistant = embedded_assistant_pb2.EmbeddedAssistantStub(channel)
+	results_file = ResultsFile(results)
+	paths = find_requests(corpus)
+	skipped = len(results_file.done.intersection(paths))
+	runner = BatchRunner(assistant, results_file, audio_dir=audio_dir,
+						 workers=workers, deadline=deadline,
+						 realtime=realtime,
+						 trailing_silence_ms=trailing_silence_ms)
+	rows = []
+
+	def on_result(row):
+		rows.append(row)
+		click.echo('%-8s %s' % (row['status'], row['path']))
+
+	started = time.monotonic()
+	try:
+		runner.run(corpus, paths, on_result)
+	finally:
+		results_file.close()
+		channel.close()
+	elapsed = time.monotonic() - started
+	done = [row for row in rows if row['status'] == OK]
+	totals = [row['total_ms'] for row in done]
+	click.echo('%d done, %d failed, %d skipped in %.1fs (%.2f requests/s)' % (
+		len(done), len(rows) - len(done), skipped, elapsed,
+		len(rows) / elapsed if elapsed else 0.0))
+	click.echo('total time p50 %.0f ms, p95 %.0f ms' % (
+		_percentile(totals, 0.5), _percentile(totals, 0.95)))
+
+
+if __name__ == '__main__':
+	main()
@@ -19,9 +19,98 @@ ASSISTANT_OAUTH_SCOPE = (
     'https://www.googleapis.com/auth/assistant-sdk-prototype'
 )
 ASSISTANT_CREDENTIALS_FILENAME = 'assistant_credentials.json'
+DEFAULT_CREDENTIALS_REFRESH_MARGIN = 300
+DEFAULT_CREDENTIALS_RETRY_DELAY = 5
+DEFAULT_CREDENTIALS_MAX_RETRY_DELAY = 300
 DEFAULT_GRPC_DEADLINE = 60 * 3 + 5
+# Set up the Assistant on first use instead of when ue_site is imported
+LAZY_ASSISTANT_SETUP = True
+DEFAULT_GRPC_KEEPALIVE_TIME_MS = 30000
+DEFAULT_GRPC_KEEPALIVE_TIMEOUT_MS = 10000
+DEFAULT_GRPC_CONNECT_TIMEOUT = 5
+DEFAULT_GRPC_RETRY_ATTEMPTS = 3
+DEFAULT_GRPC_BACKOFF_BASE = 0.25
+DEFAULT_GRPC_BACKOFF_MAX = 4
+# Response bytes a Converse stream receives ahead of being read (2 s)
+DEFAULT_GRPC_STREAM_WINDOW = 65536
 DEFAULT_AUDIO_SAMPLE_RATE = 16000
+# Rates the microphone and the sound wave run at, resampled to and from
+# the rate above; None runs them at it. Most devices and the engine's
+# mixer run at 48000
+DEFAULT_AUDIO_CAPTURE_RATE = None
+DEFAULT_AUDIO_PLAYBACK_RATE = None
+DEFAULT_RESAMPLER_TAPS = 16
 DEFAULT_AUDIO_SAMPLE_WIDTH = 2
+# Encoding of request audio: 'LINEAR16' or 'FLAC'
+DEFAULT_AUDIO_IN_ENCODING = 'LINEAR16'
+# Encoding of response audio: 'LINEAR16' or 'OPUS_IN_OGG'
+DEFAULT_AUDIO_OUT_ENCODING = 'LINEAR16'
 DEFAULT_AUDIO_ITER_SIZE = 3200
 DEFAULT_AUDIO_DEVICE_BLOCK_SIZE = 6400
 DEFAULT_AUDIO_DEVICE_FLUSH_SIZE = 25600
+DEFAULT_AUDIO_CAPTURE_RING_SIZE = 64000
+# Response audio is queued to the engine in blocks of 1024 frames. The
+# jitter buffer releases them once it holds its target depth of audio,
+# which adapts between the min and max depth below.
+DEFAULT_AUDIO_PLAYOUT_BLOCK_SIZE = 2048
+DEFAULT_JITTER_MIN_DEPTH_MS = 60
+DEFAULT_JITTER_MAX_DEPTH_MS = 500
+# Response audio queued to the engine ahead of playback, in bytes (2 s);
+# the responses wait beyond it. Keep it above the jitter buffer's max depth
+DEFAULT_PLAYBACK_QUEUE_SIZE = 64000
+DEFAULT_VAD_ENERGY_THRESHOLD = 300
+DEFAULT_VAD_HANGOVER_MS = 600
+DEFAULT_VAD_PRE_ROLL_MS = 200
+# Keep listening while the Assistant answers, so the user can interrupt it
+FULL_DUPLEX = False
+DEFAULT_BARGE_IN_ECHO_RETURN = 0.3
+DEFAULT_BARGE_IN_MIN_SPEECH_MS = 120
+DEFAULT_BARGE_IN_DUCK_GAIN = 0.3
+DEFAULT_AUDIO_WORKERS = 8
+DEFAULT_MAX_ACTIVE_CONVERSATIONS = 4
+# Converse calls in flight at a time in batch runs
+DEFAULT_BATCH_WORKERS = 8
+# Answer follow-on questions without another key press: the game records
+# again as soon as the answer has played. PREOPEN_FOLLOW_ON also opens
+# the next Converse call while the answer is still playing. Both are off
+# by default, leaving the talk key to start every turn
+AUTO_FOLLOW_ON = False
+PREOPEN_FOLLOW_ON = False
+DEFAULT_MAX_FOLLOW_ON_TURNS = 5
+# Answer repeated requests from a local cache. Off by default, as a
+# cached answer repeats word for word until it expires, e.g. the same
+# joke. Requests with any of the RESPONSE_CACHE_NO_STORE words always get
+# a fresh answer. Set RESPONSE_CACHE_STORE to a file name to keep cached
+# answers across runs
+RESPONSE_CACHE = False
+DEFAULT_RESPONSE_CACHE_TTL = 600
+DEFAULT_RESPONSE_CACHE_ENTRIES = 64
+DEFAULT_RESPONSE_CACHE_BYTES = 8 * 1024 * 1024
+RESPONSE_CACHE_STORE = None
+DEFAULT_RESPONSE_CACHE_STORE_SIZE = 32 * 1024 * 1024
+RESPONSE_CACHE_NO_STORE = (
+    'time', 'date', 'day', 'today', 'tonight', 'tomorrow', 'yesterday',
+    'now', 'weather', 'forecast', 'temperature', 'news', 'latest', 'score',
+    'traffic', 'timer', 'alarm', 'remind', 'reminder',
+)
+# Time the stages of every conversation turn. Set TURN_METRICS_FILE to a
+# file name to export the timings after every turn, as Prometheus text
+# for a .prom file and as JSON lines otherwise
+TURN_METRICS = True
+TURN_METRICS_FILE = None
+# Log messages wait in a queue for the logging thread; warnings and
+# errors of one kind are written at most DEFAULT_LOG_RATE_BURST times
+# every DEFAULT_LOG_RATE_INTERVAL seconds
+DEFAULT_LOG_QUEUE_SIZE = 1024
+DEFAULT_LOG_RATE_BURST = 5
+DEFAULT_LOG_RATE_INTERVAL = 10
+# Log every ConverseRequest and ConverseResponse, without their audio
+LOG_CONVERSE_MESSAGES = False
+# Key that starts a conversation; hold it to talk when PUSH_TO_TALK is set
+TALK_KEY = 'Q'
+PUSH_TO_TALK = False
+DEFAULT_INPUT_DEBOUNCE = 0.25
+PUBSUB_OAUTH_SCOPE = 'https://www.googleapis.com/auth/pubsub'
+PUBSUB_TOPIC_NAME = 'unreal_google_assistant'
+PUBSUB_SUBSCRIPTION_NAME = 'UnrealGoogleAssistantSub'
+PUBSUB_MAX_OUTSTANDING_MESSAGES = 100
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Logging that never blocks the game or conversation threads.
+
+Messages are queued with their format string and arguments and written
+to the Unreal log by a background thread, which is also where they are
+formatted; a message that is never written is never formatted. When the
+queue is full, messages are dropped and counted rather than waited on.
+
+Warnings and errors repeating the same format string are rate-limited:
+each may be written a few times per interval, after which the rest are
+counted and reported with the next one written.
+"""
+
+import queue
+import threading
+import time
+
+import unreal_engine as ue
+
+from . import common_settings
+
+INFO = 'info'
+WARNING = 'warning'
+ERROR = 'error'
+
+
+def _unreal_sink(level, text):
+	if level == ERROR:
+		ue.log_error(text)
+	elif level == WARNING:
+		ue.log_warning(text)
+	else:
+		ue.log(text)
+
+
+class AsyncLog(object):
+	"""Log written from a background thread.
+
+	Args:
+	  sink: callable(level, text) writing a message. Defaults to the
+	    Unreal log.
+	  max_queue: messages waiting to be written before more are dropped.
+	  rate_burst: warnings or errors of one format written per interval.
+	  rate_interval: seconds over which rate_burst applies.
+	"""
+	def __init__(self, sink=None,
+				 max_queue=common_settings.DEFAULT_LOG_QUEUE_SIZE,
+				 rate_burst=common_settings.DEFAULT_LOG_RATE_BURST,
+				 rate_interval=common_settings.DEFAULT_LOG_RATE_INTERVAL):
+		self._sink = sink or _unreal_sink
+		self._queue = queue.Queue(max_queue)
+		self._rate_burst = rate_burst
+		self._rate_interval = rate_interval
+		self._lock = threading.Lock()
+		# Format string -> [interval start, count in interval, suppressed]
+		self._rates = {}
+		self._thread = None
+		self._written = 0
+		self._dropped = 0
+		# Dropped since the last line written, which reports them
+		self._unreported = 0
+		self._suppressed = 0
+
+	def log(self, message, *args):
+		"""Queues an info message; args are applied with % when written.
+
+		The args must not change once logged; a dict passed as the only
+		arg fills %(name)s fields.
+		"""
+		self._put(INFO, message, args, 0)
+
+	def warning(self, message, *args):
+		"""Queues a warning, unless its format repeats too often."""
+		self._write_limited(WARNING, message, args)
+
+	def error(self, message, *args):
+		"""Queues an error, unless its format repeats too often."""
+		self._write_limited(ERROR, message, args)
+
+	def _write_limited(self, level, message, args):
+		now = time.monotonic()
+		with self._lock:
+			rate = self._rates.get(message)
+			if rate is None or now - rate[0] >= self._rate_interval:
+				suppressed = rate[2] if rate is not None else 0
+				rate = self._rates[message] = [now, 0, 0]
+			else:
+				suppressed = 0
+			if rate[1] >= self._rate_burst:
+				rate[2] += 1
+				self._suppressed += 1
+				return
+			rate[1] += 1
+		self._put(level, message, args, suppressed)
+
+	def _put(self, level, message, args, suppressed):
+		if self._thread is None:
+			self._start()
+		try:
+			self._queue.put_nowait((level, message, args, suppressed))
+		except queue.Full:
+			with self._lock:
+				self._dropped += 1
+				self._unreported += 1
+
+	def _start(self):
+		with self._lock:
+			if self._thread is None:
+				self._thread = threading.Thread(target=self._run,
+												name='AssistantLog',
+												daemon=True)
+				self._thread.start()
+
+	def _run(self):
+		while True:
+			item = self._queue.get()
+			try:
+				if item is not None:
+					self._write(*item)
+			finally:
+				self._queue.task_done()
+
+	def _write(self, level, message, args, suppressed):
+		# A single mapping fills named fields, as with the logging module.
+		if len(args) == 1 and isinstance(args[0], dict):
+			args = args[0]
+		try:
+			text = message % args if args else message
+		except Exception as e:
+			text = message + ' ' + repr(args) + ' (' + str(e) + ')'
+		if suppressed:
+			text += ' (' + str(suppressed) + ' similar messages suppressed)'
+		with self._lock:
+			dropped, self._unreported = self._unreported, 0
+		if dropped:
+			self._sink(WARNING, 'Log queue full, ' + str(dropped) +
+					   ' messages dropped')
+		try:
+			self._sink(level, text)
+		except Exception:
+			# Nowhere left to report it.
+			pass
+		self._written += 1
+
+	def flush(self):
+		"""Blocks until the messages queued so far have been written."""
+		if self._thread is not None:
+			self._queue.join()
+
+	@property
+	def stats(self):
+		"""Messages written, dropped while the queue was full and suppressed."""
+		with self._lock:
+			return {
+				'written': self._written,
+				'dropped': self._dropped,
+				'suppressed': self._suppressed,
+			}
+
+
+_log = None
+_log_lock = threading.Lock()
+
+
+def get_log():
+	"""Returns the process-wide AsyncLog, creating it on first use."""
+	global _log
+	if _log is None:
+		with _log_lock:
+			if _log is None:
+				_log = AsyncLog()
+	return _log
+
+
+def log(message, *args):
+	"""Writes an info message to the Unreal log in the background."""
+	get_log().log(message, *args)
+
+
+def log_warning(message, *args):
+	"""Writes a rate-limited warning to the Unreal log in the background."""
+	get_log().warning(message, *args)
+
+
+def log_error(message, *args):
+	"""Writes a rate-limited error to the Unreal log in the background."""
+	get_log().error(message, *args)
+
+
+def flush():
+	"""Blocks until everything logged so far has been written."""
+	if _log is not None:
+		_log.flush()
@@ -1,71 +1,153 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import json
+import os
 import ue_site
-from threading import Thread
-import unreal_engine as ue
+from threading import Thread, Event
 
-class SubscriptionThread(Thread):
+from google.cloud import pubsub_v1
+from googlesamples.assistant import common_settings, log_helpers
 
-  def __init__(self, msg_queue):
+# Google Cloud project that owns the intent topic
+PUBSUB_PROJECT_ID = os.environ.get('GOOGLE_CLOUD_PROJECT', '')
 
-    Thread.__init__(self)
+class IntentRegistry(object):
+  """ Maps intent names to the handlers that act on them.
 
-    self.shutdown_flag = Event()
+  Handlers are called with the decoded message payload (a dict) from
+  the subscriber's callback threads, not the game thread.
+  """
 
-    # Create a new pull subscription on the given topic
-    pubsub_client = pubsub.Client(project=PUBSUB_PROJECT_ID, credentials=creds)
-    topic_name = 'unreal_google_assistant'
-    topic = pubsub_client.topic(topic_name)
+  def __init__(self):
+    self._handlers = {}
 
-    subscription_name = 'UnrealGoogleAssistantSub'
-    self.subscription = topic.subscription(subscription_name)
-    try:
-      self.subscription.create()
-      ue.log('Subscription created')
-    except Exception as e:
-      ue.log_error('Subscription already exists! '+str(e))
+  def register(self, intent, handler=None):
+    """ Registers a handler for an intent. Can be used as a decorator. """
+    if handler is None:
+      return lambda handler: self.register(intent, handler)
+    self._handlers[intent] = handler
+    return handler
 
-  def run(self):
-    """ Poll for new messages from the pull subscription """
+  def unregister(self, intent):
+    self._handlers.pop(intent, None)
+
+  def get(self, intent):
+    return self._handlers.get(intent)
+
+# Handlers used by SubscriptionThread unless it is given its own registry
+intents = IntentRegistry()
+
+@intents.register('move_character')
+def move_character(json_obj):
+  log_helpers.log('%s', json_obj['move'])
+
+def parse_message(data):
+  """ Decodes the JSON payload of a Pub/Sub message into a dict """
+  return json.loads(data.decode('utf-8'))
+
+class SubscriptionThread(Thread):
+  """ Dispatches intents published on the assistant topic.
+
+  Messages arrive over a streaming pull, so they are handled as soon as
+  they are published. Flow control caps how many messages are held at
+  once, and the subscriber client batches the acknowledgements sent back.
+  Set shutdown_flag to stop listening.
 
-    while True:
-      # pull messages
-      results = self.subscription.pull(return_immediately=True)
+  Args:
+    msg_queue: queue of commands for the game thread.
+    subscriber: the pubsub_v1.SubscriberClient to pull with.
+    registry: the IntentRegistry to dispatch to. Defaults to intents.
+    project_id: Google Cloud project that owns the topic.
+  """
 
-      for ack_id, message in results:
+  def __init__(self, msg_queue=None, subscriber=None, registry=None,
+               project_id=None):
 
-          # convert bytes to string and slice string
-          # http://stackoverflow.com/questions/663171/is-there-a-way-to-substring-a-string-in-python
-          json_string = str(message.data)[3:-2]
-          json_string = json_string.replace('\\\\', '')
-          ue.log(json_string)
+    Thread.__init__(self)
+
+    project_id = project_id or PUBSUB_PROJECT_ID
+    if not project_id:
+      # Would only fail later, inside the streaming pull
+      raise Exception('no Pub/Sub project, set GOOGLE_CLOUD_PROJECT')
+
+    self.shutdown_flag = Event()
+    self.msg_queue = msg_queue
+    self.registry = registry or intents
+
+    # Created in run(), once ue_site's setup has the credentials
+    self.subscriber = subscriber
+    self.topic_path = 'projects/{}/topics/{}'.format(
+      project_id, common_settings.PUBSUB_TOPIC_NAME)
+    self.subscription_path = pubsub_v1.SubscriberClient.subscription_path(
+      project_id, common_settings.PUBSUB_SUBSCRIPTION_NAME)
+    self.flow_control = pubsub_v1.types.FlowControl(
+      max_messages=common_settings.PUBSUB_MAX_OUTSTANDING_MESSAGES)
 
-          # create dict from json string
-          try:
-              json_obj = json.loads(json_string)
-          except Exception as e:
-              ue.log_error('JSON Error: %s', e)
+  def run(self):
+    """ Dispatch messages from a streaming pull until shutdown_flag is set """
+
+    if self.subscriber is None:
+      # Waits here rather than in the constructor, which usually runs on
+      # the game thread; ue_site's setup may be lazy or still starting.
+      try:
+        status = ue_site.warm_up().result()
+      except Exception:
+        status = -1
+      if status != 0:
+        log_helpers.log_error('No credentials for Pub/Sub, not listening')
+        return
+      self.subscriber = pubsub_v1.SubscriberClient(credentials=ue_site.creds)
+
+    # Create a new pull subscription on the given topic
+    try:
+      self.subscriber.create_subscription(
+        name=self.subscription_path, topic=self.topic_path)
+      log_helpers.log('Subscription created')
+    except Exception as e:
+      log_helpers.log('Subscription already exists! %s', e)
 
-          # get intent from json
-          intent = json_obj['intent']
-          ue.log('pub/sub: ' + intent)
+    future = self.subscriber.subscribe(
+      self.subscription_path, callback=self.dispatch,
+      flow_control=self.flow_control)
+    # A stream that fails for good also ends the thread
+    future.add_done_callback(lambda future: self.shutdown_flag.set())
+    log_helpers.log('Listening for messages on %s', self.subscription_path)
 
-          # perform action based on intent
-          if intent == 'move_character':
-			ue.log(str(json_obj['move'])
+    self.shutdown_flag.wait()
 
-          #elif intent == 'prime_pump_end':
-          #  if PRIME_WHICH != None:
-          #    ue.log('Stop priming pump ' + PRIME_WHICH)
-          #    self.msg_queue.put('b' + PRIME_WHICH + 'l!') # turn off relay
-          #    PRIME_WHICH = None
+    # Stops pulling and waits for the callbacks in flight to finish
+    future.cancel()
+    try:
+      future.result()
+    except Exception as e:
+      log_helpers.log_error('Pub/Sub streaming pull stopped: %s', e)
+    log_helpers.log('Stopped listening on %s', self.subscription_path)
 
-          #elif intent == 'make_drink':
-          #  make_drink(json_obj['drink'], self.msg_queue)
+  def dispatch(self, message):
+    """ Hands a message to the handler registered for its intent """
 
-      # ack received message
-      if results:
-        self.subscription.acknowledge([ack_id for ack_id, message in results])
+    try:
+      json_obj = parse_message(message.data)
+      intent = json_obj['intent']
+    except (ValueError, KeyError, TypeError) as e:
+      # Redelivering a malformed message would not help
+      log_helpers.log_error('Malformed Pub/Sub message: %s', e)
+      message.ack()
+      return
+
+    log_helpers.log('pub/sub: %s', intent)
+    handler = self.registry.get(intent)
+    if handler is None:
+      log_helpers.log_warning('No handler for intent: %s', intent)
+      message.ack()
+      return
 
-      time.sleep(0.25)
\ No newline at end of file
+    try:
+      handler(json_obj)
+    except Exception as e:
+      # Let Pub/Sub redeliver it
+      log_helpers.log_error('Error handling %s: %s', intent, e)
+      message.nack()
+      return
+    message.ack()
@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Local cache of the Assistant's answers to repeated requests.
+
+Players ask the same few questions over and over. The transcript of a
+request still has to come from the Assistant, but once it matches an
+answer given before, that answer is played from the cache and the rest
+of the Converse call, with its audio, is cancelled.
+
+Answers are looked up by their normalized transcript and the audio
+format they were recorded in. They expire after a time to live, and
+the least recently used go first when the cache is full. The audio can
+be kept in a memory-mapped file instead of memory, which also keeps it
+across runs.
+"""
+
+import collections
+import json
+import mmap
+import os
+import re
+import threading
+import time
+import zlib
+
+from googlesamples.assistant.log_helpers import log_error
+
+_PUNCTUATION = re.compile(r'[^\w\s]+')
+_SPACES = re.compile(r'\s+')
+
+def normalize(text):
+	""" Returns the form of a transcript answers are looked up by.
+
+	Case, punctuation and runs of spaces are ignored, so "What's up?"
+	and "what s up" find the same answer.
+	"""
+	text = _PUNCTUATION.sub(' ', text.lower())
+	return _SPACES.sub(' ', text).strip()
+
+class CachedResponse(object):
+	""" An answer served by the ResponseCache.
+
+	Attributes:
+	  audio: the response audio, as the Assistant sent it.
+	  spoken_response_text: text of the answer, if the Assistant gave it.
+	  volume_percentage: volume the answer asked for, or 0.
+	"""
+	__slots__ = ('audio', 'spoken_response_text', 'volume_percentage')
+
+	def __init__(self, audio, spoken_response_text='', volume_percentage=0):
+		self.audio = audio
+		self.spoken_response_text = spoken_response_text
+		self.volume_percentage = volume_percentage
+
+class _Entry(object):
+	__slots__ = ('expires_at', 'size', 'crc', 'offset', 'audio',
+				 'spoken_response_text', 'volume_percentage')
+
+	def __init__(self, expires_at, size, crc, offset=None, audio=None,
+				 spoken_response_text='', volume_percentage=0):
+		self.expires_at = expires_at
+		self.size = size
+		self.crc = crc
+		# Where the audio is in the MappedStore, or None if in memory.
+		self.offset = offset
+		self.audio = audio
+		self.spoken_response_text = spoken_response_text
+		self.volume_percentage = volume_percentage
+
+class MappedStore(object):
+	""" Keeps cached audio in a memory-mapped file, written as a ring.
+
+	New audio goes after the last one written, wrapping around to the
+	start of the file when it does not fit, over the oldest audio. The
+	index of what is where is saved next to the file as JSON.
+
+	Args:
+	  path: the file to keep the audio in; created if missing.
+	  size: size of the file in bytes.
+	"""
+	def __init__(self, path, size):
+		mode = 'r+b' if os.path.exists(path) else 'w+b'
+		self._file = open(path, mode)
+		if os.fstat(self._file.fileno()).st_size != size:
+			self._file.truncate(size)
+		self._map = mmap.mmap(self._file.fileno(), size)
+		self._index_path = path + '.json'
+		self.size = size
+		self.position = 0
+
+	def write(self, data):
+		""" Writes audio; returns its offset. """
+		size = len(data)
+		if size > self.size:
+			raise Exception('unsupported audio size:', size)
+		if self.position + size > self.size:
+			self.position = 0
+		offset = self.position
+		self._map[offset:offset + size] = data
+		self.position += size
+		return offset
+
+	def read(self, offset, size):
+		""" Returns a copy of the audio at offset. """
+		return self._map[offset:offset + size]
+
+	def load_index(self):
+		""" Returns the saved entries as a list of dicts, oldest first. """
+		try:
+			with open(self._index_path) as f:
+				index = json.load(f)
+		except (IOError, ValueError):
+			return []
+		self.position = min(index.get('position', 0), self.size)
+		return index.get('entries', [])
+
+	def save_index(self, entries):
+		""" Saves the entries, a list of dicts, and the write position. """
+		self._map.flush()
+		temporary = self._index_path + '.tmp'
+		with open(temporary, 'w') as f:
+			json.dump({'position': self.position, 'entries': entries}, f)
+		os.replace(temporary, self._index_path)
+
+	def close(self):
+		self._map.close()
+		self._file.close()
+
+class ResponseCache(object):
+	""" LRU cache of answers keyed by normalized transcript, with a TTL.
+
+	Safe to share between conversations on different threads.
+
+	Args:
+	  max_entries: number of answers kept.
+	  max_bytes: audio kept in memory, in bytes. With a store, its size
+	    limits the audio instead.
+	  ttl: seconds an answer is served for.
+	  no_store: words that make a request time-sensitive; requests with
+	    any of them are always answered by the Assistant.
+	  store: optional MappedStore to keep the audio in.
+	"""
+	def __init__(self, max_entries, max_bytes, ttl, no_store=(), store=None):
+		self._max_entries = max_entries
+		self._max_bytes = max_bytes
+		self._ttl = ttl
+		self._no_store = None
+		if no_store:
+			self._no_store = re.compile(
+				r'\b(?:' + '|'.join(re.escape(normalize(word))
+									for word in no_store) + r')\b')
+		self._store = store
+		self._entries = collections.OrderedDict()
+		self._bytes = 0
+		self._lock = threading.Lock()
+		self._reset_counters()
+		if store is not None:
+			self._load()
+
+	def _reset_counters(self):
+		self._hits = 0
+		self._misses = 0
+		self._bytes_saved = 0
+		self._evictions = 0
+		self._expirations = 0
+
+	def _load(self):
+		now = time.time()
+		for saved in self._store.load_index():
+			if (saved['expires_at'] <= now or
+					saved['offset'] + saved['size'] > self._store.size):
+				continue
+			self._add(saved['key'], _Entry(
+				saved['expires_at'], saved['size'], saved['crc'],
+				offset=saved['offset'],
+				spoken_response_text=saved['spoken_response_text'],
+				volume_percentage=saved['volume_percentage']))
+		while len(self._entries) > self._max_entries:
+			self._evict()
+
+	def cacheable(self, text):
+		""" False for requests that must always get a fresh answer. """
+		return (self._no_store is None or
+				self._no_store.search(normalize(text)) is None)
+
+	def get(self, text, audio_format):
+		""" Returns the CachedResponse for a transcript, or None.
+
+		Args:
+		  text: the transcript of the request.
+		  audio_format: the format of the audio the answer is played in,
+		    such as 'LINEAR16/16000'.
+		"""
+		key = audio_format + '|' + normalize(text)
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is not None and entry.expires_at <= time.time():
+				self._remove(key)
+				self._expirations += 1
+				entry = None
+			audio = None
+			if entry is not None:
+				audio = entry.audio
+				if audio is None:
+					audio = self._store.read(entry.offset, entry.size)
+					if zlib.crc32(audio) != entry.crc:
+						# Overwritten since the index was saved.
+						self._remove(key)
+						audio = None
+			if audio is None:
+				self._misses += 1
+				return None
+			self._entries.move_to_end(key)
+			self._hits += 1
+			self._bytes_saved += entry.size
+			return CachedResponse(audio, entry.spoken_response_text,
+								  entry.volume_percentage)
+
+	def put(self, text, audio_format, audio, spoken_response_text='',
+			volume_percentage=0):
+		""" Caches the answer to a request.
+
+		Returns: False if the answer is too large to cache.
+		"""
+		audio = bytes(audio)
+		size = len(audio)
+		if not size or size > self.max_entry_bytes:
+			return False
+		key = audio_format + '|' + normalize(text)
+		entry = _Entry(time.time() + self._ttl, size, zlib.crc32(audio),
+					   spoken_response_text=spoken_response_text,
+					   volume_percentage=volume_percentage)
+		with self._lock:
+			if key in self._entries:
+				self._remove(key)
+			if self._store is None:
+				entry.audio = audio
+				while self._bytes + size > self._max_bytes:
+					self._evict()
+			else:
+				entry.offset = self._store.write(audio)
+				self._drop_overwritten(entry.offset, size)
+			while len(self._entries) >= self._max_entries:
+				self._evict()
+			self._add(key, entry)
+			if self._store is not None:
+				self._save()
+		return True
+
+	def _add(self, key, entry):
+		self._entries[key] = entry
+		self._bytes += entry.size
+
+	def _remove(self, key):
+		self._bytes -= self._entries.pop(key).size
+
+	def _evict(self):
+		key = next(iter(self._entries))
+		self._remove(key)
+		self._evictions += 1
+
+	def _drop_overwritten(self, offset, size):
+		end = offset + size
+		for key, entry in list(self._entries.items()):
+			if entry.offset < end and offset < entry.offset + entry.size:
+				self._remove(key)
+				self._evictions += 1
+
+	def _save(self):
+		entries = []
+		for key, entry in self._entries.items():
+			entries.append({
+				'key': key,
+				'expires_at': entry.expires_at,
+				'size': entry.size,
+				'crc': entry.crc,
+				'offset': entry.offset,
+				'spoken_response_text': entry.spoken_response_text,
+				'volume_percentage': entry.volume_percentage,
+			})
+		try:
+			self._store.save_index(entries)
+		except (IOError, OSError) as e:
+			log_error('Could not save the response cache: %s', e)
+
+	def clear(self):
+		""" Forgets every answer. """
+		with self._lock:
+			self._entries.clear()
+			self._bytes = 0
+			if self._store is not None:
+				self._save()
+
+	def close(self):
+		""" Saves the index of a store and closes it. """
+		if self._store is None:
+			return
+		with self._lock:
+			self._save()
+			self._store.close()
+			self._store = None
+			self._entries.clear()
+			self._bytes = 0
+
+	def reset_stats(self):
+		""" Returns the counters and resets them. """
+		with self._lock:
+			stats = self._stats()
+			self._reset_counters()
+		return stats
+
+	@property
+	def max_entry_bytes(self):
+		""" Largest answer put() accepts, in bytes.
+
+		Conversations stop collecting an answer's audio beyond it.
+		"""
+		return self._store.size if self._store is not None else self._max_bytes
+
+	@property
+	def stats(self):
+		""" Counters since the last reset_stats() call.
+
+		hit_rate is the share of lookups answered from the cache, and
+		bytes_saved the response audio they did not have to download.
+		"""
+		with self._lock:
+			return self._stats()
+
+	def _stats(self):
+		lookups = self._hits + self._misses
+		return {
+			'hits': self._hits,
+			'misses': self._misses,
+			'hit_rate': self._hits / float(lookups) if lookups else 0.0,
+			'bytes_saved': self._bytes_saved,
+			'evictions': self._evictions,
+			'expirations': self._expirations,
+			'entries': len(self._entries),
+			'bytes': self._bytes,
+		}
@@ -5,25 +5,42 @@ import os.path
 import ue_site
 import unreal_engine as ue
 
-import threaded_assistant
+import conversation_controller
+import conversation_manager
 
 from unreal_engine.classes import AudioComponent
+from googlesamples.assistant import common_settings
+from googlesamples.assistant.log_helpers import log
 
 class Hero:
 	# this is called on game start
 	def begin_play(self):
 		self.audio_component = self.uobject.get_component_by_type(AudioComponent)
-		ue_site.setup_unreal_engine_audio(self.audio_component)
+		# Actors borrow a pooled stream while they talk; the gRPC channel is shared
+		self.conversation_key = self.uobject.get_name()
+		self.conversations = conversation_manager.get_manager()
+		self.conversations.register(self.conversation_key, self.audio_component)
+		# Set up the Assistant in the background before anyone talks
+		ue_site.warm_up()
+		
+		# React to the talk key's edges instead of polling it every tick
+		self.controller = conversation_controller.ConversationController(
+			self.conversation_key, self.conversations,
+			on_state_changed=self.on_conversation_state)
+		self.uobject.enable_input()
+		self.uobject.bind_key(common_settings.TALK_KEY, ue.IE_PRESSED,
+							  self.controller.on_pressed)
+		self.uobject.bind_key(common_settings.TALK_KEY, ue.IE_RELEASED,
+							  self.controller.on_released)
 		
 	# this is called at every 'tick'
 	def tick(self, delta_time):
-		if self.uobject.is_input_key_down('Q'):
-			try:
-				# Only try to start a new conversation if one is not active
-				if not self.assistant.is_alive():
-					self.assistant = threaded_assistant.ThreadedAssistant()
-					self.assistant.start()
-			except AttributeError:
-				# This happens the first time we attempt to start a conversation
-				self.assistant = threaded_assistant.ThreadedAssistant()
-				self.assistant.start()
+		# Only checks for a state change; never blocks
+		self.controller.tick()
+		
+	def on_conversation_state(self, state):
+		log('%s conversation %s', self.conversation_key, state)
+				
+	# this is called when the actor is removed from the level
+	def end_play(self, reason):
+		self.conversations.unregister(self.conversation_key)
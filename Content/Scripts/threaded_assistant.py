@@ -1,13 +1,19 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from threading import Thread
-import unreal_engine as ue
+import os.path
+import queue
+import sys
+import time
+from threading import Event, Thread
+import grpc
 import ue_site
+import turn_metrics
 
 # Google Assistant imports
 from googlesdk.assistant.embedded.v1alpha1 import embedded_assistant_pb2
-from googlesamples.assistant import common_settings
+from googlesamples.assistant import assistant_helpers, common_settings
+from googlesamples.assistant.log_helpers import log, log_error
 
 # General Google imports
 from google.rpc import code_pb2
@@ -16,8 +22,34 @@ END_OF_UTTERANCE = embedded_assistant_pb2.ConverseResponse.END_OF_UTTERANCE
 DIALOG_FOLLOW_ON = embedded_assistant_pb2.ConverseResult.DIALOG_FOLLOW_ON
 CLOSE_MICROPHONE = embedded_assistant_pb2.ConverseResult.CLOSE_MICROPHONE
 
-class ThreadedAssistant(Thread):
-	def __init__(self):
+class _TurnSpans(object):
+	""" Turn spans as logged, formatted only once the log writes them. """
+	def __init__(self, spans):
+		self._spans = spans
+
+	def __str__(self):
+		return ', '.join(stage + ' ' + str(int(1000 * self._spans[stage])) + ' ms'
+						 for stage in turn_metrics.STAGES if stage in self._spans)
+
+class AssistantConversation(object):
+	""" Request and response handling shared by every conversation driver.
+
+	Args:
+	  conversation_stream: the ConversationStream to record from and play to.
+	    Defaults to the one set up by ue_site.
+	  follow_on: when the Assistant expects a reply, start the next turn
+	    as soon as its answer has played instead of returning.
+	  preopen: open the follow-on turn's Converse call while the answer
+	    is still playing.
+	  response_cache: the ResponseCache to answer repeated requests from.
+	    Defaults to ue_site's, if it has one.
+	  cache_responses: False for conversations whose answers depend on
+	    the moment or on game state, which must never use the cache.
+	"""
+	def __init__(self, conversation_stream=None,
+				 follow_on=common_settings.AUTO_FOLLOW_ON,
+				 preopen=common_settings.PREOPEN_FOLLOW_ON,
+				 response_cache=None, cache_responses=True):
 
 		# Opaque blob provided in ConverseResponse that,
 		# when provided in a follow-up ConverseRequest,
@@ -29,114 +61,482 @@ class ThreadedAssistant(Thread):
 
 		# Create Google Assistant API gRPC client.
 		self.deadline = common_settings.DEFAULT_GRPC_DEADLINE
-		
+
+		self.conversation_stream = (conversation_stream or
+									ue_site.conversation_stream)
+		self.continue_conversation = False
+		# Cancels the Converse call in flight, set by the driver.
+		self._cancel_call = None
+
+		self.follow_on = follow_on
+		self.preopen = preopen
+		self.max_turns = common_settings.DEFAULT_MAX_FOLLOW_ON_TURNS
+		# Seconds between the end of an answer and recording the follow-on
+		# request, one per follow-on turn.
+		self.turn_gaps = []
+		# Timing of every barge-in, see reset_barge_in_metrics().
+		self.barge_ins = []
+		# time.monotonic() the user asked for the conversation, e.g. by
+		# pressing the talk key; its first turn is timed from then.
+		self.pressed_at = None
+		self._turn_timer = None
+
+		self.response_cache = response_cache or getattr(
+			ue_site, 'response_cache', None)
+		self.cache_responses = cache_responses
+		# Transcript of the turn's request while its answer is recorded
+		# for the cache.
+		self._cache_text = None
+		self._cache_audio = bytearray()
+		self._cache_result = {}
+		self._cache_lookup = False
+		self._follow_on_turn = False
+
+	def begin_turn(self):
+		"""Starts recording the user's request."""
+		if common_settings.TURN_METRICS:
+			self._turn_timer = turn_metrics.TurnTimer(self.pressed_at)
+		self.pressed_at = None
+		# A reply to a follow-on question only makes sense in context.
+		self._follow_on_turn = self.continue_conversation
+		self.continue_conversation = False
+		self._cache_text = None
+		del self._cache_audio[:]
+		self._cache_result = {}
+		self._cache_lookup = False
+		self.conversation_stream.reset_playback_stats()
+		self.conversation_stream.reset_capture_stats()
+		self.conversation_stream.reset_playout_stats()
+		self.conversation_stream.on_barge_in = self.interrupt
+		self.conversation_stream.start_recording()
+		if self._turn_timer is not None:
+			self._turn_timer.mark(turn_metrics.CAPTURE_STARTED)
+		log('Recording audio request.')
+
+	def end_turn(self, follow_on=False, wait=True):
+		"""Stops playback once the response has been handled.
+
+		With follow_on, waits for the answer to finish playing and keeps
+		the audio devices open for the next turn.
+
+		Args:
+		  follow_on: whether another turn follows.
+		  wait: False leaves the wait for the answer to the caller, e.g.
+		    to an event loop, see ConversationStream.drain().
+		Returns: True if conversation should continue.
+		"""
+		self.conversation_stream.stop_playback(keep_open=follow_on)
+		if follow_on:
+			self.conversation_stream.drain(wait)
+		log('Finished playing assistant response.')
+		self._record_turn_timing(drained=follow_on and wait)
+
+		for barge_in in self.conversation_stream.reset_barge_in_metrics():
+			self.barge_ins.append(barge_in)
+			log('Barge-in: detected after %d ms, answer dropped after %d ms, '
+				'call cancelled after %d ms, new request after %d ms',
+				barge_in['detected_ms'], barge_in['playback_stopped_ms'],
+				barge_in['call_cancelled_ms'], barge_in['request_ms'])
+		turn_gap = self.conversation_stream.turn_gap
+		if turn_gap is not None:
+			self.turn_gaps.append(turn_gap)
+			log('Follow-on recording started %.2f ms after playback',
+				1000 * turn_gap)
+		if self._cache_lookup:
+			self._cache_lookup = False
+			stats = self.response_cache.stats
+			log('Response cache: %.0f%% hit rate, %d bytes saved, %d answers '
+				'cached', 100 * stats['hit_rate'], stats['bytes_saved'],
+				stats['entries'])
+
+		# Report buffer usage so copies and allocations can be tracked
+		log('Response audio: %(chunks)d chunks, %(bytes_copied)d bytes copied, '
+			'%(allocations)d allocations',
+			self.conversation_stream.reset_playback_stats())
+		decoder_stats = self.conversation_stream.decoder_stats
+		if decoder_stats:
+			log('Decoded %d compressed bytes into %d PCM bytes in %.2f ms, '
+				'%d corrupt pages', decoder_stats['bytes_in'],
+				decoder_stats['bytes_out'], 1000 * decoder_stats['decode_time'],
+				decoder_stats['corrupt_pages'])
+		playout_stats = self.conversation_stream.reset_playout_stats()
+		if playout_stats and playout_stats['first_audio_delay'] is not None:
+			log('Playout: first audio after %.2f ms, %d underruns (%d ms '
+				'silent), %d late chunks, %d chunks queued in %d writes, next '
+				'target %d ms', 1000 * playout_stats['first_audio_delay'],
+				playout_stats['underruns'], 1000 * playout_stats['underrun_time'],
+				playout_stats['late_chunks'], playout_stats['chunks'],
+				playout_stats['releases'], 1000 * playout_stats['target_depth'])
+		queue_stats = self.conversation_stream.reset_queue_stats()
+		if queue_stats and queue_stats['high_water_bytes']:
+			log('Playback queue: at most %(high_water_bytes)d bytes queued, '
+				'%(waits)d writes waited %(wait_time).2f s for room, '
+				'%(dropped_bytes)d bytes dropped', queue_stats)
+		resampler_stats = self.conversation_stream.reset_resampler_stats()
+		for side in ('capture', 'playback'):
+			stats = resampler_stats[side]
+			if stats and stats['samples_in']:
+				log('Resampled %s audio from %d to %d Hz, %.2f ms of CPU per '
+					'second of audio', side, stats['in_rate'], stats['out_rate'],
+					1000 * stats['cpu_per_second'])
+		capture_stats = self.conversation_stream.reset_capture_stats()
+		if capture_stats:
+			log('Request audio: %(overflows)d overflows (%(overflow_bytes)d '
+				'bytes dropped), %(underflows)d underflows', capture_stats)
+		utterance = self.conversation_stream.utterance_metrics
+		if utterance and utterance['speech_start_ms'] is not None:
+			if utterance['speech_end_ms'] is not None:
+				log('Utterance: speech at %(speech_start_ms)d ms, ended locally '
+					'at %(speech_end_ms)d ms, %(trimmed_ms)d ms trimmed, '
+					'%(sent_ms)d ms sent, %(processing_ms).2f ms spent detecting',
+					utterance)
+			else:
+				log('Utterance: speech at %(speech_start_ms)d ms, %(trimmed_ms)d '
+					'ms trimmed, %(sent_ms)d ms sent, %(processing_ms).2f ms '
+					'spent detecting', utterance)
+		return self.continue_conversation
+
+	def _record_turn_timing(self, drained):
+		"""Adds the stages of the turn that just ended to the histograms."""
+		timer = self._turn_timer
+		if timer is None:
+			return
+		self._turn_timer = None
+		stream = self.conversation_stream
+		# Taken from the stream, so its hot paths only note a time.
+		if stream.first_chunk_at is not None:
+			timer.mark(turn_metrics.FIRST_AUDIO_SENT, stream.first_chunk_at)
+		if stream.first_queued_at is not None:
+			timer.mark(turn_metrics.FIRST_SAMPLE_QUEUED, stream.first_queued_at)
+		if (timer.reached(turn_metrics.FIRST_AUDIO_OUT) or
+				timer.reached(turn_metrics.FIRST_SAMPLE_QUEUED)):
+			# Undrained, the answer plays on until the sink's estimate.
+			played_until = None if drained else stream.played_until
+			if played_until is None or played_until < timer.started:
+				played_until = time.monotonic()
+			timer.mark(turn_metrics.PLAYBACK_FINISHED, played_until)
+		spans = timer.record(turn_metrics.registry)
+		log('Turn timing: %s', _TurnSpans(spans))
+		if common_settings.TURN_METRICS_FILE:
+			path = os.path.join(sys.path[0], common_settings.TURN_METRICS_FILE)
+			try:
+				turn_metrics.registry.write(path)
+			except (IOError, OSError) as e:
+				log_error('Could not export turn timing: %s', e)
+
+	def should_follow_on(self, turns):
+		"""Whether to start another turn after the given number of turns.
+
+		A barge-in always starts one, as the user is already talking.
+		"""
+		if turns >= self.max_turns:
+			return False
+		if self.conversation_stream.barged_in:
+			return True
+		return self.follow_on and self.continue_conversation
+
+	def interrupt(self):
+		"""Cancels the Converse call in flight; called on a barge-in."""
+		cancel_call = self._cancel_call
+		if cancel_call is not None:
+			cancel_call()
+
+	def handle_response(self, resp):
+		"""Acts on a single ConverseResponse.
+
+		Returns: False if the rest of the responses are not needed, after
+		  an error or once the answer was played from the response cache.
+		"""
+		if common_settings.LOG_CONVERSE_MESSAGES:
+			assistant_helpers.log_converse_response_without_audio(resp)
+
+		# Something went wrong
+		if resp.error.code != code_pb2.OK:
+			log_error('Server error: %s', resp.error.message)
+			self.continue_conversation = False
+			return False
+
+		# Detected the user is done talking
+		if resp.event_type == END_OF_UTTERANCE:
+			log('End of audio request detected')
+			self.conversation_stream.stop_recording()
+			if self._turn_timer is not None:
+				self._turn_timer.mark(turn_metrics.END_OF_UTTERANCE)
+
+		# We parsed what the user said
+		if resp.result.spoken_request_text:
+			log('Transcript of user request: %s',
+				resp.result.spoken_request_text)
+			if self.answer_from_cache(resp.result.spoken_request_text):
+				return False
+
+		# We have a response ready to play out the speakers
+		if len(resp.audio_out.audio_data) > 0:
+			if self._turn_timer is not None:
+				self._turn_timer.mark(turn_metrics.FIRST_AUDIO_OUT)
+			self.conversation_stream.write(resp.audio_out.audio_data)
+			if self._cache_text is not None:
+				if (len(self._cache_audio) + len(resp.audio_out.audio_data) >
+						self.response_cache.max_entry_bytes):
+					# Too large to cache, stop holding on to the answer.
+					self._cache_text = None
+					del self._cache_audio[:]
+				else:
+					self._cache_audio += resp.audio_out.audio_data
+
+		# Kept with the answer in the response cache
+		if self._cache_text is not None:
+			if resp.result.spoken_response_text:
+				self._cache_result['spoken_response_text'] = (
+					resp.result.spoken_response_text)
+			if resp.result.volume_percentage != 0:
+				self._cache_result['volume_percentage'] = (
+					resp.result.volume_percentage)
+
+		# We have an updated conversation state
+		if resp.result.conversation_state:
+			self.conversation_state = resp.result.conversation_state
+
+		# Volume level needs to be updated
+		if resp.result.volume_percentage != 0:
+			self.conversation_stream.volume_percentage = (
+				resp.result.volume_percentage
+			)
+
+		# Check if user should reply
+		if resp.result.microphone_mode == DIALOG_FOLLOW_ON:
+			# Expecting user to reply
+			self.continue_conversation = True
+			log('Expecting follow-on query from user.')
+		elif resp.result.microphone_mode == CLOSE_MICROPHONE:
+			# Not expecting user to reply
+			self.continue_conversation = False
+		return True
+
+	def _audio_format(self):
+		return (self.conversation_stream.output_encoding + '/' +
+				str(self.conversation_stream.sample_rate))
+
+	def answer_from_cache(self, text):
+		"""Plays the cached answer to a request, if there is one.
+
+		Follow-on replies and requests the cache deems time-sensitive
+		are never looked up. On a miss, the answer is recorded for
+		cache_response().
+
+		Returns: True if the answer was played from the cache.
+		"""
+		cache = self.response_cache
+		if (cache is None or not self.cache_responses or
+				self._follow_on_turn or not cache.cacheable(text)):
+			return False
+		self._cache_lookup = True
+		cached = cache.get(text, self._audio_format())
+		if cached is None:
+			self._cache_text = text
+			return False
+		log('Playing cached answer to: %s', text)
+		if cached.volume_percentage != 0:
+			self.conversation_stream.volume_percentage = (
+				cached.volume_percentage)
+		self.continue_conversation = False
+		self.conversation_stream.write(cached.audio)
+		return True
+
+	def cache_response(self):
+		"""Caches the answer of a turn once all of it has been received.
+
+		Answers that ask for a reply or were cut short are not cached.
+		"""
+		text = self._cache_text
+		self._cache_text = None
+		if (text is None or self.continue_conversation or
+				self.conversation_stream.barged_in or not self._cache_audio):
+			return
+		self.response_cache.put(text, self._audio_format(), self._cache_audio,
+								**self._cache_result)
+
+	def converse_config_request(self):
+		"""Returns the first ConverseRequest, which carries the ConverseConfig."""
+		return assistant_helpers.converse_config_request(
+			self.conversation_stream, self.conversation_state)
+
+class _OpenedResponses(object):
+	""" Iterates responses on a helper thread from the moment it is created.
+
+	ChannelManager.converse() only calls Converse once iterated; this
+	opens the call right away, e.g. while the previous answer still plays.
+	Only a few responses are read ahead, so a slow playback still holds
+	back the call.
+	"""
+	_DONE = object()
+	_READ_AHEAD = 4
+
+	def __init__(self, responses):
+		self._responses = responses
+		self._queue = queue.Queue(self._READ_AHEAD)
+		self._closed = Event()
+		Thread(target=self._run, name='OpenedConverse', daemon=True).start()
+
+	def _run(self):
+		try:
+			for resp in self._responses:
+				self._queue.put(resp)
+				if self._closed.is_set():
+					return
+		except Exception as e:
+			self._queue.put(e)
+		self._queue.put(self._DONE)
+
+	def __iter__(self):
+		try:
+			while True:
+				item = self._queue.get()
+				if item is self._DONE:
+					return
+				if isinstance(item, Exception):
+					raise item
+				yield item
+		finally:
+			# Responses left unread must not keep the helper waiting.
+			self._closed.set()
+			while True:
+				try:
+					self._queue.get_nowait()
+				except queue.Empty:
+					break
+
+class ThreadedAssistant(AssistantConversation, Thread):
+	""" Runs a conversation on its own thread, one turn plus any follow-ons.
+
+	Args:
+	  conversation_stream: the ConversationStream to record from and play to.
+	  assistant: an EmbeddedAssistantStub to call directly, without the
+	    reconnects and retries of a ChannelManager.
+	  channels: the ChannelManager to call through. Defaults to ue_site's.
+	  follow_on: see AssistantConversation.
+	  preopen: see AssistantConversation.
+	  response_cache: see AssistantConversation.
+	  cache_responses: see AssistantConversation.
+	"""
+	def __init__(self, conversation_stream=None, assistant=None,
+				 channels=None, follow_on=common_settings.AUTO_FOLLOW_ON,
+				 preopen=common_settings.PREOPEN_FOLLOW_ON,
+				 response_cache=None, cache_responses=True):
+		AssistantConversation.__init__(self, conversation_stream,
+									   follow_on, preopen, response_cache,
+									   cache_responses)
+		self.assistant = assistant
+		self.channels = None
+		if assistant is None:
+			self.channels = channels or ue_site.channels
+
 		Thread.__init__(self)
-		
+
 	def __enter__(self):
 		return self
 
 	def __exit__(self, etype, e, traceback):
 		if e:
 			return False
-		ue_site.conversation_stream.close()
+		self.conversation_stream.close()
 
-	def is_grpc_error_unavailable(e):
+	def is_grpc_error_unavailable(self, e):
 		is_grpc_error = isinstance(e, grpc.RpcError)
 		if is_grpc_error and (e.code() == grpc.StatusCode.UNAVAILABLE):
-			ue.log_error('grpc unavailable error: %s', e)
+			log_error('grpc unavailable error: %s', e)
 			return True
 		return False
 
 	def run(self):
 		"""Send a voice request to the Assistant and playback the response.
 
+		While the Assistant expects a reply, follow-on turns reuse the
+		open audio devices and channel and carry the conversation_state.
+
 		Returns: True if conversation should continue.
 		"""
-		continue_conversation = False
+		self.begin_turn()
+		responses = self.open_call()
+		turns = 1
+		while True:
+			self.handle_responses(responses)
+			if self.conversation_stream.full_duplex:
+				# Keep listening for the user until the answer has played.
+				self.conversation_stream.drain()
+			if not self.should_follow_on(turns):
+				return self.end_turn()
+			if self.preopen and not self.conversation_stream.barged_in:
+				playback_drained = Event()
+				responses = self.open_call(playback_drained)
+				self.end_turn(follow_on=True)
+				playback_drained.set()
+			else:
+				self.end_turn(follow_on=True)
+				self.begin_turn()
+				responses = self.open_call()
+			turns += 1
 
-		ue_site.conversation_stream.start_recording()
-		ue.log('Recording audio request.')
+	def open_call(self, playback_drained=None):
+		"""Starts a Converse call for the next turn.
 
+		Args:
+		  playback_drained: Event set once the previous answer has played;
+		    recording waits for it. The call itself is opened right away.
+		Returns:
+		  Iterable of ConverseResponse messages.
+		"""
 		# This generator yields ConverseResponse proto messages
 		# received from the gRPC Google Assistant API.
-		for resp in ue_site.assistant.Converse(self.gen_converse_requests(),
-											self.deadline):
-			# Something went wrong
-			if resp.error.code != code_pb2.OK:
-				ue.log_error('Server error: ' + str(resp.error.message))
-				break
-			
-			# Detected the user is done talking
-			if resp.event_type == END_OF_UTTERANCE:
-				ue.log('End of audio request detected')
-				ue_site.conversation_stream.stop_recording()
-			
-			# We parsed what the user said
-			if resp.result.spoken_request_text:
-				ue.log('Transcript of user request: ' +
-							 str(resp.result.spoken_request_text))
-							 
-			# We have a response ready to play out the speakers
-			if len(resp.audio_out.audio_data) > 0:
-				ue_site.conversation_stream.write(resp.audio_out.audio_data)
-			
-			# We have an updated conversation state
-			if resp.result.conversation_state:
-				self.conversation_state = resp.result.conversation_state
-			
-			# Volume level needs to be updated
-			if resp.result.volume_percentage != 0:
-				ue_site.conversation_stream.volume_percentage = (
-					resp.result.volume_percentage
-				)
-			
-			# Check if user should reply
-			if resp.result.microphone_mode == DIALOG_FOLLOW_ON:
-				# Expecting user to reply
-				continue_conversation = True
-				ue.log('Expecting follow-on query from user.')
-			elif resp.result.microphone_mode == CLOSE_MICROPHONE:
-				# Not expecting user to reply
-				continue_conversation = False
-
-		ue.log('Finished playing assistant response.')
-		ue_site.conversation_stream.stop_playback()
-		return continue_conversation
-
-	def gen_converse_requests(self):
+		requests = self.gen_converse_requests(playback_drained)
+		if self.channels is None:
+			call = self.assistant.Converse(requests, self.deadline)
+			self._cancel_call = call.cancel
+			return call
+		responses = self.channels.converse(requests, self.deadline,
+										   on_call=self._on_call)
+		if playback_drained is not None:
+			responses = _OpenedResponses(responses)
+		return responses
+
+	def _on_call(self, call):
+		self._cancel_call = call.cancel
+
+	def handle_responses(self, responses):
+		"""Handles the responses of one turn."""
+		try:
+			for resp in responses:
+				if not self.handle_response(resp):
+					# Stop downloading responses that are not needed.
+					self.interrupt()
+					break
+			else:
+				self.cache_response()
+		except grpc.RpcError as e:
+			if (e.code() == grpc.StatusCode.CANCELLED and
+					self.conversation_stream.barged_in):
+				return
+			# Retries are exhausted or audio was already sent; give up on
+			# this turn but keep the game running.
+			if not self.is_grpc_error_unavailable(e):
+				raise
+			self.conversation_stream.stop_recording()
+
+	def gen_converse_requests(self, playback_drained=None):
 		"""Generates ConverseRequest messages to send to the API.
 		This happens over multiple frames, so it should be run in a separate thread.
 		Otherwise it WILL lock up the game thread while it's "thinking."
+
+		With playback_drained, the turn is begun once it is set.
 		"""
+		yield self.converse_config_request()
+		if playback_drained is not None:
+			playback_drained.wait()
+			self.begin_turn()
 
-		converse_state = None
-		
-		if self.conversation_state:
-			ue.log('Sending converse_state: '+ str(self.conversation_state))
-			converse_state = embedded_assistant_pb2.ConverseState(
-				conversation_state=self.conversation_state,
-			)
-		
-		# Generate the config for the assistant
-		config = embedded_assistant_pb2.ConverseConfig(
-			audio_in_config=embedded_assistant_pb2.AudioInConfig(
-				encoding='LINEAR16',
-				sample_rate_hertz=ue_site.conversation_stream.sample_rate,
-			),
-			audio_out_config=embedded_assistant_pb2.AudioOutConfig(
-				encoding='LINEAR16',
-				sample_rate_hertz=ue_site.conversation_stream.sample_rate,
-				volume_percentage=ue_site.conversation_stream.volume_percentage,
-			),
-			converse_state=converse_state
-		)
-		
-		# The first ConverseRequest must contain the ConverseConfig
-		# and no audio data.
-		yield embedded_assistant_pb2.ConverseRequest(config=config)
-		
 		# Below, we actually activate the microphone and begin recording.
-		for data in ue_site.conversation_stream:
-			# Subsequent requests need audio data, but not config.
-			yield embedded_assistant_pb2.ConverseRequest(audio_in=data)
-		ue_site.conversation_stream.start_playback()
\ No newline at end of file
+		# Subsequent requests need audio data, but not config.
+		for request in assistant_helpers.gen_audio_requests(
+				self.conversation_stream):
+			yield request
+		self.conversation_stream.start_playback()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Timing of conversation turns, kept in histograms.
+
+A TurnTimer notes when each stage of a turn is reached, from the talk
+key press to the end of the answer's playback. At the end of the turn
+its spans go into the histograms of a Registry, which can be exported
+as Prometheus text, e.g. for node_exporter's textfile collector, or as
+JSON lines.
+"""
+
+import bisect
+import json
+import math
+import os
+import threading
+import time
+
+# Stages of a conversation turn, in the order they are reached. Each is
+# timed from the start of the turn: the talk key press for the first
+# turn of a conversation, the start of recording for follow-on turns.
+CAPTURE_STARTED = 'capture_started'
+FIRST_AUDIO_SENT = 'first_audio_sent'
+END_OF_UTTERANCE = 'end_of_utterance'
+FIRST_AUDIO_OUT = 'first_audio_out'
+FIRST_SAMPLE_QUEUED = 'first_sample_queued'
+PLAYBACK_FINISHED = 'playback_finished'
+STAGES = (CAPTURE_STARTED, FIRST_AUDIO_SENT, END_OF_UTTERANCE,
+		  FIRST_AUDIO_OUT, FIRST_SAMPLE_QUEUED, PLAYBACK_FINISHED)
+
+# Histogram of the stages, labelled with the stage.
+TURN_SECONDS = 'assistant_turn_seconds'
+TURN_SECONDS_HELP = 'Seconds from the start of a conversation turn to each of its stages.'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+				   10.0, 30.0)
+
+class Histogram(object):
+	""" Counts observed values into fixed buckets.
+
+	Args:
+	  buckets: upper bounds of the buckets, ascending. Values above the
+	    last bound fall into an extra +Inf bucket.
+	"""
+	def __init__(self, buckets=DEFAULT_BUCKETS):
+		self._bounds = tuple(buckets)
+		self._counts = [0] * (len(self._bounds) + 1)
+		self._sum = 0.0
+		self._count = 0
+		self._lock = threading.Lock()
+
+	def observe(self, value):
+		idx = bisect.bisect_left(self._bounds, value)
+		with self._lock:
+			self._counts[idx] += 1
+			self._sum += value
+			self._count += 1
+
+	def snapshot(self):
+		""" Returns count, sum and the cumulative count of each bucket.
+
+		buckets is a list of (upper bound, count) pairs ending with
+		(inf, count).
+		"""
+		with self._lock:
+			counts = list(self._counts)
+			total = self._sum
+			count = self._count
+		buckets = []
+		cumulative = 0
+		for bound, bucket_count in zip(self._bounds + (math.inf,), counts):
+			cumulative += bucket_count
+			buckets.append((bound, cumulative))
+		return {'count': count, 'sum': total, 'buckets': buckets}
+
+	def quantile(self, q):
+		""" Estimates a quantile by interpolating within its bucket.
+
+		Returns None before the first observation. Quantiles in the +Inf
+		bucket are reported as the last bound.
+		"""
+		snapshot = self.snapshot()
+		if not snapshot['count']:
+			return None
+		rank = q * snapshot['count']
+		lower = 0.0
+		below = 0
+		for bound, cumulative in snapshot['buckets']:
+			if cumulative >= rank and cumulative > below:
+				if math.isinf(bound):
+					return lower
+				return lower + (bound - lower) * (rank - below) / (cumulative - below)
+			lower = bound
+			below = cumulative
+		return lower
+
+class Registry(object):
+	""" Histograms by name and labels, exportable as Prometheus text or
+	JSON lines. Safe to use from any thread. """
+	def __init__(self):
+		self._lock = threading.Lock()
+		# name -> (help, buckets, {sorted label items: Histogram})
+		self._families = {}
+
+	def histogram(self, name, help='', labels=None, buckets=DEFAULT_BUCKETS):
+		""" Returns the histogram of a name and labels, creating it. """
+		key = tuple(sorted(labels.items())) if labels else ()
+		with self._lock:
+			family = self._families.get(name)
+			if family is None:
+				family = self._families[name] = (help, tuple(buckets), {})
+			histogram = family[2].get(key)
+			if histogram is None:
+				histogram = family[2][key] = Histogram(family[1])
+			return histogram
+
+	def observe(self, name, value, help='', labels=None):
+		self.histogram(name, help, labels).observe(value)
+
+	def _series(self):
+		with self._lock:
+			families = [(name, help, list(series.items()))
+						for name, (help, _, series) in sorted(self._families.items())]
+		for name, help, series in families:
+			yield name, help, [(dict(key), histogram.snapshot())
+							   for key, histogram in sorted(series)]
+
+	def prometheus_text(self):
+		""" Returns the histograms in the Prometheus text exposition format. """
+		lines = []
+		for name, help, series in self._series():
+			if help:
+				lines.append('# HELP ' + name + ' ' + help)
+			lines.append('# TYPE ' + name + ' histogram')
+			for labels, snapshot in series:
+				for bound, cumulative in snapshot['buckets']:
+					le = '+Inf' if math.isinf(bound) else repr(bound)
+					lines.append(name + '_bucket' + _labels(labels, le=le) +
+								 ' ' + str(cumulative))
+				lines.append(name + '_sum' + _labels(labels) + ' ' +
+							 repr(snapshot['sum']))
+				lines.append(name + '_count' + _labels(labels) + ' ' +
+							 str(snapshot['count']))
+		return '\n'.join(lines) + '\n'
+
+	def json_lines(self):
+		""" Returns one JSON object per histogram, one per line. """
+		lines = []
+		for name, _, series in self._series():
+			for labels, snapshot in series:
+				lines.append(json.dumps({
+					'name': name,
+					'labels': labels,
+					'count': snapshot['count'],
+					'sum': snapshot['sum'],
+					'buckets': [['+Inf' if math.isinf(bound) else bound, count]
+								for bound, count in snapshot['buckets']],
+				}, sort_keys=True))
+		return ''.join(line + '\n' for line in lines)
+
+	def write(self, path):
+		""" Replaces a file with the histograms: Prometheus text for a .prom
+		file, JSON lines otherwise. """
+		if path.endswith('.prom'):
+			text = self.prometheus_text()
+		else:
+			text = self.json_lines()
+		# Written aside and moved, so readers never see half a file.
+		with open(path + '.tmp', 'w') as f:
+			f.write(text)
+		os.replace(path + '.tmp', path)
+
+	def clear(self):
+		with self._lock:
+			self._families.clear()
+
+def _labels(labels, **extra):
+	items = sorted(labels.items()) + sorted(extra.items())
+	if not items:
+		return ''
+	return '{' + ','.join(key + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+						  for key, value in items) + '}'
+
+# The process-wide registry conversations report to.
+registry = Registry()
+
+class TurnTimer(object):
+	""" Notes when the stages of one conversation turn are reached.
+
+	Only the first time of each stage is kept, so mark() can be called
+	for every response; it costs a dictionary lookup once the stage has
+	been reached.
+
+	Args:
+	  started: time.monotonic() the turn started at. Defaults to now.
+	"""
+	def __init__(self, started=None):
+		self.started = time.monotonic() if started is None else started
+		self._times = {}
+
+	def mark(self, stage, at=None):
+		""" Notes that a stage was reached, now or at the given time. """
+		if stage not in self._times:
+			self._times[stage] = time.monotonic() if at is None else at
+
+	def reached(self, stage):
+		return stage in self._times
+
+	def spans(self):
+		""" Returns the seconds from the start to each stage reached. """
+		return dict((stage, self._times[stage] - self.started)
+					for stage in STAGES if stage in self._times)
+
+	def record(self, registry=registry):
+		""" Adds the turn's spans to the TURN_SECONDS histograms; returns them. """
+		spans = self.spans()
+		for stage, span in spans.items():
+			registry.observe(TURN_SECONDS, span, TURN_SECONDS_HELP,
+							 {'stage': stage})
+		return spans
@@ -1,71 +1,167 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import concurrent.futures
 import sys
 import os.path
+import threading
 import unreal_engine as ue
 from unreal_engine.classes import SoundWaveProcedural
 
-from googlesdk.assistant.embedded.v1alpha1 import embedded_assistant_pb2
-from googlesamples.assistant import (
-	audio_helpers,
-	auth_helpers,
-	common_settings
-)
+from googlesamples.assistant import common_settings
+from googlesamples.assistant.log_helpers import log_error
 ASSISTANT_API_ENDPOINT = 'embeddedassistant.googleapis.com'
 
+# Setup states reported by state()
+NOT_STARTED = 'not_started'
+STARTING = 'starting'
+READY = 'ready'
+FAILED = 'failed'
+
+_setup_lock = threading.Lock()
+_setup_future = None
+
 def setup_assistant():
 	""" This sets up the OAuth credentials for the Google Assistant. """
 	
+	# Imported here, as they pull in google.auth, gRPC and protobuf,
+	# which would otherwise stall the import of this module.
+	import async_assistant
+	import channel_manager
+	import credential_service
+	from googlesamples.assistant import auth_helpers
+	
 	ue.log("Initializing Google Assistant.")
 	# Initialize credentials
 	credentials = os.path.join(sys.path[0],
 								common_settings.ASSISTANT_CREDENTIALS_FILENAME)
 
-	# Load credentials.
+	# Load credentials. Their token is refreshed in the background, so
+	# loading them never waits on the network.
+	global creds_service
+	creds_service = credential_service.CredentialService(
+		credentials, scopes=[common_settings.ASSISTANT_OAUTH_SCOPE, common_settings.PUBSUB_OAUTH_SCOPE]
+	)
 	try:
 		global creds
-		creds = auth_helpers.load_credentials(
-			credentials, scopes=[common_settings.ASSISTANT_OAUTH_SCOPE, common_settings.PUBSUB_OAUTH_SCOPE]
-		)
+		creds = creds_service.load()
 	except Exception:
 		# Maybe we didn't load the credentials yet?
 		# This could happen on first run
 		client_secret = os.path.join(sys.path[0], 'client_secrets.json')
 		creds = auth_helpers.credentials_flow_interactive(client_secret, common_settings.ASSISTANT_OAUTH_SCOPE)
 		auth_helpers.save_credentials(credentials, creds)
+		creds_service = credential_service.CredentialService(
+			credentials, scopes=[common_settings.ASSISTANT_OAUTH_SCOPE]
+		)
 		try:
-			creds = auth_helpers.load_credentials(
-				credentials, scopes=[common_settings.ASSISTANT_OAUTH_SCOPE]
-			)
+			creds = creds_service.load()
 		except Exception as e:
 			ue.log_error('Error loading credentials: ' + str(e))
 			ue.log_error('Run auth_helpers to initialize new OAuth2 credentials.')
 			# Return invalid status code
 			return -1
+	creds_service.start()
 			
 	# Define endpoint
 	# This might where you can inject custom API.AI behaviors?
 	api_endpoint = ASSISTANT_API_ENDPOINT
 
-	# Create an authorized gRPC channel.
-	grpc_channel = auth_helpers.create_grpc_channel(
-		api_endpoint, creds
+	# Create an authorized gRPC channel for threaded conversations. It
+	# only connects once one of them uses it.
+	global channels
+	channels = channel_manager.ChannelManager(
+		lambda options: auth_helpers.create_grpc_channel(
+			api_endpoint, creds, grpc_channel_options=options
+		)
 	)
+	# Conversations in the game run on the async engine; start connecting
+	# its channel, so the first one does not wait for the handshake.
 	ue.log('Connecting to '+ str(api_endpoint))
-	
-	global assistant
-	assistant = embedded_assistant_pb2.EmbeddedAssistantStub(grpc_channel)
+	async_assistant.get_engine().warm_up()
 	
 	global msg_queue
 	msg_queue = []
 	
+	global response_cache
+	response_cache = create_response_cache()
+	
 	return 0 # Initialized Google Assistant successfully
+
+def create_response_cache():
+	""" Creates the cache of answers to repeated requests, if enabled. """
+	if not common_settings.RESPONSE_CACHE:
+		return None
+	from response_cache import MappedStore, ResponseCache
+	store = None
+	if common_settings.RESPONSE_CACHE_STORE:
+		path = os.path.join(sys.path[0], common_settings.RESPONSE_CACHE_STORE)
+		try:
+			store = MappedStore(
+				path, common_settings.DEFAULT_RESPONSE_CACHE_STORE_SIZE)
+		except (IOError, OSError) as e:
+			log_error('Keeping cached answers in memory only: %s', e)
+	return ResponseCache(
+		max_entries=common_settings.DEFAULT_RESPONSE_CACHE_ENTRIES,
+		max_bytes=common_settings.DEFAULT_RESPONSE_CACHE_BYTES,
+		ttl=common_settings.DEFAULT_RESPONSE_CACHE_TTL,
+		no_store=common_settings.RESPONSE_CACHE_NO_STORE,
+		store=store
+	)
+
+def _run_setup(future):
+	try:
+		status = setup_assistant()
+	except Exception as e:
+		log_error('Error initializing Google Assistant: %s', e)
+		future.set_exception(e)
+		return
+	future.set_result(status)
+
+def warm_up(background=True):
+	""" Starts setup_assistant() on a background thread, once.
+
+	Safe to call from the game thread, e.g. from begin_play. A setup
+	that failed, e.g. without a network, is started again.
+
+	Args:
+	  background: False runs the setup on the calling thread instead.
+	Returns:
+	  concurrent.futures.Future resolving to setup_assistant()'s status:
+	  0 once the Assistant is ready, -1 if it could not be set up.
+	"""
+	global _setup_future
+	with _setup_lock:
+		if _setup_future is not None and state() != FAILED:
+			return _setup_future
+		future = _setup_future = concurrent.futures.Future()
+		future.set_running_or_notify_cancel()
+	if background:
+		threading.Thread(target=_run_setup, args=(future,),
+						 name='AssistantSetup', daemon=True).start()
+	else:
+		_run_setup(future)
+	return future
+
+def state():
+	""" Returns NOT_STARTED, STARTING, READY or FAILED; cheap enough for tick(). """
+	future = _setup_future
+	if future is None:
+		return NOT_STARTED
+	if not future.done():
+		return STARTING
+	if future.exception() is None and future.result() == 0:
+		return READY
+	return FAILED
+
+def ready():
+	""" True once setup_assistant() has succeeded. """
+	return state() == READY
 			
-def setup_unreal_engine_audio(audio_component):
-	# Set up Unreal Audio Component
-	global procedural_audio_wave
-	procedural_audio_wave = SoundWaveProcedural()
+def create_conversation_stream(procedural_audio_wave):
+	""" Creates a ConversationStream that records from the default input
+	device and plays back through the given SoundWaveProcedural. """
+	from googlesamples.assistant import audio_helpers
 	
 	# Set up audio parameters
 	audio_sample_rate = common_settings.DEFAULT_AUDIO_SAMPLE_RATE
@@ -73,39 +169,132 @@ def setup_unreal_engine_audio(audio_component):
 	audio_iter_size = common_settings.DEFAULT_AUDIO_ITER_SIZE
 	audio_block_size = common_settings.DEFAULT_AUDIO_DEVICE_BLOCK_SIZE
 	audio_flush_size = common_settings.DEFAULT_AUDIO_DEVICE_FLUSH_SIZE
+	audio_ring_size = common_settings.DEFAULT_AUDIO_CAPTURE_RING_SIZE
+	capture_rate = common_settings.DEFAULT_AUDIO_CAPTURE_RATE or audio_sample_rate
+	playback_rate = common_settings.DEFAULT_AUDIO_PLAYBACK_RATE or audio_sample_rate
+
+	def scaled(size, rate):
+		# Device sizes are set for the network rate; keep their duration.
+		size = int(size * rate / audio_sample_rate)
+		return size - size % audio_sample_width
+	audio_block_size = scaled(audio_block_size, capture_rate)
+	audio_ring_size = scaled(audio_ring_size, capture_rate)
 	
-	audio_component.SetSound(procedural_audio_wave)
+	# Smooth out the pace at which response audio arrives.
+	jitter_buffer = audio_helpers.JitterBuffer(
+		sample_rate=playback_rate,
+		sample_width=audio_sample_width,
+		block_size=scaled(common_settings.DEFAULT_AUDIO_PLAYOUT_BLOCK_SIZE,
+						  playback_rate),
+		min_depth_ms=common_settings.DEFAULT_JITTER_MIN_DEPTH_MS,
+		max_depth_ms=common_settings.DEFAULT_JITTER_MAX_DEPTH_MS
+	)
 		
 	# Configure audio source and sink.
 	audio_device = None
 	audio_source = audio_device = (
 		audio_device or audio_helpers.UnrealSoundStream(
-			sample_rate=audio_sample_rate,
+			sample_rate=capture_rate,
 			sample_width=audio_sample_width,
 			block_size=audio_block_size,
 			flush_size=audio_flush_size,
-			procedural_audio_wave=procedural_audio_wave
+			procedural_audio_wave=procedural_audio_wave,
+			ring_size=audio_ring_size,
+			jitter_buffer=jitter_buffer,
+			max_queue_bytes=scaled(common_settings.DEFAULT_PLAYBACK_QUEUE_SIZE,
+								   playback_rate),
+			playback_rate=playback_rate
 		)
 	)
 
 	audio_sink = audio_device = (
 		audio_device or audio_helpers.UnrealSoundStream(
-			sample_rate=audio_sample_rate,
+			sample_rate=capture_rate,
 			sample_width=audio_sample_width,
 			block_size=audio_block_size,
 			flush_size=audio_flush_size,
-			procedural_audio_wave=procedural_audio_wave
+			procedural_audio_wave=procedural_audio_wave,
+			ring_size=audio_ring_size,
+			jitter_buffer=jitter_buffer,
+			max_queue_bytes=scaled(common_settings.DEFAULT_PLAYBACK_QUEUE_SIZE,
+								   playback_rate),
+			playback_rate=playback_rate
 		)
 	)
 		
+	# Detect the end of the user's request locally.
+	vad = audio_helpers.VoiceActivityGate(
+		sample_rate=audio_sample_rate,
+		sample_width=audio_sample_width,
+		energy_threshold=common_settings.DEFAULT_VAD_ENERGY_THRESHOLD,
+		hangover_ms=common_settings.DEFAULT_VAD_HANGOVER_MS,
+		pre_roll_ms=common_settings.DEFAULT_VAD_PRE_ROLL_MS
+	)
+		
+	# Let the user talk over the answer if configured to.
+	barge_in = None
+	if common_settings.FULL_DUPLEX:
+		barge_in = audio_helpers.BargeInDetector(
+			sample_rate=capture_rate,
+			sample_width=audio_sample_width,
+			energy_threshold=common_settings.DEFAULT_VAD_ENERGY_THRESHOLD,
+			echo_return=common_settings.DEFAULT_BARGE_IN_ECHO_RETURN,
+			min_speech_ms=common_settings.DEFAULT_BARGE_IN_MIN_SPEECH_MS,
+			duck_gain=common_settings.DEFAULT_BARGE_IN_DUCK_GAIN,
+			playback_rate=playback_rate
+		)
+		
+	# Compress request audio if configured to.
+	audio_in_encoding = common_settings.DEFAULT_AUDIO_IN_ENCODING
+	if audio_in_encoding == 'FLAC':
+		encoder = audio_helpers.FlacEncoder(
+			sample_rate=audio_sample_rate,
+			sample_width=audio_sample_width,
+			block_samples=int(audio_iter_size/audio_sample_width)
+		)
+	elif audio_in_encoding == 'LINEAR16':
+		encoder = None
+	else:
+		raise Exception('unsupported audio encoding:', audio_in_encoding)
+		
+	# Decode compressed response audio as it streams in.
+	audio_out_encoding = common_settings.DEFAULT_AUDIO_OUT_ENCODING
+	if audio_out_encoding == 'OPUS_IN_OGG':
+		decoder = audio_helpers.OpusInOggDecoder(
+			sample_rate=audio_sample_rate,
+			sample_width=audio_sample_width
+		)
+	elif audio_out_encoding == 'LINEAR16':
+		decoder = None
+	else:
+		raise Exception('unsupported audio encoding:', audio_out_encoding)
+		
 	# Create conversation stream with the given audio source and sink.
-	global conversation_stream
-	conversation_stream = audio_helpers.ConversationStream(
+	return audio_helpers.ConversationStream(
 		source=audio_source,
 		sink=audio_sink,
 		iter_size=audio_iter_size,
 		sample_width=audio_sample_width,
+		vad=vad,
+		encoder=encoder,
+		decoder=decoder,
+		barge_in=barge_in,
+		sample_rate=audio_sample_rate,
+		resampler_taps=common_settings.DEFAULT_RESAMPLER_TAPS
 	)
+			
+def setup_unreal_engine_audio(audio_component):
+	# Set up Unreal Audio Component
+	global procedural_audio_wave
+	procedural_audio_wave = SoundWaveProcedural()
+	audio_component.SetSound(procedural_audio_wave)
+	
+	global conversation_stream
+	conversation_stream = create_conversation_stream(procedural_audio_wave)
 	
-setup_assistant()
+# Lazily, the Assistant is set up by the first conversation or warm_up().
+if not common_settings.LAZY_ASSISTANT_SETUP:
+	# On this thread: the setup imports modules that import this one,
+	# which would wait on this import from any other thread.
+	warm_up(background=False).result()
 # Audio will be set up at runtime
\ No newline at end of file